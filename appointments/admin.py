@@ -2,8 +2,23 @@ from django.contrib import admin
 from .models import (
     UserProfile, Appointment, Organization, ChatRoom, ChatMessage, 
     AuditLog, DoctorOrganizationJoinRequest, MedicalRecord, Prescription,
-    Insurance, Payment, EmergencyContact, MedicationReminder, TelemedicineSession
+    Insurance, Payment, EmergencyContact, MedicationReminder, TelemedicineSession,
+    GeocodeCache
 )
+from .appointment_search import search_terms, term_filter
+from .pagination import EstimatedCountPaginator
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    Changelist settings for tables that grow without bound: estimated page
+    counts, no second unfiltered COUNT(*), and no date_hierarchy (its
+    drill-down runs DISTINCT date queries over the whole table; the date
+    list_filter covers the same ground). Subclasses name the columns they
+    display in list_select_related and use autocomplete widgets for FKs.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 @admin.register(Organization)
 class OrganizationAdmin(admin.ModelAdmin):
@@ -18,30 +33,41 @@ class UserProfileAdmin(admin.ModelAdmin):
     list_filter = ['role', 'created_at', 'on_duty']
     search_fields = ['user__username', 'user__first_name', 'user__last_name', 'specialization']
     ordering = ['-created_at']
+    list_select_related = ['user']
+    autocomplete_fields = ['user', 'organization']
 
 @admin.register(Appointment)
-class AppointmentAdmin(admin.ModelAdmin):
+class AppointmentAdmin(LargeTableAdmin):
     list_display = ['patient', 'doctor', 'appointment_date', 'status', 'patient_status', 'fee', 'is_virtual']
     list_filter = ['status', 'patient_status', 'appointment_date', 'created_at', 'is_virtual', 'appointment_type']
-    search_fields = ['patient__username', 'doctor__username', 'notes']
+    # Names, emails and notes are denormalized into the trigram-indexed search columns
+    search_fields = ['search_text']
     ordering = ['-appointment_date']
-    date_hierarchy = 'appointment_date'
+    list_select_related = ['patient', 'doctor']
+    autocomplete_fields = ['patient', 'doctor', 'organization']
+
+    def get_search_results(self, request, queryset, search_term):
+        for term in search_terms(search_term):
+            queryset = queryset.filter(term_filter(term, reception_notes=True))
+        return queryset, False
 
 @admin.register(MedicalRecord)
-class MedicalRecordAdmin(admin.ModelAdmin):
+class MedicalRecordAdmin(LargeTableAdmin):
     list_display = ['patient', 'record_type', 'title', 'date_recorded', 'severity', 'is_active']
     list_filter = ['record_type', 'severity', 'is_active', 'date_recorded']
-    search_fields = ['patient__username', 'title', 'description']
+    search_fields = ['^patient__username', 'title']
     ordering = ['-date_recorded']
-    date_hierarchy = 'date_recorded'
+    list_select_related = ['patient']
+    autocomplete_fields = ['patient', 'doctor', 'organization']
 
 @admin.register(Prescription)
-class PrescriptionAdmin(admin.ModelAdmin):
+class PrescriptionAdmin(LargeTableAdmin):
     list_display = ['patient', 'doctor', 'medication_name', 'status', 'prescribed_date', 'is_controlled_substance']
     list_filter = ['status', 'is_controlled_substance', 'prescribed_date']
-    search_fields = ['patient__username', 'doctor__username', 'medication_name']
+    search_fields = ['^patient__username', '^doctor__username', 'medication_name']
     ordering = ['-prescribed_date']
-    date_hierarchy = 'prescribed_date'
+    list_select_related = ['patient', 'doctor']
+    autocomplete_fields = ['appointment', 'patient', 'doctor']
 
 @admin.register(Insurance)
 class InsuranceAdmin(admin.ModelAdmin):
@@ -50,14 +76,17 @@ class InsuranceAdmin(admin.ModelAdmin):
     search_fields = ['patient__username', 'provider_name', 'policy_number']
     ordering = ['-effective_date']
     date_hierarchy = 'effective_date'
+    list_select_related = ['patient']
+    autocomplete_fields = ['patient']
 
 @admin.register(Payment)
-class PaymentAdmin(admin.ModelAdmin):
+class PaymentAdmin(LargeTableAdmin):
     list_display = ['patient', 'doctor', 'payment_type', 'amount', 'status', 'payment_method', 'payment_date']
     list_filter = ['payment_type', 'status', 'payment_method', 'payment_date']
-    search_fields = ['patient__username', 'doctor__username', 'transaction_id']
+    search_fields = ['^patient__username', '^doctor__username', '=transaction_id']
     ordering = ['-payment_date']
-    date_hierarchy = 'payment_date'
+    list_select_related = ['patient', 'doctor']
+    autocomplete_fields = ['appointment', 'patient', 'doctor', 'organization', 'insurance']
 
 @admin.register(EmergencyContact)
 class EmergencyContactAdmin(admin.ModelAdmin):
@@ -65,6 +94,8 @@ class EmergencyContactAdmin(admin.ModelAdmin):
     list_filter = ['relationship', 'is_primary', 'can_make_medical_decisions']
     search_fields = ['patient__username', 'name', 'phone']
     ordering = ['patient__username', 'name']
+    list_select_related = ['patient']
+    autocomplete_fields = ['patient']
 
 @admin.register(MedicationReminder)
 class MedicationReminderAdmin(admin.ModelAdmin):
@@ -72,14 +103,17 @@ class MedicationReminderAdmin(admin.ModelAdmin):
     list_filter = ['reminder_type', 'is_active']
     search_fields = ['patient__username', 'prescription__medication_name']
     ordering = ['-next_reminder']
+    list_select_related = ['patient', 'prescription__patient']
+    autocomplete_fields = ['patient', 'prescription']
 
 @admin.register(TelemedicineSession)
-class TelemedicineSessionAdmin(admin.ModelAdmin):
+class TelemedicineSessionAdmin(LargeTableAdmin):
     list_display = ['appointment', 'session_id', 'status', 'scheduled_start', 'actual_start', 'duration_minutes']
     list_filter = ['status', 'scheduled_start']
-    search_fields = ['appointment__patient__username', 'session_id']
+    search_fields = ['^appointment__patient__username', '=session_id']
     ordering = ['-scheduled_start']
-    date_hierarchy = 'scheduled_start'
+    list_select_related = ['appointment__patient', 'appointment__doctor']
+    autocomplete_fields = ['appointment']
 
 @admin.register(ChatRoom)
 class ChatRoomAdmin(admin.ModelAdmin):
@@ -89,19 +123,23 @@ class ChatRoomAdmin(admin.ModelAdmin):
     ordering = ['-created_at']
 
 @admin.register(ChatMessage)
-class ChatMessageAdmin(admin.ModelAdmin):
+class ChatMessageAdmin(LargeTableAdmin):
     list_display = ['sender', 'room', 'created_at', 'is_read']
     list_filter = ['is_read', 'created_at']
-    search_fields = ['sender__username', 'message']
+    search_fields = ['^sender__username', 'message']
     ordering = ['-created_at']
+    list_select_related = ['sender', 'room']
+    autocomplete_fields = ['sender', 'room']
 
 @admin.register(AuditLog)
-class AuditLogAdmin(admin.ModelAdmin):
+class AuditLogAdmin(LargeTableAdmin):
     list_display = ['user', 'action', 'timestamp', 'object_type', 'object_id']
     list_filter = ['action', 'timestamp', 'object_type']
-    search_fields = ['user__username', 'action', 'details']
+    search_fields = ['^user__username', 'action', 'details']
     ordering = ['-timestamp']
     readonly_fields = ['timestamp']
+    list_select_related = ['user']
+    autocomplete_fields = ['user']
 
 @admin.register(DoctorOrganizationJoinRequest)
 class DoctorOrganizationJoinRequestAdmin(admin.ModelAdmin):
@@ -109,3 +147,13 @@ class DoctorOrganizationJoinRequestAdmin(admin.ModelAdmin):
     list_filter = ['status', 'created_at', 'reviewed_at']
     search_fields = ['doctor__username', 'organization__name']
     ordering = ['-created_at']
+    list_select_related = ['doctor', 'organization']
+    autocomplete_fields = ['doctor', 'organization', 'reviewed_by']
+
+@admin.register(GeocodeCache)
+class GeocodeCacheAdmin(admin.ModelAdmin):
+    list_display = ['normalized_address', 'found', 'latitude', 'longitude', 'provider', 'expires_at']
+    list_filter = ['found', 'provider']
+    search_fields = ['normalized_address', 'place_id']
+    ordering = ['-created_at']
+    readonly_fields = ['address_key', 'created_at']
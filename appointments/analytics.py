@@ -0,0 +1,275 @@
+"""
+Bucketed time series for the analytics charts.
+
+Day, week and month buckets are read from the daily rollups with
+``date_trunc``; hour buckets are finer than the rollups and are truncated
+from live appointments, so the hourly range is capped. Series are gap
+filled and returned column-wise: one list of bucket starts and one list of
+values per dimension key. Cached series are keyed by the scope's cache
+namespaces, so they are retired as soon as an appointment in scope changes.
+"""
+
+import hashlib
+import json
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import ExtractHour, Trunc
+from django.utils import timezone
+
+from .cache_aside import cache_aside, refresher
+from .cache_versions import ALL_APPOINTMENTS, ROLLUPS, doctor_namespace, organization_namespace, versioned_key
+from .lookups import doctor_cards, organization_cards
+from .models import Appointment
+from .rollups import day_bounds, facts_for
+from .user_context import user_context
+
+SERIES_CACHE_TIMEOUT = 300
+BUCKETS = ('hour', 'day', 'week', 'month')
+MAX_BUCKETS = {'hour': 24 * 31, 'day': 366 * 2, 'week': 52 * 5, 'month': 12 * 10}
+BUCKETS_PER_DAY = {'hour': 24, 'day': 1, 'week': 1 / 7, 'month': 1 / 31}
+DIMENSIONS = ('status', 'appointment_type', 'doctor', 'organization')
+# Hour of day also reads live appointments, so it covers at most as many days as an hourly series
+HOUR_OF_DAY_MAX_DAYS = MAX_BUCKETS['hour'] // 24
+
+# metric -> (aggregate over rollup rows, aggregate over live appointments)
+METRICS = {
+    'appointments': (lambda: Sum('appointment_count'), lambda: Count('id')),
+    'fees': (lambda: Sum('fee_total'), lambda: Sum('fee')),
+    'revenue': (
+        lambda: Sum('paid_total'),
+        lambda: Sum('payments__amount', filter=Q(payments__status='completed')),
+    ),
+}
+DIMENSION_FIELDS = {
+    'status': 'status',
+    'appointment_type': 'appointment_type',
+    'doctor': 'doctor_id',
+    'organization': 'organization_id',
+}
+
+
+class SeriesError(ValueError):
+    """Raised for invalid series parameters"""
+
+
+class SeriesScope:
+    """Which rows a caller may chart: everything, one organization or one doctor"""
+
+    def __init__(self, organization_id=None, doctor_id=None):
+        self.organization_id = organization_id
+        self.doctor_id = doctor_id
+
+    @classmethod
+    def for_user(cls, user, organization_id=None):
+        if user.is_staff:
+            return cls(organization_id=organization_id)
+        context = user_context(user)
+        if context.is_receptionist and context.organization_id:
+            return cls(organization_id=context.organization_id)
+        if context.is_doctor:
+            return cls(doctor_id=user.id)
+        return None
+
+    @property
+    def signature(self):
+        return f"o{self.organization_id or '*'}-d{self.doctor_id or '*'}"
+
+    @property
+    def namespaces(self):
+        """Cache namespaces whose writes change this scope's series"""
+        namespaces = [ROLLUPS]
+        if self.organization_id:
+            namespaces.append(organization_namespace(self.organization_id))
+        if self.doctor_id:
+            namespaces.append(doctor_namespace(self.doctor_id))
+        if not self.organization_id and not self.doctor_id:
+            namespaces.append(ALL_APPOINTMENTS)
+        return namespaces
+
+
+def bucket_start(value, bucket):
+    """Truncate a date or datetime to the start of its bucket"""
+    if bucket == 'hour':
+        return value.replace(minute=0, second=0, microsecond=0)
+    if isinstance(value, datetime):
+        value = value.date()
+    if bucket == 'week':
+        return value - timedelta(days=value.weekday())
+    if bucket == 'month':
+        return value.replace(day=1)
+    return value
+
+
+def bucket_range(start, end, bucket):
+    """Every bucket start between two bucket-aligned values, inclusive"""
+    current, buckets = start, []
+    while current <= end:
+        buckets.append(current)
+        if bucket == 'hour':
+            current += timedelta(hours=1)
+        elif bucket == 'day':
+            current += timedelta(days=1)
+        elif bucket == 'week':
+            current += timedelta(weeks=1)
+        else:
+            current = (current.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return buckets
+
+
+def _rows(metric, bucket, dimension, scope, start, end):
+    """(bucket start, dimension key, value) rows aggregated in SQL"""
+    dimension_field = DIMENSION_FIELDS.get(dimension)
+    rollup_aggregate, live_aggregate = METRICS[metric]
+    if bucket == 'hour':
+        queryset = Appointment.objects.filter(
+            appointment_date__gte=day_bounds(start)[0], appointment_date__lt=day_bounds(end)[1],
+        )
+        if scope.organization_id:
+            queryset = queryset.filter(organization_id=scope.organization_id)
+        if scope.doctor_id:
+            queryset = queryset.filter(doctor_id=scope.doctor_id)
+        truncated = Trunc('appointment_date', 'hour', tzinfo=timezone.get_current_timezone())
+        aggregate = live_aggregate()
+    else:
+        queryset = facts_for(
+            organization=scope.organization_id, doctor=scope.doctor_id, start=start, end=end,
+        )
+        truncated = Trunc('date', bucket)
+        aggregate = rollup_aggregate()
+
+    fields = ['bucket', dimension_field] if dimension_field else ['bucket']
+    rows = (
+        queryset.order_by().annotate(bucket=truncated)
+        .values(*fields).annotate(value=aggregate).values_list(*fields, 'value')
+    )
+    for row in rows:
+        bucket_value = row[0].date() if bucket != 'hour' and isinstance(row[0], datetime) else row[0]
+        yield bucket_value, (row[1] if dimension_field else None), row[-1]
+
+
+def _labels(dimension, keys):
+    if dimension == 'doctor':
+        return {user_id: card['name'] for user_id, card in doctor_cards(keys).items()}
+    if dimension == 'organization':
+        return {organization_id: card['name'] for organization_id, card in organization_cards(keys).items()}
+    if dimension == 'status':
+        return dict(Appointment.STATUS_CHOICES)
+    if dimension == 'appointment_type':
+        return dict(Appointment.APPOINTMENT_TYPE_CHOICES)
+    return {}
+
+
+def _number(value):
+    if value is None:
+        return 0
+    return value if isinstance(value, int) else float(value)
+
+
+def _label(labels, key, dimension):
+    if key is None:
+        return 'Unassigned' if dimension else 'Total'
+    return labels.get(key, str(key))
+
+
+def build_series(metric, bucket, start, end, scope, dimension=None):
+    """
+    Gap-filled columnar series::
+
+        {"buckets": [...], "series": [{"key": k, "label": l, "values": [...]}]}
+    """
+    if metric not in METRICS:
+        raise SeriesError(f"metric must be one of {', '.join(METRICS)}")
+    if bucket not in BUCKETS:
+        raise SeriesError(f"bucket must be one of {', '.join(BUCKETS)}")
+    if dimension and dimension not in DIMENSIONS:
+        raise SeriesError(f"dimension must be one of {', '.join(DIMENSIONS)}")
+    if start > end:
+        raise SeriesError('start must not be after end')
+    days = (end - start).days + 1
+    if days * BUCKETS_PER_DAY[bucket] > MAX_BUCKETS[bucket] + 31:
+        raise SeriesError(f"range too large for {bucket} buckets (max {MAX_BUCKETS[bucket]})")
+
+    if bucket == 'hour':
+        first = timezone.localtime(day_bounds(start)[0])
+        last = timezone.localtime(day_bounds(end)[1] - timedelta(hours=1))
+    else:
+        first, last = bucket_start(start, bucket), bucket_start(end, bucket)
+    buckets = bucket_range(first, last, bucket)
+    if len(buckets) > MAX_BUCKETS[bucket]:
+        raise SeriesError(f"range too large for {bucket} buckets (max {MAX_BUCKETS[bucket]})")
+
+    position = {value: index for index, value in enumerate(buckets)}
+    values = defaultdict(lambda: [0] * len(buckets))
+    for bucket_value, key, value in _rows(metric, bucket, dimension, scope, start, end):
+        if bucket == 'hour':
+            bucket_value = timezone.localtime(bucket_value)
+        index = position.get(bucket_value)
+        if index is not None:
+            values[key][index] += _number(value)
+
+    labels = _labels(dimension, list(values)) if dimension else {}
+    return {
+        'metric': metric,
+        'bucket': bucket,
+        'dimension': dimension,
+        'buckets': [value.isoformat() for value in buckets],
+        'series': [
+            {'key': key, 'label': _label(labels, key, dimension), 'values': series}
+            for key, series in sorted(values.items(), key=lambda item: str(item[0]))
+        ] or [{'key': None, 'label': 'Total', 'values': [0] * len(buckets)}],
+    }
+
+
+def serialized_series(metric, bucket, start, end, scope, dimension=None):
+    """``(body, etag)``: the series serialized once, with an ETag of the body"""
+    body = json.dumps(build_series(metric, bucket, start, end, scope, dimension), separators=(',', ':'))
+    return body, f'"{hashlib.md5(body.encode()).hexdigest()}"'
+
+
+@refresher('analytics-series')
+def refresh_series(metric, bucket, start, end, organization_id, doctor_id, dimension):
+    return serialized_series(
+        metric, bucket, date.fromisoformat(start), date.fromisoformat(end),
+        SeriesScope(organization_id, doctor_id), dimension,
+    )
+
+
+def cached_series(metric, bucket, start, end, scope, dimension=None):
+    """``(body, etag)`` for a series, cached with stampede protection"""
+    raw_key = f"{metric}:{bucket}:{dimension}:{start}:{end}:{scope.signature}"
+    key = versioned_key('analytics:series', scope.namespaces, hashlib.md5(raw_key.encode()).hexdigest())
+    return cache_aside(
+        key,
+        lambda: serialized_series(metric, bucket, start, end, scope, dimension),
+        SERIES_CACHE_TIMEOUT,
+        refresh=('analytics-series', [
+            metric, bucket, start.isoformat(), end.isoformat(), scope.organization_id, scope.doctor_id, dimension,
+        ]),
+    )
+
+
+def hour_of_day_counts(appointments, start, end):
+    """
+    Appointments per local hour of day (24 values) over the range, capped to
+    its last HOUR_OF_DAY_MAX_DAYS days. Returns ``(counts, start)`` with the
+    first day actually counted.
+    """
+    start = max(start, end - timedelta(days=HOUR_OF_DAY_MAX_DAYS - 1))
+    by_hour = dict(
+        appointments.filter(appointment_date__gte=day_bounds(start)[0], appointment_date__lt=day_bounds(end)[1])
+        .order_by().annotate(hour=ExtractHour('appointment_date'))
+        .values_list('hour').annotate(total=Count('id'))
+    )
+    return [by_hour.get(hour, 0) for hour in range(24)], start
+
+
+def parse_range(start_text, end_text, default_days=30):
+    today = timezone.localdate()
+    try:
+        end = date.fromisoformat(end_text) if end_text else today
+        start = date.fromisoformat(start_text) if start_text else end - timedelta(days=default_days - 1)
+    except ValueError:
+        raise SeriesError('start and end must be YYYY-MM-DD dates')
+    return start, end
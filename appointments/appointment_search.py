@@ -0,0 +1,108 @@
+"""
+Appointment search for reception staff, doctors and patients.
+
+Each appointment carries a lowercased ``search_text`` column (patient and
+doctor names, patient email, notes and patient notes) with a trigram GIN
+index, so a name fragment is a single indexed ``LIKE '%fragment%'`` probe on
+one table instead of ``icontains`` over three joined tables. Reception notes
+are staff-only and live in ``reception_search_text``, which only staff
+searches consult, so patients cannot probe them. Results are
+limited to what the caller may see and paged by keyset on
+``(appointment_date, id)`` (``pagination.keyset_page``), which stays fast
+however deep the history is.
+"""
+
+import re
+
+from django.db.models import Q
+
+from .models import Appointment
+from .pagination import keyset_page
+from .user_context import user_context
+
+DEFAULT_PAGE_SIZE = 25
+MAX_PAGE_SIZE = 100
+MAX_SEARCH_TERMS = 6
+
+_TOKEN = re.compile(r'[\w@.+-]+')
+
+NEWEST_FIRST = ('-appointment_date', '-id')
+
+
+def appointment_scope(user):
+    """
+    Filter kwargs for the appointments a user may see (their organization for
+    staff, their own otherwise), ``{}`` for superusers and None for nothing.
+    The ``*_id`` keys also match AppointmentTombstone.
+    """
+    if user.is_superuser:
+        return {}
+    context = user_context(user)
+    if context.role is None:
+        return None
+    if context.is_receptionist:
+        if context.organization_id is None:
+            return None
+        return {'organization_id': context.organization_id}
+    if context.is_doctor:
+        return {'doctor_id': user.id}
+    return {'patient_id': user.id}
+
+
+def visible_appointments(user):
+    """Appointments the user may search: their organization for staff, their own otherwise"""
+    scope = appointment_scope(user)
+    if scope is None:
+        return Appointment.objects.none()
+    return Appointment.objects.filter(**scope)
+
+
+def can_search_reception_notes(user):
+    """Staff, doctors and receptionists; never patients"""
+    if user.is_superuser:
+        return True
+    context = user_context(user)
+    return context.is_staff or context.is_doctor or context.is_receptionist
+
+
+def term_filter(term, reception_notes=False):
+    """Match one term in the search column, and in reception notes when the caller may see them"""
+    match = Q(search_text__contains=term)
+    if reception_notes:
+        match |= Q(reception_search_text__contains=term)
+    return match
+
+
+def search_terms(query):
+    return [term.lower() for term in _TOKEN.findall(query or '')][:MAX_SEARCH_TERMS]
+
+
+def search_appointments(user, query='', cursor=None, limit=DEFAULT_PAGE_SIZE, status=None):
+    """
+    One page of matching appointments, newest first.
+
+    Every term must appear in the search column (or, for staff, in the
+    reception notes). Returns
+    ``(appointments, next_cursor)``; ``next_cursor`` is None on the last page.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    queryset = visible_appointments(user)
+    reception_notes = can_search_reception_notes(user)
+    for term in search_terms(query):
+        queryset = queryset.filter(term_filter(term, reception_notes))
+    if status:
+        queryset = queryset.filter(status=status)
+    queryset = queryset.select_related('patient', 'doctor', 'organization')
+    return keyset_page(queryset, NEWEST_FIRST, cursor=cursor, limit=limit)
+
+
+def refresh_search_text(appointments):
+    """Rebuild ``search_text`` for appointments (with patient/doctor loaded); returns the count"""
+    changed = []
+    for appointment in appointments:
+        search_text = appointment.build_search_text()
+        if search_text != appointment.search_text:
+            appointment.search_text = search_text
+            changed.append(appointment)
+    Appointment.objects.bulk_update(changed, ['search_text'], batch_size=500)
+    return len(changed)
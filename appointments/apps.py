@@ -7,3 +7,5 @@ class AppointmentsConfig(AppConfig):
     
     def ready(self):
         import appointments.signals
+        from appointments.query_budget import install_task_hooks
+        install_task_hooks()
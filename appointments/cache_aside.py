@@ -0,0 +1,205 @@
+"""
+Stampede-protected cache-aside reads.
+
+Values are stored as ``Entry(value, expires, delta)``: ``expires`` is the
+soft expiry and ``delta`` how long the value took to compute. The cache
+keeps an entry for ``stale_timeout`` seconds past its soft expiry. A read
+then goes one of three ways:
+
+* fresh -- returned as is, unless probabilistic early refresh (XFetch)
+  decides to recompute ahead of expiry; slow values start earlier;
+* stale -- returned immediately while a single refresh runs, either in a
+  Celery task (when the caller names a registered refresher) or inline in
+  whichever request wins the refresh lock;
+* missing -- one caller takes a ``cache.add`` lock (``SET NX`` on Redis)
+  and computes; the others wait briefly for its result instead of piling
+  onto the database.
+
+Refreshers are registered by name so the Celery task can recompute a value
+from JSON arguments.
+"""
+
+import importlib
+import logging
+import math
+import random
+import time
+import uuid
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+STALE_TIMEOUT = getattr(settings, 'CACHE_ASIDE_STALE_TIMEOUT', 60 * 5)
+LOCK_TIMEOUT = 30
+LOCK_WAIT = 2.0
+LOCK_POLL_INTERVAL = 0.05
+XFETCH_BETA = 1.0
+# Modules that register refreshers; imported by the refresh task in workers
+REFRESHER_MODULES = [
+    'appointments.analytics',
+    'appointments.dashboard_cache',
+    'appointments.facets',
+    'appointments.search',
+]
+
+Entry = namedtuple('Entry', ['value', 'expires', 'delta'])
+
+_refreshers = {}
+
+
+def refresher(name):
+    """Register ``func(*args)`` to recompute values for background refresh under ``name``"""
+    def register(func):
+        _refreshers[name] = func
+        return func
+    return register
+
+
+def get_refresher(name):
+    if name not in _refreshers:
+        for module in REFRESHER_MODULES:
+            importlib.import_module(module)
+    return _refreshers[name]
+
+
+def _lock_key(key):
+    return f"{key}:lock"
+
+
+def acquire_lock(key, timeout=LOCK_TIMEOUT):
+    """A token if this caller now holds the lock for ``key``, else None"""
+    token = uuid.uuid4().hex
+    return token if cache.add(_lock_key(key), token, timeout) else None
+
+
+def release_lock(key, token):
+    if cache.get(_lock_key(key)) == token:
+        cache.delete(_lock_key(key))
+
+
+def store(key, value, timeout, delta=0.0, stale_timeout=STALE_TIMEOUT):
+    cache.set(key, Entry(value, time.time() + timeout, delta), timeout + stale_timeout)
+
+
+def store_many(values, timeout, delta=0.0, stale_timeout=STALE_TIMEOUT):
+    expires = time.time() + timeout
+    cache.set_many({key: Entry(value, expires, delta) for key, value in values.items()}, timeout + stale_timeout)
+
+
+def should_refresh(entry, now=None, beta=XFETCH_BETA):
+    """XFetch: refresh when ``now - delta * beta * ln(rand)`` reaches the soft expiry"""
+    now = now or time.time()
+    return now - entry.delta * beta * math.log(1.0 - random.random()) >= entry.expires
+
+
+def _compute_and_store(compute_many, items, timeout, stale_timeout):
+    started = time.monotonic()
+    values = compute_many(items)
+    # Spread the batch's compute time over its keys, like one XFetch sample each
+    delta = (time.monotonic() - started) / max(len(items), 1)
+    store_many(values, timeout, delta, stale_timeout)
+    return values
+
+
+def _schedule_refresh(key, name, args, timeout, stale_timeout):
+    from .tasks import refresh_cache_entry
+    token = acquire_lock(key)
+    if token is None:
+        return
+    try:
+        refresh_cache_entry.delay(name, key, list(args), timeout, stale_timeout, token)
+    except Exception as e:
+        release_lock(key, token)
+        logger.error(f"Failed to queue cache refresh for {key}: {e}")
+
+
+def _wait_for(keys, wait):
+    deadline = time.monotonic() + wait
+    found = {}
+    while keys - found.keys() and time.monotonic() < deadline:
+        time.sleep(LOCK_POLL_INTERVAL)
+        found.update({
+            key: entry.value for key, entry in cache.get_many(list(keys - found.keys())).items()
+            if isinstance(entry, Entry)
+        })
+    return found
+
+
+def cache_aside_many(items, compute_many, timeout, stale_timeout=STALE_TIMEOUT, refresh=None,
+                     lock_wait=LOCK_WAIT, beta=XFETCH_BETA):
+    """
+    Map cache key -> value for ``items`` (``{key: item}``).
+
+    ``compute_many({key: item})`` returns ``{key: value}`` for the keys it is
+    given. ``refresh(key, item)`` may return ``(refresher name, json args)``
+    to refresh stale entries in Celery rather than inline.
+    """
+    now = time.time()
+    values, refreshing, missing = {}, {}, {}
+    entries = cache.get_many(list(items))
+    for key, item in items.items():
+        entry = entries.get(key)
+        if not isinstance(entry, Entry):
+            missing[key] = item
+            continue
+        values[key] = entry.value
+        if now >= entry.expires or should_refresh(entry, now, beta):
+            refreshing[key] = item
+
+    if refreshing:
+        inline = {}
+        for key, item in refreshing.items():
+            background = refresh(key, item) if refresh else None
+            if background is not None:
+                _schedule_refresh(key, *background, timeout, stale_timeout)
+            else:
+                inline[key] = item
+        if inline:
+            batch_key = f"refresh:{min(inline)}:{len(inline)}"
+            token = acquire_lock(batch_key)
+            if token is not None:
+                try:
+                    values.update(_compute_and_store(compute_many, inline, timeout, stale_timeout))
+                finally:
+                    release_lock(batch_key, token)
+
+    if missing:
+        batch_key = f"fill:{min(missing)}:{len(missing)}"
+        token = acquire_lock(batch_key)
+        if token is None:
+            values.update(_wait_for(set(missing), lock_wait))
+            missing = {key: item for key, item in missing.items() if key not in values}
+        try:
+            if missing:
+                values.update(_compute_and_store(compute_many, missing, timeout, stale_timeout))
+        finally:
+            if token is not None:
+                release_lock(batch_key, token)
+    return values
+
+
+def cache_aside(key, compute, timeout, stale_timeout=STALE_TIMEOUT, refresh=None,
+                lock_wait=LOCK_WAIT, beta=XFETCH_BETA):
+    """
+    Cached ``compute()`` with single-flight fill, early refresh and
+    stale-while-revalidate. ``refresh`` is an optional ``(refresher name,
+    json args)`` pair for refreshing in Celery.
+    """
+    return cache_aside_many(
+        {key: None}, lambda items: {key: compute()}, timeout, stale_timeout,
+        refresh=(lambda key, item: refresh) if refresh else None, lock_wait=lock_wait, beta=beta,
+    )[key]
+
+
+def refresh_entry(name, key, args, timeout, stale_timeout=STALE_TIMEOUT, token=None):
+    """Recompute one entry with a registered refresher; used by the refresh task"""
+    try:
+        started = time.monotonic()
+        value = get_refresher(name)(*args)
+        store(key, value, timeout, time.monotonic() - started, stale_timeout)
+    finally:
+        if token is not None:
+            release_lock(key, token)
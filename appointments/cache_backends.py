@@ -0,0 +1,272 @@
+"""
+Two-tier cache backend for small, hot, rarely changing lookups.
+
+Reads are served from a bounded in-process LRU (entry count and byte cap,
+short TTL) and fall through to a shared "remote" cache alias, normally the
+Redis cache. Writes go to both tiers and are announced on a Redis pub/sub
+channel so every other process drops its local copy; the short local TTL
+bounds staleness if a message is missed or the remote cache is not Redis.
+
+Configure it as its own alias in front of ``default``::
+
+    CACHES['hot'] = {
+        'BACKEND': 'appointments.cache_backends.TwoTierCache',
+        'OPTIONS': {'REMOTE': 'default', 'LOCAL_TIMEOUT': 30, 'MAX_BYTES': 32 * 1024 * 1024},
+    }
+
+Values handed out from the local tier are shared between callers in the
+process; treat them as immutable.
+"""
+
+import logging
+import os
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+logger = logging.getLogger(__name__)
+
+INVALIDATE_ALL = '*'
+
+
+class BoundedLRU:
+    """Thread-safe LRU with per-entry expiry and a cap on entries and estimated bytes"""
+
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            expires, size, value = item
+            if expires is not None and expires <= time.monotonic():
+                self._pop(key)
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout, size):
+        if size > self.max_bytes:
+            self.delete(key)
+            return
+        expires = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            self._pop(key)
+            self._data[key] = (expires, size, value)
+            self.bytes += size
+            while len(self._data) > self.max_entries or self.bytes > self.max_bytes:
+                self._pop(next(iter(self._data)))
+
+    def delete(self, key):
+        with self._lock:
+            self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def _pop(self, key):
+        item = self._data.pop(key, None)
+        if item is not None:
+            self.bytes -= item[1]
+
+    def __contains__(self, key):
+        return self.get(key, self) is not self
+
+    def __len__(self):
+        return len(self._data)
+
+
+class TwoTierCache(BaseCache):
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self.remote_alias = options.get('REMOTE', 'default')
+        self.local_timeout = options.get('LOCAL_TIMEOUT', 30)
+        self.channel = options.get('CHANNEL', 'pulsecal:cache-invalidate')
+        self.local = BoundedLRU(options.get('MAX_ENTRIES', 5000), options.get('MAX_BYTES', 32 * 1024 * 1024))
+        self.origin = uuid.uuid4().hex
+        self._listener_pid = None
+        self._listener_lock = threading.Lock()
+
+    @property
+    def remote(self):
+        return caches[self.remote_alias]
+
+    # Local tier
+
+    def _timeout(self, timeout):
+        """Relative timeout in seconds (None for never) to pass on to the remote tier"""
+        return self.default_timeout if timeout is DEFAULT_TIMEOUT else timeout
+
+    def _local_timeout(self, timeout):
+        timeout = self._timeout(timeout)
+        return self.local_timeout if timeout is None else min(timeout, self.local_timeout)
+
+    def _remember(self, key, value, timeout=DEFAULT_TIMEOUT):
+        try:
+            size = len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        except Exception:
+            return
+        self.local.set(key, value, self._local_timeout(timeout), size)
+
+    # Cross-process invalidation
+
+    def _redis(self):
+        try:
+            from django_redis import get_redis_connection
+            return get_redis_connection(self.remote_alias)
+        except Exception:
+            return None
+
+    def _ensure_listener(self):
+        """Start (once per process, again after fork) the thread that applies other processes' invalidations"""
+        if self._listener_pid == os.getpid():
+            return
+        with self._listener_lock:
+            if self._listener_pid == os.getpid():
+                return
+            self._listener_pid = os.getpid()
+            self.local.clear()
+            connection = self._redis()
+            if connection is None:
+                return
+            thread = threading.Thread(target=self._listen, args=(connection,), daemon=True, name='cache-invalidation')
+            thread.start()
+
+    def _listen(self, connection):
+        while True:
+            try:
+                pubsub = connection.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                for message in pubsub.listen():
+                    self._apply_invalidation(message['data'])
+            except Exception as e:
+                # Entries written while we were disconnected may be missed; start clean
+                logger.error(f"Cache invalidation listener lost its connection: {e}")
+                self.local.clear()
+                time.sleep(1)
+
+    def _apply_invalidation(self, data):
+        origin, _, key = data.decode().partition('|')
+        if origin == self.origin:
+            return
+        if key == INVALIDATE_ALL:
+            self.local.clear()
+        else:
+            self.local.delete(key)
+
+    def _announce(self, *keys):
+        connection = self._redis()
+        if connection is None:
+            return
+        try:
+            for key in keys:
+                connection.publish(self.channel, f"{self.origin}|{key}")
+        except Exception as e:
+            logger.error(f"Failed to publish cache invalidation: {e}")
+
+    # Cache API
+
+    def get(self, key, default=None, version=None):
+        self._ensure_listener()
+        key = self.make_and_validate_key(key, version=version)
+        value = self.local.get(key, self)
+        if value is not self:
+            return value
+        value = self.remote.get(key, self)
+        if value is self:
+            return default
+        self._remember(key, value)
+        return value
+
+    def get_many(self, keys, version=None):
+        self._ensure_listener()
+        made = {self.make_and_validate_key(key, version=version): key for key in keys}
+        found, missing = {}, []
+        for made_key, key in made.items():
+            value = self.local.get(made_key, self)
+            if value is self:
+                missing.append(made_key)
+            else:
+                found[key] = value
+        for made_key, value in self.remote.get_many(missing).items():
+            self._remember(made_key, value)
+            found[made[made_key]] = value
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self._ensure_listener()
+        key = self.make_and_validate_key(key, version=version)
+        self.remote.set(key, value, self._timeout(timeout))
+        self._remember(key, value, timeout)
+        self._announce(key)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        self._ensure_listener()
+        made = {self.make_and_validate_key(key, version=version): value for key, value in data.items()}
+        self.remote.set_many(made, self._timeout(timeout))
+        for key, value in made.items():
+            self._remember(key, value, timeout)
+        self._announce(*made)
+        return []
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self._ensure_listener()
+        key = self.make_and_validate_key(key, version=version)
+        if not self.remote.add(key, value, self._timeout(timeout)):
+            return False
+        self._remember(key, value, timeout)
+        self._announce(key)
+        return True
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        return self.remote.touch(key, self._timeout(timeout))
+
+    def delete(self, key, version=None):
+        self._ensure_listener()
+        key = self.make_and_validate_key(key, version=version)
+        self.local.delete(key)
+        deleted = self.remote.delete(key)
+        self._announce(key)
+        return deleted
+
+    def delete_many(self, keys, version=None):
+        self._ensure_listener()
+        made = [self.make_and_validate_key(key, version=version) for key in keys]
+        for key in made:
+            self.local.delete(key)
+        self.remote.delete_many(made)
+        self._announce(*made)
+
+    def incr(self, key, delta=1, version=None):
+        self._ensure_listener()
+        key = self.make_and_validate_key(key, version=version)
+        value = self.remote.incr(key, delta)
+        self.local.delete(key)
+        self._announce(key)
+        return value
+
+    def has_key(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        return key in self.local or self.remote.has_key(key)
+
+    def clear(self):
+        """Drop the local tier everywhere and, on Redis, this alias's remote keys"""
+        self.local.clear()
+        if hasattr(self.remote, 'delete_pattern'):
+            self.remote.delete_pattern(f"{self.key_prefix}:*" if self.key_prefix else '*')
+        self._announce(INVALIDATE_ALL)
@@ -0,0 +1,240 @@
+"""
+Codecs and metrics for the django_redis cache.
+
+``ThresholdCompressor`` leaves small values alone and compresses larger ones
+with the fastest available algorithm (lz4, then zstd, then zlib); a two-byte
+header records which one, so the algorithm can change without flushing.
+Values without a header are either uncompressed or written by the old
+``ZlibCompressor`` and are still read.
+
+``FastSerializer`` encodes JSON-shaped values (dicts with string keys,
+lists, strings, numbers, booleans, None) with orjson or msgpack when one is
+installed and falls back to pickle for everything else, including tuples,
+Decimals, dates and model instances, so values always round-trip exactly.
+
+``MeteredClient`` counts hits, misses and bytes moved per process; see
+``cache_metrics()``.
+"""
+
+import pickle
+import threading
+import zlib
+
+from django.conf import settings
+from django_redis.client import DefaultClient
+from django_redis.compressors.base import BaseCompressor
+from django_redis.exceptions import CompressorError
+from django_redis.serializers.base import BaseSerializer
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+COMPRESSION_MIN_SIZE = getattr(settings, 'CACHE_COMPRESSION_MIN_SIZE', 1024)
+COMPRESSION = getattr(settings, 'CACHE_COMPRESSION', 'auto')
+JSON_CODEC = getattr(settings, 'CACHE_JSON_CODEC', 'auto')
+# Walking very large values to prove they are JSON-shaped costs more than pickling them
+MAX_JSON_CHECK_ITEMS = 20000
+
+COMPRESSED_HEADER = b'\xffC'
+ZLIB_MAGIC = (b'\x78\x01', b'\x78\x5e', b'\x78\x9c', b'\x78\xda')
+
+
+def _zstd_compress(data):
+    return zstandard.ZstdCompressor(level=3).compress(data)
+
+
+def _zstd_decompress(data):
+    return zstandard.ZstdDecompressor().decompress(data)
+
+
+# marker -> (name, compress, decompress, available)
+ALGORITHMS = {
+    b'l': ('lz4', lambda data: lz4.frame.compress(data), lambda data: lz4.frame.decompress(data), lz4 is not None),
+    b's': ('zstd', _zstd_compress, _zstd_decompress, zstandard is not None),
+    b'z': ('zlib', lambda data: zlib.compress(data, 6), zlib.decompress, True),
+}
+
+
+class CacheMetrics:
+    """Per-process cache counters"""
+
+    FIELDS = ('hits', 'misses', 'bytes_read', 'bytes_written', 'raw_bytes', 'compressed_bytes')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def add(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                self._counts[name] += value
+
+    def reset(self):
+        with self._lock:
+            self._counts = dict.fromkeys(self.FIELDS, 0)
+
+    def snapshot(self):
+        with self._lock:
+            counts = dict(self._counts)
+        lookups = counts['hits'] + counts['misses']
+        counts['hit_rate'] = round(counts['hits'] / lookups, 4) if lookups else None
+        counts['compression_ratio'] = (
+            round(counts['compressed_bytes'] / counts['raw_bytes'], 4) if counts['raw_bytes'] else None
+        )
+        return counts
+
+
+metrics = CacheMetrics()
+
+
+def cache_metrics():
+    """Hit/miss/byte counters for this process, plus the codecs in use"""
+    return {
+        **metrics.snapshot(),
+        'compressor': ALGORITHMS[_compression_marker()][0],
+        'json_codec': _json_codec() or 'pickle',
+    }
+
+
+def _compression_marker():
+    if COMPRESSION != 'auto':
+        for marker, (name, _, _, available) in ALGORITHMS.items():
+            if name == COMPRESSION and available:
+                return marker
+    return next(marker for marker, (_, _, _, available) in ALGORITHMS.items() if available)
+
+
+def _json_codec():
+    if JSON_CODEC in ('orjson', 'auto') and orjson is not None:
+        return 'orjson'
+    if JSON_CODEC in ('msgpack', 'auto') and msgpack is not None:
+        return 'msgpack'
+    return None
+
+
+class ThresholdCompressor(BaseCompressor):
+    min_length = COMPRESSION_MIN_SIZE
+
+    def __init__(self, options):
+        super().__init__(options)
+        self.marker = _compression_marker()
+        self._compress = ALGORITHMS[self.marker][1]
+
+    def compress(self, value):
+        if len(value) < self.min_length:
+            return value
+        compressed = COMPRESSED_HEADER + self.marker + self._compress(value)
+        if len(compressed) >= len(value):
+            return value
+        metrics.add(raw_bytes=len(value), compressed_bytes=len(compressed))
+        return compressed
+
+    def decompress(self, value):
+        if value[:2] == COMPRESSED_HEADER:
+            name, _, decompress, available = ALGORITHMS.get(value[2:3], (None, None, None, False))
+            if not available:
+                raise CompressorError(f"cannot decompress cache value compressed with {name or value[2:3]!r}")
+            return decompress(value[3:])
+        if value[:2] in ZLIB_MAGIC:
+            # Written before this compressor, by django_redis' ZlibCompressor
+            try:
+                return zlib.decompress(value)
+            except zlib.error:
+                pass
+        raise CompressorError('value is not compressed')
+
+
+def _is_json_shaped(value, budget):
+    stack = [value]
+    while stack:
+        budget -= 1
+        if budget < 0:
+            return False
+        item = stack.pop()
+        kind = type(item)
+        if kind in (str, int, float, bool) or item is None:
+            continue
+        if kind is list:
+            stack.extend(item)
+        elif kind is dict:
+            if any(type(key) is not str for key in item):
+                return False
+            stack.extend(item.values())
+        else:
+            return False
+    return True
+
+
+class FastSerializer(BaseSerializer):
+    # Pickle output starts with b'\x80', so these one-byte markers cannot collide with it
+    def __init__(self, options):
+        super().__init__(options=options)
+        self.codec = _json_codec()
+        self.protocol = options.get('PICKLE_VERSION', pickle.HIGHEST_PROTOCOL)
+
+    def dumps(self, value):
+        if self.codec and _is_json_shaped(value, MAX_JSON_CHECK_ITEMS):
+            try:
+                if self.codec == 'orjson':
+                    return b'J' + orjson.dumps(value)
+                return b'M' + msgpack.packb(value, use_bin_type=True)
+            except (TypeError, ValueError, OverflowError):
+                # e.g. integers beyond 64 bits
+                pass
+        return pickle.dumps(value, self.protocol)
+
+    def loads(self, value):
+        marker = value[:1]
+        if marker == b'J':
+            return orjson.loads(value[1:])
+        if marker == b'M':
+            return msgpack.unpackb(value[1:], raw=False)
+        return pickle.loads(value)
+
+
+class MeteredClient(DefaultClient):
+    """django_redis client that records hits, misses and payload bytes"""
+
+    _missing = object()
+
+    def get(self, key, default=None, version=None, client=None):
+        value = super().get(key, default=self._missing, version=version, client=client)
+        if value is self._missing:
+            metrics.add(misses=1)
+            return default
+        metrics.add(hits=1)
+        return value
+
+    def get_many(self, keys, version=None, client=None):
+        keys = list(keys)
+        found = super().get_many(keys, version=version, client=client)
+        metrics.add(hits=len(found), misses=len(keys) - len(found))
+        return found
+
+    def decode(self, value):
+        if isinstance(value, bytes):
+            metrics.add(bytes_read=len(value))
+        return super().decode(value)
+
+    def encode(self, value):
+        encoded = super().encode(value)
+        if isinstance(encoded, bytes):
+            metrics.add(bytes_written=len(encoded))
+        return encoded
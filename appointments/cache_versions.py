@@ -0,0 +1,128 @@
+"""
+Generational cache namespaces.
+
+A namespace such as ``org:12``, ``doctor:5`` or the doctor directory has a
+version counter in the shared cache. Keys for data derived from a namespace
+embed its current version, so bumping one counter after a write orphans
+every dependent dashboard fragment, map tile, facet count and analytics
+series at once -- no key scanning or pattern deletes -- and the orphaned
+entries expire on their own timeouts.
+"""
+
+import hashlib
+import logging
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+# Directory-wide namespaces for data that spans organizations
+DOCTOR_DIRECTORY = 'doctors'
+ORGANIZATION_DIRECTORY = 'organizations'
+ALL_APPOINTMENTS = 'appointments'
+ROLLUPS = 'rollups'
+
+MAX_PLAIN_KEY_LENGTH = 200
+
+
+def organization_namespace(organization_id):
+    return f"org:{organization_id}"
+
+
+def doctor_namespace(doctor_id):
+    return f"doctor:{doctor_id}"
+
+
+def patient_namespace(patient_id):
+    return f"patient:{patient_id}"
+
+
+def profile_namespace(user_id):
+    return f"profile:{user_id}"
+
+
+def _version_key(namespace):
+    return f"ns:{namespace}"
+
+
+def _seed():
+    # A counter recreated after eviction starts from the clock, which is ahead
+    # of any version already embedded in a derived key.
+    return time.time_ns() // 1000
+
+
+def versions(namespaces):
+    """Map namespace -> current version with one cache round trip, creating missing counters"""
+    keys = {_version_key(namespace): namespace for namespace in namespaces}
+    found = cache.get_many(list(keys))
+    current = {}
+    for key, namespace in keys.items():
+        if key not in found:
+            cache.add(key, _seed(), None)
+            found[key] = cache.get(key)
+        current[namespace] = found[key]
+    return current
+
+
+def bump(*namespaces):
+    """Invalidate every key derived from the given namespaces"""
+    for namespace in namespaces:
+        key = _version_key(namespace)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, _seed(), None)
+
+
+def bump_on_commit(namespaces):
+    """Bump namespaces once the current transaction commits"""
+    namespaces = set(namespaces)
+    if not namespaces:
+        return
+
+    def run():
+        try:
+            bump(*namespaces)
+        except Exception as e:
+            logger.error(f"Failed to bump cache namespaces {sorted(namespaces)}: {e}")
+
+    transaction.on_commit(run)
+
+
+def namespace_stamp(namespaces):
+    """``ns@version`` pairs for embedding in keys; compute once when deriving many keys"""
+    current = versions(namespaces)
+    return ','.join(f"{namespace}@{current[namespace]}" for namespace in sorted(current))
+
+
+def versioned_key(prefix, namespaces, *parts):
+    """
+    A cache key for ``parts`` that changes whenever any namespace is bumped.
+
+    Long keys are hashed so they stay within memcached/Redis friendly limits.
+    """
+    key = ':'.join([prefix, namespace_stamp(namespaces), *map(str, parts)])
+    if len(key) > MAX_PLAIN_KEY_LENGTH:
+        key = f"{prefix}:{hashlib.md5(key.encode()).hexdigest()}"
+    return key
+
+
+def appointment_namespaces(instance):
+    """
+    Namespaces an appointment (or payment) belongs to, before and after the
+    change: its organization, doctor and patient, plus the global one.
+    """
+    namespaces = {ALL_APPOINTMENTS}
+    builders = {
+        'organization_id': organization_namespace,
+        'doctor_id': doctor_namespace,
+        'patient_id': patient_namespace,
+    }
+    current = {field: getattr(instance, field, None) for field in builders}
+    for values in (current, getattr(instance, '_loaded_values', None) or {}):
+        for field, build in builders.items():
+            if values.get(field) is not None:
+                namespaces.add(build(values[field]))
+    return namespaces
@@ -0,0 +1,207 @@
+"""
+Cached fragments for the doctor, reception and patient dashboards.
+
+Status counts, today's appointments and upcoming lists are cached per
+(scope, fragment, day), where the scope is an organization, a doctor or a
+patient. Every fragment key embeds the version of that scope's cache
+namespace (see ``cache_versions``), which appointment and payment writes
+bump once the transaction commits. Old keys are never deleted, they simply
+stop being read and age out, so a dashboard is served from cache until
+something it shows has actually changed.
+
+Time-of-day details (the current patient, the next patient, free slots) are
+derived from the cached day list on each request rather than cached.
+"""
+
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+
+from .cache_aside import cache_aside_many, refresher
+from .cache_versions import doctor_namespace, organization_namespace, patient_namespace, versions
+from .models import Appointment, Payment
+from .rollups import day_bounds
+from .user_context import user_context
+
+DASHBOARD_CACHE_TIMEOUT = getattr(settings, 'DASHBOARD_CACHE_TIMEOUT', 60 * 10)
+SCOPE_FIELDS = {
+    'organization': 'organization_id',
+    'doctor': 'doctor_id',
+    'patient': 'patient_id',
+}
+SCOPE_NAMESPACES = {
+    'organization': organization_namespace,
+    'doctor': doctor_namespace,
+    'patient': patient_namespace,
+}
+INACTIVE_STATUSES = ('cancelled', 'declined')
+UPCOMING_LIMIT = 10
+SLOT_MINUTES = 30
+CLINIC_HOURS = (9, 17)
+MAX_SLOTS = 8
+
+
+def fragment_key(scope, scope_id, version, fragment, day):
+    return f"dashboard:{scope}:{scope_id}:v{version}:{fragment}:{day.isoformat()}"
+
+
+def cached_fragments(scope, scope_ids, fragment, day=None, timeout=DASHBOARD_CACHE_TIMEOUT):
+    """
+    Map scope id -> fragment for several scopes: one cache read for the
+    versions and one for the fragments. Missing fragments are computed once
+    under a lock; stale ones are served while Celery refreshes them.
+    """
+    day = day or timezone.localdate()
+    namespaces = {scope_id: SCOPE_NAMESPACES[scope](scope_id) for scope_id in scope_ids}
+    current = versions(namespaces.values())
+    keys = {
+        fragment_key(scope, scope_id, current[namespace], fragment, day): scope_id
+        for scope_id, namespace in namespaces.items()
+    }
+    compute = FRAGMENTS[fragment]
+    values = cache_aside_many(
+        keys,
+        lambda missing: {key: compute(scope, scope_id, day) for key, scope_id in missing.items()},
+        timeout,
+        refresh=lambda key, scope_id: ('dashboard-fragment', [scope, scope_id, fragment, day.isoformat()]),
+    )
+    return {scope_id: values[key] for key, scope_id in keys.items()}
+
+
+def cached_fragment(scope, scope_id, fragment, day=None, timeout=DASHBOARD_CACHE_TIMEOUT):
+    return cached_fragments(scope, [scope_id], fragment, day, timeout)[scope_id]
+
+
+@refresher('dashboard-fragment')
+def refresh_fragment(scope, scope_id, fragment, day):
+    return FRAGMENTS[fragment](scope, scope_id, date.fromisoformat(day))
+
+
+def scoped_appointments(scope, scope_id):
+    return Appointment.objects.filter(**{SCOPE_FIELDS[scope]: scope_id})
+
+
+def compute_stats(scope, scope_id, day):
+    """Template-ready counters for a scope's dashboard"""
+    appointments = scoped_appointments(scope, scope_id).order_by()
+    by_status = dict(appointments.values_list('status').annotate(total=Count('id')))
+    start, end = day_bounds(day)
+    recent = appointments.aggregate(
+        last_7=Count('id', filter=Q(appointment_date__gte=start - timedelta(days=6), appointment_date__lt=end)),
+        last_30=Count('id', filter=Q(appointment_date__gte=start - timedelta(days=29), appointment_date__lt=end)),
+    )
+    queue = dict(
+        appointments.filter(appointment_date__gte=start, appointment_date__lt=end)
+        .exclude(status__in=INACTIVE_STATUSES)
+        .values_list('patient_status').annotate(total=Count('id'))
+    )
+    revenue = Payment.objects.filter(
+        status='completed', **{f'appointment__{SCOPE_FIELDS[scope]}': scope_id}
+    ).aggregate(total=Sum('amount'))['total']
+
+    total = sum(by_status.values())
+    completed = by_status.get('completed', 0)
+    return {
+        'total_appointments': total,
+        'pending_appointments': by_status.get('pending', 0),
+        'accepted_appointments': by_status.get('confirmed', 0),
+        'declined_appointments': by_status.get('declined', 0),
+        'cancelled_appointments': by_status.get('cancelled', 0),
+        'completed_appointments': completed,
+        'completion_rate': (completed / total * 100) if total else 0.0,
+        'total_revenue': revenue or Decimal('0'),
+        'appts_last_7': recent['last_7'],
+        'appts_last_30': recent['last_30'],
+        'waiting_patients': queue.get('waiting', 0),
+        'in_consultation': queue.get('in_consultation', 0),
+        'done_patients': queue.get('done', 0),
+    }
+
+
+def compute_day_appointments(scope, scope_id, day):
+    """A scope's appointments on one day, earliest first, with related rows loaded"""
+    start, end = day_bounds(day)
+    return list(
+        scoped_appointments(scope, scope_id)
+        .filter(appointment_date__gte=start, appointment_date__lt=end)
+        .select_related('patient', 'doctor__profile', 'organization')
+        .order_by('appointment_date', 'id')
+    )
+
+
+def compute_upcoming(scope, scope_id, day):
+    """The next active appointments after the given day"""
+    return list(
+        scoped_appointments(scope, scope_id)
+        .filter(appointment_date__gte=day_bounds(day)[1])
+        .exclude(status__in=INACTIVE_STATUSES)
+        .select_related('patient', 'doctor__profile', 'organization')
+        .order_by('appointment_date', 'id')[:UPCOMING_LIMIT]
+    )
+
+
+FRAGMENTS = {
+    'stats': compute_stats,
+    'day': compute_day_appointments,
+    'upcoming': compute_upcoming,
+}
+
+
+def available_slots(appointments, day, now=None):
+    """Unbooked slot start times left in the clinic day"""
+    now = now or timezone.now()
+    booked = {
+        timezone.localtime(appointment.appointment_date).replace(second=0, microsecond=0)
+        for appointment in appointments if appointment.status not in INACTIVE_STATUSES
+    }
+    slot = day_bounds(day)[0] + timedelta(hours=CLINIC_HOURS[0])
+    closing = day_bounds(day)[0] + timedelta(hours=CLINIC_HOURS[1])
+    slots = []
+    while slot < closing and len(slots) < MAX_SLOTS:
+        if slot >= now and timezone.localtime(slot) not in booked:
+            slots.append(slot)
+        slot += timedelta(minutes=SLOT_MINUTES)
+    return slots
+
+
+def doctor_status(appointments, day, now=None):
+    """Current and next patient plus free slots, from a doctor's cached day list"""
+    now = now or timezone.now()
+    active = [appointment for appointment in appointments if appointment.status not in INACTIVE_STATUSES]
+    current = next((a for a in active if a.patient_status == 'in_consultation'), None)
+    upcoming = (a for a in active if a.patient_status == 'waiting' and a.appointment_date >= now - timedelta(minutes=SLOT_MINUTES))
+    return {
+        'current_appointment': current,
+        'next_appointment': next(upcoming, None),
+        'available_slots': available_slots(appointments, day, now),
+    }
+
+
+def doctor_infos(doctors, day=None, now=None):
+    """Dashboard cards for doctors (users with ``profile`` loaded), without per-doctor queries"""
+    day = day or timezone.localdate()
+    schedules = cached_fragments('doctor', [doctor.id for doctor in doctors], 'day', day)
+    return [
+        {
+            'doctor': doctor,
+            'on_duty': doctor.profile.on_duty,
+            **doctor_status(schedules[doctor.id], day, now),
+        }
+        for doctor in doctors
+    ]
+
+
+def dashboard_scope(user):
+    """The (scope, id) whose dashboard a user sees, or None"""
+    context = user_context(user)
+    if context.role is None:
+        return None
+    if context.is_doctor:
+        return 'doctor', user.id
+    if context.is_receptionist:
+        return ('organization', context.organization_id) if context.organization_id else None
+    return 'patient', user.id
+
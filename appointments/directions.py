@@ -0,0 +1,253 @@
+"""
+Travel distance/ETA estimates between patient areas and clinics.
+
+Estimates are keyed by a coarse geohash of the patient's location plus the
+organization id, so everyone in the same ~5 km cell shares an entry. Reads
+go through a bounded in-process LRU, whose entries expire after
+``TRAVEL_ESTIMATE_LRU_TIMEOUT`` so a worker never serves an estimate the
+shared cache has already dropped, and then the shared Django cache; on a
+miss the request path falls back to a straight-line estimate and never calls
+an external routing API. Real routing results are precomputed by Celery for
+upcoming appointments, using the origin each patient last shared.
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from dataclasses import asdict, dataclass
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .geo import decode_geohash, encode_geohash, haversine_km
+
+logger = logging.getLogger(__name__)
+
+ORIGIN_GEOHASH_PRECISION = 5
+ORIGIN_MEMORY_TIMEOUT = 60 * 60 * 24 * 30
+GOOGLE_DISTANCE_MATRIX_URL = 'https://maps.googleapis.com/maps/api/distancematrix/json'
+# Distance Matrix allows up to 25 destinations per origin in one request.
+MAX_DESTINATIONS_PER_REQUEST = 25
+
+
+@dataclass
+class TravelEstimate:
+    distance_km: float
+    duration_minutes: int
+    provider: str
+    computed_at: str = ''
+
+    @property
+    def is_precise(self):
+        return self.provider != StraightLineEstimator.name
+
+
+class LRUCache:
+    """Small thread-safe LRU map with per-entry expiry, used as the per-process tier"""
+
+    def __init__(self, max_entries, timeout=None, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.clock = clock
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """The value, or None if missing or expired (expired entries are dropped)"""
+        with self._lock:
+            if key not in self._data:
+                return None
+            expires, value = self._data[key]
+            if expires is not None and self.clock() >= expires:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        with self._lock:
+            self._data[key] = (None if timeout is None else self.clock() + timeout, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+_local_estimates = LRUCache(
+    getattr(settings, 'TRAVEL_ESTIMATE_LRU_SIZE', 2048), getattr(settings, 'TRAVEL_ESTIMATE_LRU_TIMEOUT', 60 * 5),
+)
+
+
+class StraightLineEstimator:
+    """Offline estimate: haversine distance with a road detour factor and average speed"""
+    name = 'straight_line'
+    detour_factor = 1.3
+    average_speed_kmh = 30.0
+
+    def estimate_many(self, origin, destinations):
+        results = {}
+        for key, (latitude, longitude) in destinations.items():
+            distance = haversine_km(origin[0], origin[1], latitude, longitude) * self.detour_factor
+            results[key] = TravelEstimate(
+                distance_km=round(distance, 1),
+                duration_minutes=max(1, round(distance / self.average_speed_kmh * 60)),
+                provider=self.name,
+                computed_at=timezone.now().isoformat(),
+            )
+        return results
+
+
+class GoogleDistanceMatrixProvider:
+    """Driving estimates from the Google Distance Matrix API, one request per origin"""
+    name = 'google'
+
+    def __init__(self, api_key=None, timeout=10):
+        self.api_key = api_key or settings.GOOGLE_MAPS_API_KEY
+        self.timeout = timeout
+
+    def estimate_many(self, origin, destinations):
+        results = {}
+        items = list(destinations.items())
+        for start in range(0, len(items), MAX_DESTINATIONS_PER_REQUEST):
+            chunk = items[start:start + MAX_DESTINATIONS_PER_REQUEST]
+            response = requests.get(
+                GOOGLE_DISTANCE_MATRIX_URL,
+                params={
+                    'origins': f'{origin[0]},{origin[1]}',
+                    'destinations': '|'.join(f'{lat},{lng}' for _, (lat, lng) in chunk),
+                    'mode': 'driving',
+                    'key': self.api_key,
+                },
+                timeout=self.timeout,
+            )
+            response.raise_for_status()
+            elements = response.json()['rows'][0]['elements']
+            for (key, _), element in zip(chunk, elements):
+                if element.get('status') != 'OK':
+                    continue
+                results[key] = TravelEstimate(
+                    distance_km=round(element['distance']['value'] / 1000, 1),
+                    duration_minutes=max(1, round(element['duration']['value'] / 60)),
+                    provider=self.name,
+                    computed_at=timezone.now().isoformat(),
+                )
+        return results
+
+
+def get_route_provider():
+    """Configured routing provider; the straight-line estimator when offline"""
+    path = getattr(settings, 'DIRECTIONS_PROVIDER', None)
+    if path:
+        return import_string(path)()
+    if settings.GOOGLE_MAPS_API_KEY:
+        return GoogleDistanceMatrixProvider()
+    return StraightLineEstimator()
+
+
+def origin_cell(latitude, longitude):
+    return encode_geohash(latitude, longitude, ORIGIN_GEOHASH_PRECISION)
+
+
+def estimate_key(cell, organization_id):
+    return f"travel:{cell}:{organization_id}"
+
+
+def _destination(organization):
+    return float(organization.latitude), float(organization.longitude)
+
+
+def get_cached_estimate(cell, organization_id):
+    """Look up an estimate in the process LRU, then the shared cache"""
+    key = estimate_key(cell, organization_id)
+    estimate = _local_estimates.get(key)
+    if estimate is not None:
+        return estimate
+    data = cache.get(key)
+    if data is None:
+        return None
+    estimate = TravelEstimate(**data)
+    _local_estimates.set(key, estimate)
+    return estimate
+
+
+def store_estimate(cell, organization_id, estimate):
+    key = estimate_key(cell, organization_id)
+    cache.set(key, asdict(estimate), settings.TRAVEL_ESTIMATE_CACHE_TIMEOUT)
+    _local_estimates.set(key, estimate)
+
+
+def get_travel_estimate(latitude, longitude, organization):
+    """
+    Travel estimate from a point to an organization, safe for the request path.
+
+    Returns a precomputed routing result when one exists for the origin cell,
+    otherwise a straight-line estimate (which is not cached, so a later warm
+    run can replace it). Returns None if the organization has no coordinates.
+    """
+    if organization is None or organization.latitude is None or organization.longitude is None:
+        return None
+    cell = origin_cell(latitude, longitude)
+    estimate = get_cached_estimate(cell, organization.id)
+    if estimate is not None:
+        return estimate
+    return StraightLineEstimator().estimate_many(
+        (float(latitude), float(longitude)), {organization.id: _destination(organization)}
+    )[organization.id]
+
+
+def remember_origin(user_id, latitude, longitude):
+    """Record the coarse area a user last shared, for warming their estimates"""
+    cache.set(f"travel:origin:{user_id}", origin_cell(latitude, longitude), ORIGIN_MEMORY_TIMEOUT)
+
+
+def remembered_origins(user_ids):
+    """Map user id -> remembered origin cell"""
+    keys = {f"travel:origin:{user_id}": user_id for user_id in user_ids}
+    found = cache.get_many(list(keys))
+    return {keys[key]: cell for key, cell in found.items()}
+
+
+def warm_estimates(pairs, provider=None):
+    """
+    Compute and cache estimates for (origin cell, organization) pairs.
+
+    Pairs are grouped by origin so each origin costs one provider request
+    (per 25 destinations). Pairs already cached with a precise result are
+    skipped. Returns the number of estimates stored.
+    """
+    provider = provider or get_route_provider()
+    by_origin = defaultdict(dict)
+    for cell, organization in pairs:
+        if organization.latitude is None or organization.longitude is None:
+            continue
+        cached = get_cached_estimate(cell, organization.id)
+        if cached is not None and cached.is_precise:
+            continue
+        by_origin[cell][organization.id] = _destination(organization)
+
+    stored = 0
+    for cell, destinations in by_origin.items():
+        try:
+            results = provider.estimate_many(decode_geohash(cell), destinations)
+        except Exception as e:
+            logger.error(f"Travel estimate provider failed for origin {cell}: {e}")
+            continue
+        for organization_id, estimate in results.items():
+            store_estimate(cell, organization_id, estimate)
+            stored += 1
+    return stored
@@ -0,0 +1,158 @@
+"""
+Facet counts for the doctor browser.
+
+All facets are counted in a single grouped pass over the doctor search
+documents using ``GROUPING SETS``. Each facet's counts apply every selected
+filter except its own (so picking one specialization still shows how many
+doctors the other specializations have), which is done with per-facet
+``COUNT(...) FILTER (WHERE ...)`` columns. Results are cached per filter
+signature, versioned by the doctor directory namespace.
+"""
+
+from functools import reduce
+from operator import and_
+
+from django.db import connection
+from django.db.models import BooleanField, Case, CharField, ExpressionWrapper, Value, When
+
+from .cache_aside import cache_aside, refresher
+from .cache_versions import DOCTOR_DIRECTORY, versioned_key
+from .map_clusters import filter_signature
+from .models import DoctorSearchDocument
+from .search import (
+    BANDS, apply_search_filters, band_q, filter_params, filter_q, match_documents, parse_search_filters, search_terms,
+)
+
+FACET_CACHE_TIMEOUT = 60
+MAX_FACET_VALUES = 50
+FACETS = ('specialization', 'organization', 'language', 'fee_band', 'rating_band', 'on_duty')
+
+FACET_SQL = """
+SELECT
+    CASE
+        WHEN GROUPING(docs.specialization) = 0 THEN 'specialization'
+        WHEN GROUPING(docs.organization_id) = 0 THEN 'organization'
+        WHEN GROUPING(lang.value) = 0 THEN 'language'
+        WHEN GROUPING(docs.fee_band) = 0 THEN 'fee_band'
+        WHEN GROUPING(docs.rating_band) = 0 THEN 'rating_band'
+        WHEN GROUPING(docs.on_duty) = 0 THEN 'on_duty'
+        ELSE 'total'
+    END AS facet,
+    CASE
+        WHEN GROUPING(docs.specialization) = 0 THEN docs.specialization
+        WHEN GROUPING(docs.organization_id) = 0 THEN docs.organization_id::text
+        WHEN GROUPING(lang.value) = 0 THEN lang.value
+        WHEN GROUPING(docs.fee_band) = 0 THEN docs.fee_band
+        WHEN GROUPING(docs.rating_band) = 0 THEN docs.rating_band
+        WHEN GROUPING(docs.on_duty) = 0 THEN docs.on_duty::text
+    END AS value,
+    MAX(docs.organization_name) AS label,
+    CASE
+        WHEN GROUPING(docs.specialization) = 0 THEN COUNT(DISTINCT docs.user_id) FILTER (WHERE docs.ok_specialization)
+        WHEN GROUPING(docs.organization_id) = 0 THEN COUNT(DISTINCT docs.user_id) FILTER (WHERE docs.ok_organization)
+        WHEN GROUPING(lang.value) = 0 THEN COUNT(DISTINCT docs.user_id) FILTER (WHERE docs.ok_language)
+        WHEN GROUPING(docs.fee_band) = 0 THEN COUNT(DISTINCT docs.user_id) FILTER (WHERE docs.ok_fee_band)
+        WHEN GROUPING(docs.rating_band) = 0 THEN COUNT(DISTINCT docs.user_id) FILTER (WHERE docs.ok_rating_band)
+        WHEN GROUPING(docs.on_duty) = 0 THEN COUNT(DISTINCT docs.user_id) FILTER (WHERE docs.ok_on_duty)
+        ELSE COUNT(DISTINCT docs.user_id) FILTER (WHERE docs.ok_all)
+    END AS doctors
+FROM ({documents}) AS docs
+LEFT JOIN LATERAL jsonb_array_elements_text(docs.languages) AS lang(value) ON TRUE
+GROUP BY GROUPING SETS (
+    (docs.specialization), (docs.organization_id), (lang.value),
+    (docs.fee_band), (docs.rating_band), (docs.on_duty), ()
+)
+"""
+
+
+def band_case(field, bands):
+    return Case(
+        *[When(band_q(field, low, high), then=Value(name)) for name, low, high in bands],
+        default=Value(None),
+        output_field=CharField(),
+    )
+
+
+def _all_of(filters):
+    """Boolean column that is true when every filter passes"""
+    if not filters:
+        return Value(True, output_field=BooleanField())
+    return ExpressionWrapper(reduce(and_, [filter_q(key, value) for key, value in filters.items()]),
+                             output_field=BooleanField())
+
+
+def facet_documents(query, filters):
+    """
+    The per-doctor rows the facet query groups over.
+
+    Non-facet filters (text query, org type, fee/rating bounds) restrict the
+    rows; facet filters become ``ok_<facet>`` flags instead.
+    """
+    facet_filters = {key: value for key, value in filters.items() if key in FACETS}
+    queryset = apply_search_filters(
+        DoctorSearchDocument.objects.filter(is_active=True),
+        {key: value for key, value in filters.items() if key not in FACETS},
+    )
+    terms = search_terms(query)
+    if terms:
+        queryset = match_documents(queryset, terms)
+
+    flags = {
+        f'ok_{facet}': _all_of({key: value for key, value in facet_filters.items() if key != facet})
+        for facet in FACETS
+    }
+    flags['ok_all'] = _all_of(facet_filters)
+    bands = {key: band_case(field, bands) for key, (field, bands) in BANDS.items()}
+    return queryset.annotate(**bands, **flags).values(
+        'user_id', 'specialization', 'organization_id', 'organization_name', 'languages', 'on_duty',
+        *bands, *flags,
+    )
+
+
+def compute_facet_counts(query='', filters=None):
+    """Run the grouped facet query; returns ``{'total': n, 'facets': {...}}``"""
+    sql, params = facet_documents(query, filters or {}).query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(FACET_SQL.format(documents=sql), params)
+        rows = cursor.fetchall()
+
+    total = 0
+    facets = {facet: [] for facet in FACETS}
+    for facet, value, label, doctors in rows:
+        if facet == 'total':
+            total = doctors
+            continue
+        if value in (None, '') or not doctors:
+            continue
+        bucket = {'value': value, 'count': doctors}
+        if facet == 'organization':
+            bucket.update(value=int(value), label=label)
+        elif facet == 'on_duty':
+            bucket['value'] = value == 'true'
+        facets[facet].append(bucket)
+
+    for facet, buckets in facets.items():
+        if facet in BANDS:
+            order = [name for name, _, _ in BANDS[facet][1]]
+            buckets.sort(key=lambda bucket: order.index(bucket['value']))
+        else:
+            buckets.sort(key=lambda bucket: (-bucket['count'], str(bucket['value'])))
+            del buckets[MAX_FACET_VALUES:]
+    return {'total': total, 'facets': facets}
+
+
+@refresher('doctor-facets')
+def refresh_facet_counts(query, params):
+    return compute_facet_counts(query, parse_search_filters(params))
+
+
+def facet_counts(query='', filters=None):
+    """Cached facet counts for a query and filter selection"""
+    filters = filters or {}
+    params = filter_params(filters)
+    signature = filter_signature(q=' '.join(search_terms(query)), **params)
+    key = versioned_key('doctor-facets', [DOCTOR_DIRECTORY], signature)
+    return cache_aside(
+        key, lambda: compute_facet_counts(query, filters), FACET_CACHE_TIMEOUT,
+        refresh=('doctor-facets', [query, params]),
+    )
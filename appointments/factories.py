@@ -43,6 +43,23 @@ class UserProfileFactory(factory.django.DjangoModelFactory):
     certifications = factory.LazyFunction(lambda: [fake.job()[:50] for _ in range(fake.random_int(min=0, max=3))])
 
 
+def make_member(role, organization=None, profile_fields=None, **user_fields):
+    """
+    A user with the given role and organization, freshly loaded.
+
+    Users get their profile from a post_save signal, so UserProfileFactory
+    cannot build one for a new user; this sets up that profile instead.
+    """
+    user = UserFactory(**user_fields)
+    profile = user.profile
+    profile.role = role
+    profile.organization = organization
+    for field, value in (profile_fields or {}).items():
+        setattr(profile, field, value)
+    profile.save()
+    return User.objects.get(pk=user.pk)
+
+
 class OrganizationFactory(factory.django.DjangoModelFactory):
     """Factory for creating Organization instances"""
     class Meta:
@@ -0,0 +1,199 @@
+"""
+Geospatial helpers for organization lookups.
+
+Organizations carry a geohash that is indexed with a plain B-tree, so radius
+queries can narrow candidates with a handful of prefix range scans, tighten
+them with a latitude/longitude bounding box and then rank the survivors by
+exact haversine distance in SQL. No PostGIS required.
+"""
+
+import math
+from functools import reduce
+from operator import or_
+
+from django.db.models import F, FloatField, Q, Value
+from django.db.models.functions import ASin, Cast, Cos, Power, Radians, Sin, Sqrt
+
+EARTH_RADIUS_KM = 6371.0088
+GEOHASH_PRECISION = 12
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_DECODE = {char: index for index, char in enumerate(GEOHASH_ALPHABET)}
+
+# Upper bound on the number of prefix scans a single radius query may issue.
+MAX_COVER_CELLS = 16
+
+
+def encode_geohash(latitude, longitude, precision=GEOHASH_PRECISION):
+    """Encode a coordinate as a geohash string"""
+    latitude, longitude = float(latitude), float(longitude)
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, bit_count, even = [], 0, 0, True
+    while len(chars) < precision:
+        interval, value = (lng_range, longitude) if even else (lat_range, latitude)
+        mid = (interval[0] + interval[1]) / 2
+        if value >= mid:
+            bits = (bits << 1) | 1
+            interval[0] = mid
+        else:
+            bits <<= 1
+            interval[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(GEOHASH_ALPHABET[bits])
+            bits, bit_count = 0, 0
+    return ''.join(chars)
+
+
+def decode_geohash_bounds(geohash):
+    """Return (min_lat, min_lng, max_lat, max_lng) of a geohash cell"""
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    even = True
+    for char in geohash:
+        value = GEOHASH_DECODE[char]
+        for shift in range(4, -1, -1):
+            interval = lng_range if even else lat_range
+            mid = (interval[0] + interval[1]) / 2
+            if (value >> shift) & 1:
+                interval[0] = mid
+            else:
+                interval[1] = mid
+            even = not even
+    return lat_range[0], lng_range[0], lat_range[1], lng_range[1]
+
+
+def decode_geohash(geohash):
+    """Return the (latitude, longitude) centre of a geohash cell"""
+    min_lat, min_lng, max_lat, max_lng = decode_geohash_bounds(geohash)
+    return (min_lat + max_lat) / 2, (min_lng + max_lng) / 2
+
+
+def geohash_cell_size(precision):
+    """Return (height, width) in degrees of a geohash cell at ``precision``"""
+    total_bits = precision * 5
+    lng_bits = (total_bits + 1) // 2
+    lat_bits = total_bits // 2
+    return 180.0 / (2 ** lat_bits), 360.0 / (2 ** lng_bits)
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    """Great-circle distance between two coordinates in kilometres"""
+    lat1, lng1, lat2, lng2 = map(math.radians, map(float, (lat1, lng1, lat2, lng2)))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_box(latitude, longitude, radius_km):
+    """
+    Return (min_lat, min_lng, max_lat, max_lng) enclosing a circle.
+
+    Longitudes may fall outside [-180, 180] when the circle crosses the
+    antimeridian; callers that build SQL filters should check for that.
+    """
+    latitude, longitude = float(latitude), float(longitude)
+    lat_delta = math.degrees(radius_km / EARTH_RADIUS_KM)
+    min_lat, max_lat = max(-90.0, latitude - lat_delta), min(90.0, latitude + lat_delta)
+    if min_lat <= -90.0 or max_lat >= 90.0:
+        return min_lat, -180.0, max_lat, 180.0
+    lng_delta = math.degrees(radius_km / (EARTH_RADIUS_KM * math.cos(math.radians(latitude))))
+    return min_lat, longitude - lng_delta, max_lat, longitude + lng_delta
+
+
+def _normalize_lng(longitude):
+    return ((longitude + 180.0) % 360.0) - 180.0
+
+
+def cover_bbox(min_lat, min_lng, max_lat, max_lng, max_cells=MAX_COVER_CELLS, max_precision=GEOHASH_PRECISION):
+    """
+    Return the geohash prefixes covering a bounding box.
+
+    Picks the finest precision (up to ``max_precision``) whose covering stays
+    within ``max_cells`` cells, so a radius query costs at most that many
+    index range scans.
+    Returns None when even single-character cells would exceed the limit,
+    in which case prefix filtering is not worth it.
+    """
+    if max_lng - min_lng >= 360.0:
+        min_lng, max_lng = -180.0, 180.0
+    for precision in range(max_precision, 0, -1):
+        height, width = geohash_cell_size(precision)
+        rows = math.floor((max_lat + 90.0) / height) - math.floor((min_lat + 90.0) / height) + 1
+        cols = math.floor((max_lng + 180.0) / width) - math.floor((min_lng + 180.0) / width) + 1
+        if rows * cols > max_cells:
+            continue
+
+        cells = set()
+        lat_start = math.floor((min_lat + 90.0) / height) * height - 90.0
+        lng_start = math.floor((min_lng + 180.0) / width) * width - 180.0
+        for row in range(rows):
+            cell_lat = min(89.999999, lat_start + (row + 0.5) * height)
+            for col in range(cols):
+                cell_lng = _normalize_lng(lng_start + (col + 0.5) * width)
+                cells.add(encode_geohash(cell_lat, cell_lng, precision))
+        return sorted(cells)
+    return None
+
+
+def haversine_expression(latitude, longitude, lat_field='latitude', lng_field='longitude'):
+    """ORM expression computing the haversine distance (km) from a point"""
+    origin_lat = math.radians(float(latitude))
+    origin_lng = math.radians(float(longitude))
+    row_lat = Radians(Cast(F(lat_field), FloatField()))
+    row_lng = Radians(Cast(F(lng_field), FloatField()))
+    a = (
+        Power(Sin((row_lat - Value(origin_lat)) / 2), 2)
+        + Value(math.cos(origin_lat)) * Cos(row_lat) * Power(Sin((row_lng - Value(origin_lng)) / 2), 2)
+    )
+    return Value(2 * EARTH_RADIUS_KM) * ASin(Sqrt(a))
+
+
+def geohash_prefix_filter(prefixes, field='geohash'):
+    """Q object matching rows whose geohash starts with any of ``prefixes``"""
+    if prefixes is None:
+        return Q()
+    if not prefixes:
+        return Q(pk__in=[])
+    return reduce(or_, (Q(**{f'{field}__startswith': prefix}) for prefix in prefixes))
+
+
+def bbox_filter(min_lat, min_lng, max_lat, max_lng, lat_field='latitude', lng_field='longitude'):
+    """Q object restricting rows to a bounding box, handling antimeridian wrap"""
+    query = Q(**{f'{lat_field}__gte': min_lat, f'{lat_field}__lte': max_lat})
+    if min_lng < -180.0:
+        query &= Q(**{f'{lng_field}__gte': min_lng + 360.0}) | Q(**{f'{lng_field}__lte': max_lng})
+    elif max_lng > 180.0:
+        query &= Q(**{f'{lng_field}__gte': min_lng}) | Q(**{f'{lng_field}__lte': max_lng - 360.0})
+    else:
+        query &= Q(**{f'{lng_field}__gte': min_lng, f'{lng_field}__lte': max_lng})
+    return query
+
+
+def filter_within_radius(queryset, latitude, longitude, radius_km, prefix=''):
+    """
+    Restrict ``queryset`` to rows within ``radius_km`` of a point, nearest first.
+
+    ``prefix`` points at a related model carrying the coordinates, e.g.
+    ``'organization__'`` for doctor profiles. Rows are annotated with
+    ``distance_km``.
+    """
+    bbox = bounding_box(latitude, longitude, radius_km)
+    lat_field, lng_field = f'{prefix}latitude', f'{prefix}longitude'
+    return (
+        queryset.filter(geohash_prefix_filter(cover_bbox(*bbox), f'{prefix}geohash'))
+        .filter(bbox_filter(*bbox, lat_field=lat_field, lng_field=lng_field))
+        .annotate(distance_km=haversine_expression(latitude, longitude, lat_field, lng_field))
+        .filter(distance_km__lte=radius_km)
+        .order_by('distance_km', 'id')
+    )
+
+
+def parse_coordinates(latitude, longitude):
+    """Validate user-supplied coordinates, returning floats or None"""
+    try:
+        latitude, longitude = float(latitude), float(longitude)
+    except (TypeError, ValueError):
+        return None
+    if not (-90.0 <= latitude <= 90.0 and -180.0 <= longitude <= 180.0):
+        return None
+    return latitude, longitude
@@ -0,0 +1,290 @@
+"""
+Geocoding for organization addresses.
+
+Providers are pluggable (``settings.GEOCODING_PROVIDER``): the Google
+Geocoding API in production and a deterministic local stub for development
+and tests. The stub writes made-up coordinates, so it is only used when
+named explicitly; with no provider and no API key nothing is geocoded and
+organizations stay unverified. Every lookup goes through a persistent cache keyed by the
+normalized address, and batch geocoding coalesces organizations that share
+an address into a single provider call. Geocoding only ever runs in Celery
+tasks; request handlers read coordinates that are already stored.
+"""
+
+import hashlib
+import logging
+import re
+import time
+from dataclasses import dataclass
+from datetime import timedelta
+from decimal import Decimal
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import GeocodeCache, Organization
+
+logger = logging.getLogger(__name__)
+
+GOOGLE_GEOCODE_URL = 'https://maps.googleapis.com/maps/api/geocode/json'
+GEOCODE_LOCK_TIMEOUT = 60
+
+_PUNCTUATION = re.compile(r'[^\w\s]')
+_WHITESPACE = re.compile(r'\s+')
+
+
+@dataclass
+class GeocodeResult:
+    latitude: Decimal
+    longitude: Decimal
+    place_id: str = None
+    formatted_address: str = None
+
+
+class GeocoderError(Exception):
+    """Raised when a provider fails in a way worth retrying"""
+
+
+class BaseGeocoder:
+    """Interface for geocoding providers"""
+    name = 'base'
+
+    def geocode(self, address):
+        """Return a GeocodeResult, or None when the address cannot be found"""
+        raise NotImplementedError
+
+
+class GoogleGeocoder(BaseGeocoder):
+    name = 'google'
+
+    def __init__(self, api_key=None, timeout=5):
+        self.api_key = api_key or settings.GOOGLE_MAPS_API_KEY
+        self.timeout = timeout
+
+    def geocode(self, address):
+        try:
+            response = requests.get(
+                GOOGLE_GEOCODE_URL,
+                params={'address': address, 'key': self.api_key},
+                timeout=self.timeout,
+            )
+            response.raise_for_status()
+            payload = response.json()
+        except (requests.RequestException, ValueError) as e:
+            raise GeocoderError(f"Google geocoding request failed: {e}")
+
+        status = payload.get('status')
+        if status == 'ZERO_RESULTS':
+            return None
+        if status != 'OK':
+            raise GeocoderError(f"Google geocoding returned {status}")
+
+        result = payload['results'][0]
+        location = result['geometry']['location']
+        return GeocodeResult(
+            latitude=Decimal(str(location['lat'])),
+            longitude=Decimal(str(location['lng'])),
+            place_id=result.get('place_id'),
+            formatted_address=result.get('formatted_address'),
+        )
+
+
+class StubGeocoder(BaseGeocoder):
+    """
+    Offline provider that derives stable coordinates from the address text.
+
+    Useful for development and tests: the same address always maps to the
+    same point, and nothing leaves the machine. ``known`` can pin specific
+    addresses to fixed results.
+    """
+    name = 'stub'
+
+    def __init__(self, known=None):
+        self.known = {normalize_address(key): value for key, value in (known or {}).items()}
+        self.calls = []
+
+    def geocode(self, address):
+        self.calls.append(address)
+        normalized = normalize_address(address)
+        if normalized in self.known:
+            return self.known[normalized]
+        digest = hashlib.sha256(normalized.encode('utf-8')).digest()
+        latitude = Decimal(int.from_bytes(digest[:4], 'big') % 1_600_000) / Decimal(10_000) - 80
+        longitude = Decimal(int.from_bytes(digest[4:8], 'big') % 3_600_000) / Decimal(10_000) - 180
+        return GeocodeResult(latitude=latitude, longitude=longitude, place_id=f"stub:{digest[:8].hex()}")
+
+
+def geocoding_enabled():
+    """Whether a provider is configured: GEOCODING_PROVIDER, or Google through GOOGLE_MAPS_API_KEY"""
+    return bool(getattr(settings, 'GEOCODING_PROVIDER', None) or settings.GOOGLE_MAPS_API_KEY)
+
+
+def get_geocoder():
+    """Instantiate the configured provider, or None when geocoding is not configured"""
+    path = getattr(settings, 'GEOCODING_PROVIDER', None)
+    if path:
+        return import_string(path)()
+    if settings.GOOGLE_MAPS_API_KEY:
+        return GoogleGeocoder()
+    return None
+
+
+def normalize_address(address):
+    """Lowercase, strip punctuation and collapse whitespace"""
+    address = _PUNCTUATION.sub(' ', (address or '').lower())
+    return _WHITESPACE.sub(' ', address).strip()
+
+
+def address_key(normalized):
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+
+def organization_address(organization):
+    """Full one-line address for an organization"""
+    parts = [
+        organization.address, organization.city, organization.state,
+        organization.postal_code, organization.country,
+    ]
+    return ', '.join(part.strip() for part in parts if part and part.strip())
+
+
+def get_cached_geocode(normalized):
+    """Return an unexpired GeocodeCache entry for a normalized address, if any"""
+    return GeocodeCache.objects.filter(
+        address_key=address_key(normalized),
+        expires_at__gt=timezone.now(),
+    ).first()
+
+
+def store_geocode(normalized, result, provider_name):
+    """Persist a provider result (or a miss) with the configured TTL"""
+    if result is None:
+        ttl = timedelta(days=settings.GEOCODING_NEGATIVE_CACHE_TTL_DAYS)
+    else:
+        ttl = timedelta(days=settings.GEOCODING_CACHE_TTL_DAYS)
+    entry, _ = GeocodeCache.objects.update_or_create(
+        address_key=address_key(normalized),
+        defaults={
+            'normalized_address': normalized,
+            'found': result is not None,
+            'latitude': result.latitude if result else None,
+            'longitude': result.longitude if result else None,
+            'place_id': result.place_id if result else None,
+            'formatted_address': result.formatted_address if result else None,
+            'provider': provider_name,
+            'expires_at': timezone.now() + ttl,
+        },
+    )
+    return entry
+
+
+class RateLimiter:
+    """Spaces calls at least ``1 / rate`` seconds apart"""
+
+    def __init__(self, rate, clock=time.monotonic, sleep=time.sleep):
+        self.interval = 1.0 / rate if rate else 0
+        self.clock = clock
+        self.sleep = sleep
+        self.next_allowed = 0.0
+
+    def wait(self):
+        now = self.clock()
+        if now < self.next_allowed:
+            self.sleep(self.next_allowed - now)
+            now = self.next_allowed
+        self.next_allowed = now + self.interval
+
+
+def geocode_address(address, geocoder=None, rate_limiter=None):
+    """
+    Geocode one address through the persistent cache.
+
+    Returns the GeocodeCache entry, or None if no provider is configured or
+    another worker is already geocoding the same address (the caller can
+    pick it up next round).
+    """
+    normalized = normalize_address(address)
+    if not normalized:
+        return None
+    entry = get_cached_geocode(normalized)
+    if entry is not None:
+        return entry
+    geocoder = geocoder or get_geocoder()
+    if geocoder is None:
+        return None
+
+    lock_key = f"geocode:lock:{address_key(normalized)}"
+    if not cache.add(lock_key, 1, GEOCODE_LOCK_TIMEOUT):
+        return None
+    try:
+        if rate_limiter:
+            rate_limiter.wait()
+        result = geocoder.geocode(address)
+        return store_geocode(normalized, result, geocoder.name)
+    finally:
+        cache.delete(lock_key)
+
+
+def apply_geocode(organization, entry):
+    """Copy a found cache entry onto an organization and mark it verified"""
+    organization.latitude = entry.latitude
+    organization.longitude = entry.longitude
+    if entry.place_id and not organization.google_places_id:
+        organization.google_places_id = entry.place_id
+    organization.is_location_verified = True
+    organization.save(update_fields=['latitude', 'longitude', 'google_places_id', 'is_location_verified'])
+
+
+def geocode_organizations(organizations, geocoder=None, rate=None):
+    """
+    Geocode a batch of organizations.
+
+    Organizations sharing a normalized address are coalesced into a single
+    lookup, cached addresses skip the provider entirely and provider calls
+    are rate limited. Returns a dict of counters.
+    """
+    geocoder = geocoder or get_geocoder()
+    limiter = RateLimiter(rate if rate is not None else settings.GEOCODING_RATE_LIMIT)
+    stats = {'organizations': 0, 'addresses': 0, 'updated': 0, 'not_found': 0, 'skipped': 0, 'errors': 0}
+    if geocoder is None:
+        organizations = list(organizations)
+        logger.warning(f"No geocoding provider configured; skipping {len(organizations)} organizations")
+        stats['organizations'] = stats['skipped'] = len(organizations)
+        return stats
+
+    by_address = {}
+    for organization in organizations:
+        stats['organizations'] += 1
+        address = organization_address(organization)
+        normalized = normalize_address(address)
+        if not normalized:
+            stats['skipped'] += 1
+            continue
+        by_address.setdefault(normalized, (address, []))[1].append(organization)
+
+    for normalized, (address, members) in by_address.items():
+        stats['addresses'] += 1
+        try:
+            entry = geocode_address(address, geocoder=geocoder, rate_limiter=limiter)
+        except GeocoderError as e:
+            logger.error(f"Geocoding failed for '{normalized}': {e}")
+            stats['errors'] += len(members)
+            continue
+
+        if entry is None:
+            stats['skipped'] += len(members)
+        elif not entry.found:
+            stats['not_found'] += len(members)
+        else:
+            for organization in members:
+                apply_geocode(organization, entry)
+            stats['updated'] += len(members)
+    return stats
+
+
+def unverified_organizations():
+    """Organizations with an address whose location has not been verified"""
+    return Organization.objects.filter(is_location_verified=False).exclude(address__isnull=True).exclude(address='')
@@ -0,0 +1,530 @@
+"""
+Incremental, batched sync of appointments to Google Calendar.
+
+Sync only runs in Celery (``tasks.sync_google_calendar``), never in a
+request. A pass for one GoogleCalendarLink
+
+1. pulls what changed in the calendar since the stored ``syncToken`` and
+   marks mappings of events edited or deleted there as stale, so PulseCal's
+   version is written back;
+2. pushes the user's appointments whose ``change_seq`` is above the link's
+   ``pushed_seq`` (plus stale ones), and deletes events for tombstones and
+   cancelled appointments. Each event body is hashed, and appointments whose
+   event already has that content are skipped.
+
+Writes go out as batch requests of ``GOOGLE_CALENDAR_BATCH_SIZE``. Rate
+limit and server errors are retried with exponential backoff and jitter,
+and the high-water mark only moves past writes that succeeded. Event ids are
+derived from appointment ids, so a write repeated after a crash updates the
+existing event instead of creating a duplicate.
+
+Clients are pluggable (``settings.GOOGLE_CALENDAR_CLIENT``):
+``GoogleCalendarClient`` wraps google-api-python-client and
+``FakeCalendarClient`` is an in-memory stand-in with the API's semantics
+(etags, sync tokens, 409/410 answers, injected failures) for development
+and tests.
+"""
+
+import abc
+import hashlib
+import json
+import logging
+import random
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field, replace
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .calendar_feed import current_change_seq
+from .models import Appointment, AppointmentTombstone, GoogleCalendarEvent, GoogleCalendarLink
+
+logger = logging.getLogger(__name__)
+
+SCOPES = ['https://www.googleapis.com/auth/calendar.events']
+TOKEN_URI = 'https://oauth2.googleapis.com/token'
+# Google event ids may use the base32hex alphabet (a-v, 0-9)
+EVENT_ID_PREFIX = 'pulsecal'
+EVENT_MINUTES = getattr(settings, 'CALENDAR_EVENT_MINUTES', 30)
+REMOVED_STATUSES = {'cancelled', 'declined'}
+RATE_LIMIT_REASONS = ('rateLimitExceeded', 'userRateLimitExceeded', 'quotaExceeded')
+
+
+class CalendarApiError(Exception):
+    """Raised when a whole API call fails"""
+
+    def __init__(self, status, reason=''):
+        super().__init__(f"Google Calendar API returned {status}: {reason}")
+        self.status = status
+        self.reason = reason
+
+
+class SyncTokenInvalid(CalendarApiError):
+    """Raised (410 Gone) when a sync token has expired; a full sync is needed"""
+
+    def __init__(self, reason='Sync token is no longer valid'):
+        super().__init__(410, reason)
+
+
+def is_retryable(status, reason=''):
+    """Rate limits and server errors are worth retrying; other failures are not"""
+    if status == 429 or status >= 500:
+        return True
+    return status == 403 and any(name in reason for name in RATE_LIMIT_REASONS)
+
+
+@dataclass
+class EventWrite:
+    method: str  # 'insert', 'update' or 'delete'
+    event_id: str
+    appointment_id: int
+    change_seq: int = 0
+    body: dict = None
+    content_hash: str = ''
+
+
+@dataclass
+class WriteResult:
+    status: int
+    event: dict = field(default_factory=dict)
+    reason: str = ''
+
+    @property
+    def ok(self):
+        return 200 <= self.status < 300
+
+
+class BaseCalendarClient(abc.ABC):
+    """Interface for Google Calendar clients"""
+
+    @abc.abstractmethod
+    def execute_batch(self, calendar_id, writes):
+        """Send writes as one batch request; return a WriteResult per write, in order"""
+
+    @abc.abstractmethod
+    def list_events(self, calendar_id, sync_token=None, page_token=None):
+        """
+        One page of events changed since ``sync_token`` (all events without
+        one), including deleted ones, as ``{'items', 'nextPageToken'}`` or
+        ``{'items', 'nextSyncToken'}`` on the last page. Raises
+        SyncTokenInvalid when the token has expired.
+        """
+
+    def refreshed_credentials(self):
+        """Credentials to store if the client refreshed its access token, else None"""
+        return None
+
+
+class GoogleCalendarClient(BaseCalendarClient):
+    """Calendar API v3 through google-api-python-client, with the link's OAuth credentials"""
+
+    def __init__(self, link):
+        self.link = link
+        self._credentials = None
+        self._service = None
+
+    @property
+    def service(self):
+        if self._service is None:
+            from google.oauth2.credentials import Credentials
+            from googleapiclient.discovery import build
+            stored = self.link.credentials
+            self._credentials = Credentials(
+                token=stored.get('token'),
+                refresh_token=stored.get('refresh_token'),
+                token_uri=TOKEN_URI,
+                client_id=settings.GOOGLE_CLIENT_ID,
+                client_secret=settings.GOOGLE_CLIENT_SECRET,
+                scopes=stored.get('scopes') or SCOPES,
+            )
+            self._service = build('calendar', 'v3', credentials=self._credentials, cache_discovery=False)
+        return self._service
+
+    @staticmethod
+    def _error(exception):
+        status = getattr(getattr(exception, 'resp', None), 'status', None)
+        return int(status) if status else 500, str(exception)
+
+    def _request(self, events, calendar_id, write):
+        if write.method == 'insert':
+            return events.insert(calendarId=calendar_id, body={**write.body, 'id': write.event_id})
+        if write.method == 'update':
+            return events.update(calendarId=calendar_id, eventId=write.event_id, body=write.body)
+        return events.delete(calendarId=calendar_id, eventId=write.event_id)
+
+    def execute_batch(self, calendar_id, writes):
+        from googleapiclient.errors import HttpError
+        results = [None] * len(writes)
+
+        def collect(request_id, response, exception):
+            if exception is None:
+                results[int(request_id)] = WriteResult(200, response or {})
+            else:
+                status, reason = self._error(exception)
+                results[int(request_id)] = WriteResult(status, reason=reason)
+
+        batch = self.service.new_batch_http_request(callback=collect)
+        events = self.service.events()
+        for index, write in enumerate(writes):
+            batch.add(self._request(events, calendar_id, write), request_id=str(index))
+        try:
+            batch.execute()
+        except HttpError as e:
+            raise CalendarApiError(*self._error(e))
+        return results
+
+    def list_events(self, calendar_id, sync_token=None, page_token=None):
+        from googleapiclient.errors import HttpError
+        params = {'calendarId': calendar_id, 'showDeleted': True, 'singleEvents': True, 'maxResults': 250}
+        if sync_token:
+            params['syncToken'] = sync_token
+        if page_token:
+            params['pageToken'] = page_token
+        try:
+            return self.service.events().list(**params).execute()
+        except HttpError as e:
+            status, reason = self._error(e)
+            if status == 410:
+                raise SyncTokenInvalid(reason)
+            raise CalendarApiError(status, reason)
+
+    def refreshed_credentials(self):
+        if self._credentials is None or self._credentials.token == self.link.credentials.get('token'):
+            return None
+        return {**self.link.credentials, 'token': self._credentials.token}
+
+
+class FakeCalendarClient(BaseCalendarClient):
+    """
+    In-memory Google Calendar for development and tests.
+
+    Events get a new etag on every write, deletes leave cancelled events
+    behind (as Google does), sync tokens are change counters, and
+    ``fail_next`` makes the next writes fail with a given status. ``batches``
+    records the size of every batch request.
+    """
+
+    def __init__(self, link=None, page_size=250):
+        self.page_size = page_size
+        self.calendars = defaultdict(dict)
+        self.version = 0
+        self.batches = []
+        self.failures = []
+        self.oldest_token = 0
+
+    def fail_next(self, count, status=429, reason='rateLimitExceeded'):
+        self.failures.extend([(status, reason)] * count)
+
+    def expire_sync_tokens(self):
+        self.oldest_token = self.version + 1
+
+    def _touch(self, event):
+        self.version += 1
+        event['etag'] = f'"{self.version}"'
+        event['_version'] = self.version
+        return event
+
+    def _public(self, event):
+        return {key: value for key, value in event.items() if not key.startswith('_')}
+
+    def edit(self, calendar_id, event_id, **changes):
+        """Change an event as the user would in Google Calendar"""
+        self._touch(self.calendars[calendar_id][event_id]).update(changes)
+
+    def _write(self, events, write):
+        current = events.get(write.event_id)
+        if write.method == 'insert':
+            if current is not None:
+                return WriteResult(409, reason='duplicate')
+            events[write.event_id] = self._touch({**write.body, 'id': write.event_id, 'status': 'confirmed'})
+        elif write.method == 'update':
+            if current is None:
+                return WriteResult(404, reason='notFound')
+            events[write.event_id] = self._touch({**write.body, 'id': write.event_id, 'status': 'confirmed'})
+        else:
+            if current is None or current['status'] == 'cancelled':
+                return WriteResult(410, reason='deleted')
+            self._touch(current)['status'] = 'cancelled'
+            return WriteResult(204)
+        return WriteResult(200, self._public(events[write.event_id]))
+
+    def execute_batch(self, calendar_id, writes):
+        self.batches.append(len(writes))
+        results = []
+        for write in writes:
+            if self.failures:
+                results.append(WriteResult(*self.failures.pop(0)))
+            else:
+                results.append(self._write(self.calendars[calendar_id], write))
+        return results
+
+    def list_events(self, calendar_id, sync_token=None, page_token=None):
+        since = 0
+        if sync_token:
+            if not sync_token.isdigit() or int(sync_token) < self.oldest_token:
+                raise SyncTokenInvalid()
+            since = int(sync_token)
+        changed = sorted(
+            (event for event in self.calendars[calendar_id].values()
+             if event['_version'] > since and (since or event['status'] != 'cancelled')),
+            key=lambda event: event['_version'],
+        )
+        offset = int(page_token or 0)
+        page = {'items': [self._public(event) for event in changed[offset:offset + self.page_size]]}
+        if offset + self.page_size < len(changed):
+            page['nextPageToken'] = str(offset + self.page_size)
+        else:
+            page['nextSyncToken'] = str(self.version)
+        return page
+
+
+def get_calendar_client(link):
+    """Instantiate the configured client for a link (the Google API by default)"""
+    path = getattr(settings, 'GOOGLE_CALENDAR_CLIENT', None)
+    if path:
+        return import_string(path)(link)
+    return GoogleCalendarClient(link)
+
+
+def connect_link(user, credentials):
+    """
+    Store a new OAuth grant for ``user`` and reset the link's sync state.
+
+    The grant may be for another Google account, so the event mappings of the
+    old one are dropped along with the sync token and high-water mark; the
+    next sync pushes everything again and matches existing events by id.
+    """
+    with transaction.atomic():
+        link, _ = GoogleCalendarLink.objects.update_or_create(
+            user=user,
+            defaults={'credentials': credentials, 'sync_token': '', 'pushed_seq': 0},
+        )
+        link.events.all().delete()
+    return link
+
+
+def oauth_flow(redirect_uri, state=None):
+    """google-auth-oauthlib Flow for the Calendar consent screen"""
+    from google_auth_oauthlib.flow import Flow
+    client_config = {
+        'web': {
+            'client_id': settings.GOOGLE_CLIENT_ID,
+            'client_secret': settings.GOOGLE_CLIENT_SECRET,
+            'auth_uri': 'https://accounts.google.com/o/oauth2/auth',
+            'token_uri': TOKEN_URI,
+        }
+    }
+    return Flow.from_client_config(client_config, scopes=SCOPES, state=state, redirect_uri=redirect_uri)
+
+
+def event_id_for(appointment_id):
+    return f"{EVENT_ID_PREFIX}{appointment_id}"
+
+
+def event_body(appointment, user_id):
+    """Google event resource for an appointment, as seen by ``user_id``"""
+    if appointment.patient_id == user_id:
+        doctor = appointment.doctor.get_full_name() or appointment.doctor.username
+        summary = f"Appointment with Dr. {doctor}"
+    else:
+        summary = f"Appointment: {appointment.patient.get_full_name() or appointment.patient.username}"
+    start = appointment.appointment_date
+    body = {
+        'summary': summary,
+        'description': f"{appointment.get_appointment_type_display()} appointment ({appointment.get_status_display()})",
+        'start': {'dateTime': start.isoformat()},
+        'end': {'dateTime': (start + timedelta(minutes=EVENT_MINUTES)).isoformat()},
+        'status': 'tentative' if appointment.status == 'pending' else 'confirmed',
+        'extendedProperties': {'private': {'pulsecal_appointment': str(appointment.id)}},
+    }
+    if appointment.is_virtual and appointment.meeting_link:
+        body['location'] = appointment.meeting_link
+    elif appointment.organization is not None:
+        body['location'] = ', '.join(part for part in (appointment.organization.name, appointment.organization.address) if part)
+    return body
+
+
+def content_hash(body):
+    return hashlib.md5(json.dumps(body, sort_keys=True).encode()).hexdigest()
+
+
+class CalendarSync:
+    """One sync pass for a GoogleCalendarLink; ``run()`` returns a dict of counters"""
+
+    def __init__(self, link, client=None, batch_size=None, max_retries=None, backoff=None, sleep=time.sleep):
+        self.link = link
+        self.client = client or get_calendar_client(link)
+        self.batch_size = batch_size or settings.GOOGLE_CALENDAR_BATCH_SIZE
+        self.max_retries = settings.GOOGLE_CALENDAR_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff = settings.GOOGLE_CALENDAR_BACKOFF_SECONDS if backoff is None else backoff
+        self.sleep = sleep
+        self.stats = {'stale': 0, 'inserted': 0, 'updated': 0, 'deleted': 0, 'skipped': 0, 'failed': 0, 'retries': 0}
+
+    def run(self):
+        self.pull()
+        self.push()
+        self.link.last_synced_at = timezone.now()
+        self.link.last_error = ''
+        update_fields = ['sync_token', 'pushed_seq', 'last_synced_at', 'last_error']
+        credentials = self.client.refreshed_credentials()
+        if credentials is not None:
+            self.link.credentials = credentials
+            update_fields.append('credentials')
+        self.link.save(update_fields=update_fields)
+        return self.stats
+
+    def _changed_events(self):
+        """Our events changed in Google since the sync token, by event id; restarts when the token expired"""
+        changed, sync_token, page_token = {}, self.link.sync_token or None, None
+        while True:
+            try:
+                page = self.client.list_events(self.link.calendar_id, sync_token, page_token)
+            except SyncTokenInvalid:
+                if sync_token is None:
+                    raise
+                changed, sync_token, page_token = {}, None, None
+                continue
+            for item in page.get('items', []):
+                if item.get('id', '').startswith(EVENT_ID_PREFIX):
+                    changed[item['id']] = item
+            page_token = page.get('nextPageToken')
+            if not page_token:
+                return changed, page.get('nextSyncToken', '')
+
+    def pull(self):
+        """Mark mappings of events edited or deleted in Google as stale"""
+        changed, next_sync_token = self._changed_events()
+        stale = []
+        for mapping in self.link.events.filter(event_id__in=list(changed)):
+            item = changed[mapping.event_id]
+            if item.get('status') == 'cancelled':
+                mapping.etag, mapping.content_hash = '', ''
+            elif item.get('etag') != mapping.etag:
+                mapping.content_hash = ''
+            else:
+                continue
+            stale.append(mapping)
+        GoogleCalendarEvent.objects.bulk_update(stale, ['etag', 'content_hash'])
+        self.stats['stale'] = len(stale)
+        self.link.sync_token = next_sync_token
+
+    def _pending_writes(self, user_id):
+        since = timezone.now() - timedelta(days=settings.GOOGLE_CALENDAR_SYNC_PAST_DAYS)
+        stale_ids = self.link.events.filter(content_hash='').values_list('appointment_id', flat=True)
+        appointments = list(
+            Appointment.objects.filter(Q(doctor_id=user_id) | Q(patient_id=user_id), appointment_date__gte=since)
+            .filter(Q(change_seq__gt=self.link.pushed_seq) | Q(id__in=stale_ids))
+            .select_related('patient', 'doctor', 'organization')
+        )
+        current = {appointment.id for appointment in appointments}
+        removed = {
+            tombstone.appointment_id: tombstone.change_seq
+            for tombstone in AppointmentTombstone.objects.filter(
+                Q(doctor_id=user_id) | Q(patient_id=user_id), change_seq__gt=self.link.pushed_seq,
+            )
+            if tombstone.appointment_id not in current
+        }
+        # Tombstones of appointments that moved to another doctor but stayed with this patient (or
+        # the reverse) must not delete the event
+        still_owned = set(
+            Appointment.objects.filter(Q(doctor_id=user_id) | Q(patient_id=user_id), id__in=list(removed))
+            .values_list('id', flat=True)
+        )
+        mappings = {
+            mapping.appointment_id: mapping
+            for mapping in self.link.events.filter(appointment_id__in=list(current | set(removed)))
+        }
+
+        writes = []
+        for appointment in appointments:
+            mapping = mappings.get(appointment.id)
+            if appointment.status in REMOVED_STATUSES:
+                if mapping is not None:
+                    writes.append(EventWrite('delete', mapping.event_id, appointment.id, appointment.change_seq))
+                continue
+            body = event_body(appointment, user_id)
+            digest = content_hash(body)
+            if mapping is not None and mapping.content_hash == digest:
+                self.stats['skipped'] += 1
+                continue
+            method = 'update' if mapping is not None and mapping.etag else 'insert'
+            writes.append(EventWrite(
+                method, event_id_for(appointment.id), appointment.id, appointment.change_seq, body, digest,
+            ))
+        for appointment_id, change_seq in removed.items():
+            if appointment_id in mappings and appointment_id not in still_owned:
+                writes.append(EventWrite('delete', mappings[appointment_id].event_id, appointment_id, change_seq))
+        return writes
+
+    def _send_batch(self, writes):
+        try:
+            return self.client.execute_batch(self.link.calendar_id, writes)
+        except CalendarApiError as e:
+            if not is_retryable(e.status, e.reason):
+                raise
+            return [WriteResult(e.status, reason=e.reason) for _ in writes]
+
+    def execute(self, writes):
+        """Send writes in batches, retrying rate-limited ones with backoff; returns (write, result) pairs"""
+        done, pending = [], list(writes)
+        for attempt in range(self.max_retries + 1):
+            retry_now, retry_later = [], []
+            for start in range(0, len(pending), self.batch_size):
+                chunk = pending[start:start + self.batch_size]
+                for write, result in zip(chunk, self._send_batch(chunk)):
+                    if result.ok:
+                        done.append((write, result))
+                    elif write.method == 'insert' and result.status == 409:
+                        # Written before (a crash lost the mapping, or deleted in Google): overwrite it
+                        retry_now.append(replace(write, method='update'))
+                    elif write.method == 'update' and result.status == 404:
+                        retry_now.append(replace(write, method='insert'))
+                    elif write.method == 'delete' and result.status in (404, 410):
+                        done.append((write, WriteResult(204)))
+                    elif is_retryable(result.status, result.reason):
+                        retry_later.append(write)
+                    else:
+                        done.append((write, result))
+            pending = retry_now + retry_later
+            if not pending:
+                break
+            if retry_later and attempt < self.max_retries:
+                self.stats['retries'] += 1
+                self.sleep(self.backoff * (2 ** attempt) * (1 + random.random()))
+        done.extend((write, WriteResult(429, reason='retries exhausted')) for write in pending)
+        return done
+
+    def push(self):
+        """Write changed appointments and deletions to Google, then advance ``pushed_seq``"""
+        # Read first: changes saved while this runs are picked up next time
+        high_water = current_change_seq()
+        results = self.execute(self._pending_writes(self.link.user_id))
+
+        saved, deleted, failed_seqs = [], [], []
+        for write, result in results:
+            if not result.ok:
+                self.stats['failed'] += 1
+                logger.warning(f"Google Calendar {write.method} of appointment {write.appointment_id} failed: "
+                               f"{result.status} {result.reason}")
+                if write.change_seq > self.link.pushed_seq:
+                    failed_seqs.append(write.change_seq)
+            elif write.method == 'delete':
+                self.stats['deleted'] += 1
+                deleted.append(write.appointment_id)
+            else:
+                self.stats['inserted' if write.method == 'insert' else 'updated'] += 1
+                saved.append(GoogleCalendarEvent(
+                    link=self.link, appointment_id=write.appointment_id, event_id=write.event_id,
+                    etag=result.event.get('etag', ''), content_hash=write.content_hash,
+                ))
+        GoogleCalendarEvent.objects.bulk_create(
+            saved, update_conflicts=True, unique_fields=['link', 'appointment_id'],
+            update_fields=['event_id', 'etag', 'content_hash', 'updated_at'],
+        )
+        self.link.events.filter(appointment_id__in=deleted).delete()
+        self.link.pushed_seq = min([high_water] + [seq - 1 for seq in failed_seqs])
@@ -0,0 +1,220 @@
+"""
+iCalendar subscription feeds for doctors and patients.
+
+Calendar apps poll subscription URLs every few minutes, so a poll must be
+cheap when nothing changed. Each user gets an unguessable feed key
+(``UserProfile.calendar_feed_key``, created on first use and resettable).
+A poll resolves the key to a user id and reads the version stamp of the
+user's doctor, patient and profile namespaces (bumped by every appointment
+and profile change, see cache_versions) -- both from the cache -- and
+derives the ETag from them. A matching ``If-None-Match`` or
+``If-Modified-Since`` is answered with 304 without touching the database.
+
+Otherwise the rendered feed is served from the cache, keyed by that stamp,
+or streamed from the database by ``iter_calendar`` row by row and stored
+as it goes out.
+"""
+
+import hashlib
+import uuid
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.http import http_date, parse_http_date_safe
+
+from .cache_versions import (
+    ORGANIZATION_DIRECTORY, doctor_namespace, namespace_stamp, patient_namespace, profile_namespace,
+)
+from .models import Appointment, UserProfile
+
+FEED_CACHE_TIMEOUT = getattr(settings, 'ICS_FEED_CACHE_TIMEOUT', 60 * 60 * 24)
+FEED_PAST_DAYS = getattr(settings, 'ICS_FEED_PAST_DAYS', 90)
+EVENT_MINUTES = getattr(settings, 'CALENDAR_EVENT_MINUTES', 30)
+UID_DOMAIN = 'pulsecal'
+# Unknown keys are remembered briefly so revoked subscriptions keep polling the cache, not the database
+UNKNOWN_KEY = 0
+UNKNOWN_KEY_TIMEOUT = 60 * 10
+
+FEED_FIELDS = (
+    'id', 'appointment_date', 'status', 'appointment_type', 'is_virtual', 'meeting_link', 'patient_id',
+    'patient__first_name', 'patient__last_name', 'patient__username',
+    'doctor__first_name', 'doctor__last_name', 'doctor__username', 'organization__name', 'organization__address',
+)
+ICS_STATUS = {'pending': 'TENTATIVE', 'cancelled': 'CANCELLED', 'declined': 'CANCELLED'}
+MAX_LINE_OCTETS = 75
+
+
+def _owner_key(feed_key):
+    return f"ics-feed:owner:{feed_key}"
+
+
+def feed_key_for(user):
+    """The user's feed key, or None until they create one; never writes"""
+    return user.profile.calendar_feed_key
+
+
+def ensure_feed_key(user):
+    """The user's feed key, created if they have none yet; call from a POST"""
+    profile = user.profile
+    if profile.calendar_feed_key is None:
+        profile.calendar_feed_key = uuid.uuid4()
+        profile.save(update_fields=['calendar_feed_key'])
+    return profile.calendar_feed_key
+
+
+def reset_feed_key(user):
+    """Give the user a new feed key; subscriptions to the old URL stop working"""
+    profile = user.profile
+    if profile.calendar_feed_key is not None:
+        cache.delete(_owner_key(profile.calendar_feed_key))
+    profile.calendar_feed_key = uuid.uuid4()
+    profile.save(update_fields=['calendar_feed_key'])
+    return profile.calendar_feed_key
+
+
+def feed_owner(feed_key):
+    """User id for a feed key, or None; answered from the cache after the first poll"""
+    user_id = cache.get(_owner_key(feed_key))
+    if user_id is None:
+        user_id = UserProfile.objects.filter(calendar_feed_key=feed_key).values_list('user_id', flat=True).first()
+        if user_id is None:
+            cache.set(_owner_key(feed_key), UNKNOWN_KEY, UNKNOWN_KEY_TIMEOUT)
+        else:
+            cache.set(_owner_key(feed_key), user_id, FEED_CACHE_TIMEOUT)
+    return user_id or None
+
+
+def schedule_stamp(user_id):
+    """Version stamp of everything a user's feed is built from; changes on any relevant write"""
+    # Events carry organization names and addresses; any organization edit bumps the directory
+    # namespace, which is cheaper than looking up which organizations the feed touches
+    return namespace_stamp([
+        doctor_namespace(user_id), patient_namespace(user_id), profile_namespace(user_id), ORGANIZATION_DIRECTORY,
+    ])
+
+
+def feed_etag(user_id, stamp):
+    return f'"{hashlib.md5(f"{user_id}|{stamp}".encode()).hexdigest()}"'
+
+
+def feed_cache_key(user_id, stamp):
+    return f"ics-feed:body:{user_id}:{hashlib.md5(stamp.encode()).hexdigest()}"
+
+
+def cached_feed(user_id, stamp):
+    """``(body, last_modified)`` of the rendered feed for this schedule version, or None"""
+    return cache.get(feed_cache_key(user_id, stamp))
+
+
+def escape_text(value):
+    """TEXT value escaping from RFC 5545 section 3.3.11"""
+    return (
+        str(value).replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+        .replace('\r\n', '\\n').replace('\n', '\\n')
+    )
+
+
+def fold(line):
+    """A content line folded at 75 octets (without splitting UTF-8 sequences), with CRLF"""
+    encoded = line.encode('utf-8')
+    if len(encoded) <= MAX_LINE_OCTETS:
+        return line + '\r\n'
+    parts, start, limit = [], 0, MAX_LINE_OCTETS
+    while start < len(encoded):
+        end = min(start + limit, len(encoded))
+        while end < len(encoded) and (encoded[end] & 0xC0) == 0x80:
+            end -= 1
+        parts.append(encoded[start:end].decode('utf-8'))
+        start, limit = end, MAX_LINE_OCTETS - 1
+    return '\r\n '.join(parts) + '\r\n'
+
+
+def _stamp(moment):
+    return moment.astimezone(dt_timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def _display_name(row, prefix):
+    full_name = f"{row[f'{prefix}__first_name']} {row[f'{prefix}__last_name']}".strip()
+    return full_name or row[f'{prefix}__username']
+
+
+def event_lines(row, user_id, now):
+    """VEVENT content lines for a row of FEED_FIELDS, as seen by ``user_id``"""
+    if row['patient_id'] == user_id:
+        summary = f"Appointment with Dr. {_display_name(row, 'doctor')}"
+    else:
+        summary = f"Appointment: {_display_name(row, 'patient')}"
+    start = row['appointment_date']
+    lines = [
+        'BEGIN:VEVENT',
+        f"UID:appointment-{row['id']}@{UID_DOMAIN}",
+        f"DTSTAMP:{_stamp(now)}",
+        f"DTSTART:{_stamp(start)}",
+        f"DTEND:{_stamp(start + timedelta(minutes=EVENT_MINUTES))}",
+        f"SUMMARY:{escape_text(summary)}",
+        f"STATUS:{ICS_STATUS.get(row['status'], 'CONFIRMED')}",
+        f"CATEGORIES:{escape_text(row['appointment_type'])}",
+    ]
+    location = row['meeting_link'] if row['is_virtual'] and row['meeting_link'] else ', '.join(
+        part for part in (row['organization__name'], row['organization__address']) if part
+    )
+    if location:
+        lines.append(f"LOCATION:{escape_text(location)}")
+    lines.append('END:VEVENT')
+    return lines
+
+
+def feed_rows(user_id):
+    """The user's appointments as doctor or patient, from FEED_PAST_DAYS ago on"""
+    since = timezone.now() - timedelta(days=FEED_PAST_DAYS)
+    return (
+        Appointment.objects.filter(Q(doctor_id=user_id) | Q(patient_id=user_id), appointment_date__gte=since)
+        .order_by('appointment_date', 'id').values(*FEED_FIELDS)
+    )
+
+
+def iter_calendar(user_id, rows, chunk_size=500):
+    """Yield the VCALENDAR text a few hundred lines at a time, reading rows as it goes"""
+    now = timezone.now()
+    header = ['BEGIN:VCALENDAR', 'VERSION:2.0', 'PRODID:-//PulseCal//Appointments//EN',
+              'CALSCALE:GREGORIAN', 'METHOD:PUBLISH', 'X-WR-CALNAME:PulseCal']
+    buffer = [fold(line) for line in header]
+    for row in rows.iterator(chunk_size=chunk_size):
+        buffer.extend(fold(line) for line in event_lines(row, user_id, now))
+        if len(buffer) >= chunk_size:
+            yield ''.join(buffer)
+            buffer = []
+    buffer.append(fold('END:VCALENDAR'))
+    yield ''.join(buffer)
+
+
+def stream_and_cache(user_id, stamp, last_modified):
+    """Render the feed from the database, storing it once the last chunk has been sent"""
+    chunks = []
+    for chunk in iter_calendar(user_id, feed_rows(user_id)):
+        chunks.append(chunk)
+        yield chunk
+    cache.set(feed_cache_key(user_id, stamp), (''.join(chunks), last_modified), FEED_CACHE_TIMEOUT)
+
+
+def not_modified(request, etag, last_modified=None):
+    """Whether the request's validators match; If-None-Match wins over If-Modified-Since"""
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match:
+        return etag in if_none_match or if_none_match.strip() == '*'
+    if last_modified is None:
+        return False
+    since = parse_http_date_safe(request.headers.get('If-Modified-Since', ''))
+    return since is not None and int(last_modified.timestamp()) <= since
+
+
+def last_modified_header(moment):
+    return http_date(moment.timestamp())
+
+
+def render_time():
+    """Last-Modified for a feed rendered now, truncated to what the header can carry"""
+    return datetime.fromtimestamp(int(timezone.now().timestamp()), tz=dt_timezone.utc)
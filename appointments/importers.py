@@ -0,0 +1,279 @@
+"""
+Bulk appointment import with batched conflict detection.
+
+Rows are validated and checked against the same doctor-overlap rule used by
+``AppointmentForm.clean()``, but instead of one query per row the importer
+loads every affected doctor's existing bookings in a single query and runs a
+sweep-line pass over the rows sorted by (doctor, start).
+"""
+
+import csv
+import io
+import logging
+import os
+from bisect import bisect_left
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from decimal import Decimal, InvalidOperation
+
+import pytz
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.functions import Lower
+
+from .models import Appointment, next_change_seqs
+from .cache_versions import appointment_namespaces, bump_on_commit
+from .rollups import appointment_cell, queue_rollup_refresh
+
+logger = logging.getLogger(__name__)
+
+# Mirrors the overlap window in AppointmentForm.clean(): an existing booking
+# at ``other`` blocks a new booking at ``start`` when
+# ``start - 29min <= other < start + 30min``.
+OVERLAP_BEFORE = timedelta(minutes=29)
+OVERLAP_AFTER = timedelta(minutes=30)
+
+DATE_FORMATS = ['%Y-%m-%d %H:%M', '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M']
+STATUS_ALIASES = {'accepted': 'confirmed'}
+VALID_STATUSES = {choice[0] for choice in Appointment.STATUS_CHOICES}
+IMPORT_TIMEZONE = pytz.timezone('Asia/Kolkata')
+
+
+@dataclass
+class ImportRowResult:
+    """Outcome of a single imported row."""
+    row_number: int
+    patient_email: str = ''
+    doctor_email: str = ''
+    appointment_date: datetime = None
+    status: str = 'pending'
+    fee: Decimal = Decimal('0')
+    notes: str = ''
+    patient: User = None
+    doctor: User = None
+    errors: list = field(default_factory=list)
+    conflict_with: str = ''
+
+    @property
+    def is_valid(self):
+        return not self.errors
+
+    @property
+    def patient_name(self):
+        return self.patient.get_full_name() or self.patient.username if self.patient else self.patient_email
+
+    @property
+    def doctor_name(self):
+        return self.doctor.get_full_name() or self.doctor.username if self.doctor else self.doctor_email
+
+    def as_dict(self):
+        return {
+            'row': self.row_number,
+            'patient_email': self.patient_email,
+            'doctor_email': self.doctor_email,
+            'appointment_date': self.appointment_date.isoformat() if self.appointment_date else None,
+            'status': self.status,
+            'valid': self.is_valid,
+            'errors': list(self.errors),
+            'conflict_with': self.conflict_with,
+        }
+
+
+def read_appointment_rows(uploaded_file):
+    """Read rows from an uploaded CSV or Excel file as a list of dicts"""
+    extension = os.path.splitext(uploaded_file.name)[1].lower()
+    if extension in ('.xlsx', '.xls'):
+        import openpyxl
+        workbook = openpyxl.load_workbook(uploaded_file, read_only=True, data_only=True)
+        sheet = workbook.active
+        rows = sheet.iter_rows(values_only=True)
+        header = [str(cell).strip().lower() if cell is not None else '' for cell in next(rows, [])]
+        return [
+            {header[i]: ('' if value is None else str(value)) for i, value in enumerate(row) if i < len(header)}
+            for row in rows
+        ]
+
+    content = uploaded_file.read()
+    if isinstance(content, bytes):
+        content = content.decode('utf-8-sig')
+    reader = csv.DictReader(io.StringIO(content))
+    return [{(key or '').strip().lower(): (value or '') for key, value in row.items()} for row in reader]
+
+
+def parse_import_datetime(value):
+    """Parse an import date string, localizing naive values like AppointmentForm does"""
+    if isinstance(value, datetime):
+        parsed = value
+    else:
+        value = (value or '').strip()
+        parsed = None
+        for fmt in DATE_FORMATS:
+            try:
+                parsed = datetime.strptime(value, fmt)
+                break
+            except ValueError:
+                continue
+        if parsed is None:
+            return None
+    if parsed.tzinfo is None:
+        parsed = IMPORT_TIMEZONE.localize(parsed)
+    return parsed
+
+
+def find_conflicts(rows, existing_by_doctor):
+    """
+    Sweep-line overlap detection.
+
+    ``rows`` must be valid ImportRowResults sorted by (doctor id, start).
+    ``existing_by_doctor`` maps doctor id to a sorted list of
+    (start, appointment id) tuples already in the database. Rows that clash
+    get an error and a ``conflict_with`` reference; accepted rows become
+    part of the schedule later rows are checked against.
+    """
+    last_accepted = {}
+    for row in rows:
+        doctor_id = row.doctor.id
+        start = row.appointment_date
+
+        existing = existing_by_doctor.get(doctor_id, [])
+        index = bisect_left(existing, (start - OVERLAP_BEFORE,))
+        if index < len(existing) and existing[index][0] < start + OVERLAP_AFTER:
+            row.conflict_with = f"appointment #{existing[index][1]}"
+            row.errors.append("Doctor already has an overlapping appointment")
+            continue
+
+        previous = last_accepted.get(doctor_id)
+        if previous is not None and previous.appointment_date >= start - OVERLAP_BEFORE:
+            row.conflict_with = f"row {previous.row_number}"
+            row.errors.append(f"Overlaps with row {previous.row_number} in this file")
+            continue
+
+        last_accepted[doctor_id] = row
+
+
+class AppointmentImporter:
+    """
+    Validate and import appointment rows for one organization.
+
+    Lookups are batched: one query resolves every patient and doctor email,
+    one query loads existing bookings for the affected doctors over the
+    window covered by the file, and valid rows are written with
+    ``bulk_create``.
+    """
+
+    def __init__(self, organization, batch_size=1000):
+        self.organization = organization
+        self.batch_size = batch_size
+
+    def validate(self, raw_rows):
+        """Return an ImportRowResult per input row, in input order"""
+        results = [self._parse_row(number, raw) for number, raw in enumerate(raw_rows, start=2)]
+        self._resolve_users(results)
+
+        candidates = [r for r in results if r.is_valid]
+        candidates.sort(key=lambda r: (r.doctor.id, r.appointment_date, r.row_number))
+        find_conflicts(candidates, self._load_existing(candidates))
+        return results
+
+    def run(self, raw_rows, commit=True):
+        """Validate rows and, if ``commit``, create every conflict-free appointment"""
+        results = self.validate(raw_rows)
+        created = []
+        if commit:
+            valid = [r for r in results if r.is_valid]
+            with transaction.atomic():
+                appointments = [self._build_appointment(r) for r in valid]
+                # bulk_create skips save(), which numbers changes for calendar sync
+                for appointment, change_seq in zip(appointments, next_change_seqs(len(appointments))):
+                    appointment.change_seq = change_seq
+                created = Appointment.objects.bulk_create(appointments, batch_size=self.batch_size)
+                # bulk_create sends no post_save, so refresh the rollups here
+                queue_rollup_refresh({appointment_cell(appointment) for appointment in created})
+                bump_on_commit(set().union(*(appointment_namespaces(appointment) for appointment in created)))
+            logger.info(
+                f"Imported {len(created)} appointments for organization {self.organization.id} "
+                f"({len(results) - len(valid)} rows rejected)"
+            )
+        return results, created
+
+    def _parse_row(self, row_number, raw):
+        result = ImportRowResult(
+            row_number=row_number,
+            patient_email=(raw.get('patient_email') or '').strip().lower(),
+            doctor_email=(raw.get('doctor_email') or '').strip().lower(),
+            notes=(raw.get('notes') or '').strip(),
+        )
+        if not result.patient_email:
+            result.errors.append("Missing patient_email")
+        if not result.doctor_email:
+            result.errors.append("Missing doctor_email")
+
+        result.appointment_date = parse_import_datetime(raw.get('appointment_date'))
+        if result.appointment_date is None:
+            result.errors.append("Invalid appointment_date (expected YYYY-MM-DD HH:MM)")
+
+        status = (raw.get('status') or 'pending').strip().lower()
+        status = STATUS_ALIASES.get(status, status)
+        if status not in VALID_STATUSES:
+            result.errors.append(f"Invalid status '{status}'")
+        result.status = status
+
+        try:
+            result.fee = Decimal(str(raw.get('fee') or '0').strip())
+            if result.fee < 0:
+                result.errors.append("Fee cannot be negative")
+        except InvalidOperation:
+            result.errors.append("Invalid fee")
+        return result
+
+    def _resolve_users(self, results):
+        emails = {r.patient_email for r in results} | {r.doctor_email for r in results}
+        emails.discard('')
+        users = {}
+        # Emails are stored as typed; compare lowercased on both sides
+        matches = User.objects.annotate(email_lower=Lower('email')).filter(email_lower__in=emails)
+        for user in matches.select_related('profile'):
+            users.setdefault(user.email_lower, user)
+
+        for result in results:
+            if result.patient_email:
+                result.patient = users.get(result.patient_email)
+                if result.patient is None:
+                    result.errors.append(f"Patient {result.patient_email} not found")
+            if result.doctor_email:
+                result.doctor = users.get(result.doctor_email)
+                profile = getattr(result.doctor, 'profile', None) if result.doctor else None
+                if result.doctor is None:
+                    result.errors.append(f"Doctor {result.doctor_email} not found")
+                elif profile is None or profile.role != 'doctor':
+                    result.errors.append(f"{result.doctor_email} is not a doctor")
+
+    def _load_existing(self, candidates):
+        if not candidates:
+            return {}
+        starts = [r.appointment_date for r in candidates]
+        existing = Appointment.objects.filter(
+            doctor_id__in={r.doctor.id for r in candidates},
+            appointment_date__gte=min(starts) - OVERLAP_BEFORE,
+            appointment_date__lt=max(starts) + OVERLAP_AFTER,
+        ).order_by('doctor_id', 'appointment_date').values_list('doctor_id', 'appointment_date', 'id')
+
+        by_doctor = defaultdict(list)
+        for doctor_id, appointment_date, appointment_id in existing:
+            by_doctor[doctor_id].append((appointment_date, appointment_id))
+        return by_doctor
+
+    def _build_appointment(self, result):
+        appointment = Appointment(
+            patient=result.patient,
+            doctor=result.doctor,
+            appointment_date=result.appointment_date,
+            status=result.status,
+            fee=result.fee,
+            notes=result.notes,
+            organization=self.organization,
+        )
+        # bulk_create skips save(), so fill the search column here
+        appointment.search_text = appointment.build_search_text()
+        return appointment
@@ -0,0 +1,99 @@
+"""
+Hot lookups served from the two-tier ``hot`` cache.
+
+Public clinic and doctor cards are small and change rarely, so they live
+in process memory in front of Redis. Writes to the underlying rows delete
+the cards, which also evicts them from every other process over pub/sub.
+
+The cards resolve ids to names for analytics series labels. Pages that
+show clinics and doctors already have their own caches: dashboard
+fragments, map tiles, and doctor search documents with cached facet
+counts. They build richer objects than a card, so they are deliberately
+not routed through here. Choice labels are module constants and need no
+cache.
+"""
+
+from django.core.cache import caches
+
+from .models import Organization, UserProfile
+
+CARD_TIMEOUT = 60 * 60
+
+
+def hot_cache():
+    return caches['hot']
+
+
+def _organization_key(organization_id):
+    return f"card:organization:{organization_id}"
+
+
+def _doctor_key(user_id):
+    return f"card:doctor:{user_id}"
+
+
+def _organization_card(organization):
+    return {
+        'id': organization.id,
+        'name': organization.name,
+        'org_type': organization.org_type,
+        'org_type_display': organization.get_org_type_display(),
+        'address': organization.address,
+        'phone': organization.phone,
+        'latitude': float(organization.latitude) if organization.latitude is not None else None,
+        'longitude': float(organization.longitude) if organization.longitude is not None else None,
+    }
+
+
+def _doctor_card(profile):
+    user = profile.user
+    return {
+        'id': user.id,
+        'name': f"Dr. {user.get_full_name() or user.username}",
+        'specialization': profile.specialization,
+        'qualification': profile.qualification,
+        'rating': float(profile.rating) if profile.rating is not None else None,
+        'consultation_fee': float(profile.consultation_fee) if profile.consultation_fee is not None else None,
+        'organization_id': profile.organization_id,
+    }
+
+
+def _cards(ids, make_key, load):
+    ids = [item_id for item_id in ids if item_id is not None]
+    keys = {make_key(item_id): item_id for item_id in ids}
+    found = hot_cache().get_many(list(keys))
+    cards = {keys[key]: card for key, card in found.items()}
+    missing = [item_id for item_id in ids if item_id not in cards]
+    if missing:
+        loaded = load(missing)
+        hot_cache().set_many({make_key(item_id): card for item_id, card in loaded.items()}, CARD_TIMEOUT)
+        cards.update(loaded)
+    return cards
+
+
+def organization_cards(organization_ids):
+    """Map organization id -> public card; unknown ids are left out"""
+    return _cards(organization_ids, _organization_key, lambda ids: {
+        organization.id: _organization_card(organization)
+        for organization in Organization.objects.filter(id__in=ids)
+    })
+
+
+def doctor_cards(user_ids):
+    """Map doctor user id -> public card; users without a profile are left out"""
+    return _cards(user_ids, _doctor_key, lambda ids: {
+        profile.user_id: _doctor_card(profile)
+        for profile in UserProfile.objects.filter(user_id__in=ids).select_related('user')
+    })
+
+
+def forget_organization(organization_id):
+    hot_cache().delete(_organization_key(organization_id))
+
+
+def forget_doctor(user_id):
+    hot_cache().delete(_doctor_key(user_id))
+
+
+def forget_doctors(user_ids):
+    hot_cache().delete_many([_doctor_key(user_id) for user_id in user_ids])
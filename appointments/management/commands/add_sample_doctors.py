@@ -1,6 +1,7 @@
 from django.core.management.base import BaseCommand
 from django.contrib.auth.models import User
 from appointments.models import UserProfile, Organization
+from appointments.signals import suppress_profile_signals
 from decimal import Decimal
 import random
 from datetime import datetime, timedelta
@@ -153,50 +154,54 @@ class Command(BaseCommand):
         
         doctors_created = 0
         
-        for i, doctor_data in enumerate(doctors_data):
-            # Create user
-            username = f"doctor_{doctor_data['first_name'].lower()}_{doctor_data['last_name'].lower()}"
+        # Search documents and cards are synced once for the whole batch
+        with suppress_profile_signals():
+            for i, doctor_data in enumerate(doctors_data):
+                # Create user
+                username = f"doctor_{doctor_data['first_name'].lower()}_{doctor_data['last_name'].lower()}"
             
-            # Check if user already exists
-            if User.objects.filter(username=username).exists():
-                self.stdout.write(f'Doctor {doctor_data["first_name"]} {doctor_data["last_name"]} already exists, skipping...')
-                continue
+                # Check if user already exists
+                if User.objects.filter(username=username).exists():
+                    self.stdout.write(f'Doctor {doctor_data["first_name"]} {doctor_data["last_name"]} already exists, skipping...')
+                    continue
             
-            user = User.objects.create_user(
-                username=username,
-                email=doctor_data['email'],
-                password='doctor123',
-                first_name=doctor_data['first_name'],
-                last_name=doctor_data['last_name']
-            )
+                user = User.objects.create_user(
+                    username=username,
+                    email=doctor_data['email'],
+                    password='doctor123',
+                    first_name=doctor_data['first_name'],
+                    last_name=doctor_data['last_name']
+                )
             
-            # Assign to a random organization
-            organization = random.choice(organizations)
+                # Assign to a random organization
+                organization = random.choice(organizations)
             
-            # Create user profile
-            profile = UserProfile.objects.create(
-                user=user,
-                role='doctor',
-                organization=organization,
-                specialization=doctor_data['specialization'],
-                phone=f"+1-555-{random.randint(100, 999)}-{random.randint(1000, 9999)}",
-                on_duty=doctor_data['on_duty'],
-                experience_years=doctor_data['experience_years'],
-                rating=Decimal(str(doctor_data['rating'])),
-                consultation_fee=Decimal(str(doctor_data['consultation_fee'])),
-                bio=doctor_data['bio'],
-                languages=doctor_data['languages'],
-                certifications=doctor_data['certifications'],
-                next_available=datetime.now() + timedelta(days=random.randint(1, 7)) if doctor_data['on_duty'] else None,
-                total_appointments=random.randint(50, 500)
-            )
+                # Fill in the profile the post_save signal created
+                profile, _ = UserProfile.objects.update_or_create(
+                    user=user,
+                    defaults=dict(
+                        role='doctor',
+                        organization=organization,
+                        specialization=doctor_data['specialization'],
+                        phone=f"+1-555-{random.randint(100, 999)}-{random.randint(1000, 9999)}",
+                        on_duty=doctor_data['on_duty'],
+                        experience_years=doctor_data['experience_years'],
+                        rating=Decimal(str(doctor_data['rating'])),
+                        consultation_fee=Decimal(str(doctor_data['consultation_fee'])),
+                        bio=doctor_data['bio'],
+                        languages=doctor_data['languages'],
+                        certifications=doctor_data['certifications'],
+                        next_available=datetime.now() + timedelta(days=random.randint(1, 7)) if doctor_data['on_duty'] else None,
+                        total_appointments=random.randint(50, 500)
+                    ),
+                )
             
-            doctors_created += 1
-            self.stdout.write(
-                self.style.SUCCESS(
-                    f'Created Dr. {doctor_data["first_name"]} {doctor_data["last_name"]} - {doctor_data["specialization"]} at {organization.name}'
+                doctors_created += 1
+                self.stdout.write(
+                    self.style.SUCCESS(
+                        f'Created Dr. {doctor_data["first_name"]} {doctor_data["last_name"]} - {doctor_data["specialization"]} at {organization.name}'
+                    )
                 )
-            )
         
         self.stdout.write(
             self.style.SUCCESS(
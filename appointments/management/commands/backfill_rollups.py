@@ -0,0 +1,37 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from appointments.models import Appointment
+from appointments.rollups import REBUILD_CHUNK_DAYS, local_date, rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the daily appointment rollups used by the analytics dashboards'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', help='First day to rebuild (YYYY-MM-DD); defaults to the oldest appointment')
+        parser.add_argument('--end', help='Last day to rebuild (YYYY-MM-DD); defaults to the newest appointment')
+        parser.add_argument('--chunk-days', type=int, default=REBUILD_CHUNK_DAYS)
+
+    def handle(self, *args, **options):
+        bounds = Appointment.objects.aggregate(first=Min('appointment_date'), last=Max('appointment_date'))
+        if bounds['first'] is None:
+            self.stdout.write(self.style.WARNING('No appointments to roll up.'))
+            return
+        try:
+            start = date.fromisoformat(options['start']) if options['start'] else local_date(bounds['first'])
+            end = date.fromisoformat(options['end']) if options['end'] else local_date(bounds['last'])
+        except ValueError as e:
+            raise CommandError(f"Invalid date: {e}")
+        if start > end:
+            raise CommandError('--start must not be after --end')
+
+        started = timezone.now()
+        written = rebuild_rollups(start, end, chunk_days=options['chunk_days'])
+        elapsed = (timezone.now() - started).total_seconds()
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {written} rollup rows for {start} to {end} in {elapsed:.1f}s"
+        ))
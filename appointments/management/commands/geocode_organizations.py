@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from django.conf import settings
+
+from appointments.geocoding import geocode_organizations, unverified_organizations
+from appointments.tasks import geocode_unverified_organizations
+
+
+class Command(BaseCommand):
+    help = 'Geocode organizations whose location has not been verified'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--async', action='store_true', dest='run_async',
+                            help='Queue the batch job on Celery instead of running inline')
+        parser.add_argument('--batch-size', type=int, default=settings.GEOCODING_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        if options['run_async']:
+            geocode_unverified_organizations.delay(options['batch_size'])
+            self.stdout.write(self.style.SUCCESS('Queued geocoding of unverified organizations'))
+            return
+
+        after_id, totals = 0, {}
+        while True:
+            batch = list(unverified_organizations().filter(id__gt=after_id).order_by('id')[:options['batch_size']])
+            if not batch:
+                break
+            stats = geocode_organizations(batch)
+            for key, value in stats.items():
+                totals[key] = totals.get(key, 0) + value
+            after_id = batch[-1].id
+
+        if not totals:
+            self.stdout.write(self.style.WARNING('No unverified organizations with an address found.'))
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f"Geocoded {totals['updated']} of {totals['organizations']} organizations "
+            f"({totals['addresses']} unique addresses, {totals['not_found']} not found, "
+            f"{totals['errors']} errors)"
+        ))
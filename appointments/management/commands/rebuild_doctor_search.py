@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from appointments.models import DoctorSearchDocument
+from appointments.search import doctor_profiles, index_doctors, remove_doctor_documents
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the denormalized doctor search documents'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch, indexed = [], 0
+        for profile in doctor_profiles().order_by('user_id').iterator(chunk_size=options['batch_size']):
+            batch.append(profile)
+            if len(batch) >= options['batch_size']:
+                indexed += index_doctors(batch)
+                batch = []
+        indexed += index_doctors(batch)
+
+        stale = remove_doctor_documents(DoctorSearchDocument.objects.exclude(
+            user_id__in=doctor_profiles().values('user_id')
+        ))
+        self.stdout.write(self.style.SUCCESS(f"Indexed {indexed} doctors, removed {stale} stale documents"))
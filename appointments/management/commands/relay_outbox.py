@@ -0,0 +1,28 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from appointments.outbox import BATCH_SIZE, relay_pending
+
+
+class Command(BaseCommand):
+    help = 'Relay appointment outbox events to websockets, Celery and notifications'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Relay what is due and exit instead of polling')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--interval', type=float, default=settings.OUTBOX_POLL_SECONDS,
+                            help='Seconds to wait when no events are due')
+
+    def handle(self, *args, **options):
+        if options['once']:
+            relayed = relay_pending(options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f"Relayed {relayed} outbox events"))
+            return
+
+        self.stdout.write(f"Relaying outbox events every {options['interval']}s while idle")
+        # Several relays can run side by side; SKIP LOCKED gives each its own events
+        while True:
+            if not relay_pending(options['batch_size'], max_batches=10):
+                time.sleep(options['interval'])
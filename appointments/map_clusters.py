@@ -0,0 +1,210 @@
+"""
+Viewport-based, server-side clustered map markers.
+
+A viewport (bounding box + zoom) is snapped to geohash tiles. Each tile's
+markers are aggregated in SQL by geohash prefix -- one row per cell with a
+count and centroid -- and cached per (kind, filter, precision, tile), so
+panning only computes tiles that have not been seen recently. Tile keys
+embed the layer's cache namespaces, so a write to a clinic or doctor
+retires every tile at once. Concurrent misses on the same tiles are
+computed by one request while the others wait for its result. At street
+level zooms individual points are returned instead of clusters.
+"""
+
+import hashlib
+import json
+import logging
+import math
+from collections import defaultdict
+
+from django.db.models import Avg, Count, FloatField, Min
+from django.db.models.functions import Cast, Substr
+
+from .cache_aside import cache_aside_many
+from .cache_versions import namespace_stamp
+from .geo import GEOHASH_ALPHABET, cover_bbox, geohash_prefix_filter
+
+logger = logging.getLogger(__name__)
+
+MAP_TILE_CACHE_TIMEOUT = 300
+MAX_VIEWPORT_TILES = 32
+MAX_POINTS_PER_TILE = 500
+
+# Zoom level (inclusive upper bound) -> geohash precision of a cluster cell.
+# Cells roughly match a 60px marker footprint at that zoom.
+ZOOM_CLUSTER_PRECISION = [
+    (2, 1),
+    (4, 2),
+    (6, 3),
+    (8, 4),
+    (11, 5),
+    (13, 6),
+]
+POINT_TILE_PRECISION = 6
+MAX_ZOOM = 21
+
+
+def cluster_precision_for_zoom(zoom):
+    """Return the cluster cell precision for a zoom level, or None to return points"""
+    for max_zoom, precision in ZOOM_CLUSTER_PRECISION:
+        if zoom <= max_zoom:
+            return precision
+    return None
+
+
+def parse_viewport(bbox, zoom, default_zoom=2):
+    """
+    Parse ``bbox=west,south,east,north`` and ``zoom`` query parameters.
+
+    Returns ((min_lat, min_lng, max_lat, max_lng), zoom) or None when the
+    bounding box is malformed or out of range (non-finite values, latitudes
+    outside [-90, 90], longitudes outside [-180, 180]). A missing bbox means
+    the whole world.
+    """
+    try:
+        zoom = int(zoom) if zoom not in (None, '') else default_zoom
+    except (TypeError, ValueError):
+        zoom = default_zoom
+    zoom = max(0, min(MAX_ZOOM, zoom))
+
+    if not bbox:
+        return (-90.0, -180.0, 90.0, 180.0), zoom
+    try:
+        west, south, east, north = (float(part) for part in bbox.split(','))
+    except (TypeError, ValueError):
+        return None
+    if not all(math.isfinite(value) for value in (west, south, east, north)):
+        return None
+    if not (-90.0 <= south <= north <= 90.0):
+        return None
+    if not (-180.0 <= west <= 180.0 and -180.0 <= east <= 180.0):
+        return None
+    if east < west:
+        # Viewport crosses the antimeridian; unwrap the east edge.
+        east += 360.0
+    return (south, west, north, east), zoom
+
+
+def filter_signature(**filters):
+    """Stable short hash of the filters applied to a marker query"""
+    normalized = json.dumps({key: value for key, value in filters.items() if value not in (None, '')}, sort_keys=True)
+    return hashlib.md5(normalized.encode('utf-8')).hexdigest()[:12]
+
+
+def viewport_tiles(bbox, precision):
+    """Geohash tiles (at most ``precision`` long) covering a viewport"""
+    tiles = cover_bbox(*bbox, max_cells=MAX_VIEWPORT_TILES, max_precision=precision)
+    return tiles if tiles is not None else list(GEOHASH_ALPHABET)
+
+
+class MarkerLayer:
+    """
+    One kind of marker (organizations, doctors) that can be clustered.
+
+    ``queryset`` holds the already-filtered rows; ``prefix`` points at the
+    relation carrying latitude/longitude/geohash (``''`` for organizations,
+    ``'organization__'`` for doctor profiles). ``serialize`` turns a row
+    into a point payload and ``id_field`` names the identifier used in it.
+    ``namespaces`` are the cache namespaces whose writes invalidate the tiles.
+    """
+
+    def __init__(self, kind, queryset, serialize, signature, prefix='', id_field='id', namespaces=()):
+        self.kind = kind
+        self.queryset = queryset
+        self.serialize = serialize
+        self.signature = signature
+        self.prefix = prefix
+        self.id_field = id_field
+        self.namespaces = tuple(namespaces)
+
+    def cache_key(self, precision, tile, stamp=''):
+        return f"maps:{self.kind}:{stamp}:{self.signature}:{precision}:{tile}"
+
+    def markers(self, bbox, zoom):
+        """Clusters or points for a viewport, served per tile from cache"""
+        precision = cluster_precision_for_zoom(zoom)
+        tile_precision = precision or POINT_TILE_PRECISION
+        level = precision or 'points'
+        tiles = viewport_tiles(bbox, tile_precision)
+
+        stamp = namespace_stamp(self.namespaces) if self.namespaces else ''
+        keys = {tile: self.cache_key(level, tile, stamp) for tile in tiles}
+
+        def compute(missing):
+            missing_tiles = list(missing.values())
+            if precision:
+                computed = self._compute_clusters(missing_tiles, precision)
+            else:
+                computed = self._compute_points(missing_tiles)
+            return {key: computed.get(tile, []) for key, tile in missing.items()}
+
+        cached = cache_aside_many({key: tile for tile, key in keys.items()}, compute, MAP_TILE_CACHE_TIMEOUT)
+        markers = []
+        for tile in tiles:
+            markers.extend(cached.get(keys[tile], []))
+        return markers
+
+    def _tile_for(self, geohash, tiles):
+        for tile in tiles:
+            if geohash.startswith(tile):
+                return tile
+        return None
+
+    def _compute_clusters(self, tiles, precision):
+        geohash_field = f'{self.prefix}geohash'
+        rows = (
+            self.queryset.filter(geohash_prefix_filter(tiles, geohash_field))
+            .order_by()
+            .annotate(cell=Substr(geohash_field, 1, precision))
+            .values('cell')
+            .annotate(
+                count=Count(self.id_field),
+                latitude=Avg(Cast(f'{self.prefix}latitude', FloatField())),
+                longitude=Avg(Cast(f'{self.prefix}longitude', FloatField())),
+                sample_id=Min(self.id_field),
+            )
+        )
+        rows = list(rows)
+
+        singles = [row['sample_id'] for row in rows if row['count'] == 1]
+        points = {}
+        if singles:
+            for obj in self.queryset.filter(**{f'{self.id_field}__in': singles}):
+                points[getattr(obj, self.id_field)] = obj
+
+        by_tile = defaultdict(list)
+        for row in rows:
+            tile = self._tile_for(row['cell'], tiles)
+            if tile is None:
+                continue
+            obj = points.get(row['sample_id']) if row['count'] == 1 else None
+            if obj is not None:
+                by_tile[tile].append({'cluster': False, **self.serialize(obj)})
+            else:
+                by_tile[tile].append({
+                    'cluster': True,
+                    'geohash': row['cell'],
+                    'count': row['count'],
+                    'latitude': row['latitude'],
+                    'longitude': row['longitude'],
+                })
+        return by_tile
+
+    def _compute_points(self, tiles):
+        geohash_field = f'{self.prefix}geohash'
+        rows = self.queryset.filter(geohash_prefix_filter(tiles, geohash_field)).order_by(geohash_field)
+
+        by_tile = defaultdict(list)
+        for obj in rows.iterator():
+            geohash = self._geohash_of(obj)
+            tile = self._tile_for(geohash or '', tiles)
+            if tile is None or len(by_tile[tile]) >= MAX_POINTS_PER_TILE:
+                continue
+            by_tile[tile].append({'cluster': False, **self.serialize(obj)})
+        return by_tile
+
+    def _geohash_of(self, obj):
+        for part in self.prefix.split('__'):
+            if part:
+                obj = getattr(obj, part)
+        return obj.geohash
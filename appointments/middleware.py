@@ -0,0 +1,14 @@
+from django.utils.functional import SimpleLazyObject
+
+from .user_context import user_context
+
+
+class RequestContextMiddleware:
+    """Attach the caller's role/organization context as ``request.pc_context``; place after AuthenticationMiddleware"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.pc_context = SimpleLazyObject(lambda: user_context(request.user))
+        return self.get_response(request)
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.15 on 2026-10-19 04:13
+
+from django.db import migrations, models
+
+
+def backfill_geohashes(apps, schema_editor):
+    from appointments.geo import encode_geohash
+
+    Organization = apps.get_model('appointments', 'Organization')
+    organizations = Organization.objects.filter(latitude__isnull=False, longitude__isnull=False)
+    batch = []
+    for organization in organizations.only('id', 'latitude', 'longitude').iterator():
+        organization.geohash = encode_geohash(organization.latitude, organization.longitude)
+        batch.append(organization)
+        if len(batch) >= 1000:
+            Organization.objects.bulk_update(batch, ['geohash'])
+            batch = []
+    if batch:
+        Organization.objects.bulk_update(batch, ['geohash'])
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0008_userprofile_qualification_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='organization',
+            name='geohash',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=12, null=True),
+        ),
+        migrations.RunPython(backfill_geohashes, migrations.RunPython.noop),
+    ]
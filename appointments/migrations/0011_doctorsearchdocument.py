@@ -0,0 +1,74 @@
+# Generated by Django 4.2.15 on 2026-10-19 04:21
+
+from django.conf import settings
+from django.contrib.postgres.operations import TrigramExtension
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+SEARCH_VECTOR_TRIGGER = """
+CREATE OR REPLACE FUNCTION appointments_doctor_search_vector() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('simple', coalesce(NEW.full_name, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(NEW.specialization, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(NEW.qualification, '')), 'B') ||
+        setweight(to_tsvector('simple', coalesce(
+            array_to_string(ARRAY(SELECT jsonb_array_elements_text(NEW.languages)), ' '), ''
+        )), 'B') ||
+        setweight(to_tsvector('simple', coalesce(NEW.organization_name, '')), 'C') ||
+        setweight(to_tsvector('simple', coalesce(NEW.bio, '')), 'D');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER doctor_search_vector_update
+BEFORE INSERT OR UPDATE ON appointments_doctorsearchdocument
+FOR EACH ROW EXECUTE FUNCTION appointments_doctor_search_vector();
+"""
+
+DROP_SEARCH_VECTOR_TRIGGER = """
+DROP TRIGGER IF EXISTS doctor_search_vector_update ON appointments_doctorsearchdocument;
+DROP FUNCTION IF EXISTS appointments_doctor_search_vector();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('appointments', '0010_geocodecache'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.CreateModel(
+            name='DoctorSearchDocument',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('full_name', models.CharField(blank=True, max_length=300)),
+                ('specialization', models.CharField(blank=True, max_length=100)),
+                ('qualification', models.CharField(blank=True, max_length=255)),
+                ('languages', models.JSONField(blank=True, default=list)),
+                ('bio', models.TextField(blank=True)),
+                ('organization_name', models.CharField(blank=True, max_length=200)),
+                ('org_type', models.CharField(blank=True, max_length=15)),
+                ('on_duty', models.BooleanField(default=False)),
+                ('consultation_fee', models.DecimalField(blank=True, decimal_places=2, max_digits=8, null=True)),
+                ('rating', models.DecimalField(blank=True, decimal_places=2, max_digits=3, null=True)),
+                ('is_active', models.BooleanField(default=True)),
+                ('document', models.TextField(blank=True)),
+                ('search_vector', django.contrib.postgres.search.SearchVectorField(editable=False, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('organization', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='appointments.organization')),
+            ],
+            options={
+                'verbose_name': 'Doctor Search Document',
+                'verbose_name_plural': 'Doctor Search Documents',
+                'indexes': [django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='doctor_search_vector_idx'), django.contrib.postgres.indexes.GinIndex(fields=['document'], name='doctor_search_trgm_idx', opclasses=['gin_trgm_ops']), models.Index(fields=['org_type', 'on_duty'], name='doctor_search_facets_idx')],
+            },
+        ),
+        migrations.RunSQL(SEARCH_VECTOR_TRIGGER, DROP_SEARCH_VECTOR_TRIGGER),
+    ]
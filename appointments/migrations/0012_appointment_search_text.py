@@ -0,0 +1,39 @@
+# Generated by Django 4.2.15 on 2026-10-19 04:25
+
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+BACKFILL_SEARCH_TEXT = """
+UPDATE appointments_appointment AS a
+SET search_text = lower(concat_ws(' ',
+    NULLIF(p.first_name, ''), NULLIF(p.last_name, ''), NULLIF(p.email, ''),
+    NULLIF(d.first_name, ''), NULLIF(d.last_name, ''),
+    NULLIF(a.notes, ''), NULLIF(a.patient_notes, '')
+))
+FROM auth_user AS p, auth_user AS d
+WHERE p.id = a.patient_id AND d.id = a.doctor_id;
+"""
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0011_doctorsearchdocument'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='search_text',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.RunSQL(BACKFILL_SEARCH_TEXT, migrations.RunSQL.noop),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_text'], name='appointment_search_trgm_idx', opclasses=['gin_trgm_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['organization', '-appointment_date', '-id'], name='appointment_org_date_idx'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.2.15 on 2026-10-19 04:27
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('appointments', '0012_appointment_search_text'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyAppointmentFact',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('status', models.CharField(max_length=20)),
+                ('appointment_type', models.CharField(max_length=20)),
+                ('appointment_count', models.PositiveIntegerField(default=0)),
+                ('fee_total', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('paid_total', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('doctor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('organization', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='appointments.organization')),
+            ],
+            options={
+                'verbose_name': 'Daily Appointment Fact',
+                'verbose_name_plural': 'Daily Appointment Facts',
+                'indexes': [models.Index(fields=['organization', 'date'], name='fact_org_date_idx'), models.Index(fields=['doctor', 'date'], name='fact_doctor_date_idx'), models.Index(fields=['date'], name='fact_date_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='dailyappointmentfact',
+            constraint=models.UniqueConstraint(fields=('organization', 'doctor', 'date', 'status', 'appointment_type'), name='unique_daily_appointment_fact'),
+        ),
+    ]
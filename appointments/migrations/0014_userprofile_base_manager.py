@@ -0,0 +1,25 @@
+# Generated by Django 4.2.15 on 2026-10-19 04:54
+
+from django.db import migrations
+import django.db.models.manager
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0013_dailyappointmentfact'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='userprofile',
+            options={'base_manager_name': 'with_organization', 'verbose_name': 'User Profile', 'verbose_name_plural': 'User Profiles'},
+        ),
+        migrations.AlterModelManagers(
+            name='userprofile',
+            managers=[
+                ('objects', django.db.models.manager.Manager()),
+                ('with_organization', django.db.models.manager.Manager()),
+            ],
+        ),
+    ]
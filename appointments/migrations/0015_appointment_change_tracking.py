@@ -0,0 +1,51 @@
+# Generated by Django 4.2.15 on 2026-10-19 05:10
+
+from django.db import migrations, models
+
+
+def create_change_sequence(apps, schema_editor):
+    # Shared by appointments and tombstones; other databases fall back to MAX() + 1
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('CREATE SEQUENCE IF NOT EXISTS appointments_change_seq')
+
+
+def drop_change_sequence(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP SEQUENCE IF EXISTS appointments_change_seq')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0014_userprofile_base_manager'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AppointmentTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('appointment_id', models.IntegerField()),
+                ('patient_id', models.IntegerField(db_index=True, null=True)),
+                ('doctor_id', models.IntegerField(db_index=True, null=True)),
+                ('organization_id', models.IntegerField(blank=True, db_index=True, null=True)),
+                ('change_seq', models.BigIntegerField(db_index=True)),
+                ('deleted_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                'verbose_name': 'Appointment Tombstone',
+                'verbose_name_plural': 'Appointment Tombstones',
+            },
+        ),
+        migrations.AddField(
+            model_name='appointment',
+            name='change_seq',
+            field=models.BigIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='appointment',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.RunPython(create_change_sequence, drop_change_sequence),
+    ]
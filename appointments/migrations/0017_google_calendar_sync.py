@@ -0,0 +1,55 @@
+# Generated by Django 4.2.15 on 2026-10-19 05:21
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('appointments', '0016_userprofile_calendar_feed_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GoogleCalendarLink',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('calendar_id', models.CharField(default='primary', max_length=255)),
+                ('credentials', models.JSONField(blank=True, default=dict)),
+                ('sync_token', models.CharField(blank=True, default='', max_length=500)),
+                ('pushed_seq', models.BigIntegerField(default=0)),
+                ('last_synced_at', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='google_calendar', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Google Calendar Link',
+                'verbose_name_plural': 'Google Calendar Links',
+            },
+        ),
+        migrations.CreateModel(
+            name='GoogleCalendarEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('appointment_id', models.IntegerField()),
+                ('event_id', models.CharField(max_length=255)),
+                ('etag', models.CharField(blank=True, default='', max_length=255)),
+                ('content_hash', models.CharField(blank=True, default='', max_length=32)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('link', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='appointments.googlecalendarlink')),
+            ],
+            options={
+                'verbose_name': 'Google Calendar Event',
+                'verbose_name_plural': 'Google Calendar Events',
+                'indexes': [models.Index(fields=['link', 'event_id'], name='google_event_lookup_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='googlecalendarevent',
+            constraint=models.UniqueConstraint(fields=('link', 'appointment_id'), name='unique_google_event_per_appointment'),
+        ),
+    ]
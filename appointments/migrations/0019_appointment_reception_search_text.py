@@ -0,0 +1,28 @@
+# Generated by Django 4.2.15 on 2026-10-19 05:55
+
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+BACKFILL_RECEPTION_SEARCH_TEXT = """
+UPDATE appointments_appointment SET reception_search_text = lower(coalesce(reception_notes, ''));
+"""
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0018_appointment_outbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='reception_search_text',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.RunSQL(BACKFILL_RECEPTION_SEARCH_TEXT, migrations.RunSQL.noop),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['reception_search_text'], name='appointment_reception_trgm_idx', opclasses=['gin_trgm_ops']),
+        ),
+    ]
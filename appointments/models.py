@@ -1,11 +1,48 @@
-from django.db import models
+from django.db import connections, models, transaction
 from django.contrib.auth.models import User
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import RegexValidator
 from django.conf import settings
 from django.core.exceptions import ValidationError
+from django.utils import timezone
 from decimal import Decimal
+import copy
 import uuid
 
+from .geo import encode_geohash, filter_within_radius
+
+# Fields that make up an organization's geocoded address
+ADDRESS_FIELDS = ('address', 'city', 'state', 'postal_code', 'country')
+
+class OrganizationQuerySet(models.QuerySet):
+    def with_coordinates(self):
+        return self.filter(latitude__isnull=False, longitude__isnull=False)
+
+    def within_radius(self, latitude, longitude, radius_km):
+        """
+        Organizations within ``radius_km`` of a point, nearest first.
+
+        Candidates come from geohash prefix scans over the indexed column,
+        are tightened by a bounding box and ranked by exact haversine
+        distance, annotated as ``distance_km``.
+        """
+        return filter_within_radius(self, latitude, longitude, radius_km)
+
+    def nearest(self, latitude, longitude, limit=10, max_radius_km=100, start_radius_km=2):
+        """
+        The ``limit`` nearest organizations within ``max_radius_km``.
+
+        The search radius doubles until enough rows are found, so dense areas
+        only touch a few geohash cells.
+        """
+        radius = min(start_radius_km, max_radius_km)
+        while True:
+            results = list(self.within_radius(latitude, longitude, radius)[:limit])
+            if len(results) >= limit or radius >= max_radius_km:
+                return results
+            radius = min(radius * 2, max_radius_km)
+
 class Organization(models.Model):
     ORG_TYPE_CHOICES = [
         ('clinic', 'Clinic'),
@@ -30,10 +67,44 @@ class Organization(models.Model):
     state = models.CharField(max_length=255, blank=True, null=True)
     website = models.URLField(blank=True, null=True)
     admin = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='admin_organizations')
+    geohash = models.CharField(max_length=12, blank=True, null=True, db_index=True, editable=False)
+
+    objects = OrganizationQuerySet.as_manager()
 
     def __str__(self):
         return f"{self.get_org_type_display()}: {self.name}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_address = instance._address_values()
+        return instance
+
+    def _address_values(self):
+        return {field: getattr(self, field) for field in ADDRESS_FIELDS if field in self.__dict__}
+
+    def save(self, *args, **kwargs):
+        if self.latitude is not None and self.longitude is not None:
+            self.geohash = encode_geohash(self.latitude, self.longitude)
+        else:
+            self.geohash = None
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'latitude', 'longitude'} & set(update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'geohash'}
+        # A new address needs a new lookup; verification belonged to the old one
+        loaded = getattr(self, '_loaded_address', None)
+        current = self._address_values()
+        if loaded and self.is_location_verified and any(loaded.get(f) != v for f, v in current.items() if f in loaded):
+            self.is_location_verified = False
+            if update_fields is not None:
+                kwargs['update_fields'] = set(kwargs['update_fields']) | {'is_location_verified'}
+        super().save(*args, **kwargs)
+        self._loaded_address = self._address_values()
+
+class UserProfileManager(models.Manager):
+    def get_queryset(self):
+        return super().get_queryset().select_related('organization')
+
 class UserProfile(models.Model):
     ROLE_CHOICES = [
         ('patient', 'Patient'),
@@ -61,6 +132,13 @@ class UserProfile(models.Model):
     working_hours = models.JSONField(default=dict, blank=True)
     show_experience = models.BooleanField(default=True)
     show_qualification = models.BooleanField(default=True)
+    # Secret part of the iCalendar subscription URL (appointments/ics_feed.py), created on first use
+    calendar_feed_key = models.UUIDField(null=True, blank=True, unique=True, editable=False)
+    
+    objects = models.Manager()
+    # Base manager, used for ``user.profile``: templates read the organization
+    # through __str__ and get_status_display, so join it into the same query
+    with_organization = UserProfileManager()
     
     def __str__(self):
         return f"{self.user.get_full_name()} - {self.role} ({self.organization})"
@@ -82,6 +160,60 @@ class UserProfile(models.Model):
     class Meta:
         verbose_name = "User Profile"
         verbose_name_plural = "User Profiles"
+        base_manager_name = 'with_organization'
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._remember_values(field_names)
+        return instance
+    
+    def _remember_values(self, field_names):
+        # JSON values are copied so in-place edits (profile.languages.append) still count as changes
+        loaded = getattr(self, '_loaded_values', None) or {}
+        deferred = self.get_deferred_fields()
+        for field in self._meta.concrete_fields:
+            if field.attname in field_names and field.attname not in deferred:
+                value = getattr(self, field.attname)
+                loaded[field.attname] = copy.deepcopy(value) if isinstance(value, (dict, list)) else value
+        self._loaded_values = loaded
+    
+    def changed_fields(self):
+        """Names of fields that differ from the last load or save; every field for unsaved profiles"""
+        loaded = getattr(self, '_loaded_values', None)
+        fields = [field for field in self._meta.concrete_fields if not field.primary_key]
+        if self._state.adding or loaded is None:
+            return {field.name for field in fields}
+        deferred = self.get_deferred_fields()
+        return {
+            field.name for field in fields
+            if field.attname not in deferred
+            and (field.attname not in loaded or loaded[field.attname] != getattr(self, field.attname))
+        }
+    
+    def save_if_changed(self):
+        """Write only the changed fields, or nothing; returns whether a write happened"""
+        changed = self.changed_fields()
+        if not changed:
+            return False
+        self.save(update_fields=None if self._state.adding else changed)
+        return True
+    
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None:
+            self._remember_values({field.attname for field in self._meta.concrete_fields})
+        else:
+            names = set(update_fields)
+            self._remember_values({
+                field.attname for field in self._meta.concrete_fields
+                if field.name in names or field.attname in names
+            })
+
+SEARCH_TEXT_SOURCES = {'patient', 'patient_id', 'doctor', 'doctor_id', 'notes', 'patient_notes'}
+# Columns compared with the loaded values to tell whether a full save needs a new search_text
+SEARCH_TEXT_COLUMNS = ('patient_id', 'doctor_id', 'notes', 'patient_notes')
 
 class Appointment(models.Model):
     STATUS_CHOICES = [
@@ -121,6 +253,13 @@ class Appointment(models.Model):
     is_virtual = models.BooleanField(default=False)
     meeting_link = models.URLField(blank=True, null=True)
     meeting_password = models.CharField(max_length=50, blank=True, null=True)
+    # Lowercased names and notes, trigram-indexed for search_appointments
+    search_text = models.TextField(blank=True, default='', editable=False)
+    # Reception notes are staff-only, so they are searched through their own column
+    reception_search_text = models.TextField(blank=True, default='', editable=False)
+    # Calendar sync tokens (appointments/calendar_feed.py): every save takes the next change number
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    change_seq = models.BigIntegerField(default=0, editable=False, db_index=True)
     
     def __str__(self):
         return f"{self.patient.get_full_name()} - {self.doctor.get_full_name()} - {self.appointment_date}"
@@ -129,11 +268,61 @@ class Appointment(models.Model):
         ordering = ['-appointment_date']
         verbose_name = "Appointment"
         verbose_name_plural = "Appointments"
+        indexes = [
+            GinIndex(fields=['search_text'], name='appointment_search_trgm_idx', opclasses=['gin_trgm_ops']),
+            GinIndex(fields=['reception_search_text'], name='appointment_reception_trgm_idx',
+                     opclasses=['gin_trgm_ops']),
+            models.Index(fields=['organization', '-appointment_date', '-id'], name='appointment_org_date_idx'),
+        ]
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember what was loaded so rollups can tell which cell an edit moved out of
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+    
+    def build_search_text(self):
+        """Denormalized search column: patient/doctor names and emails plus the notes patients can see"""
+        parts = [
+            self.patient.first_name, self.patient.last_name, self.patient.email,
+            self.doctor.first_name, self.doctor.last_name,
+            self.notes, self.patient_notes,
+        ]
+        return ' '.join(part for part in parts if part).lower()
+    
+    def search_text_stale(self, update_fields=None):
+        """
+        Whether save() must rebuild search_text. Rebuilding reads the patient
+        and doctor, so a full save of a loaded appointment only does it when a
+        source column changed; renames are picked up by refresh_search_text.
+        """
+        if update_fields is not None:
+            return bool(SEARCH_TEXT_SOURCES & set(update_fields))
+        loaded = getattr(self, '_loaded_values', None)
+        if self._state.adding or loaded is None:
+            return True
+        return any(column not in loaded or loaded[column] != getattr(self, column) for column in SEARCH_TEXT_COLUMNS)
     
     def save(self, *args, **kwargs):
         if self.appointment_type == 'virtual':
             self.is_virtual = True
-        super().save(*args, **kwargs)
+        update_fields = kwargs.get('update_fields')
+        if self.search_text_stale(update_fields):
+            self.search_text = self.build_search_text()
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | {'search_text'}
+        if update_fields is None or 'reception_notes' in update_fields:
+            self.reception_search_text = (self.reception_notes or '').lower()
+            if update_fields is not None:
+                kwargs['update_fields'] = set(kwargs['update_fields']) | {'reception_search_text'}
+        using = kwargs.get('using') or self._state.db or 'default'
+        # post_save receivers (tombstones, the outbox event) commit or roll back with the row
+        with transaction.atomic(using=using, savepoint=False):
+            self.change_seq = next_change_seq(using)
+            if update_fields is not None:
+                kwargs['update_fields'] = set(kwargs['update_fields']) | {'change_seq', 'updated_at'}
+            super().save(*args, **kwargs)
 
 # New Models for Enhanced Features
 
@@ -463,3 +652,217 @@ class DoctorOrganizationJoinRequest(models.Model):
     
     def __str__(self):
         return f"{self.doctor.get_full_name()} - {self.organization.name} - {self.get_status_display()}"
+
+class GeocodeCache(models.Model):
+    """Normalized address -> coordinates, so each address is geocoded once per TTL"""
+    address_key = models.CharField(max_length=64, unique=True)  # sha256 of normalized_address
+    normalized_address = models.TextField()
+    found = models.BooleanField(default=True)
+    latitude = models.DecimalField(max_digits=10, decimal_places=8, blank=True, null=True)
+    longitude = models.DecimalField(max_digits=11, decimal_places=8, blank=True, null=True)
+    place_id = models.CharField(max_length=255, blank=True, null=True)
+    formatted_address = models.TextField(blank=True, null=True)
+    provider = models.CharField(max_length=50)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+    
+    def __str__(self):
+        return self.normalized_address
+    
+    class Meta:
+        verbose_name = "Geocode Cache Entry"
+        verbose_name_plural = "Geocode Cache Entries"
+
+class DoctorSearchDocument(models.Model):
+    """
+    Denormalized search row for one doctor.
+
+    Kept in sync from User/UserProfile/Organization signals. ``search_vector``
+    is computed from the text columns by a database trigger (see migration
+    0011); ``document`` holds the same text lowercased for trigram matching.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='search_document')
+    organization = models.ForeignKey(Organization, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    full_name = models.CharField(max_length=300, blank=True)
+    specialization = models.CharField(max_length=100, blank=True)
+    qualification = models.CharField(max_length=255, blank=True)
+    languages = models.JSONField(default=list, blank=True)
+    bio = models.TextField(blank=True)
+    organization_name = models.CharField(max_length=200, blank=True)
+    org_type = models.CharField(max_length=15, blank=True)
+    on_duty = models.BooleanField(default=False)
+    consultation_fee = models.DecimalField(max_digits=8, decimal_places=2, blank=True, null=True)
+    rating = models.DecimalField(max_digits=3, decimal_places=2, blank=True, null=True)
+    is_active = models.BooleanField(default=True)
+    document = models.TextField(blank=True)
+    search_vector = SearchVectorField(null=True, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return self.full_name
+    
+    class Meta:
+        verbose_name = "Doctor Search Document"
+        verbose_name_plural = "Doctor Search Documents"
+        indexes = [
+            GinIndex(fields=['search_vector'], name='doctor_search_vector_idx'),
+            GinIndex(fields=['document'], name='doctor_search_trgm_idx', opclasses=['gin_trgm_ops']),
+            models.Index(fields=['org_type', 'on_duty'], name='doctor_search_facets_idx'),
+        ]
+
+class DailyAppointmentFact(models.Model):
+    """
+    Pre-aggregated appointments per (organization, doctor, day, status, type).
+
+    Maintained incrementally by appointments.rollups from Appointment and
+    Payment changes and rebuilt with the backfill_rollups command.
+    """
+    organization = models.ForeignKey(Organization, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    doctor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    date = models.DateField()
+    status = models.CharField(max_length=20)
+    appointment_type = models.CharField(max_length=20)
+    appointment_count = models.PositiveIntegerField(default=0)
+    fee_total = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    paid_total = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.date} {self.doctor_id} {self.status}/{self.appointment_type}: {self.appointment_count}"
+    
+    class Meta:
+        verbose_name = "Daily Appointment Fact"
+        verbose_name_plural = "Daily Appointment Facts"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['organization', 'doctor', 'date', 'status', 'appointment_type'],
+                name='unique_daily_appointment_fact',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['organization', 'date'], name='fact_org_date_idx'),
+            models.Index(fields=['doctor', 'date'], name='fact_doctor_date_idx'),
+            models.Index(fields=['date'], name='fact_date_idx'),
+        ]
+
+class AppointmentTombstone(models.Model):
+    """
+    A deleted appointment, or one that left a doctor's, patient's or
+    organization's calendar, so calendar sync can tell clients to drop it.
+    Kept for CALENDAR_TOMBSTONE_RETENTION_DAYS, as long as sync tokens live.
+    """
+    appointment_id = models.IntegerField()
+    patient_id = models.IntegerField(null=True, db_index=True)
+    doctor_id = models.IntegerField(null=True, db_index=True)
+    organization_id = models.IntegerField(null=True, blank=True, db_index=True)
+    change_seq = models.BigIntegerField(db_index=True)
+    deleted_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    
+    def __str__(self):
+        return f"Appointment {self.appointment_id} removed at change {self.change_seq}"
+    
+    class Meta:
+        verbose_name = "Appointment Tombstone"
+        verbose_name_plural = "Appointment Tombstones"
+
+class GoogleCalendarLink(models.Model):
+    """
+    A user's connected Google Calendar and the state of its incremental sync
+    (appointments/google_calendar.py).
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='google_calendar')
+    calendar_id = models.CharField(max_length=255, default='primary')
+    # OAuth token, refresh token and scopes from the consent flow
+    credentials = models.JSONField(default=dict, blank=True)
+    # Google's nextSyncToken from the last pull
+    sync_token = models.CharField(max_length=500, blank=True, default='')
+    # Appointment.change_seq up to which changes have been pushed
+    pushed_seq = models.BigIntegerField(default=0)
+    last_synced_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"{self.user.username} -> {self.calendar_id}"
+    
+    class Meta:
+        verbose_name = "Google Calendar Link"
+        verbose_name_plural = "Google Calendar Links"
+
+class GoogleCalendarEvent(models.Model):
+    """The Google event mirroring an appointment, with the etag and content last written"""
+    link = models.ForeignKey(GoogleCalendarLink, on_delete=models.CASCADE, related_name='events')
+    appointment_id = models.IntegerField()
+    event_id = models.CharField(max_length=255)
+    etag = models.CharField(max_length=255, blank=True, default='')
+    # Hash of the event body last written; cleared when the event was edited in Google
+    content_hash = models.CharField(max_length=32, blank=True, default='')
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"Appointment {self.appointment_id} -> {self.event_id}"
+    
+    class Meta:
+        verbose_name = "Google Calendar Event"
+        verbose_name_plural = "Google Calendar Events"
+        constraints = [
+            models.UniqueConstraint(fields=['link', 'appointment_id'], name='unique_google_event_per_appointment'),
+        ]
+        indexes = [
+            models.Index(fields=['link', 'event_id'], name='google_event_lookup_idx'),
+        ]
+
+class OutboxEvent(models.Model):
+    """
+    An appointment change waiting to be relayed to websockets, Celery and
+    notifications (appointments/outbox.py). Written in the same transaction
+    as the change, so an event exists exactly when the change committed.
+    """
+    event_type = models.CharField(max_length=20)
+    appointment_id = models.IntegerField(db_index=True)
+    # Everything the handlers need, so events of deleted appointments can still be delivered
+    payload = models.JSONField(default=dict)
+    # Names of the handlers that already ran; a retry only runs the rest
+    delivered = models.JSONField(default=list, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    # Due time; while a relay holds the event's lease, the time the lease runs out
+    available_at = models.DateTimeField(default=timezone.now)
+    # Claim of the relay currently delivering the event; only that relay may record the outcome
+    lease_token = models.CharField(max_length=32, blank=True, default='')
+    processed_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.event_type} appointment {self.appointment_id}"
+
+    class Meta:
+        verbose_name = "Outbox Event"
+        verbose_name_plural = "Outbox Events"
+        indexes = [
+            models.Index(fields=['available_at', 'id'], condition=models.Q(processed_at__isnull=True),
+                         name='outbox_pending_idx'),
+        ]
+
+CHANGE_SEQUENCE = 'appointments_change_seq'
+
+def next_change_seq(using='default'):
+    """Next number of the calendar change sequence shared by appointments and their tombstones"""
+    return next_change_seqs(1, using)[0]
+
+
+def next_change_seqs(count, using='default'):
+    """The next ``count`` change numbers in one round trip, for rows written with bulk_create"""
+    if count <= 0:
+        return []
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT nextval(%s) FROM generate_series(1, %s)', [CHANGE_SEQUENCE, count])
+            return [row[0] for row in cursor.fetchall()]
+    # Other databases (SQLite in development and tests) have one writer at a time
+    latest = max(
+        Appointment.objects.using(using).aggregate(latest=models.Max('change_seq'))['latest'] or 0,
+        AppointmentTombstone.objects.using(using).aggregate(latest=models.Max('change_seq'))['latest'] or 0,
+    )
+    return list(range(latest + 1, latest + count + 1))
@@ -0,0 +1,278 @@
+"""
+Transactional outbox for appointment side effects.
+
+Saving or deleting an appointment inserts an ``OutboxEvent`` in the same
+transaction (see the receivers in signals.py), so the request pays one
+INSERT and nothing is sent for a change that rolled back. A relay
+(``manage.py relay_outbox``, with the ``relay_outbox_events`` task as a
+periodic backstop) fans each event out to every handler in HANDLERS: the
+channel layer, Celery email tasks and stored notifications.
+
+A batch goes through two short transactions with the network I/O between
+them, so no row lock or transaction is held while a broker is slow. The
+first claims due events with ``SELECT ... FOR UPDATE SKIP LOCKED`` and
+leases them: ``available_at`` moves OUTBOX_LEASE_SECONDS ahead and a fresh
+``lease_token`` is stamped on them. The handlers then run outside any
+transaction, each in its own atomic block so a database error rolls back
+only that handler's writes. The second transaction records the outcomes,
+but only for events still carrying this relay's token.
+
+Delivery is at least once. A relay that dies mid-batch leaves its events
+leased; they become due again when the lease runs out, and a relay that
+outlives its lease does not overwrite the next relay's record. Handlers that already
+succeeded are recorded on the event and skipped when a failed one is
+retried, so most duplicates are avoided, but consumers must tolerate them.
+Messages carry the appointment's status rather than a diff, so a repeated
+or late message does no harm.
+
+Bulk updates and ``bulk_create`` skip signals and write no events.
+"""
+
+import logging
+import uuid
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+
+from .models import OutboxEvent, UserProfile
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = getattr(settings, 'OUTBOX_BATCH_SIZE', 100)
+MAX_ATTEMPTS = getattr(settings, 'OUTBOX_MAX_ATTEMPTS', 10)
+RETRY_SECONDS = getattr(settings, 'OUTBOX_RETRY_SECONDS', 5)
+MAX_RETRY_SECONDS = 60 * 60
+RETENTION_DAYS = getattr(settings, 'OUTBOX_RETENTION_DAYS', 7)
+LEASE_SECONDS = getattr(settings, 'OUTBOX_LEASE_SECONDS', 60 * 5)
+OUTCOME_FIELDS = ['delivered', 'attempts', 'available_at', 'processed_at', 'last_error', 'lease_token']
+
+BOOKED, CONFIRMED, CANCELLED, UPDATED, DELETED = 'booked', 'confirmed', 'cancelled', 'updated', 'deleted'
+# Status changes that get their own event type; other saves are plain updates
+STATUS_EVENTS = {'confirmed': CONFIRMED, 'cancelled': CANCELLED}
+# Events people are notified about personally; plain updates only when one of
+# the USER_VISIBLE_FIELDS changed (dashboards get every event)
+NOTIFY_EVENTS = {BOOKED, CONFIRMED, CANCELLED, DELETED}
+USER_VISIBLE_FIELDS = ('appointment_date', 'doctor_id')
+
+
+def event_type_for(instance, created, previous_status=None):
+    """The outbox event type for a saved appointment"""
+    if created:
+        return BOOKED
+    if previous_status is not None and previous_status != instance.status:
+        return STATUS_EVENTS.get(instance.status, UPDATED)
+    return UPDATED
+
+
+def changed_fields(instance, loaded_values):
+    """USER_VISIBLE_FIELDS that differ from the values the instance was loaded or last saved with"""
+    loaded_values = loaded_values or {}
+    return [field for field in USER_VISIBLE_FIELDS
+            if field in loaded_values and loaded_values[field] != getattr(instance, field)]
+
+
+def event_payload(instance, event_type, previous_status=None, changed=()):
+    return {
+        'event_type': event_type,
+        'appointment_id': instance.id,
+        'status': instance.status,
+        'previous_status': previous_status,
+        'patient_status': instance.patient_status,
+        'doctor_id': instance.doctor_id,
+        'patient_id': instance.patient_id,
+        'organization_id': instance.organization_id,
+        'appointment_date': instance.appointment_date.isoformat() if instance.appointment_date else None,
+        'changed': list(changed),
+    }
+
+
+def should_notify(payload):
+    """Whether the doctor, patient and receptionists hear about this event personally"""
+    return payload['event_type'] in NOTIFY_EVENTS or bool(payload.get('changed'))
+
+
+def record_event(instance, event_type, previous_status=None, using=None, changed=()):
+    """Insert the outbox row for an appointment change; call inside the change's transaction"""
+    return OutboxEvent.objects.using(using or instance._state.db or 'default').create(
+        event_type=event_type,
+        appointment_id=instance.id,
+        payload=event_payload(instance, event_type, previous_status, changed),
+    )
+
+
+def _notification_message(payload, message):
+    return {
+        'type': 'notification_message',
+        'notification_type': 'appointment_update',
+        'message': message,
+        'data': {'appointment_id': payload['appointment_id'], 'event_type': payload['event_type']},
+        'timestamp': timezone.now().isoformat(),
+    }
+
+
+def publish_to_channels(payload):
+    """Organization dashboards, the doctor, the patient and the organization's receptionists"""
+    channel_layer = get_channel_layer()
+    group_send = async_to_sync(channel_layer.group_send)
+    event_type = payload['event_type']
+    if payload['organization_id']:
+        group_send(f"appointments_org_{payload['organization_id']}", {
+            'type': 'appointment_update',
+            'appointment_id': payload['appointment_id'],
+            'status': payload['status'],
+            'patient_status': payload['patient_status'],
+            'timestamp': timezone.now().isoformat(),
+        })
+    if not should_notify(payload):
+        return
+    active = set(User.objects.filter(id__in=[payload['doctor_id'], payload['patient_id']], is_active=True)
+                 .values_list('id', flat=True))
+    if payload['doctor_id'] in active:
+        group_send(f"notifications_{payload['doctor_id']}",
+                   _notification_message(payload, f'Appointment {event_type} for you.'))
+    if payload['patient_id'] in active:
+        group_send(f"notifications_{payload['patient_id']}",
+                   _notification_message(payload, f'Your appointment has been {event_type}.'))
+    if payload['organization_id']:
+        receptionist_ids = UserProfile.objects.filter(
+            organization_id=payload['organization_id'], role='receptionist', user__is_active=True,
+        ).values_list('user_id', flat=True)
+        for user_id in receptionist_ids:
+            group_send(f'notifications_{user_id}',
+                       _notification_message(payload, f'Appointment {event_type} in your organization.'))
+
+
+def queue_email_tasks(payload):
+    """Confirmation and cancellation emails; the tasks run on the realtime queue"""
+    from .tasks import send_appointment_cancellation, send_appointment_confirmation
+    event_type = payload['event_type']
+    if event_type == CONFIRMED or (event_type == BOOKED and payload['status'] == 'confirmed'):
+        send_appointment_confirmation.delay(payload['appointment_id'])
+    elif event_type == CANCELLED:
+        send_appointment_cancellation.delay(payload['appointment_id'])
+
+
+def store_notifications(payload):
+    """Notification inbox entries for bookings, confirmations and cancellations"""
+    from notifications.signals import notify
+    event_type = payload['event_type']
+    if event_type not in (BOOKED, CONFIRMED, CANCELLED):
+        return
+    users = User.objects.in_bulk([payload['doctor_id'], payload['patient_id']])
+    doctor, patient = users.get(payload['doctor_id']), users.get(payload['patient_id'])
+    if doctor is None or patient is None:
+        return
+    data = {'appointment_id': payload['appointment_id'], 'appointment_date': payload['appointment_date']}
+    notify.send(doctor, recipient=patient, verb=f'appointment_{event_type}',
+                description=f'Your appointment has been {event_type}.', data=data)
+    if event_type != CONFIRMED:
+        notify.send(patient, recipient=doctor, verb=f'appointment_{event_type}',
+                    description=f'Appointment {event_type} for you.', data=data)
+
+
+HANDLERS = {
+    'channels': publish_to_channels,
+    'tasks': queue_email_tasks,
+    'notifications': store_notifications,
+}
+
+
+def retry_delay(attempts):
+    """Exponential backoff after the given number of failed attempts, capped at an hour"""
+    return timedelta(seconds=min(RETRY_SECONDS * 2 ** (attempts - 1), MAX_RETRY_SECONDS))
+
+
+def deliver(event, handlers, now):
+    """Run the handlers this event has not been through yet; returns whether all succeeded"""
+    errors = []
+    for name, handler in handlers.items():
+        if name in event.delivered:
+            continue
+        try:
+            with transaction.atomic():
+                handler(event.payload)
+            event.delivered = event.delivered + [name]
+        except Exception as e:
+            errors.append(f"{name}: {e}")
+    if not errors:
+        event.processed_at = now
+        event.last_error = ''
+        event.lease_token = ''
+        return True
+    event.attempts += 1
+    event.last_error = '; '.join(errors)[:1000]
+    event.lease_token = ''
+    if event.attempts >= MAX_ATTEMPTS:
+        logger.error(f"Giving up on outbox event {event.id} after {event.attempts} attempts: {event.last_error}")
+        event.processed_at = now
+    else:
+        event.available_at = now + retry_delay(event.attempts)
+    return False
+
+
+def claim_batch(batch_size=None, now=None):
+    """Lease up to ``batch_size`` due events to this caller; returns them, stamped with the lease token"""
+    now = now or timezone.now()
+    token = uuid.uuid4().hex
+    with transaction.atomic():
+        ids = list(
+            OutboxEvent.objects.select_for_update(skip_locked=True)
+            .filter(processed_at__isnull=True, available_at__lte=now)
+            .order_by('id').values_list('id', flat=True)[:batch_size or BATCH_SIZE]
+        )
+        OutboxEvent.objects.filter(id__in=ids).update(
+            available_at=now + timedelta(seconds=LEASE_SECONDS), lease_token=token,
+        )
+    return list(OutboxEvent.objects.filter(id__in=ids, lease_token=token).order_by('id'))
+
+
+def record_outcomes(events, token):
+    """Save delivery results for the events this lease still holds; returns how many were saved"""
+    with transaction.atomic():
+        held = set(
+            OutboxEvent.objects.select_for_update()
+            .filter(id__in=[event.id for event in events], lease_token=token)
+            .values_list('id', flat=True)
+        )
+        OutboxEvent.objects.bulk_update([event for event in events if event.id in held], OUTCOME_FIELDS)
+    if len(held) < len(events):
+        logger.warning(f"Outbox lease expired for {len(events) - len(held)} events; their next relay records them")
+    return len(held)
+
+
+def relay_batch(batch_size=None, handlers=None):
+    """Claim, deliver and record up to ``batch_size`` due events; returns how many were claimed"""
+    handlers = HANDLERS if handlers is None else handlers
+    events = claim_batch(batch_size)
+    if not events:
+        return 0
+    token = events[0].lease_token
+    failed = sum(not deliver(event, handlers, timezone.now()) for event in events)
+    record_outcomes(events, token)
+    if failed:
+        logger.warning(f"{failed} of {len(events)} outbox events failed and will be retried")
+    return len(events)
+
+
+def relay_pending(batch_size=None, handlers=None, max_batches=None):
+    """Relay batches until nothing is due (or ``max_batches`` ran); returns the events claimed"""
+    batch_size = batch_size or BATCH_SIZE
+    total = batches = 0
+    while max_batches is None or batches < max_batches:
+        claimed = relay_batch(batch_size, handlers)
+        total += claimed
+        batches += 1
+        if claimed < batch_size:
+            break
+    return total
+
+
+def prune_events(days=None):
+    """Delete processed events older than the retention period"""
+    cutoff = timezone.now() - timedelta(days=RETENTION_DAYS if days is None else days)
+    return OutboxEvent.objects.filter(processed_at__lt=cutoff).delete()[0]
@@ -0,0 +1,186 @@
+"""
+Pagination helpers for large tables.
+
+``COUNT(*)`` on PostgreSQL reads every visible row, which is what makes
+admin changelists and list pages slow once a table has millions of rows.
+``EstimatedCountPaginator`` asks the planner instead: ``pg_class.reltuples``
+for an unfiltered table, the ``EXPLAIN`` row estimate for a filtered one.
+Only when the estimate is below ``PAGINATION_ESTIMATE_THRESHOLD`` -- where
+an exact count is cheap and page numbers should be right -- does it count,
+and that count is cached for ``PAGINATION_COUNT_CACHE_TIMEOUT`` seconds per
+filter signature (the count query's SQL and parameters), so paging through
+one filtered list counts it once.
+
+Infinite scroll and APIs should not count at all: ``keyset_page`` returns a
+page after an opaque cursor holding the last row's ordering values, which is
+an index range scan however deep the reader has scrolled.
+"""
+
+import base64
+import hashlib
+import json
+from collections import namedtuple
+from datetime import date, datetime, time
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+ESTIMATE_THRESHOLD = getattr(settings, 'PAGINATION_ESTIMATE_THRESHOLD', 100000)
+COUNT_CACHE_TIMEOUT = getattr(settings, 'PAGINATION_COUNT_CACHE_TIMEOUT', 60)
+
+KeysetPage = namedtuple('KeysetPage', ['object_list', 'next_cursor'])
+
+
+class InvalidCursor(ValueError):
+    """Raised when a paging cursor cannot be decoded"""
+
+
+def table_estimate(model, using='default'):
+    """The planner's row count for a model's table (as of the last ANALYZE), or None off PostgreSQL"""
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+            [connection.ops.quote_name(model._meta.db_table)],
+        )
+        row = cursor.fetchone()
+    # -1 means the table has never been analyzed
+    return row[0] if row and row[0] >= 0 else None
+
+
+def planner_estimate(queryset):
+    """The planner's row estimate for a queryset, or None off PostgreSQL"""
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def count_signature(queryset):
+    """Stable short hash of the SQL and parameters that count ``queryset``"""
+    sql, params = queryset.order_by().query.sql_with_params()
+    payload = f"{queryset.db}|{sql}|{params!r}"
+    return hashlib.md5(payload.encode('utf-8')).hexdigest()
+
+
+def cached_count(queryset, timeout=COUNT_CACHE_TIMEOUT):
+    """``queryset.count()``, cached for ``timeout`` seconds per filter signature"""
+    if not timeout:
+        return queryset.count()
+    key = f"pagination-count:{count_signature(queryset)}"
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, timeout)
+    return count
+
+
+def estimated_count(queryset, threshold=ESTIMATE_THRESHOLD, timeout=COUNT_CACHE_TIMEOUT):
+    """A row count for ``queryset``: estimated when large, exact (and briefly cached) otherwise"""
+    if queryset.query.is_sliced:
+        return queryset.count()
+    if not queryset.query.where and not queryset.query.distinct:
+        estimate = table_estimate(queryset.model, queryset.db)
+    else:
+        estimate = planner_estimate(queryset)
+    if estimate is not None and estimate >= threshold:
+        return estimate
+    return cached_count(queryset, timeout)
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator whose count is estimated above ``threshold`` rows; pair with show_full_result_count=False"""
+
+    threshold = ESTIMATE_THRESHOLD
+    count_timeout = COUNT_CACHE_TIMEOUT
+
+    @cached_property
+    def count(self):
+        if not hasattr(self.object_list, 'query'):
+            return super().count
+        return estimated_count(self.object_list, self.threshold, self.count_timeout)
+
+
+def _ordering_fields(queryset, ordering):
+    fields = []
+    for name in ordering:
+        descending = name.startswith('-')
+        field_name = name.lstrip('-')
+        field = queryset.model._meta.pk if field_name == 'pk' else queryset.model._meta.get_field(field_name)
+        fields.append((field_name, field, descending))
+    return fields
+
+
+def _cursor_value(value):
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def encode_cursor(values):
+    """Opaque cursor for a row's ordering values"""
+    payload = json.dumps([_cursor_value(value) for value in values])
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_cursor(cursor, fields):
+    """Ordering values from a cursor, converted by each model field; raises InvalidCursor"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor(str(e))
+    if not isinstance(values, list) or len(values) != len(fields):
+        raise InvalidCursor(cursor)
+    try:
+        decoded = [field.to_python(value) for (_, field, _), value in zip(fields, values)]
+    except ValidationError as e:
+        raise InvalidCursor(str(e))
+    if any(value is None for value in decoded):
+        raise InvalidCursor(cursor)
+    return decoded
+
+
+def _after(fields, values):
+    """Rows strictly after ``values`` in the ordering, as (a < x) OR (a = x AND b < y) ..."""
+    condition = Q()
+    for position, (name, _, descending) in enumerate(fields):
+        lookup = 'lt' if descending else 'gt'
+        clause = Q(**{f"{name}__{lookup}": values[position]})
+        for earlier in range(position):
+            clause &= Q(**{fields[earlier][0]: values[earlier]})
+        condition |= clause
+    return condition
+
+
+def keyset_page(queryset, ordering, cursor=None, limit=25):
+    """
+    One page of ``queryset`` in ``ordering`` after ``cursor``.
+
+    ``ordering`` must end in a unique field (normally ``-id`` or ``id``) and
+    none of its fields may be null. Returns ``KeysetPage(object_list,
+    next_cursor)``; ``next_cursor`` is None on the last page.
+    """
+    fields = _ordering_fields(queryset, ordering)
+    if cursor:
+        queryset = queryset.filter(_after(fields, decode_cursor(cursor, fields)))
+    page = list(queryset.order_by(*ordering)[:limit + 1])
+    if len(page) > limit:
+        last = page[limit - 1]
+        return KeysetPage(page[:limit], encode_cursor([getattr(last, name) for name, _, _ in fields]))
+    return KeysetPage(page, None)
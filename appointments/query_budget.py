@@ -0,0 +1,187 @@
+"""
+Query counting and N+1 detection for requests, Celery tasks and tests.
+
+``record_queries(label)`` installs an ``execute_wrapper`` on every database
+connection and counts statements by shape (the SQL with literals and
+``IN (...)`` lists collapsed). A shape seen ``QUERY_REPEAT_THRESHOLD`` times
+in one unit of work is almost always a lazy load inside a loop; the stack
+where it crossed the threshold is kept so the log points at the loop.
+
+* ``QueryBudgetMiddleware`` and the Celery hooks log requests and tasks that
+  exceed their budget or repeat a shape (enabled by ``QUERY_BUDGET_ENABLED``).
+* ``@query_budget(n)`` declares a view's or task's budget.
+* ``enforce_query_budget(n)`` raises ``QueryBudgetExceeded`` instead, as a
+  context manager or test decorator, so regressions fail CI.
+"""
+
+import logging
+import re
+import threading
+import traceback
+from collections import Counter
+from contextlib import ContextDecorator, ExitStack, contextmanager
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+QUERY_BUDGET_ENABLED = getattr(settings, 'QUERY_BUDGET_ENABLED', False)
+DEFAULT_BUDGET = getattr(settings, 'QUERY_BUDGET_DEFAULT', 50)
+REPEAT_THRESHOLD = getattr(settings, 'QUERY_REPEAT_THRESHOLD', 8)
+STACK_DEPTH = 6
+
+_IN_LIST = re.compile(r'\((?:\s*%s\s*,)+\s*%s\s*\)')
+_NUMBER = re.compile(r'\b\d+\b')
+_STRING = re.compile(r"'(?:[^']|'')*'")
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Raised by enforce_query_budget when a block runs too many or repeated queries"""
+
+
+def query_shape(sql):
+    """SQL with literals and IN lists collapsed, so the same query with other ids compares equal"""
+    shape = _IN_LIST.sub('(%s...)', sql)
+    shape = _STRING.sub('?', shape)
+    return _NUMBER.sub('?', shape)
+
+
+def _stack_summary():
+    """The innermost project frames (no Django/library code) leading to the current query"""
+    base_dir = str(settings.BASE_DIR)
+    frames = [
+        frame for frame in traceback.extract_stack()
+        if frame.filename.startswith(base_dir) and 'site-packages' not in frame.filename
+        and frame.filename != __file__
+    ]
+    return [f"{frame.filename[len(base_dir) + 1:]}:{frame.lineno} in {frame.name}" for frame in frames[-STACK_DEPTH:]]
+
+
+class QueryRecorder:
+    def __init__(self, label, repeat_threshold=REPEAT_THRESHOLD):
+        self.label = label
+        self.repeat_threshold = repeat_threshold
+        self.count = 0
+        self.shapes = Counter()
+        self.stacks = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        shape = query_shape(sql)
+        self.count += 1
+        self.shapes[shape] += 1
+        if self.shapes[shape] == self.repeat_threshold:
+            self.stacks[shape] = _stack_summary()
+        return execute(sql, params, many, context)
+
+    def repeated(self):
+        """(shape, count) for shapes run at least ``repeat_threshold`` times, most frequent first"""
+        return [(shape, count) for shape, count in self.shapes.most_common() if count >= self.repeat_threshold]
+
+    def problems(self, budget=None):
+        """Human-readable budget and N+1 findings; empty when the unit of work is clean"""
+        problems = []
+        if budget is not None and self.count > budget:
+            problems.append(f"{self.label}: {self.count} queries, budget {budget}")
+        for shape, count in self.repeated():
+            stack = ' <- '.join(reversed(self.stacks.get(shape, []))) or 'unknown caller'
+            problems.append(f"{self.label}: {count}x {shape[:200]} at {stack}")
+        return problems
+
+
+@contextmanager
+def record_queries(label, repeat_threshold=REPEAT_THRESHOLD):
+    """Count the queries run in this thread inside the block; yields the QueryRecorder"""
+    recorder = QueryRecorder(label, repeat_threshold)
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(recorder))
+        yield recorder
+
+
+def query_budget(max_queries):
+    """Declare the query budget of a view or Celery task (apply under ``@shared_task``)"""
+    def declare(func):
+        func.query_budget = max_queries
+        return func
+    return declare
+
+
+class enforce_query_budget(ContextDecorator):
+    """
+    Fail when the block runs more than ``max_queries`` queries or repeats a
+    query shape ``repeat_threshold`` times. Use in tests as a context manager
+    or decorator.
+    """
+
+    def __init__(self, max_queries=None, repeat_threshold=REPEAT_THRESHOLD, label='block'):
+        self.max_queries = max_queries
+        self.repeat_threshold = repeat_threshold
+        self.label = label
+
+    def __enter__(self):
+        self._stack = ExitStack()
+        self.recorder = self._stack.enter_context(record_queries(self.label, self.repeat_threshold))
+        return self.recorder
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        self._stack.close()
+        if exc_type is None:
+            problems = self.recorder.problems(self.max_queries)
+            if problems:
+                raise QueryBudgetExceeded('\n'.join(problems))
+        return False
+
+
+def report(recorder, budget):
+    for problem in recorder.problems(budget):
+        logger.warning(f"Query budget: {problem}")
+
+
+class QueryBudgetMiddleware:
+    """Log requests that exceed their view's budget or look like N+1; enable with QUERY_BUDGET_ENABLED"""
+
+    def __init__(self, get_response):
+        if not QUERY_BUDGET_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with record_queries(f"{request.method} {request.path}") as recorder:
+            response = self.get_response(request)
+        report(recorder, getattr(request, 'query_budget', DEFAULT_BUDGET))
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.query_budget = getattr(view_func, 'query_budget', DEFAULT_BUDGET)
+
+
+_task_recordings = threading.local()
+
+
+def _task_started(task_id=None, task=None, **kwargs):
+    stack = ExitStack()
+    recorder = stack.enter_context(record_queries(f"task {task.name}"))
+    if not hasattr(_task_recordings, 'active'):
+        _task_recordings.active = {}
+    budget = getattr(task.run, 'query_budget', DEFAULT_BUDGET)
+    _task_recordings.active[task_id] = (stack, recorder, budget)
+
+
+def _task_finished(task_id=None, **kwargs):
+    active = getattr(_task_recordings, 'active', {})
+    if task_id not in active:
+        return
+    stack, recorder, budget = active.pop(task_id)
+    stack.close()
+    report(recorder, budget)
+
+
+def install_task_hooks():
+    """Record queries for every Celery task run in this process"""
+    if not QUERY_BUDGET_ENABLED:
+        return
+    from celery.signals import task_postrun, task_prerun
+    task_prerun.connect(_task_started, weak=False)
+    task_postrun.connect(_task_finished, weak=False)
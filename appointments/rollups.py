@@ -0,0 +1,231 @@
+"""
+Daily appointment rollups for the analytics dashboards.
+
+``DailyAppointmentFact`` holds one row per (organization, doctor, day,
+status, appointment type) with the appointment count, booked fees and
+completed payments. Saving or deleting an appointment or payment recomputes
+only the affected (organization, doctor, day) cells after the transaction
+commits; ``rebuild_rollups`` re-aggregates whole date ranges for backfills
+and for catching up with bulk updates that bypass signals. Dashboards read
+these rows, so a year of history is a few hundred rows per doctor.
+"""
+
+import logging
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from functools import reduce
+from operator import or_
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .cache_versions import ROLLUPS, bump_on_commit
+from .models import Appointment, DailyAppointmentFact, Payment
+
+logger = logging.getLogger(__name__)
+
+# Matches the reception dashboard: a pending appointment whose day has passed
+NO_SHOW_STATUSES = ('pending',)
+NOT_ATTENDABLE_STATUSES = ('cancelled', 'declined')
+REBUILD_CHUNK_DAYS = 31
+FACT_KEY = ('organization_id', 'doctor_id', 'date', 'status', 'appointment_type')
+
+
+def local_date(value):
+    return timezone.localtime(value).date() if timezone.is_aware(value) else value.date()
+
+
+def day_bounds(day):
+    start = datetime.combine(day, time.min)
+    if timezone.is_naive(start):
+        start = timezone.make_aware(start)
+    return start, start + timedelta(days=1)
+
+
+def appointment_cell(appointment):
+    """The (organization id, doctor id, day) cell an appointment rolls up into"""
+    return appointment.organization_id, appointment.doctor_id, local_date(appointment.appointment_date)
+
+
+def previous_cell(appointment):
+    """The cell as loaded from the database, or None for new or partially loaded instances"""
+    loaded = getattr(appointment, '_loaded_values', None) or {}
+    if not {'organization_id', 'doctor_id', 'appointment_date'} <= loaded.keys():
+        return None
+    return loaded['organization_id'], loaded['doctor_id'], local_date(loaded['appointment_date'])
+
+
+def _cell_q(cells, prefix=''):
+    def q(organization_id, doctor_id, day):
+        start, end = day_bounds(day)
+        organization = (
+            {f'{prefix}organization__isnull': True} if organization_id is None
+            else {f'{prefix}organization_id': organization_id}
+        )
+        return Q(**organization, **{
+            f'{prefix}doctor_id': doctor_id,
+            f'{prefix}appointment_date__gte': start,
+            f'{prefix}appointment_date__lt': end,
+        })
+    return reduce(or_, [q(*cell) for cell in cells])
+
+
+def _fact_cell_q(cells):
+    return reduce(or_, [
+        Q(organization__isnull=True, doctor_id=doctor_id, date=day) if organization_id is None
+        else Q(organization_id=organization_id, doctor_id=doctor_id, date=day)
+        for organization_id, doctor_id, day in cells
+    ])
+
+
+def aggregate_facts(appointment_filter, payment_filter):
+    """Unsaved DailyAppointmentFact rows for the matching appointments and their payments"""
+    rows = (
+        Appointment.objects.filter(appointment_filter)
+        .annotate(date=TruncDate('appointment_date'))
+        .order_by()
+        .values('organization_id', 'doctor_id', 'date', 'status', 'appointment_type')
+        .annotate(appointment_count=Count('id'), fee_total=Sum('fee'))
+    )
+    facts = {
+        tuple(row[field] for field in FACT_KEY): DailyAppointmentFact(
+            **{field: row[field] for field in FACT_KEY},
+            appointment_count=row['appointment_count'],
+            fee_total=row['fee_total'] or Decimal('0'),
+        )
+        for row in rows
+    }
+
+    payments = (
+        Payment.objects.filter(payment_filter, status='completed', appointment__isnull=False)
+        .annotate(date=TruncDate('appointment__appointment_date'))
+        .order_by()
+        .values(
+            'appointment__organization_id', 'appointment__doctor_id', 'date',
+            'appointment__status', 'appointment__appointment_type',
+        )
+        .annotate(paid_total=Sum('amount'))
+    )
+    for row in payments:
+        key = (
+            row['appointment__organization_id'], row['appointment__doctor_id'], row['date'],
+            row['appointment__status'], row['appointment__appointment_type'],
+        )
+        if key in facts:
+            facts[key].paid_total = row['paid_total'] or Decimal('0')
+    return list(facts.values())
+
+
+def refresh_cells(cells):
+    """Recompute the fact rows for a set of (organization id, doctor id, day) cells"""
+    cells = {cell for cell in cells if cell is not None and cell[1] is not None}
+    if not cells:
+        return 0
+    for attempt in range(2):
+        try:
+            with transaction.atomic():
+                DailyAppointmentFact.objects.filter(_fact_cell_q(cells)).delete()
+                facts = aggregate_facts(_cell_q(cells), _cell_q(cells, prefix='appointment__'))
+                DailyAppointmentFact.objects.bulk_create(facts)
+            return len(facts)
+        except IntegrityError:
+            # A concurrent refresh of the same cell committed first; recompute on top of it
+            if attempt:
+                raise
+    return 0
+
+
+def queue_rollup_refresh(cells):
+    """Refresh cells once the current transaction commits"""
+    cells = set(cells)
+
+    def refresh():
+        try:
+            refresh_cells(cells)
+        except Exception as e:
+            logger.error(f"Failed to refresh appointment rollups for {len(cells)} cells: {e}")
+
+    transaction.on_commit(refresh)
+
+
+def rebuild_rollups(start, end, chunk_days=REBUILD_CHUNK_DAYS):
+    """Re-aggregate every fact row for days in [start, end], a chunk of days at a time"""
+    written = 0
+    chunk_start = start
+    while chunk_start <= end:
+        chunk_end = min(chunk_start + timedelta(days=chunk_days - 1), end)
+        range_start, _ = day_bounds(chunk_start)
+        _, range_end = day_bounds(chunk_end)
+        with transaction.atomic():
+            DailyAppointmentFact.objects.filter(date__gte=chunk_start, date__lte=chunk_end).delete()
+            facts = aggregate_facts(
+                Q(appointment_date__gte=range_start, appointment_date__lt=range_end),
+                Q(appointment__appointment_date__gte=range_start, appointment__appointment_date__lt=range_end),
+            )
+            DailyAppointmentFact.objects.bulk_create(facts, batch_size=1000)
+        written += len(facts)
+        chunk_start = chunk_end + timedelta(days=1)
+    bump_on_commit({ROLLUPS})
+    return written
+
+
+def facts_for(organization=None, doctor=None, start=None, end=None):
+    facts = DailyAppointmentFact.objects.all()
+    if organization is not None:
+        facts = facts.filter(organization=organization)
+    if doctor is not None:
+        facts = facts.filter(doctor=doctor)
+    if start is not None:
+        facts = facts.filter(date__gte=start)
+    if end is not None:
+        facts = facts.filter(date__lte=end)
+    return facts
+
+
+def summarize(facts, today=None):
+    """
+    Headline numbers from fact rows: totals by status, booked and paid
+    revenue, and the no-show rate over days that have already passed.
+    """
+    today = today or timezone.localdate()
+    by_status = defaultdict(int)
+    past_attendable = no_shows = 0
+    fee_total = paid_total = Decimal('0')
+    rows = facts.order_by().values('status', 'date').annotate(
+        appointments=Sum('appointment_count'), fees=Sum('fee_total'), paid=Sum('paid_total'),
+    )
+    for row in rows:
+        by_status[row['status']] += row['appointments']
+        fee_total += row['fees'] or 0
+        paid_total += row['paid'] or 0
+        if row['date'] < today and row['status'] not in NOT_ATTENDABLE_STATUSES:
+            past_attendable += row['appointments']
+            if row['status'] in NO_SHOW_STATUSES:
+                no_shows += row['appointments']
+    return {
+        'total': sum(by_status.values()),
+        'by_status': dict(by_status),
+        'fee_total': fee_total,
+        'paid_total': paid_total,
+        'no_show_rate': (no_shows / past_attendable * 100) if past_attendable else 0.0,
+    }
+
+
+def daily_series(facts, start, end):
+    """(labels, counts) for every day in [start, end], zero-filled"""
+    counts = dict(
+        facts.filter(date__gte=start, date__lte=end).order_by()
+        .values_list('date').annotate(total=Sum('appointment_count'))
+    )
+    days = [start + timedelta(days=offset) for offset in range((end - start).days + 1)]
+    return [day.isoformat() for day in days], [counts.get(day, 0) for day in days]
+
+
+def doctor_volumes(facts):
+    """[(doctor id, appointments)] busiest first"""
+    return list(
+        facts.order_by().values_list('doctor_id').annotate(total=Sum('appointment_count')).order_by('-total')
+    )
@@ -0,0 +1,240 @@
+"""
+Doctor search.
+
+Each doctor has one denormalized DoctorSearchDocument row holding the text
+we search (name, specialization, qualification, languages, bio, clinic name)
+and the facet columns we filter on. A trigger keeps its weighted
+``search_vector`` up to date, so queries hit the GIN indexes instead of
+scanning ``auth_user`` joins with ``LIKE '%...%'``. Matching combines
+prefix full-text search (search-as-you-type) with trigram word similarity
+(typo tolerance). Result pages are cached under the doctor directory
+namespace, which every document write bumps.
+"""
+
+import re
+from decimal import Decimal, InvalidOperation
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramWordSimilarity
+from django.db.models import F, Q
+from django.db.models.functions import Greatest
+
+from .cache_aside import cache_aside, refresher
+from .cache_versions import DOCTOR_DIRECTORY, bump_on_commit, versioned_key
+from .map_clusters import filter_signature
+from .models import DoctorSearchDocument, UserProfile
+
+SEARCH_CONFIG = 'simple'
+MAX_SEARCH_TERMS = 8
+DEFAULT_SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+SEARCH_CACHE_TIMEOUT = 300
+
+DOCUMENT_FIELDS = [
+    'organization', 'full_name', 'specialization', 'qualification', 'languages', 'bio',
+    'organization_name', 'org_type', 'on_duty', 'consultation_fee', 'rating', 'is_active',
+    'document', 'updated_at',
+]
+
+_TOKEN = re.compile(r'\w+')
+
+
+def doctor_profiles():
+    return UserProfile.objects.filter(role='doctor').select_related('user', 'organization')
+
+
+def document_for(profile):
+    """Build the (unsaved) search document for a doctor's profile"""
+    user = profile.user
+    organization = profile.organization
+    languages = [str(language) for language in (profile.languages or []) if language]
+    fields = {
+        'full_name': user.get_full_name() or user.username,
+        'specialization': profile.specialization or '',
+        'qualification': profile.qualification or '',
+        'bio': profile.bio or '',
+        'organization_name': organization.name if organization else '',
+    }
+    text = ' '.join([fields['full_name'], fields['specialization'], fields['qualification'],
+                     ' '.join(languages), fields['organization_name']])
+    return DoctorSearchDocument(
+        user=user,
+        organization=organization,
+        languages=languages,
+        org_type=organization.org_type if organization else '',
+        on_duty=profile.on_duty,
+        consultation_fee=profile.consultation_fee,
+        rating=profile.rating,
+        is_active=user.is_active,
+        document=' '.join(text.lower().split()),
+        **fields,
+    )
+
+
+def index_doctors(profiles):
+    """Upsert search documents for doctor profiles in one statement; returns the count"""
+    documents = [document_for(profile) for profile in profiles]
+    if documents:
+        DoctorSearchDocument.objects.bulk_create(
+            documents,
+            update_conflicts=True,
+            unique_fields=['user'],
+            update_fields=DOCUMENT_FIELDS,
+        )
+        bump_on_commit({DOCTOR_DIRECTORY})
+    return len(documents)
+
+
+def remove_doctor_documents(documents):
+    """Delete search documents (a queryset); returns the count"""
+    removed, _ = documents.delete()
+    if removed:
+        bump_on_commit({DOCTOR_DIRECTORY})
+    return removed
+
+
+def sync_doctor_document(user_id):
+    """Refresh one user's document, dropping it if they are no longer a doctor"""
+    profile = doctor_profiles().filter(user_id=user_id).first()
+    if profile is None:
+        remove_doctor_documents(DoctorSearchDocument.objects.filter(user_id=user_id))
+        return
+    index_doctors([profile])
+
+
+def search_terms(query):
+    return [term.lower() for term in _TOKEN.findall(query or '')][:MAX_SEARCH_TERMS]
+
+
+FEE_BANDS = [
+    ('under-25', None, Decimal('25')),
+    ('25-50', Decimal('25'), Decimal('50')),
+    ('50-100', Decimal('50'), Decimal('100')),
+    ('100-200', Decimal('100'), Decimal('200')),
+    ('200-plus', Decimal('200'), None),
+]
+RATING_BANDS = [
+    ('4.5-plus', Decimal('4.5'), None),
+    ('4-4.5', Decimal('4'), Decimal('4.5')),
+    ('3-4', Decimal('3'), Decimal('4')),
+    ('under-3', None, Decimal('3')),
+]
+BANDS = {'fee_band': ('consultation_fee', FEE_BANDS), 'rating_band': ('rating', RATING_BANDS)}
+
+
+def band_q(field, low, high):
+    """Rows with ``low <= field < high``; either bound may be open"""
+    q = Q(**{f'{field}__isnull': False})
+    if low is not None:
+        q &= Q(**{f'{field}__gte': low})
+    if high is not None:
+        q &= Q(**{f'{field}__lt': high})
+    return q
+
+
+def parse_search_filters(params):
+    """Clean facet filters from request parameters"""
+    filters = {}
+    for key in ('specialization', 'org_type', 'org_name', 'language'):
+        value = (params.get(key) or '').strip()
+        if value:
+            filters[key] = value
+    if params.get('on_duty') in ('true', '1', 'on'):
+        filters['on_duty'] = True
+    if (params.get('organization') or '').isdigit():
+        filters['organization'] = int(params['organization'])
+    for key, (_, bands) in BANDS.items():
+        if params.get(key) in {name for name, _, _ in bands}:
+            filters[key] = params[key]
+    for key in ('min_fee', 'max_fee', 'min_rating'):
+        try:
+            value = Decimal(params.get(key))
+        except (TypeError, InvalidOperation):
+            continue
+        if value.is_finite() and value >= 0:
+            filters[key] = value
+    return filters
+
+
+def filter_params(filters):
+    """Filters back as request parameters, which ``parse_search_filters`` round-trips"""
+    return {key: 'true' if value is True else str(value) for key, value in filters.items()}
+
+
+def filter_q(key, value):
+    """The Q object for one parsed filter"""
+    if key in BANDS:
+        field, bands = BANDS[key]
+        low, high = next((low, high) for name, low, high in bands if name == value)
+        return band_q(field, low, high)
+    return {
+        'specialization': lambda: Q(specialization__iexact=value),
+        'org_type': lambda: Q(org_type=value),
+        'org_name': lambda: Q(organization_name__icontains=value),
+        'organization': lambda: Q(organization_id=value),
+        'language': lambda: Q(languages__contains=[value]),
+        'on_duty': lambda: Q(on_duty=True),
+        'min_fee': lambda: Q(consultation_fee__gte=value),
+        'max_fee': lambda: Q(consultation_fee__lte=value),
+        'min_rating': lambda: Q(rating__gte=value),
+    }[key]()
+
+
+def apply_search_filters(queryset, filters):
+    for key, value in filters.items():
+        queryset = queryset.filter(filter_q(key, value))
+    return queryset
+
+
+def prefix_query(terms):
+    return SearchQuery(' & '.join(f"{term}:*" for term in terms), search_type='raw', config=SEARCH_CONFIG)
+
+
+def match_documents(queryset, terms):
+    """Documents matching every term as a prefix, or the whole query by trigram similarity"""
+    return queryset.filter(
+        Q(search_vector=prefix_query(terms)) | Q(document__trigram_word_similar=' '.join(terms))
+    )
+
+
+def search_doctors(query='', filters=None, limit=DEFAULT_SEARCH_LIMIT):
+    """
+    Ranked doctor search documents for a free-text query and facet filters.
+
+    Every term is matched as a prefix against the weighted search vector;
+    documents that miss (usually typos) can still match by trigram word
+    similarity. Without a query, doctors on duty and best rated come first.
+    """
+    queryset = apply_search_filters(
+        DoctorSearchDocument.objects.filter(is_active=True), filters or {},
+    ).select_related('user', 'organization')
+    limit = max(1, min(limit, MAX_SEARCH_LIMIT))
+
+    terms = search_terms(query)
+    if not terms:
+        return queryset.order_by('-on_duty', F('rating').desc(nulls_last=True), 'full_name')[:limit]
+
+    tsquery = prefix_query(terms)
+    return (
+        match_documents(queryset, terms)
+        .annotate(rank=Greatest(
+            SearchRank(F('search_vector'), tsquery),
+            TrigramWordSimilarity(' '.join(terms), 'document'),
+        ))
+        .order_by('-rank', F('rating').desc(nulls_last=True), 'user_id')[:limit]
+    )
+
+
+@refresher('doctor-search')
+def refresh_search(query, params, limit):
+    return list(search_doctors(query, parse_search_filters(params), limit))
+
+
+def cached_search_doctors(query='', filters=None, limit=DEFAULT_SEARCH_LIMIT):
+    """``search_doctors`` as a list, cached until the next search document write"""
+    params = filter_params(filters or {})
+    signature = filter_signature(q=' '.join(search_terms(query)), limit=limit, **params)
+    key = versioned_key('doctor-search', [DOCTOR_DIRECTORY], signature)
+    return cache_aside(
+        key, lambda: list(search_doctors(query, filters, limit)), SEARCH_CACHE_TIMEOUT,
+        refresh=('doctor-search', [query, params, limit]),
+    )
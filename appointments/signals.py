@@ -1,9 +1,102 @@
-from django.db.models.signals import post_save
+import logging
+import threading
+from contextlib import contextmanager
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
 from django.dispatch import receiver
 from django.contrib.auth.models import User
 from allauth.socialaccount.signals import pre_social_login
 from allauth.account.signals import user_signed_up
-from .models import UserProfile
+from .cache_versions import (
+    DOCTOR_DIRECTORY, ORGANIZATION_DIRECTORY, appointment_namespaces, bump, bump_on_commit, organization_namespace,
+    profile_namespace,
+)
+from .geocoding import geocoding_enabled
+from .lookups import forget_doctor, forget_doctors, forget_organization
+from .outbox import DELETED, changed_fields, event_type_for, record_event
+from .models import (
+    ADDRESS_FIELDS, Appointment, AppointmentTombstone, DoctorSearchDocument, Organization, Payment, UserProfile,
+    next_change_seq,
+)
+from .rollups import appointment_cell, previous_cell, queue_rollup_refresh
+from .search import doctor_profiles, index_doctors, remove_doctor_documents, sync_doctor_document
+
+logger = logging.getLogger(__name__)
+
+SEARCH_ORGANIZATION_FIELDS = {'name', 'org_type'}
+APPOINTMENT_SEARCH_USER_FIELDS = {'first_name', 'last_name', 'email'}
+CARD_USER_FIELDS = {'first_name', 'last_name', 'username'}
+# User fields copied into DoctorSearchDocument
+SEARCH_USER_FIELDS = {'first_name', 'last_name', 'username', 'is_active'}
+# Profile fields DoctorSearchDocument is built from, plus the role that decides whether there is one
+SEARCH_PROFILE_FIELDS = {
+    'role', 'user', 'user_id', 'organization', 'organization_id', 'specialization', 'qualification', 'bio',
+    'languages', 'on_duty', 'consultation_fee', 'rating',
+}
+# What django.contrib.auth and allauth write on every login
+LOGIN_FIELDS = {'last_login'}
+# Whose calendars an appointment appears on
+CALENDAR_AUDIENCE_FIELDS = ('patient_id', 'doctor_id', 'organization_id')
+
+_suppressed = threading.local()
+
+@contextmanager
+def suppress_profile_signals():
+    """
+    Skip per-row search, card and appointment-search syncing for users and
+    profiles saved inside the block (imports, seeding), then sync every
+    touched user once on exit. Profile creation and profile write-back
+    still run.
+    """
+    outer = getattr(_suppressed, 'user_ids', None)
+    _suppressed.user_ids = set() if outer is None else outer
+    try:
+        yield
+    finally:
+        if outer is None:
+            user_ids, _suppressed.user_ids = _suppressed.user_ids, None
+            sync_users(user_ids)
+
+def _defer_while_suppressed(user_id):
+    """True (and the user remembered for the bulk sync) inside suppress_profile_signals"""
+    user_ids = getattr(_suppressed, 'user_ids', None)
+    if user_ids is None:
+        return False
+    user_ids.add(user_id)
+    return True
+
+def sync_users(user_ids):
+    """Bring search documents, doctor cards and appointment search text up to date for users in bulk"""
+    user_ids = set(user_ids)
+    if not user_ids:
+        return
+    doctors = list(doctor_profiles().filter(user_id__in=user_ids))
+    index_doctors(doctors)
+    remove_doctor_documents(
+        DoctorSearchDocument.objects.filter(user_id__in=user_ids).exclude(
+            user_id__in=[profile.user_id for profile in doctors]
+        )
+    )
+    forget_doctors(user_ids)
+    # Only users with appointments have search text to refresh
+    with_appointments = set(
+        Appointment.objects.filter(patient_id__in=user_ids).values_list('patient_id', flat=True).distinct()
+    ) | set(
+        Appointment.objects.filter(doctor_id__in=user_ids).values_list('doctor_id', flat=True).distinct()
+    )
+    if not with_appointments:
+        return
+
+    def enqueue():
+        from .tasks import refresh_user_appointment_search
+        for user_id in with_appointments:
+            try:
+                refresh_user_appointment_search.delay(user_id)
+            except Exception as e:
+                logger.error(f"Failed to queue appointment search refresh for user {user_id}: {e}")
+
+    transaction.on_commit(enqueue)
 
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
@@ -15,10 +108,17 @@ def create_user_profile(sender, instance, created, **kwargs):
         )
 
 @receiver(post_save, sender=User)
-def save_user_profile(sender, instance, **kwargs):
-    """Save UserProfile when User is saved"""
-    if hasattr(instance, 'profile'):
-        instance.profile.save()
+def save_user_profile(sender, instance, created, update_fields=None, **kwargs):
+    """Write back changes made through ``user.profile``; nothing to do if it was never loaded or is unchanged"""
+    if created or (update_fields is not None and set(update_fields) <= LOGIN_FIELDS):
+        return
+    if not User.profile.is_cached(instance):
+        return
+    try:
+        profile = instance.profile
+    except UserProfile.DoesNotExist:
+        return
+    profile.save_if_changed()
 
 @receiver(user_signed_up)
 def user_signed_up_handler(request, user, **kwargs):
@@ -37,11 +137,15 @@ def user_signed_up_handler(request, user, **kwargs):
             
             # Update profile with Google data
             if social_account.provider == 'google':
+                changed = []
                 if not user.first_name and extra_data.get('given_name'):
                     user.first_name = extra_data.get('given_name')
+                    changed.append('first_name')
                 if not user.last_name and extra_data.get('family_name'):
                     user.last_name = extra_data.get('family_name')
-                user.save()
+                    changed.append('last_name')
+                if changed:
+                    user.save(update_fields=changed)
 
 @receiver(pre_social_login)
 def pre_social_login_handler(request, sociallogin, **kwargs):
@@ -56,4 +160,195 @@ def pre_social_login_handler(request, sociallogin, **kwargs):
                     # Link the social account to existing user
                     sociallogin.connect(request, existing_user)
             except User.DoesNotExist:
-                pass
\ No newline at end of file
+                pass
+
+@receiver(post_save, sender=Organization)
+def queue_organization_geocode(sender, instance, update_fields=None, **kwargs):
+    """Geocode unverified organizations in the background, never in the request"""
+    if instance.is_location_verified or not instance.address or not geocoding_enabled():
+        return
+    if update_fields is not None and not set(ADDRESS_FIELDS) & set(update_fields):
+        return
+
+    def enqueue():
+        from .tasks import geocode_organization
+        try:
+            geocode_organization.delay(instance.id)
+        except Exception as e:
+            logger.error(f"Failed to queue geocoding for organization {instance.id}: {e}")
+
+    transaction.on_commit(enqueue)
+
+@receiver(post_save, sender=UserProfile)
+def update_doctor_search_from_profile(sender, instance, update_fields=None, **kwargs):
+    """Index doctors on profile save"""
+    if update_fields is not None and not SEARCH_PROFILE_FIELDS & set(update_fields):
+        return
+    if _defer_while_suppressed(instance.user_id):
+        return
+    if instance.role == 'doctor':
+        index_doctors([instance])
+    else:
+        remove_doctor_documents(DoctorSearchDocument.objects.filter(user_id=instance.user_id))
+
+@receiver(post_save, sender=Organization)
+def update_doctor_search_from_organization(sender, instance, created, update_fields=None, **kwargs):
+    """Reindex an organization's doctors when its name or type changes"""
+    if created:
+        return
+    if update_fields is not None and not SEARCH_ORGANIZATION_FIELDS & set(update_fields):
+        return
+    index_doctors(doctor_profiles().filter(organization=instance))
+
+@receiver(post_save, sender=Organization)
+@receiver(post_delete, sender=Organization)
+def bump_organization_namespaces(sender, instance, **kwargs):
+    """Clinic details show up on clinic and doctor map tiles, search results and dashboards"""
+    bump_on_commit({organization_namespace(instance.id), ORGANIZATION_DIRECTORY, DOCTOR_DIRECTORY})
+
+@receiver(post_save, sender=Organization)
+@receiver(post_delete, sender=Organization)
+def forget_organization_card(sender, instance, **kwargs):
+    forget_organization(instance.id)
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=UserProfile)
+def forget_doctor_card(sender, instance, update_fields=None, **kwargs):
+    """Doctor cards show the user's name and the profile's public fields"""
+    if _defer_while_suppressed(instance.id if sender is User else instance.user_id):
+        return
+    if sender is User:
+        if update_fields is None or CARD_USER_FIELDS & set(update_fields):
+            forget_doctor(instance.id)
+        return
+    forget_doctor(instance.user_id)
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def bump_profile_namespace(sender, instance, **kwargs):
+    """Retire the cached role/organization context (appointments/user_context.py)"""
+    # Now, so this transaction's own reads miss, and after commit, so nothing
+    # cached from the old row in between survives
+    namespace = profile_namespace(instance.user_id)
+    bump(namespace)
+    bump_on_commit({namespace})
+
+@receiver(pre_delete, sender=Organization)
+def bump_member_profile_namespaces(sender, instance, **kwargs):
+    """Deleting an organization clears its members' profiles with a bulk update that sends no signals"""
+    namespaces = {profile_namespace(user_id) for user_id in instance.members.values_list('user_id', flat=True)}
+    if namespaces:
+        bump(*namespaces)
+        bump_on_commit(namespaces)
+
+@receiver(post_save, sender=User)
+def update_doctor_search_from_user(sender, instance, created, update_fields=None, **kwargs):
+    """Doctor documents carry the user's name and active flag; resync when they no longer match"""
+    if created:
+        return
+    if update_fields is not None and not SEARCH_USER_FIELDS & set(update_fields):
+        return
+    if _defer_while_suppressed(instance.id):
+        return
+    document = DoctorSearchDocument.objects.filter(user_id=instance.id).only('full_name', 'is_active').first()
+    if document is None:
+        return
+    if (document.full_name, document.is_active) != (instance.get_full_name() or instance.username, instance.is_active):
+        sync_doctor_document(instance.id)
+
+@receiver(post_save, sender=User)
+def queue_appointment_search_refresh(sender, instance, created, update_fields=None, **kwargs):
+    """Names and emails are denormalized into Appointment.search_text; refresh them in the background"""
+    if created:
+        return
+    if update_fields is not None and not APPOINTMENT_SEARCH_USER_FIELDS & set(update_fields):
+        return
+    if _defer_while_suppressed(instance.id):
+        return
+
+    def enqueue():
+        from .tasks import refresh_user_appointment_search
+        try:
+            refresh_user_appointment_search.delay(instance.id)
+        except Exception as e:
+            logger.error(f"Failed to queue appointment search refresh for user {instance.id}: {e}")
+
+    transaction.on_commit(enqueue)
+
+@receiver(post_save, sender=Appointment)
+def refresh_rollups_on_appointment_save(sender, instance, **kwargs):
+    """Recompute the rollup cells an appointment left and entered"""
+    queue_rollup_refresh({appointment_cell(instance), previous_cell(instance)})
+
+@receiver(post_delete, sender=Appointment)
+def refresh_rollups_on_appointment_delete(sender, instance, **kwargs):
+    queue_rollup_refresh({appointment_cell(instance), previous_cell(instance)})
+
+@receiver(post_save, sender=Payment)
+@receiver(post_delete, sender=Payment)
+def refresh_rollups_on_payment_change(sender, instance, **kwargs):
+    """Paid totals live on the appointment's cell"""
+    if instance.appointment_id is None:
+        return
+    appointment = Appointment.objects.filter(pk=instance.appointment_id).only(
+        'organization_id', 'doctor_id', 'appointment_date'
+    ).first()
+    if appointment is not None:
+        queue_rollup_refresh({appointment_cell(appointment)})
+
+@receiver(post_save, sender=Appointment)
+@receiver(post_delete, sender=Appointment)
+@receiver(post_save, sender=Payment)
+@receiver(post_delete, sender=Payment)
+def bump_appointment_namespaces(sender, instance, **kwargs):
+    """Retire cached dashboards and analytics for the organization, doctor and patient involved"""
+    # Registered after the rollup receivers so the bump runs after their refresh commits
+    bump_on_commit(appointment_namespaces(instance))
+
+@receiver(post_delete, sender=Appointment)
+def record_deleted_appointment(sender, instance, **kwargs):
+    """Leave a tombstone so calendar sync tells clients to drop the event"""
+    AppointmentTombstone.objects.create(
+        appointment_id=instance.id,
+        change_seq=next_change_seq(instance._state.db or 'default'),
+        **{field: getattr(instance, field) for field in CALENDAR_AUDIENCE_FIELDS},
+    )
+
+@receiver(post_save, sender=Appointment)
+def record_moved_appointment(sender, instance, created, **kwargs):
+    """An appointment given to another doctor, patient or organization leaves their old calendars"""
+    previous = getattr(instance, '_loaded_values', None)
+    if created or not previous:
+        return
+    audience = {field: previous[field] for field in CALENDAR_AUDIENCE_FIELDS if field in previous}
+    if all(value == getattr(instance, field) for field, value in audience.items()):
+        return
+    AppointmentTombstone.objects.create(appointment_id=instance.id, change_seq=instance.change_seq, **audience)
+
+@receiver(post_save, sender=Appointment)
+def record_appointment_event(sender, instance, created, raw=False, **kwargs):
+    """Queue the change for the outbox relay, in the transaction Appointment.save opened"""
+    if raw:
+        return
+    loaded_values = getattr(instance, '_loaded_values', None) or {}
+    previous_status = loaded_values.get('status')
+    changed = [] if created else changed_fields(instance, loaded_values)
+    record_event(instance, event_type_for(instance, created, previous_status), previous_status, changed=changed)
+
+@receiver(post_delete, sender=Appointment)
+def record_appointment_deleted_event(sender, instance, **kwargs):
+    """Deletes run in the collector's transaction, so the event commits with them"""
+    record_event(instance, DELETED, instance.status)
+
+@receiver(post_save, sender=Appointment)
+def remember_saved_values(sender, instance, **kwargs):
+    """Registered last: the receivers above compare against the values as previously saved"""
+    instance._loaded_values = {
+        'organization_id': instance.organization_id,
+        'doctor_id': instance.doctor_id,
+        'patient_id': instance.patient_id,
+        'appointment_date': instance.appointment_date,
+        'status': instance.status,
+        'notes': instance.notes,
+        'patient_notes': instance.patient_notes,
+    }
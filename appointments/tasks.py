@@ -4,9 +4,11 @@ from django.conf import settings
 from django.template.loader import render_to_string
 from django.utils import timezone
 from datetime import timedelta
+from collections import defaultdict
 import logging
 
 from .models import Appointment, UserProfile
+from .query_budget import query_budget
 from notifications.signals import notify
 # from .utils import send_sms  # Removed Twilio
 
@@ -144,52 +146,53 @@ def cleanup_old_notifications():
         logger.error(f"Error cleaning up old notifications: {str(e)}")
 
 @shared_task
+@query_budget(5)
 def send_daily_appointment_summary():
     """Send daily appointment summary to doctors"""
     try:
         today = timezone.now().date()
         tomorrow = today + timedelta(days=1)
         
-        # Get all doctors
-        doctors = UserProfile.objects.filter(role='doctor')
-        
-        for doctor_profile in doctors:
-            doctor = doctor_profile.user
-            appointments = Appointment.objects.filter(
-                doctor=doctor,
-                appointment_date__date=tomorrow,
-                status='confirmed'
-            ).order_by('appointment_date')
+        # Tomorrow's confirmed appointments for all doctors in one query, grouped by doctor
+        appointments_by_doctor = defaultdict(list)
+        appointments = Appointment.objects.filter(
+            doctor__profile__role='doctor',
+            appointment_date__date=tomorrow,
+            status='confirmed'
+        ).select_related('doctor', 'patient').order_by('appointment_date')
+        for appointment in appointments:
+            appointments_by_doctor[appointment.doctor_id].append(appointment)
+        
+        for doctor_appointments in appointments_by_doctor.values():
+            doctor = doctor_appointments[0].doctor
+            subject = f"Tomorrow's Appointments - {tomorrow.strftime('%B %d, %Y')}"
+            message = f"""
+            Dear Dr. {doctor.get_full_name()},
+            
+            Here are your appointments for tomorrow ({tomorrow.strftime('%B %d, %Y')}):
+            
+            """
             
-            if appointments.exists():
-                subject = f"Tomorrow's Appointments - {tomorrow.strftime('%B %d, %Y')}"
-                message = f"""
-                Dear Dr. {doctor.get_full_name()},
-                
-                Here are your appointments for tomorrow ({tomorrow.strftime('%B %d, %Y')}):
-                
-                """
-                
-                for appointment in appointments:
-                    message += f"""
-                - {appointment.appointment_date.strftime('%I:%M %p')} - {appointment.patient.get_full_name()}
-                  Type: {appointment.get_appointment_type_display()}
-                  Fee: ${appointment.fee}
-                """
-                
-                message += """
-                
-                Best regards,
-                PulseCal Team
-                """
-                
-                send_mail(
-                    subject=subject,
-                    message=message,
-                    from_email=settings.DEFAULT_FROM_EMAIL,
-                    recipient_list=[doctor.email],
-                    fail_silently=False,
-                )
+            for appointment in doctor_appointments:
+                message += f"""
+            - {appointment.appointment_date.strftime('%I:%M %p')} - {appointment.patient.get_full_name()}
+              Type: {appointment.get_appointment_type_display()}
+              Fee: ${appointment.fee}
+            """
+            
+            message += """
+            
+            Best regards,
+            PulseCal Team
+            """
+            
+            send_mail(
+                subject=subject,
+                message=message,
+                from_email=settings.DEFAULT_FROM_EMAIL,
+                recipient_list=[doctor.email],
+                fail_silently=False,
+            )
         
         logger.info("Daily appointment summaries sent to doctors")
         
@@ -197,33 +200,195 @@ def send_daily_appointment_summary():
         logger.error(f"Error sending daily appointment summaries: {str(e)}")
 
 @shared_task
+@query_budget(5)
 def update_doctor_availability():
     """Update doctor availability status based on current time"""
+    from django.db.models import Max
     try:
         now = timezone.now()
         
         # Get doctors who are on duty
-        on_duty_doctors = UserProfile.objects.filter(role='doctor', on_duty=True)
+        on_duty_doctors = list(UserProfile.objects.filter(role='doctor', on_duty=True).only('id', 'user_id'))
         
-        for doctor_profile in on_duty_doctors:
-            # Check if doctor has appointments within the next 2 hours
-            upcoming_appointments = Appointment.objects.filter(
-                doctor=doctor_profile.user,
+        # Latest confirmed appointment within the next 2 hours, per doctor, in one query
+        last_appointments = dict(
+            Appointment.objects.filter(
+                doctor__profile__role='doctor',
+                doctor__profile__on_duty=True,
                 appointment_date__gte=now,
                 appointment_date__lte=now + timedelta(hours=2),
                 status='confirmed'
-            )
-            
-            # Update next available time
-            if upcoming_appointments.exists():
-                last_appointment = upcoming_appointments.order_by('-appointment_date').first()
-                doctor_profile.next_available = last_appointment.appointment_date + timedelta(minutes=30)
-            else:
-                doctor_profile.next_available = now
-            
-            doctor_profile.save()
+            ).values('doctor_id').annotate(last=Max('appointment_date')).values_list('doctor_id', 'last')
+        )
+        
+        for doctor_profile in on_duty_doctors:
+            last_appointment = last_appointments.get(doctor_profile.user_id)
+            doctor_profile.next_available = last_appointment + timedelta(minutes=30) if last_appointment else now
+        
+        # next_available feeds no search document, card or cached context, so skipping signals is safe
+        UserProfile.objects.bulk_update(on_duty_doctors, ['next_available'], batch_size=500)
         
         logger.info("Doctor availability updated")
         
     except Exception as e:
-        logger.error(f"Error updating doctor availability: {str(e)}") 
\ No newline at end of file
+        logger.error(f"Error updating doctor availability: {str(e)}") 
+
+@shared_task
+def geocode_organization(organization_id):
+    """Geocode a single organization after its address changes"""
+    from .geocoding import geocode_organizations, unverified_organizations
+    try:
+        stats = geocode_organizations(unverified_organizations().filter(id=organization_id))
+        logger.info(f"Geocoded organization {organization_id}: {stats}")
+    except Exception as e:
+        logger.error(f"Error geocoding organization {organization_id}: {str(e)}")
+
+@shared_task
+def geocode_unverified_organizations(batch_size=None, after_id=0):
+    """Geocode unverified organizations in id order, chaining one batch at a time"""
+    from .geocoding import geocode_organizations, unverified_organizations
+    batch_size = batch_size or settings.GEOCODING_BATCH_SIZE
+    try:
+        batch = list(unverified_organizations().filter(id__gt=after_id).order_by('id')[:batch_size])
+        if not batch:
+            return
+        stats = geocode_organizations(batch)
+        logger.info(f"Geocoded organizations after id {after_id}: {stats}")
+        if len(batch) == batch_size:
+            geocode_unverified_organizations.delay(batch_size, batch[-1].id)
+    except Exception as e:
+        logger.error(f"Error geocoding unverified organizations: {str(e)}")
+
+@shared_task
+def warm_upcoming_travel_estimates(hours=48):
+    """Precompute travel estimates for patients with appointments in the next ``hours``"""
+    from .directions import remembered_origins, warm_estimates
+    try:
+        now = timezone.now()
+        appointments = list(
+            Appointment.objects.filter(
+                appointment_date__gte=now,
+                appointment_date__lte=now + timedelta(hours=hours),
+                organization__latitude__isnull=False,
+                organization__longitude__isnull=False,
+                status__in=['pending', 'confirmed'],
+            ).select_related('organization')
+        )
+        origins = remembered_origins({appointment.patient_id for appointment in appointments})
+        pairs = {
+            (origins[appointment.patient_id], appointment.organization_id): appointment.organization
+            for appointment in appointments
+            if appointment.patient_id in origins
+        }
+        stored = warm_estimates([(cell, organization) for (cell, _), organization in pairs.items()])
+        logger.info(f"Warmed {stored} travel estimates for {len(appointments)} upcoming appointments")
+    except Exception as e:
+        logger.error(f"Error warming travel estimates: {str(e)}")
+
+@shared_task
+def refresh_user_appointment_search(user_id, batch_size=1000):
+    """Rebuild appointment search text after a patient or doctor changes name or email"""
+    from django.db.models import Q
+    from .appointment_search import refresh_search_text
+    try:
+        appointments = Appointment.objects.filter(Q(patient_id=user_id) | Q(doctor_id=user_id))
+        after_id, updated = 0, 0
+        while True:
+            batch = list(
+                appointments.filter(id__gt=after_id).select_related('patient', 'doctor').order_by('id')[:batch_size]
+            )
+            if not batch:
+                break
+            updated += refresh_search_text(batch)
+            after_id = batch[-1].id
+        logger.info(f"Refreshed search text for {updated} appointments of user {user_id}")
+    except Exception as e:
+        logger.error(f"Error refreshing appointment search for user {user_id}: {str(e)}")
+
+@shared_task
+def rebuild_recent_rollups(days=3):
+    """Re-aggregate recent analytics rollups, catching bulk updates that bypass signals"""
+    from .rollups import rebuild_rollups
+    try:
+        today = timezone.localdate()
+        written = rebuild_rollups(today - timedelta(days=days), today + timedelta(days=days))
+        logger.info(f"Rebuilt {written} rollup rows around {today}")
+    except Exception as e:
+        logger.error(f"Error rebuilding analytics rollups: {str(e)}")
+
+@shared_task
+def refresh_cache_entry(name, key, args, timeout, stale_timeout, token=None):
+    """Recompute a stale cached value in the background while readers keep the old one"""
+    from .cache_aside import refresh_entry
+    try:
+        refresh_entry(name, key, args, timeout, stale_timeout, token)
+    except Exception as e:
+        logger.error(f"Error refreshing cache entry {key} with {name}: {str(e)}")
+
+@shared_task
+def prune_calendar_tombstones():
+    """Drop calendar sync tombstones older than any sync token still accepted"""
+    from .calendar_feed import prune_tombstones
+    try:
+        deleted = prune_tombstones()
+        logger.info(f"Pruned {deleted} calendar tombstones")
+    except Exception as e:
+        logger.error(f"Error pruning calendar tombstones: {str(e)}")
+
+@shared_task
+def sync_google_calendar(link_id):
+    """Pull calendar edits and push appointment changes for one connected Google Calendar"""
+    from .cache_aside import acquire_lock, release_lock
+    from .google_calendar import CalendarSync
+    from .models import GoogleCalendarLink
+    lock_key = f"google-calendar:sync:{link_id}"
+    token = acquire_lock(lock_key, settings.GOOGLE_CALENDAR_LOCK_TIMEOUT)
+    if token is None:
+        logger.info(f"Google Calendar sync for link {link_id} is already running")
+        return
+    try:
+        link = GoogleCalendarLink.objects.select_related('user').get(pk=link_id)
+        stats = CalendarSync(link).run()
+        logger.info(f"Synced Google Calendar link {link_id}: {stats}")
+    except GoogleCalendarLink.DoesNotExist:
+        logger.info(f"Google Calendar link {link_id} no longer exists")
+    except Exception as e:
+        logger.error(f"Error syncing Google Calendar link {link_id}: {str(e)}")
+        GoogleCalendarLink.objects.filter(pk=link_id).update(last_error=str(e)[:1000])
+    finally:
+        # Only if this run still holds it; an expired lock may belong to the next sync by now
+        release_lock(lock_key, token)
+
+@shared_task
+def queue_google_calendar_syncs():
+    """Queue a sync for every connected Google Calendar"""
+    from .models import GoogleCalendarLink
+    try:
+        link_ids = list(GoogleCalendarLink.objects.exclude(credentials={}).values_list('id', flat=True))
+        for link_id in link_ids:
+            sync_google_calendar.delay(link_id)
+        logger.info(f"Queued {len(link_ids)} Google Calendar syncs")
+    except Exception as e:
+        logger.error(f"Error queueing Google Calendar syncs: {str(e)}")
+
+@shared_task
+def relay_outbox_events():
+    """Backstop for the relay_outbox command: deliver any outbox events that are due"""
+    from .outbox import relay_pending
+    try:
+        # Bounded so the task finishes well inside the realtime queue's time limit
+        relayed = relay_pending(max_batches=20)
+        if relayed:
+            logger.info(f"Relayed {relayed} outbox events")
+    except Exception as e:
+        logger.error(f"Error relaying outbox events: {str(e)}")
+
+@shared_task
+def prune_outbox_events():
+    """Drop relayed outbox events past their retention period"""
+    from .outbox import prune_events
+    try:
+        deleted = prune_events()
+        logger.info(f"Pruned {deleted} outbox events")
+    except Exception as e:
+        logger.error(f"Error pruning outbox events: {str(e)}")
@@ -0,0 +1,60 @@
+from unittest import mock
+
+import pytest
+from django.contrib import admin
+from django.core.cache import cache
+from django.test import RequestFactory
+
+from .factories import AppointmentFactory, UserFactory
+from .models import Appointment
+from .pagination import EstimatedCountPaginator, estimated_count
+from .query_budget import enforce_query_budget
+
+
+def changelist(model, **params):
+    request = RequestFactory().get('/', params)
+    request.user = UserFactory(is_staff=True, is_superuser=True)
+    return admin.site._registry[model].get_changelist_instance(request)
+
+
+@pytest.mark.django_db
+class TestEstimatedCount:
+    """Test that large tables use the planner's estimate and small ones an exact count"""
+
+    def setup_method(self):
+        cache.clear()
+
+    def test_small_tables_are_counted(self):
+        AppointmentFactory.create_batch(3)
+        with mock.patch('appointments.pagination.table_estimate', return_value=3):
+            assert estimated_count(Appointment.objects.all(), threshold=10) == 3
+
+    def test_large_tables_are_estimated(self):
+        AppointmentFactory.create_batch(3)
+        with mock.patch('appointments.pagination.table_estimate', return_value=5000000):
+            paginator = EstimatedCountPaginator(Appointment.objects.order_by('id'), 2)
+            assert paginator.count == 5000000
+            assert len(paginator.page(1).object_list) == 2
+
+    def test_filtered_querysets_use_the_plan_estimate(self):
+        with mock.patch('appointments.pagination.planner_estimate', return_value=250000) as planner:
+            assert estimated_count(Appointment.objects.filter(status='pending'), threshold=1000) == 250000
+        planner.assert_called_once()
+
+
+@pytest.mark.django_db
+class TestAppointmentAdmin:
+    """Test the appointment changelist's query shape"""
+
+    def test_changelist_rows_need_no_extra_queries(self):
+        AppointmentFactory.create_batch(10)
+        cl = changelist(Appointment)
+        assert not cl.show_full_result_count and cl.model_admin.date_hierarchy is None
+        with enforce_query_budget(1):
+            [(str(row.patient), str(row.doctor)) for row in cl.result_list]
+
+    def test_search_uses_search_text(self):
+        match = AppointmentFactory(notes='Follow up on MRI')
+        AppointmentFactory(notes='Routine')
+        cl = changelist(Appointment, q='mri')
+        assert [row.id for row in cl.result_list] == [match.id]
@@ -0,0 +1,86 @@
+import pytest
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from .analytics import (
+    HOUR_OF_DAY_MAX_DAYS, SeriesError, SeriesScope, bucket_range, build_series, cached_series, hour_of_day_counts,
+)
+from .models import Appointment
+from .rollups import rebuild_rollups
+from .factories import AppointmentFactory, OrganizationFactory, UserFactory
+
+
+def at(day, hour=10):
+    return timezone.make_aware(datetime.combine(day, datetime.min.time()) + timedelta(hours=hour))
+
+
+class TestBuckets:
+    """Test bucket alignment and validation"""
+
+    def test_month_range_crosses_year(self):
+        assert bucket_range(date(2024, 11, 1), date(2025, 2, 1), 'month') == [
+            date(2024, 11, 1), date(2024, 12, 1), date(2025, 1, 1), date(2025, 2, 1),
+        ]
+
+    def test_invalid_parameters(self):
+        scope = SeriesScope()
+        with pytest.raises(SeriesError):
+            build_series('bogus', 'day', date(2025, 1, 1), date(2025, 1, 2), scope)
+        with pytest.raises(SeriesError):
+            build_series('appointments', 'hour', date(2020, 1, 1), date(2025, 1, 1), scope)
+
+
+@pytest.mark.django_db
+class TestSeries:
+    """Test gap-filled series from rollups and live appointments"""
+
+    def setup_method(self):
+        cache.clear()
+        self.clinic = OrganizationFactory(is_location_verified=True)
+        self.doctor = UserFactory()
+        self.start = date(2025, 3, 3)  # a Monday
+        for offset, status, hour in ((0, 'completed', 9), (0, 'pending', 9), (2, 'completed', 14), (9, 'completed', 9)):
+            AppointmentFactory(doctor=self.doctor, organization=self.clinic, status=status, fee=Decimal('25'),
+                               appointment_date=at(self.start + timedelta(days=offset), hour))
+        rebuild_rollups(self.start, self.start + timedelta(days=13))
+        self.scope = SeriesScope(organization_id=self.clinic.id)
+
+    def test_daily_series_is_gap_filled(self):
+        series = build_series('appointments', 'day', self.start, self.start + timedelta(days=3), self.scope)
+        assert series['buckets'] == ['2025-03-03', '2025-03-04', '2025-03-05', '2025-03-06']
+        assert series['series'] == [{'key': None, 'label': 'Total', 'values': [2, 0, 1, 0]}]
+
+    def test_weekly_series_by_status(self):
+        series = build_series('fees', 'week', self.start, self.start + timedelta(days=13), self.scope, 'status')
+        assert series['buckets'] == ['2025-03-03', '2025-03-10']
+        by_key = {s['key']: s['values'] for s in series['series']}
+        assert by_key == {'completed': [50.0, 25.0], 'pending': [25.0, 0]}
+        assert {s['label'] for s in series['series']} == {'Completed', 'Pending'}
+
+    def test_hourly_series_reads_live_appointments(self):
+        series = build_series('appointments', 'hour', self.start, self.start, self.scope)
+        assert len(series['buckets']) == 24
+        assert series['series'][0]['values'][9] == 2
+
+    def test_hour_of_day_is_capped_to_the_end_of_long_ranges(self):
+        appointments = Appointment.objects.filter(organization=self.clinic)
+        counts, start = hour_of_day_counts(appointments, self.start, self.start + timedelta(days=13))
+        assert start == self.start and counts[9] == 3 and counts[14] == 1
+        end = self.start + timedelta(days=HOUR_OF_DAY_MAX_DAYS + 8)
+        counts, start = hour_of_day_counts(appointments, date(2000, 1, 1), end)
+        assert start == self.start + timedelta(days=9) and sum(counts) == 1
+
+    def test_cached_series_serves_etag_without_queries(self):
+        body, etag = cached_series('appointments', 'day', self.start, self.start, self.scope)
+        with CaptureQueriesContext(connection) as queries:
+            assert cached_series('appointments', 'day', self.start, self.start, self.scope) == (body, etag)
+        assert len(queries) == 0
+
+    def test_scope_for_patient_is_denied(self):
+        patient = UserFactory()
+        assert SeriesScope.for_user(patient) is None
@@ -0,0 +1,94 @@
+import pytest
+from datetime import timedelta
+
+from django.utils import timezone
+
+from .appointment_search import refresh_search_text, search_appointments
+from .models import Appointment
+from .pagination import InvalidCursor
+from .factories import AppointmentFactory, OrganizationFactory, make_member
+
+
+@pytest.mark.django_db
+class TestAppointmentSearch:
+    """Test the denormalized appointment search column, scoping and keyset paging"""
+
+    def setup_method(self):
+        self.clinic = OrganizationFactory()
+        self.receptionist = make_member('receptionist', self.clinic)
+        self.doctor = make_member('doctor', self.clinic, first_name='Meera', last_name='Shah')
+        self.patient = make_member('patient', first_name='Johnathan', last_name='Okafor')
+        self.start = timezone.now()
+
+    def book(self, minutes, **fields):
+        defaults = dict(patient=self.patient, doctor=self.doctor, organization=self.clinic,
+                        appointment_date=self.start + timedelta(minutes=minutes), notes='', reception_notes='',
+                        patient_notes='')
+        defaults.update(fields)
+        return AppointmentFactory(**defaults)
+
+    def test_search_text_is_denormalized_on_save(self):
+        appointment = self.book(0, notes='Bring X-Ray')
+        assert 'johnathan okafor' in appointment.search_text
+        assert 'meera shah' in appointment.search_text
+        assert appointment.search_text.endswith('bring x-ray')
+
+    def test_status_update_leaves_search_text_alone(self):
+        appointment = self.book(0)
+        Appointment.objects.filter(pk=appointment.pk).update(search_text='stale')
+        appointment.refresh_from_db()
+        appointment.status = 'confirmed'
+        appointment.save(update_fields=['status'])
+        appointment.refresh_from_db()
+        assert appointment.search_text == 'stale'
+
+    def test_full_save_only_rebuilds_search_text_when_a_source_changed(self):
+        appointment = Appointment.objects.get(pk=self.book(0, notes='Bring X-Ray').pk)
+        appointment.status = 'confirmed'
+        appointment.save()
+        assert not Appointment.patient.is_cached(appointment) and not Appointment.doctor.is_cached(appointment)
+
+        appointment.notes = 'Fasting'
+        appointment.save()
+        assert appointment.search_text.endswith('fasting')
+        appointment.notes = 'Bring scans'
+        appointment.save()
+        assert Appointment.objects.get(pk=appointment.pk).search_text.endswith('bring scans')
+
+    def test_name_fragment_search_is_scoped_to_organization(self):
+        mine = self.book(0)
+        AppointmentFactory(patient=self.patient, organization=OrganizationFactory())
+        results, next_cursor = search_appointments(self.receptionist, 'nathan')
+        assert results == [mine]
+        assert next_cursor is None
+        assert search_appointments(self.receptionist, 'nathan nobody')[0] == []
+
+    def test_reception_notes_are_searchable_by_staff_only(self):
+        appointment = self.book(0, reception_notes='Owes balance from March')
+        assert 'balance' not in appointment.search_text
+        assert search_appointments(self.receptionist, 'okafor balance')[0] == [appointment]
+        assert search_appointments(self.doctor, 'balance')[0] == [appointment]
+        assert search_appointments(self.patient, 'balance')[0] == []
+        assert search_appointments(self.patient, 'okafor')[0] == [appointment]
+
+    def test_keyset_paging_visits_every_row_once(self):
+        booked = [self.book(minutes) for minutes in (0, 30, 30, 60, 90)]
+        seen, cursor = [], None
+        while True:
+            page, cursor = search_appointments(self.receptionist, 'okafor', cursor=cursor, limit=2)
+            seen.extend(page)
+            if cursor is None:
+                break
+        assert sorted(a.id for a in seen) == sorted(a.id for a in booked)
+        assert [a.appointment_date for a in seen] == sorted((a.appointment_date for a in booked), reverse=True)
+
+    def test_invalid_cursor(self):
+        with pytest.raises(InvalidCursor):
+            search_appointments(self.receptionist, cursor='not-a-cursor')
+
+    def test_refresh_after_rename(self):
+        appointment = self.book(0)
+        self.patient.last_name = 'Mensah'
+        self.patient.save()
+        assert refresh_search_text(Appointment.objects.select_related('patient', 'doctor')) == 1
+        assert search_appointments(self.doctor, 'mensah')[0] == [appointment]
@@ -0,0 +1,75 @@
+import time
+from unittest import mock
+
+from django.core.cache import cache
+
+from .cache_aside import (
+    Entry, acquire_lock, cache_aside, cache_aside_many, refresh_entry, refresher, should_refresh, store,
+)
+
+
+@refresher('test-square')
+def square(value):
+    return value * value
+
+
+class TestCacheAside:
+    """Test single-flight fills, early refresh and stale-while-revalidate"""
+
+    def setup_method(self):
+        cache.clear()
+        self.calls = 0
+
+    def compute(self):
+        self.calls += 1
+        return self.calls
+
+    def test_miss_computes_once_then_hits(self):
+        assert cache_aside('k', self.compute, 60) == 1
+        assert cache_aside('k', self.compute, 60) == 1
+        assert self.calls == 1
+        assert isinstance(cache.get('k'), Entry)
+
+    def test_lock_loser_waits_then_falls_back(self):
+        acquire_lock('fill:k:1')
+        started = time.monotonic()
+        assert cache_aside('k', self.compute, 60, lock_wait=0.1) == 1
+        assert time.monotonic() - started >= 0.1
+
+    def test_lock_loser_gets_winners_value(self):
+        acquire_lock('fill:k:1')
+        with mock.patch('appointments.cache_aside._wait_for', return_value={'k': 'winner'}):
+            assert cache_aside('k', self.compute, 60) == 'winner'
+        assert self.calls == 0
+
+    def test_stale_value_served_while_refreshing_in_background(self):
+        cache.set('k', Entry('old', time.time() - 1, 0.0), 60)
+        with mock.patch('appointments.tasks.refresh_cache_entry.delay') as delay:
+            assert cache_aside('k', self.compute, 60, refresh=('test-square', [3])) == 'old'
+            assert cache_aside('k', self.compute, 60, refresh=('test-square', [3])) == 'old'
+        assert delay.call_count == 1
+        name, key, args, timeout, stale_timeout, token = delay.call_args[0]
+        refresh_entry(name, key, args, timeout, stale_timeout, token)
+        assert cache_aside('k', self.compute, 60) == 9
+        assert self.calls == 0
+
+    def test_stale_value_refreshed_inline_without_refresher(self):
+        cache.set('k', Entry('old', time.time() - 1, 0.0), 60)
+        assert cache_aside('k', self.compute, 60) == 1
+        assert cache.get('k').value == 1
+
+    def test_xfetch_refreshes_slow_values_early(self):
+        now = time.time()
+        assert not should_refresh(Entry(1, now + 60, 0.0), now)
+        assert should_refresh(Entry(1, now + 60, 1000.0), now, beta=1000.0)
+
+    def test_many_computes_only_missing_keys(self):
+        store('a', 'cached', 60)
+        computed = []
+
+        def compute_many(items):
+            computed.extend(items)
+            return {key: item * 2 for key, item in items.items()}
+
+        assert cache_aside_many({'a': 1, 'b': 2}, compute_many, 60) == {'a': 'cached', 'b': 4}
+        assert computed == ['b']
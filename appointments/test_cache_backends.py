@@ -0,0 +1,80 @@
+import pytest
+from unittest import mock
+
+from django.core.cache import caches
+
+from .cache_backends import BoundedLRU, TwoTierCache
+from .factories import OrganizationFactory
+from .lookups import organization_cards
+
+
+class TestBoundedLRU:
+    """Test the in-process tier's limits"""
+
+    def test_evicts_least_recently_used_over_byte_cap(self):
+        lru = BoundedLRU(max_entries=10, max_bytes=100)
+        lru.set('a', 1, None, 40)
+        lru.set('b', 2, None, 40)
+        lru.get('a')
+        lru.set('c', 3, None, 40)
+        assert 'a' in lru and 'c' in lru and 'b' not in lru
+        assert lru.bytes == 80
+
+    def test_expiry_and_oversized_values(self):
+        lru = BoundedLRU(max_entries=10, max_bytes=100)
+        lru.set('a', 1, 0, 10)
+        assert lru.get('a') is None
+        lru.set('b', 2, None, 500)
+        assert 'b' not in lru and lru.bytes == 0
+
+
+class TestTwoTierCache:
+    """Test local hits, write-through and invalidation"""
+
+    def setup_method(self):
+        caches['default'].clear()
+        self.cache = TwoTierCache('', {'OPTIONS': {'REMOTE': 'default', 'LOCAL_TIMEOUT': 30}, 'KEY_PREFIX': 't'})
+
+    def test_local_hit_skips_remote(self):
+        self.cache.set('k', {'v': 1})
+        with mock.patch.object(caches['default'], 'get', side_effect=AssertionError('remote read')):
+            assert self.cache.get('k') == {'v': 1}
+            assert self.cache.get_many(['k']) == {'k': {'v': 1}}
+
+    def test_remote_fill_and_delete(self):
+        other = TwoTierCache('', {'OPTIONS': {'REMOTE': 'default'}, 'KEY_PREFIX': 't'})
+        self.cache.set('k', 1)
+        assert other.get('k') == 1
+        self.cache.delete('k')
+        assert self.cache.get('k') is None
+        assert self.cache.add('k', 2) and not self.cache.add('k', 3)
+        assert self.cache.incr('k') == 3
+
+    def test_invalidation_messages_from_other_processes(self):
+        self.cache.set('k', 1)
+        made = self.cache.make_key('k')
+        self.cache._apply_invalidation(f"{self.cache.origin}|{made}".encode())
+        assert made in self.cache.local
+        self.cache._apply_invalidation(f"other|{made}".encode())
+        assert made not in self.cache.local
+        self.cache.set('j', 1)
+        self.cache._apply_invalidation(b'other|*')
+        assert len(self.cache.local) == 0
+
+
+@pytest.mark.django_db
+class TestHotLookups:
+    """Test clinic cards are cached and dropped on write"""
+
+    def setup_method(self):
+        caches['hot'].clear()
+        caches['default'].clear()
+
+    def test_cards_invalidate_on_save(self, django_assert_num_queries):
+        clinic = OrganizationFactory(is_location_verified=True, name='North')
+        assert organization_cards([clinic.id])[clinic.id]['name'] == 'North'
+        with django_assert_num_queries(0):
+            organization_cards([clinic.id])
+        clinic.name = 'South'
+        clinic.save()
+        assert organization_cards([clinic.id])[clinic.id]['name'] == 'South'
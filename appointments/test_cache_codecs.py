@@ -0,0 +1,118 @@
+import datetime
+import os
+import pickle
+import zlib
+from decimal import Decimal
+from unittest import mock
+
+import pytest
+from django_redis.cache import RedisCache
+from django_redis.client import DefaultClient
+from django_redis.exceptions import CompressorError
+
+from .cache_aside import Entry
+from .cache_codecs import COMPRESSED_HEADER, FastSerializer, ThresholdCompressor, metrics
+
+
+def redis_cache():
+    # The client connects lazily, so encode/decode need no server
+    return RedisCache('redis://localhost:6379/15', {'OPTIONS': {
+        'CLIENT_CLASS': 'appointments.cache_codecs.MeteredClient',
+        'COMPRESSOR': 'appointments.cache_codecs.ThresholdCompressor',
+        'SERIALIZER': 'appointments.cache_codecs.FastSerializer',
+    }})
+
+
+class TestThresholdCompressor:
+    """Test size-gated compression and reading values written by ZlibCompressor"""
+
+    def setup_method(self):
+        self.compressor = ThresholdCompressor({})
+
+    def test_small_values_are_stored_as_is(self):
+        assert self.compressor.compress(b'tiny') == b'tiny'
+        with pytest.raises(CompressorError):
+            self.compressor.decompress(b'tiny')
+
+    def test_large_values_round_trip_with_header(self):
+        value = b'appointment ' * 500
+        compressed = self.compressor.compress(value)
+        assert compressed.startswith(COMPRESSED_HEADER)
+        assert len(compressed) < len(value)
+        assert self.compressor.decompress(compressed) == value
+
+    def test_incompressible_values_are_stored_as_is(self):
+        value = os.urandom(4096)
+        assert self.compressor.compress(value) == value
+
+    def test_reads_legacy_zlib_values(self):
+        value = pickle.dumps({'legacy': True})
+        assert self.compressor.decompress(zlib.compress(value)) == value
+
+
+class TestFastSerializer:
+    """Test that JSON-shaped values take the fast path and everything else round-trips through pickle"""
+
+    def setup_method(self):
+        self.serializer = FastSerializer({})
+
+    @pytest.mark.parametrize('value', [
+        {'labels': ['Mon', 'Tue'], 'values': [1, 2.5], 'meta': {'empty': None, 'ok': True}},
+        [1, 'two', None],
+        'plain',
+        42,
+    ])
+    def test_json_shaped_values_round_trip(self, value):
+        data = self.serializer.dumps(value)
+        if self.serializer.codec:
+            assert data[:1] in (b'J', b'M')
+        assert self.serializer.loads(data) == value
+
+    @pytest.mark.parametrize('value', [
+        Entry({'a': 1}, 1.5, 0.1),
+        {1: 'int keys'},
+        {'when': datetime.date(2026, 1, 1)},
+        {'fee': Decimal('12.50')},
+        ('a', 'tuple'),
+        {'big': 2 ** 70},
+    ])
+    def test_other_values_keep_their_types(self, value):
+        data = self.serializer.dumps(value)
+        loaded = self.serializer.loads(data)
+        assert loaded == value
+        assert type(loaded) is type(value)
+
+    def test_reads_legacy_pickles(self):
+        assert self.serializer.loads(pickle.dumps({'legacy': (1, 2)})) == {'legacy': (1, 2)}
+
+
+class TestMeteredClient:
+    """Test the hit/miss and byte counters"""
+
+    def setup_method(self):
+        metrics.reset()
+        self.client = redis_cache().client
+
+    def test_encode_decode_round_trip_and_count_bytes(self):
+        value = {'rows': [{'id': i, 'name': f"Doctor {i}"} for i in range(200)]}
+        encoded = self.client.encode(value)
+        assert self.client.decode(encoded) == value
+        snapshot = metrics.snapshot()
+        assert snapshot['bytes_written'] == snapshot['bytes_read'] == len(encoded)
+        assert snapshot['raw_bytes'] > snapshot['compressed_bytes'] > 0
+
+    def test_decodes_values_written_by_the_old_codecs(self):
+        legacy = zlib.compress(pickle.dumps({'legacy': 1}, pickle.HIGHEST_PROTOCOL))
+        assert self.client.decode(legacy) == {'legacy': 1}
+
+    def test_counts_hits_and_misses(self):
+        def fake_get(self, key, default=None, **kwargs):
+            return 'value' if key == 'present' else default
+
+        with mock.patch.object(DefaultClient, 'get', autospec=True, side_effect=fake_get), \
+                mock.patch.object(DefaultClient, 'get_many', return_value={'present': 'value'}):
+            assert self.client.get('present') == 'value'
+            assert self.client.get('absent', 'fallback') == 'fallback'
+            self.client.get_many(['present', 'absent'])
+        snapshot = metrics.snapshot()
+        assert (snapshot['hits'], snapshot['misses'], snapshot['hit_rate']) == (2, 2, 0.5)
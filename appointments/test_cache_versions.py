@@ -0,0 +1,58 @@
+import pytest
+
+from django.core.cache import cache
+
+from .cache_versions import (
+    ALL_APPOINTMENTS, DOCTOR_DIRECTORY, appointment_namespaces, bump, versioned_key, versions,
+)
+from .factories import AppointmentFactory, OrganizationFactory
+
+
+class TestNamespaces:
+    """Test namespace version counters and derived keys"""
+
+    def setup_method(self):
+        cache.clear()
+
+    def test_bump_changes_only_that_namespace(self):
+        before = versions(['org:1', 'org:2'])
+        bump('org:1')
+        after = versions(['org:1', 'org:2'])
+        assert after['org:1'] == before['org:1'] + 1
+        assert after['org:2'] == before['org:2']
+
+    def test_evicted_counter_restarts_ahead(self):
+        version = versions(['doctor:7'])['doctor:7']
+        cache.delete('ns:doctor:7')
+        bump('doctor:7')
+        assert versions(['doctor:7'])['doctor:7'] > version
+
+    def test_versioned_key_changes_on_bump(self):
+        key = versioned_key('facets', [DOCTOR_DIRECTORY, 'org:3'], 'abc')
+        assert key == versioned_key('facets', ['org:3', DOCTOR_DIRECTORY], 'abc')
+        bump('org:3')
+        assert versioned_key('facets', [DOCTOR_DIRECTORY, 'org:3'], 'abc') != key
+        assert len(versioned_key('facets', ['org:3'], 'x' * 300)) < 100
+
+
+@pytest.mark.django_db
+class TestInvalidation:
+    """Test that writes bump the namespaces of the data they touch"""
+
+    def setup_method(self):
+        cache.clear()
+
+    def test_appointment_namespaces_include_previous_values(self):
+        first, second = OrganizationFactory(is_location_verified=True), OrganizationFactory(is_location_verified=True)
+        appointment = AppointmentFactory(organization=first)
+        appointment.organization = second
+        namespaces = appointment_namespaces(appointment)
+        assert {f'org:{first.id}', f'org:{second.id}', ALL_APPOINTMENTS} <= namespaces
+        assert f'doctor:{appointment.doctor_id}' in namespaces
+
+    def test_save_bumps_after_commit(self, django_capture_on_commit_callbacks):
+        clinic = OrganizationFactory(is_location_verified=True)
+        before = versions([f'org:{clinic.id}'])[f'org:{clinic.id}']
+        with django_capture_on_commit_callbacks(execute=True):
+            AppointmentFactory(organization=clinic)
+        assert versions([f'org:{clinic.id}'])[f'org:{clinic.id}'] > before
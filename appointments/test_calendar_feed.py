@@ -0,0 +1,128 @@
+import json
+from datetime import timedelta
+
+import pytest
+from django.core.cache import cache
+from django.test import RequestFactory
+from django.utils import timezone
+
+from . import calendar_feed
+from .calendar_feed import CalendarFeedError, SyncTokenExpired, calendar_events, decode_sync_token, parse_window
+from .factories import AppointmentFactory, make_member
+from .models import Appointment, AppointmentTombstone
+from .views import api_appointments
+
+
+def make_person(role):
+    return make_member(role, first_name='Ada', last_name='Stone')
+
+
+@pytest.mark.django_db
+class TestCalendarEvents:
+    """Test range loads and sync-token deltas"""
+
+    def setup_method(self):
+        cache.clear()
+
+    @pytest.fixture(autouse=True)
+    def no_overlap(self, monkeypatch):
+        monkeypatch.setattr(calendar_feed, 'SYNC_OVERLAP_SECONDS', 0)
+
+    def setup_week(self):
+        self.doctor = make_person('doctor')
+        self.monday = timezone.now().replace(hour=9, minute=0, second=0, microsecond=0)
+        self.week = (self.monday, self.monday + timedelta(days=7))
+        self.inside = AppointmentFactory(doctor=self.doctor, appointment_date=self.monday + timedelta(days=1))
+        self.later = AppointmentFactory(doctor=self.doctor, appointment_date=self.monday + timedelta(days=8))
+        AppointmentFactory(appointment_date=self.monday + timedelta(days=2))
+
+    def test_full_load_is_the_visible_range(self):
+        self.setup_week()
+        feed = calendar_events(self.doctor, *self.week)
+        assert feed['full'] and [event['id'] for event in feed['events']] == [self.inside.id]
+        assert feed['events'][0]['title'] == self.inside.patient.get_full_name()
+        patient_feed = calendar_events(self.inside.patient, *self.week)
+        assert patient_feed['events'][0]['title'] == 'Dr. Ada Stone'
+
+    def test_unchanged_range_is_an_empty_delta(self, django_assert_max_num_queries):
+        self.setup_week()
+        token = calendar_events(self.doctor, *self.week)['sync_token']
+        with django_assert_max_num_queries(6):
+            feed = calendar_events(self.doctor, *self.week, sync_token=token)
+        assert not feed['full'] and feed['events'] == [] and feed['deleted'] == []
+
+    def test_changes_and_deletions_since_the_token(self):
+        self.setup_week()
+        token = calendar_events(self.doctor, *self.week)['sync_token']
+        self.inside.status = 'confirmed'
+        self.inside.save(update_fields=['status'])
+        added = AppointmentFactory(doctor=self.doctor, appointment_date=self.monday + timedelta(days=3))
+        deleted_id = added.id
+        added.delete()
+        moved = AppointmentFactory(doctor=self.doctor, appointment_date=self.monday + timedelta(days=4))
+        token = calendar_events(self.doctor, *self.week, sync_token=token)['sync_token']
+
+        moved.doctor = make_person('doctor')
+        moved.save()
+        self.inside.appointment_date = self.monday + timedelta(days=10)
+        self.inside.save()
+        feed = calendar_events(self.doctor, *self.week, sync_token=token)
+        assert feed['events'] == []
+        assert feed['deleted'] == sorted([self.inside.id, moved.id])
+        assert AppointmentTombstone.objects.filter(appointment_id=deleted_id).exists()
+
+    def test_next_week_sends_only_the_new_days(self):
+        self.setup_week()
+        token = calendar_events(self.doctor, *self.week)['sync_token']
+        next_week = (self.monday + timedelta(days=3), self.monday + timedelta(days=10))
+        feed = calendar_events(self.doctor, *next_week, sync_token=token)
+        assert [event['id'] for event in feed['events']] == [self.later.id]
+        assert feed['deleted'] == []
+
+    def test_every_save_takes_a_new_change_number(self):
+        appointment = AppointmentFactory()
+        first = appointment.change_seq
+        appointment.save(update_fields=['notes'])
+        assert Appointment.objects.get(pk=appointment.pk).change_seq > first > 0
+
+
+class TestSyncTokens:
+    """Test range parsing and token validation"""
+
+    def test_ranges(self):
+        start, end = parse_window('2025-03-03', '2025-03-10T00:00:00+01:00')
+        assert end - start == timedelta(days=6, hours=23)
+        for bounds in (('2025-03-10', '2025-03-03'), ('2025-01-01', '2025-06-01'), ('soon', '2025-03-03')):
+            with pytest.raises(CalendarFeedError):
+                parse_window(*bounds)
+
+    def test_bad_and_expired_tokens(self, monkeypatch):
+        with pytest.raises(CalendarFeedError):
+            decode_sync_token('tampered')
+        token = calendar_feed.encode_sync_token(*parse_window('2025-03-03', '2025-03-10'), 5, timezone.now())
+        assert decode_sync_token(token)[2] == 5
+        monkeypatch.setattr(calendar_feed, 'TOMBSTONE_RETENTION_DAYS', -1)
+        with pytest.raises(SyncTokenExpired):
+            decode_sync_token(token)
+
+
+@pytest.mark.django_db
+class TestCalendarApi:
+    """Test the api_appointments endpoint"""
+
+    def test_feed_and_errors(self):
+        doctor = make_person('doctor')
+        appointment = AppointmentFactory(doctor=doctor)
+        day = appointment.appointment_date.date()
+
+        def get(**params):
+            request = RequestFactory().get('/api/appointments/', params)
+            request.user = doctor
+            return api_appointments(request)
+
+        week = {'start': (day - timedelta(days=1)).isoformat(), 'end': (day + timedelta(days=6)).isoformat()}
+        response = get(**week)
+        assert response.status_code == 200
+        assert [event['id'] for event in json.loads(response.content)['events']] == [appointment.id]
+        assert get(start='x', end='y').status_code == 400
+        assert get(sync_token='tampered', **week).status_code == 400
@@ -0,0 +1,83 @@
+import pytest
+from datetime import datetime, timedelta
+
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from .dashboard_cache import available_slots, cached_fragment, compute_day_appointments, doctor_infos
+from .factories import AppointmentFactory, OrganizationFactory, UserFactory, make_member
+
+
+def at(day, hour=10, minute=0):
+    return timezone.make_aware(datetime.combine(day, datetime.min.time()) + timedelta(hours=hour, minutes=minute))
+
+
+@pytest.mark.django_db
+class TestDashboardFragments:
+    """Test fragment caching and signal-driven invalidation"""
+
+    def setup_method(self):
+        cache.clear()
+        self.clinic = OrganizationFactory(is_location_verified=True)
+        self.doctor = make_member('doctor')
+        self.patient = UserFactory()
+        self.today = timezone.localdate()
+
+    def book(self, **fields):
+        defaults = dict(patient=self.patient, doctor=self.doctor, organization=self.clinic,
+                        appointment_date=at(self.today), status='confirmed', patient_status='waiting')
+        defaults.update(fields)
+        return AppointmentFactory(**defaults)
+
+    def stats(self):
+        return cached_fragment('organization', self.clinic.id, 'stats', self.today)
+
+    def test_hit_runs_no_queries(self):
+        self.book()
+        assert self.stats()['total_appointments'] == 1
+        with CaptureQueriesContext(connection) as queries:
+            assert self.stats()['accepted_appointments'] == 1
+        assert len(queries) == 0
+
+    def test_save_and_delete_invalidate_after_commit(self, django_capture_on_commit_callbacks):
+        assert self.stats()['total_appointments'] == 0
+        with django_capture_on_commit_callbacks(execute=True):
+            appointment = self.book()
+        assert self.stats()['total_appointments'] == 1
+        with django_capture_on_commit_callbacks(execute=True):
+            appointment.delete()
+        assert self.stats()['total_appointments'] == 0
+
+    def test_moving_an_appointment_invalidates_both_organizations(self, django_capture_on_commit_callbacks):
+        other = OrganizationFactory(is_location_verified=True)
+        with django_capture_on_commit_callbacks(execute=True):
+            appointment = self.book()
+        other_stats = cached_fragment('organization', other.id, 'stats', self.today)
+        assert other_stats['total_appointments'] == 0
+        assert self.stats()['total_appointments'] == 1
+        with django_capture_on_commit_callbacks(execute=True):
+            appointment.organization = other
+            appointment.save()
+        assert self.stats()['total_appointments'] == 0
+        assert cached_fragment('organization', other.id, 'stats', self.today)['total_appointments'] == 1
+
+    def test_doctor_cards(self):
+        self.book(appointment_date=at(self.today, 9), patient_status='in_consultation')
+        waiting = self.book(appointment_date=at(self.today, 9, 30))
+        now = at(self.today, 8)
+        info, = doctor_infos([self.doctor], self.today, now)
+        assert info['current_appointment'].patient_status == 'in_consultation'
+        assert info['next_appointment'].id == waiting.id
+        assert at(self.today, 9) not in info['available_slots']
+        assert info['available_slots'][0] == at(self.today, 10)
+        with CaptureQueriesContext(connection) as queries:
+            doctor_infos([self.doctor], self.today, now)
+        assert len(queries) == 0
+
+    def test_day_list_excludes_other_days(self):
+        self.book()
+        self.book(appointment_date=at(self.today + timedelta(days=1)))
+        assert len(compute_day_appointments('doctor', self.doctor.id, self.today)) == 1
+        assert available_slots([], self.today, now=at(self.today, 23)) == []
@@ -0,0 +1,85 @@
+import pytest
+
+from django.core.cache import cache
+
+from .directions import (
+    LRUCache, StraightLineEstimator, TravelEstimate, _local_estimates, get_cached_estimate,
+    get_travel_estimate, origin_cell, remember_origin, remembered_origins, store_estimate,
+    warm_estimates,
+)
+from .factories import OrganizationFactory
+
+
+class RecordingProvider:
+    name = 'recording'
+
+    def __init__(self):
+        self.calls = []
+
+    def estimate_many(self, origin, destinations):
+        self.calls.append((origin, sorted(destinations)))
+        return {key: TravelEstimate(12.5, 20, self.name) for key in destinations}
+
+
+def test_lru_cache_evicts_least_recently_used():
+    lru = LRUCache(2)
+    lru.set('a', 1)
+    lru.set('b', 2)
+    lru.get('a')
+    lru.set('c', 3)
+    assert lru.get('b') is None
+    assert lru.get('a') == 1 and lru.get('c') == 3
+    assert len(lru) == 2
+
+
+def test_lru_cache_entries_expire():
+    now = [0.0]
+    lru = LRUCache(10, timeout=60, clock=lambda: now[0])
+    lru.set('a', 1)
+    lru.set('b', 2, timeout=300)
+    now[0] = 60
+    assert lru.get('a') is None and lru.get('b') == 2
+    assert len(lru) == 1
+
+
+@pytest.mark.django_db
+class TestTravelEstimates:
+    """Test cached travel estimates and warming"""
+
+    def setup_method(self):
+        cache.clear()
+        _local_estimates.clear()
+        self.clinic = OrganizationFactory(latitude=40.7128, longitude=-74.0060)
+        self.other = OrganizationFactory(latitude=40.7306, longitude=-73.9352)
+
+    def test_miss_falls_back_to_uncached_straight_line(self):
+        estimate = get_travel_estimate(40.75, -73.99, self.clinic)
+        assert estimate.provider == StraightLineEstimator.name
+        assert not estimate.is_precise
+        assert estimate.distance_km > 0
+        assert get_cached_estimate(origin_cell(40.75, -73.99), self.clinic.id) is None
+
+    def test_cached_estimate_is_served(self):
+        cell = origin_cell(40.75, -73.99)
+        store_estimate(cell, self.clinic.id, TravelEstimate(9.0, 17, 'google'))
+        _local_estimates.clear()
+        assert get_travel_estimate(40.75, -73.99, self.clinic) == TravelEstimate(9.0, 17, 'google')
+
+    def test_warm_groups_by_origin_and_skips_precise_entries(self):
+        cell = origin_cell(40.75, -73.99)
+        far_cell = origin_cell(41.2, -73.5)
+        store_estimate(far_cell, self.clinic.id, TravelEstimate(60.0, 70, 'google'))
+        provider = RecordingProvider()
+
+        stored = warm_estimates(
+            [(cell, self.clinic), (cell, self.other), (far_cell, self.clinic), (cell, self.clinic)],
+            provider=provider,
+        )
+        assert stored == 2
+        assert len(provider.calls) == 1
+        assert provider.calls[0][1] == sorted([self.clinic.id, self.other.id])
+        assert get_travel_estimate(40.75, -73.99, self.other).provider == 'recording'
+
+    def test_remembered_origins_round_trip(self):
+        remember_origin(7, 40.75, -73.99)
+        assert remembered_origins([7, 8]) == {7: origin_cell(40.75, -73.99)}
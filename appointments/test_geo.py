@@ -0,0 +1,96 @@
+import pytest
+
+from .geo import (
+    bounding_box, cover_bbox, decode_geohash, decode_geohash_bounds, encode_geohash,
+    haversine_km, parse_coordinates,
+)
+from .models import Organization
+from .factories import OrganizationFactory, make_member
+from .views import clinic_search_results
+
+
+class TestGeohash:
+    """Test geohash encoding and bounding-box coverage"""
+
+    def test_encode_known_value(self):
+        assert encode_geohash(57.64911, 10.40744, 11) == 'u4pruydqqvj'
+
+    def test_decode_round_trip(self):
+        geohash = encode_geohash(40.7128, -74.0060)
+        latitude, longitude = decode_geohash(geohash)
+        assert abs(latitude - 40.7128) < 1e-6
+        assert abs(longitude + 74.0060) < 1e-6
+
+    def test_haversine_distance(self):
+        # Manhattan to Times Square is roughly 5.3 km
+        distance = haversine_km(40.7128, -74.0060, 40.7580, -73.9855)
+        assert 5.0 < distance < 5.6
+        assert haversine_km(10, 10, 10, 10) == 0
+
+    def test_cover_contains_every_point_in_radius(self):
+        latitude, longitude, radius = 40.7128, -74.0060, 10
+        bbox = bounding_box(latitude, longitude, radius)
+        cells = cover_bbox(*bbox)
+        assert 0 < len(cells) <= 16
+        for lat_offset in (-0.08, 0, 0.08):
+            for lng_offset in (-0.1, 0, 0.1):
+                geohash = encode_geohash(latitude + lat_offset, longitude + lng_offset)
+                assert any(geohash.startswith(cell) for cell in cells)
+
+    def test_cover_handles_antimeridian(self):
+        bbox = bounding_box(0, 179.99, 20)
+        cells = cover_bbox(*bbox)
+        assert any(decode_geohash_bounds(cell)[1] < 0 for cell in cells)
+        assert any(decode_geohash_bounds(cell)[3] > 0 for cell in cells)
+
+    def test_cover_skips_prefix_filter_for_huge_boxes(self):
+        assert cover_bbox(-80, -179, 80, 179) is None
+
+    def test_parse_coordinates(self):
+        assert parse_coordinates('40.7', '-74') == (40.7, -74.0)
+        assert parse_coordinates('91', '0') is None
+        assert parse_coordinates('abc', '0') is None
+        assert parse_coordinates(None, None) is None
+
+
+@pytest.mark.django_db
+class TestOrganizationRadiusSearch:
+    """Test radius and k-nearest organization queries"""
+
+    def make_org(self, name, latitude, longitude):
+        return OrganizationFactory(name=name, latitude=latitude, longitude=longitude)
+
+    def test_geohash_is_maintained_on_save(self):
+        org = self.make_org('Downtown', 40.7128, -74.0060)
+        assert org.geohash == encode_geohash(org.latitude, org.longitude)
+        org.latitude = None
+        org.save()
+        assert Organization.objects.get(pk=org.pk).geohash is None
+
+    def test_within_radius_orders_by_distance(self):
+        far = self.make_org('Far', 40.90, -74.0060)
+        near = self.make_org('Near', 40.7130, -74.0062)
+        middle = self.make_org('Middle', 40.7580, -73.9855)
+        results = list(Organization.objects.within_radius(40.7128, -74.0060, 10))
+        assert results == [near, middle]
+        assert results[0].distance_km < 0.1
+        assert 5.0 < results[1].distance_km < 5.6
+        assert far not in results
+
+    def test_nearest_expands_until_limit(self):
+        for index in range(3):
+            self.make_org(f'Clinic {index}', 40.7128 + index * 0.2, -74.0060)
+        results = Organization.objects.nearest(40.7128, -74.0060, limit=2, max_radius_km=100)
+        assert [org.name for org in results] == ['Clinic 0', 'Clinic 1']
+
+    def test_clinic_search_ranks_by_distance_and_lists_doctors(self):
+        far = self.make_org('Far Clinic', 40.90, -74.0060)
+        near = self.make_org('Near Clinic', 40.7130, -74.0062)
+        self.make_org('Near Hospital', 40.7131, -74.0061)
+        doctor = make_member('doctor', near)
+        results = clinic_search_results('clinic', (40.7128, -74.0060), radius=50)
+        assert [item['org'] for item in results] == [near, far]
+        assert [profile.user_id for profile in results[0]['doctors']] == [doctor.id]
+        assert [item['org'] for item in clinic_search_results('hospital')] == [
+            org for org in Organization.objects.filter(name__icontains='hospital').order_by('name')
+        ]
@@ -0,0 +1,142 @@
+import pytest
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+
+from django.utils import timezone
+
+from .geocoding import (
+    GeocodeResult, GeocoderError, RateLimiter, StubGeocoder, geocode_address,
+    geocode_organizations, normalize_address, organization_address,
+)
+from .models import GeocodeCache, Organization
+from .factories import OrganizationFactory
+
+
+class FailingGeocoder(StubGeocoder):
+    def geocode(self, address):
+        raise GeocoderError('quota exceeded')
+
+
+def make_org(address, **extra):
+    defaults = dict(address=address, city='New York', state='NY', postal_code='10001', country='USA',
+                    latitude=None, longitude=None, is_location_verified=False)
+    defaults.update(extra)
+    return OrganizationFactory(**defaults)
+
+
+class TestAddressHelpers:
+    """Test address normalization and rate limiting"""
+
+    def test_normalize_address(self):
+        assert normalize_address('  123 Broadway,  New York, NY ') == '123 broadway new york ny'
+        assert normalize_address(None) == ''
+
+    def test_stub_geocoder_is_deterministic(self):
+        first = StubGeocoder().geocode('123 Broadway')
+        second = StubGeocoder().geocode('123 broadway.')
+        assert first == second
+        assert -90 <= first.latitude <= 90 and -180 <= first.longitude <= 180
+
+    def test_rate_limiter_spaces_calls(self):
+        now = [0.0]
+        sleeps = []
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+            now[0] += seconds
+
+        limiter = RateLimiter(4, clock=lambda: now[0], sleep=sleep)
+        for _ in range(3):
+            limiter.wait()
+        assert sleeps == [0.25, 0.25]
+
+
+@pytest.mark.django_db
+class TestGeocodeCache:
+    """Test cached and batched organization geocoding"""
+
+    def test_cache_hit_skips_provider(self):
+        geocoder = StubGeocoder()
+        first = geocode_address('1 Main St, Springfield', geocoder=geocoder)
+        second = geocode_address('1 main st springfield', geocoder=geocoder)
+        assert first.pk == second.pk
+        assert len(geocoder.calls) == 1
+
+    def test_expired_entry_is_refreshed(self):
+        geocoder = StubGeocoder()
+        entry = geocode_address('1 Main St', geocoder=geocoder)
+        GeocodeCache.objects.filter(pk=entry.pk).update(expires_at=timezone.now() - timedelta(seconds=1))
+        geocode_address('1 Main St', geocoder=geocoder)
+        assert len(geocoder.calls) == 2
+        assert GeocodeCache.objects.count() == 1
+
+    def test_batch_coalesces_shared_addresses(self):
+        first = make_org('123 Broadway')
+        second = make_org('123  broadway')
+        other = make_org('77 Water St')
+        geocoder = StubGeocoder(known={
+            organization_address(first): GeocodeResult(Decimal('40.7128'), Decimal('-74.0060'), 'place-1'),
+        })
+        stats = geocode_organizations([first, second, other], geocoder=geocoder, rate=0)
+        assert stats['addresses'] == 2
+        assert stats['updated'] == 3
+        assert len(geocoder.calls) == 2
+
+        first.refresh_from_db()
+        assert first.is_location_verified
+        assert first.latitude == Decimal('40.71280000')
+        assert first.google_places_id == 'place-1'
+        assert first.geohash
+
+    def test_misses_are_negatively_cached(self):
+        org = make_org('Nowhere Lane')
+        geocoder = StubGeocoder(known={organization_address(org): None})
+        assert geocode_organizations([org], geocoder=geocoder, rate=0)['not_found'] == 1
+        assert geocode_organizations([org], geocoder=geocoder, rate=0)['not_found'] == 1
+        assert len(geocoder.calls) == 1
+        assert not Organization.objects.get(pk=org.pk).is_location_verified
+
+    def test_provider_errors_are_counted_not_cached(self):
+        org = make_org('500 Error Ave')
+        stats = geocode_organizations([org], geocoder=FailingGeocoder(), rate=0)
+        assert stats['errors'] == 1
+        assert not GeocodeCache.objects.exists()
+
+    def test_without_a_provider_nothing_is_geocoded(self, settings):
+        settings.GEOCODING_PROVIDER = ''
+        settings.GOOGLE_MAPS_API_KEY = ''
+        org = make_org('123 Broadway')
+        stats = geocode_organizations([org])
+        assert stats['skipped'] == 1 and stats['updated'] == 0
+        org.refresh_from_db()
+        assert not org.is_location_verified and org.latitude is None
+
+
+@pytest.mark.django_db
+class TestAddressChanges:
+    """Test that organizations are re-geocoded when their address changes"""
+
+    def test_address_edit_resets_verification(self, settings, django_capture_on_commit_callbacks):
+        settings.GEOCODING_PROVIDER = 'appointments.geocoding.StubGeocoder'
+        org = make_org('123 Broadway', latitude=Decimal('40.7128'), longitude=Decimal('-74.0060'),
+                       is_location_verified=True)
+        org = Organization.objects.get(pk=org.pk)
+        with mock.patch('appointments.tasks.geocode_organization.delay') as queued:
+            with django_capture_on_commit_callbacks(execute=True):
+                org.phone = '555-0100'
+                org.save()
+            queued.assert_not_called()
+            with django_capture_on_commit_callbacks(execute=True):
+                org.address = '77 Water St'
+                org.save(update_fields=['address'])
+        queued.assert_called_once_with(org.pk)
+        assert not Organization.objects.get(pk=org.pk).is_location_verified
+
+    def test_nothing_is_queued_without_a_provider(self, settings, django_capture_on_commit_callbacks):
+        settings.GEOCODING_PROVIDER = ''
+        settings.GOOGLE_MAPS_API_KEY = ''
+        with mock.patch('appointments.tasks.geocode_organization.delay') as queued:
+            with django_capture_on_commit_callbacks(execute=True):
+                make_org('123 Broadway')
+        queued.assert_not_called()
@@ -0,0 +1,145 @@
+import pytest
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache
+from pulsecal_system.celery import BULK, QUEUE_TIME_LIMITS
+
+from .factories import AppointmentFactory, make_member
+from .google_calendar import BaseCalendarClient, CalendarSync, FakeCalendarClient, connect_link, event_id_for
+from .models import GoogleCalendarEvent, GoogleCalendarLink
+from .tasks import sync_google_calendar
+
+
+@pytest.mark.django_db
+class TestCalendarSync:
+    """Test the Google Calendar sync engine against the in-memory client"""
+
+    def setup_method(self):
+        self.client = FakeCalendarClient(page_size=2)
+        self.sleeps = []
+
+    def make_link(self):
+        doctor = make_member('doctor')
+        return GoogleCalendarLink.objects.create(user=doctor, credentials={'token': 'test'})
+
+    def sync(self, link, **options):
+        link.refresh_from_db()
+        return CalendarSync(link, client=self.client, sleep=self.sleeps.append, **options).run()
+
+    def remote(self, appointment):
+        return self.client.calendars['primary'][event_id_for(appointment.id)]
+
+    def test_first_sync_inserts_in_batches(self):
+        link = self.make_link()
+        appointments = AppointmentFactory.create_batch(5, doctor=link.user, status='confirmed')
+        stats = self.sync(link, batch_size=2)
+        assert stats['inserted'] == 5 and self.client.batches == [2, 2, 1]
+        assert GoogleCalendarEvent.objects.filter(link=link).count() == 5
+        assert self.remote(appointments[0])['summary'].startswith('Appointment: ')
+
+    def test_unchanged_appointments_are_skipped(self):
+        link = self.make_link()
+        appointment = AppointmentFactory(doctor=link.user, status='confirmed', notes='first')
+        self.sync(link)
+        assert self.sync(link)['inserted'] == 0 and len(self.client.batches) == 1
+
+        # A save that does not change the event body is skipped by hash
+        appointment.notes = 'second'
+        appointment.save()
+        stats = self.sync(link)
+        assert stats['skipped'] == 1 and len(self.client.batches) == 1
+
+        appointment.status = 'pending'
+        appointment.appointment_type = 'followup'
+        appointment.save()
+        assert self.sync(link)['updated'] == 1
+
+    def test_deletes_and_cancellations_remove_events(self):
+        link = self.make_link()
+        deleted, cancelled = AppointmentFactory.create_batch(2, doctor=link.user, status='confirmed')
+        self.sync(link)
+        deleted_id = deleted.id
+        deleted.delete()
+        cancelled.status = 'cancelled'
+        cancelled.save()
+        assert self.sync(link)['deleted'] == 2
+        assert self.client.calendars['primary'][event_id_for(deleted_id)]['status'] == 'cancelled'
+        assert not GoogleCalendarEvent.objects.filter(link=link).exists()
+
+    def test_remote_edits_are_overwritten(self):
+        link = self.make_link()
+        appointment = AppointmentFactory(doctor=link.user, status='confirmed')
+        self.sync(link)
+        original = self.remote(appointment)['summary']
+        self.client.edit('primary', event_id_for(appointment.id), summary='Moved by hand')
+        stats = self.sync(link)
+        assert stats['stale'] == 1 and stats['updated'] == 1
+        assert self.remote(appointment)['summary'] == original
+
+    def test_expired_sync_token_falls_back_to_full_sync(self):
+        link = self.make_link()
+        AppointmentFactory.create_batch(3, doctor=link.user, status='confirmed')
+        self.sync(link)
+        self.client.expire_sync_tokens()
+        stats = self.sync(link)
+        assert stats['stale'] == 0 and stats['failed'] == 0
+        link.refresh_from_db()
+        assert link.sync_token == str(self.client.version)
+
+    def test_rate_limits_back_off_and_retry(self):
+        link = self.make_link()
+        AppointmentFactory.create_batch(3, doctor=link.user, status='confirmed')
+        self.client.fail_next(2)
+        stats = self.sync(link, backoff=1)
+        assert stats['inserted'] == 3 and stats['retries'] == 1
+        assert len(self.sleeps) == 1 and 1 <= self.sleeps[0] < 2
+
+    def test_exhausted_retries_hold_back_the_high_water_mark(self):
+        link = self.make_link()
+        first, _ = AppointmentFactory.create_batch(2, doctor=link.user, status='confirmed')
+        self.client.fail_next(6)
+        stats = self.sync(link, max_retries=2)
+        assert stats['failed'] == 2 and len(self.sleeps) == 2
+        link.refresh_from_db()
+        assert link.pushed_seq < first.change_seq
+        assert self.sync(link)['inserted'] == 2
+
+    def test_lost_mapping_updates_instead_of_duplicating(self):
+        link = self.make_link()
+        appointment = AppointmentFactory(doctor=link.user, status='confirmed')
+        self.sync(link)
+        GoogleCalendarEvent.objects.filter(link=link).delete()
+        GoogleCalendarLink.objects.filter(pk=link.pk).update(pushed_seq=0)
+        assert self.sync(link)['updated'] == 1
+        assert len(self.client.calendars['primary']) == 1
+        assert GoogleCalendarEvent.objects.get(link=link).etag == self.remote(appointment)['etag']
+
+    def test_reauthorizing_drops_old_event_mappings(self):
+        link = self.make_link()
+        AppointmentFactory(doctor=link.user, status='confirmed')
+        self.sync(link)
+        relinked = connect_link(link.user, {'token': 'other-account'})
+        assert relinked.pk == link.pk and relinked.pushed_seq == 0
+        assert not GoogleCalendarEvent.objects.filter(link=link).exists()
+
+    def test_clients_must_implement_the_interface(self):
+        with pytest.raises(TypeError):
+            BaseCalendarClient()
+
+    def test_expired_lock_taken_over_by_another_run_is_kept(self):
+        link = self.make_link()
+        lock_key = f"google-calendar:sync:{link.id}:lock"
+
+        def run(self):
+            # This run's lock expired and the next sync took it
+            cache.set(lock_key, 'next-run')
+            return {}
+
+        with mock.patch.object(CalendarSync, 'run', run):
+            sync_google_calendar(link.id)
+        assert cache.get(lock_key) == 'next-run'
+        cache.delete(lock_key)
+
+    def test_lock_outlives_the_bulk_time_limit(self):
+        assert settings.GOOGLE_CALENDAR_LOCK_TIMEOUT >= QUEUE_TIME_LIMITS[BULK]
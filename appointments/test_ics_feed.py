@@ -0,0 +1,102 @@
+import uuid
+
+import pytest
+from django.core.cache import cache
+from django.test import RequestFactory
+
+from .factories import AppointmentFactory, make_member
+from .ics_feed import ensure_feed_key, escape_text, feed_key_for, fold, reset_feed_key
+from .views import calendar_ics_feed
+
+
+def poll(feed_key, **headers):
+    request = RequestFactory().get(f'/calendar/feed/{feed_key}.ics', headers=headers)
+    response = calendar_ics_feed(request, feed_key)
+    if response.streaming:
+        response.body = b''.join(response.streaming_content).decode()
+    elif response.status_code == 200:
+        response.body = response.content.decode()
+    return response
+
+
+class TestWriter:
+    """Test iCalendar text escaping and line folding"""
+
+    def test_escape_text(self):
+        assert escape_text('Follow-up; bring scans, notes\nRoom 2') == 'Follow-up\\; bring scans\\, notes\\nRoom 2'
+
+    def test_fold_keeps_lines_within_75_octets(self):
+        folded = fold('SUMMARY:' + 'é' * 80)
+        lines = folded.rstrip('\r\n').split('\r\n')
+        assert all(len(line.encode('utf-8')) <= 75 for line in lines)
+        assert ''.join(line[1:] if i else line for i, line in enumerate(lines)) == 'SUMMARY:' + 'é' * 80
+
+
+@pytest.mark.django_db
+class TestIcsFeed:
+    """Test the tokenized feed's rendering and conditional GET"""
+
+    def setup_method(self):
+        cache.clear()
+
+    def make_doctor(self):
+        return make_member('doctor', first_name='Ada', last_name='Stone')
+
+    def test_feed_lists_the_doctors_appointments(self):
+        doctor = self.make_doctor()
+        appointment = AppointmentFactory(doctor=doctor, notes='ignored')
+        AppointmentFactory()
+        response = poll(ensure_feed_key(doctor))
+        assert response.status_code == 200 and response['Content-Type'].startswith('text/calendar')
+        assert response.body.startswith('BEGIN:VCALENDAR\r\n') and response.body.endswith('END:VCALENDAR\r\n')
+        assert response.body.count('BEGIN:VEVENT') == 1
+        assert f'UID:appointment-{appointment.id}@pulsecal' in response.body
+
+    def test_unchanged_schedule_is_not_modified_without_queries(self, django_assert_num_queries):
+        doctor = self.make_doctor()
+        AppointmentFactory(doctor=doctor)
+        key = ensure_feed_key(doctor)
+        first = poll(key)
+        with django_assert_num_queries(0):
+            assert poll(key, if_none_match=first['ETag']).status_code == 304
+            assert poll(key, if_modified_since=first['Last-Modified']).status_code == 304
+            assert poll(key).body == first.body
+
+    def test_appointment_changes_retire_the_etag(self, django_capture_on_commit_callbacks):
+        doctor = self.make_doctor()
+        appointment = AppointmentFactory(doctor=doctor)
+        key = ensure_feed_key(doctor)
+        etag = poll(key)['ETag']
+        with django_capture_on_commit_callbacks(execute=True):
+            appointment.status = 'cancelled'
+            appointment.save()
+        response = poll(key, if_none_match=etag)
+        assert response.status_code == 200 and 'STATUS:CANCELLED' in response.body
+
+    def test_organization_edits_retire_the_etag(self, django_capture_on_commit_callbacks):
+        doctor = self.make_doctor()
+        appointment = AppointmentFactory(doctor=doctor)
+        key = ensure_feed_key(doctor)
+        etag = poll(key)['ETag']
+        with django_capture_on_commit_callbacks(execute=True):
+            appointment.organization.name = 'Harbour Clinic'
+            appointment.organization.save()
+        response = poll(key, if_none_match=etag)
+        assert response.status_code == 200 and 'Harbour Clinic' in response.body
+
+    def test_reading_the_key_never_creates_one(self):
+        doctor = self.make_doctor()
+        assert feed_key_for(doctor) is None
+        doctor.profile.refresh_from_db()
+        assert doctor.profile.calendar_feed_key is None
+        key = ensure_feed_key(doctor)
+        assert feed_key_for(doctor) == key == ensure_feed_key(doctor)
+
+    def test_unknown_and_reset_keys(self):
+        doctor = self.make_doctor()
+        old_key = ensure_feed_key(doctor)
+        assert poll(old_key).status_code == 200
+        new_key = reset_feed_key(doctor)
+        assert poll(old_key).status_code == 404
+        assert poll(new_key).status_code == 200
+        assert poll(uuid.uuid4()).status_code == 404
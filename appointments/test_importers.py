@@ -0,0 +1,116 @@
+import pytest
+from datetime import datetime, timedelta
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from .importers import AppointmentImporter, IMPORT_TIMEZONE, parse_import_datetime
+from .models import Appointment
+from .factories import OrganizationFactory, AppointmentFactory, make_member
+
+
+def make_row(patient, doctor, when, **extra):
+    row = {
+        'patient_email': patient.email,
+        'doctor_email': doctor.email,
+        'appointment_date': when,
+        'status': 'pending',
+        'fee': '50.00',
+        'notes': '',
+    }
+    row.update(extra)
+    return row
+
+
+@pytest.mark.django_db
+class TestAppointmentImporter:
+    """Test batched appointment import and conflict detection"""
+
+    def setup_method(self):
+        self.organization = OrganizationFactory()
+        self.doctor = make_member('doctor', self.organization)
+        self.other_doctor = make_member('doctor', self.organization)
+        self.patient = make_member('patient')
+
+    def test_parse_import_datetime_localizes_naive_values(self):
+        parsed = parse_import_datetime('2030-01-15 10:00')
+        assert parsed.tzinfo is not None
+        assert parsed.utcoffset() == timedelta(hours=5, minutes=30)
+        assert parse_import_datetime('not a date') is None
+
+    def test_valid_rows_are_imported(self):
+        rows = [
+            make_row(self.patient, self.doctor, '2030-01-15 10:00'),
+            make_row(self.patient, self.doctor, '2030-01-15 10:30'),
+            make_row(self.patient, self.other_doctor, '2030-01-15 10:00', status='accepted'),
+        ]
+        results, created = AppointmentImporter(self.organization).run(rows)
+        assert all(r.is_valid for r in results)
+        assert len(created) == 3
+        assert Appointment.objects.filter(organization=self.organization).count() == 3
+        assert results[2].status == 'confirmed'
+
+    def test_imported_rows_take_new_change_numbers(self):
+        existing = AppointmentFactory(doctor=self.other_doctor, organization=self.organization)
+        rows = [make_row(self.patient, self.doctor, f'2030-01-15 1{hour}:00') for hour in range(3)]
+        AppointmentImporter(self.organization).run(rows)
+        seqs = list(Appointment.objects.filter(doctor=self.doctor).values_list('change_seq', flat=True))
+        assert len(set(seqs)) == 3 and min(seqs) > existing.change_seq
+
+    def test_overlap_within_file_is_reported(self):
+        rows = [
+            make_row(self.patient, self.doctor, '2030-01-15 10:15'),
+            make_row(self.patient, self.doctor, '2030-01-15 10:00'),
+        ]
+        results, created = AppointmentImporter(self.organization).run(rows)
+        assert len(created) == 1
+        # Rows are swept in start order, so the 10:00 row (row 3) wins.
+        assert results[1].is_valid
+        assert not results[0].is_valid
+        assert results[0].conflict_with == 'row 3'
+
+    def test_overlap_with_existing_booking_is_reported(self):
+        existing = AppointmentFactory(
+            doctor=self.doctor,
+            appointment_date=IMPORT_TIMEZONE.localize(datetime(2030, 1, 15, 10, 0)),
+        )
+        rows = [
+            make_row(self.patient, self.doctor, '2030-01-15 10:20'),
+            make_row(self.patient, self.doctor, '2030-01-15 09:31'),
+            make_row(self.patient, self.doctor, '2030-01-15 11:00'),
+        ]
+        results, created = AppointmentImporter(self.organization).run(rows)
+        assert [r.is_valid for r in results] == [False, False, True]
+        assert results[0].conflict_with == f"appointment #{existing.id}"
+        assert len(created) == 1
+
+    def test_unknown_users_and_bad_values_are_reported(self):
+        patient_only = make_member('patient')
+        rows = [
+            {'patient_email': 'nobody@example.com', 'doctor_email': self.doctor.email,
+             'appointment_date': '2030-01-15 10:00'},
+            make_row(self.patient, patient_only, '2030-01-15 10:00'),
+            make_row(self.patient, self.doctor, 'tomorrow', fee='-1', status='bogus'),
+        ]
+        results = AppointmentImporter(self.organization).validate(rows)
+        assert "Patient nobody@example.com not found" in results[0].errors
+        assert f"{patient_only.email} is not a doctor" in results[1].errors
+        assert len(results[2].errors) == 3
+
+    def test_stored_emails_match_regardless_of_case(self):
+        self.patient.email = 'Mixed.Case@Example.com'
+        self.patient.save()
+        row = make_row(self.patient, self.doctor, '2030-01-15 10:00', patient_email='mixed.case@example.COM')
+        results = AppointmentImporter(self.organization).validate([row])
+        assert results[0].is_valid and results[0].patient == self.patient
+
+    def test_query_count_does_not_scale_with_rows(self):
+        base = datetime(2030, 1, 15, 8, 0)
+        rows = [
+            make_row(self.patient, self.doctor, (base + timedelta(minutes=30 * i)).strftime('%Y-%m-%d %H:%M'))
+            for i in range(40)
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            results = AppointmentImporter(self.organization).validate(rows)
+        assert all(r.is_valid for r in results)
+        assert len(queries) == 2
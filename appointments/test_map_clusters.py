@@ -0,0 +1,87 @@
+import pytest
+
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from .map_clusters import (
+    MarkerLayer, cluster_precision_for_zoom, filter_signature, parse_viewport,
+)
+from .models import Organization
+from .factories import OrganizationFactory
+
+
+def serialize(org):
+    return {'id': org.id, 'name': org.name}
+
+
+class TestViewportParsing:
+    """Test viewport and zoom parsing"""
+
+    def test_parse_viewport(self):
+        bbox, zoom = parse_viewport('-74.1,40.6,-73.9,40.8', '12')
+        assert bbox == (40.6, -74.1, 40.8, -73.9)
+        assert zoom == 12
+
+    def test_missing_bbox_means_world(self):
+        bbox, zoom = parse_viewport(None, None)
+        assert bbox == (-90.0, -180.0, 90.0, 180.0)
+        assert zoom == 2
+
+    def test_antimeridian_viewport_is_unwrapped(self):
+        bbox, _ = parse_viewport('170,-10,-170,10', '5')
+        assert bbox == (-10.0, 170.0, 10.0, 190.0)
+
+    def test_invalid_bbox(self):
+        assert parse_viewport('a,b,c,d', '3') is None
+        assert parse_viewport('0,50,10,40', '3') is None
+        assert parse_viewport('nan,0,10,1', '3') is None
+        assert parse_viewport('inf,0,10,1', '3') is None
+        assert parse_viewport('0,0,-inf,1', '3') is None
+        assert parse_viewport('-200,0,10,1', '3') is None
+        assert parse_viewport('0,0,190,1', '3') is None
+
+    def test_zoom_precision_mapping(self):
+        assert cluster_precision_for_zoom(0) == 1
+        assert cluster_precision_for_zoom(10) == 5
+        assert cluster_precision_for_zoom(16) is None
+
+    def test_filter_signature_ignores_empty_values(self):
+        assert filter_signature(a='x', b='') == filter_signature(a='x')
+        assert filter_signature(a='x') != filter_signature(a='y')
+
+
+@pytest.mark.django_db
+class TestMarkerLayer:
+    """Test clustered marker aggregation and tile caching"""
+
+    def setup_method(self):
+        cache.clear()
+        for index in range(5):
+            OrganizationFactory(latitude=40.71 + index * 0.001, longitude=-74.00)
+        self.lonely = OrganizationFactory(name='Lonely Clinic', latitude=51.5, longitude=-0.12)
+
+    def layer(self):
+        return MarkerLayer('orgs', Organization.objects.with_coordinates(), serialize, 'test')
+
+    def test_low_zoom_returns_clusters_with_counts(self):
+        markers = self.layer().markers((-90.0, -180.0, 90.0, 180.0), 3)
+        clusters = [m for m in markers if m['cluster']]
+        points = [m for m in markers if not m['cluster']]
+        assert len(clusters) == 1
+        assert clusters[0]['count'] == 5
+        assert abs(clusters[0]['latitude'] - 40.712) < 0.01
+        assert points == [{'cluster': False, 'id': self.lonely.id, 'name': 'Lonely Clinic'}]
+
+    def test_high_zoom_returns_points_in_viewport(self):
+        markers = self.layer().markers((40.70, -74.01, 40.72, -73.99), 17)
+        assert len(markers) == 5
+        assert not any(m['cluster'] for m in markers)
+
+    def test_tiles_are_served_from_cache(self):
+        bbox = (40.0, -75.0, 41.0, -73.0)
+        first = self.layer().markers(bbox, 9)
+        with CaptureQueriesContext(connection) as queries:
+            second = self.layer().markers(bbox, 9)
+        assert first == second
+        assert len(queries) == 0
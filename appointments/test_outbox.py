@@ -0,0 +1,155 @@
+from datetime import timedelta
+from unittest import mock
+
+import pytest
+from django.db import transaction
+from django.utils import timezone
+from notifications.models import Notification
+
+from .factories import AppointmentFactory
+from .models import Appointment, OutboxEvent
+from .outbox import HANDLERS, claim_batch, relay_batch, relay_pending
+
+
+class Recorder:
+    def __init__(self, fail=0):
+        self.calls = []
+        self.fail = fail
+
+    def __call__(self, payload):
+        if self.fail:
+            self.fail -= 1
+            raise RuntimeError('channel layer down')
+        self.calls.append((payload['event_type'], payload['appointment_id']))
+
+
+@pytest.mark.django_db
+class TestOutbox:
+    """Test that appointment changes are recorded transactionally and relayed at least once"""
+
+    def events(self, appointment_id):
+        return list(OutboxEvent.objects.filter(appointment_id=appointment_id).order_by('id')
+                    .values_list('event_type', flat=True))
+
+    def test_changes_write_events(self):
+        appointment = AppointmentFactory(status='pending')
+        appointment.status = 'confirmed'
+        appointment.save()
+        appointment.notes = 'Bring scans'
+        appointment.save()
+        appointment.status = 'cancelled'
+        appointment.save()
+        appointment_id = appointment.id
+        appointment.delete()
+        assert self.events(appointment_id) == ['booked', 'confirmed', 'updated', 'cancelled', 'deleted']
+        payload = OutboxEvent.objects.filter(appointment_id=appointment_id).last().payload
+        assert payload['previous_status'] == 'cancelled' and payload['doctor_id']
+
+    def test_rolled_back_changes_leave_no_event(self):
+        appointment = AppointmentFactory(status='pending')
+        with pytest.raises(RuntimeError):
+            with transaction.atomic():
+                appointment.status = 'confirmed'
+                appointment.save()
+                raise RuntimeError('rollback')
+        assert self.events(appointment.id) == ['booked']
+
+    def test_relay_fans_out_once(self):
+        appointment = AppointmentFactory(status='pending')
+        channels, tasks = Recorder(), Recorder()
+        handlers = {'channels': channels, 'tasks': tasks}
+        assert relay_pending(handlers=handlers) == 1
+        assert relay_pending(handlers=handlers) == 0
+        assert channels.calls == tasks.calls == [('booked', appointment.id)]
+        assert OutboxEvent.objects.get(appointment_id=appointment.id).processed_at is not None
+
+    def test_failed_handler_is_retried_alone_after_backoff(self):
+        appointment = AppointmentFactory(status='pending')
+        channels, tasks = Recorder(fail=1), Recorder()
+        handlers = {'channels': channels, 'tasks': tasks}
+        relay_batch(handlers=handlers)
+        event = OutboxEvent.objects.get(appointment_id=appointment.id)
+        assert event.processed_at is None and event.attempts == 1 and event.delivered == ['tasks']
+        assert 'channel layer down' in event.last_error
+
+        # Not due until the backoff has passed
+        assert relay_batch(handlers=handlers) == 0
+        OutboxEvent.objects.filter(pk=event.pk).update(available_at=timezone.now() - timedelta(seconds=1))
+        assert relay_batch(handlers=handlers) == 1
+        assert channels.calls == tasks.calls == [('booked', appointment.id)]
+
+    def test_database_error_in_handler_keeps_the_batch(self):
+        appointment = AppointmentFactory(status='pending')
+        event = OutboxEvent.objects.get(appointment_id=appointment.id)
+
+        def duplicate(payload):
+            OutboxEvent.objects.create(id=event.id, event_type='booked', appointment_id=appointment.id, payload={})
+
+        tasks = Recorder()
+        assert relay_batch(handlers={'tasks': tasks, 'duplicate': duplicate}) == 1
+        event.refresh_from_db()
+        assert event.attempts == 1 and event.delivered == ['tasks'] and event.processed_at is None
+        assert 'duplicate' in event.last_error
+        assert OutboxEvent.objects.count() == 1
+
+    def test_claimed_events_are_leased_until_the_relay_records_them(self):
+        appointment = AppointmentFactory(status='pending')
+        # A relay that claimed the event and died
+        [claimed] = claim_batch()
+        assert claimed.lease_token and claimed.available_at > timezone.now()
+        tasks = Recorder()
+        assert relay_batch(handlers={'tasks': tasks}) == 0
+
+        OutboxEvent.objects.filter(pk=claimed.pk).update(available_at=timezone.now() - timedelta(seconds=1))
+        assert relay_batch(handlers={'tasks': tasks}) == 1
+        assert tasks.calls == [('booked', appointment.id)]
+        assert OutboxEvent.objects.get(pk=claimed.pk).lease_token == ''
+
+    def test_expired_lease_does_not_overwrite_the_next_relay(self):
+        AppointmentFactory(status='pending')
+
+        def slow(payload):
+            # This relay's lease ran out and another relay claimed the event meanwhile
+            OutboxEvent.objects.update(lease_token='next-relay')
+
+        relay_batch(handlers={'slow': slow})
+        event = OutboxEvent.objects.get()
+        assert event.lease_token == 'next-relay' and event.processed_at is None and event.delivered == []
+
+    def test_gives_up_after_max_attempts(self):
+        AppointmentFactory(status='pending')
+        failing = Recorder(fail=100)
+        with mock.patch('appointments.outbox.MAX_ATTEMPTS', 2):
+            for _ in range(2):
+                OutboxEvent.objects.update(available_at=timezone.now() - timedelta(seconds=1))
+                relay_batch(handlers={'channels': failing})
+        event = OutboxEvent.objects.get()
+        assert event.attempts == 2 and event.processed_at is not None and event.last_error
+
+    def test_default_handlers(self):
+        appointment = AppointmentFactory(status='pending')
+        Appointment.objects.get(pk=appointment.pk).delete()
+        with mock.patch('appointments.tasks.send_appointment_confirmation.delay') as confirm:
+            appointment = AppointmentFactory(status='confirmed')
+            assert relay_pending() == 3
+        confirm.assert_called_once_with(appointment.id)
+        assert Notification.objects.filter(recipient=appointment.patient, verb='appointment_booked').exists()
+        assert Notification.objects.filter(recipient=appointment.doctor, verb='appointment_booked').exists()
+        assert not OutboxEvent.objects.filter(processed_at__isnull=True).exists()
+
+    def test_plain_updates_notify_dashboards_only(self):
+        appointment = AppointmentFactory(status='pending')
+        OutboxEvent.objects.update(processed_at=timezone.now())
+        appointment.notes = 'Bring scans'
+        appointment.save()
+        appointment.appointment_date += timedelta(days=1)
+        appointment.save()
+        channel_layer = mock.Mock()
+        with mock.patch('appointments.outbox.get_channel_layer', return_value=channel_layer), \
+                mock.patch('appointments.outbox.async_to_sync', side_effect=lambda send: send):
+            assert relay_pending(handlers={'channels': HANDLERS['channels']}) == 2
+        groups = [call.args[0] for call in channel_layer.group_send.call_args_list]
+        assert groups.count(f'appointments_org_{appointment.organization_id}') == 2
+        assert groups.count(f'notifications_{appointment.patient_id}') == 1
+        payloads = OutboxEvent.objects.filter(event_type='updated').order_by('id').values_list('payload', flat=True)
+        assert [payload['changed'] for payload in payloads] == [[], ['appointment_date']]
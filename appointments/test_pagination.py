@@ -0,0 +1,65 @@
+from datetime import timedelta
+
+import pytest
+from django.core.cache import cache
+from django.utils import timezone
+
+from .factories import AppointmentFactory
+from .models import Appointment
+from .pagination import InvalidCursor, cached_count, encode_cursor, estimated_count, keyset_page
+
+NEWEST_FIRST = ('-appointment_date', '-id')
+
+
+@pytest.mark.django_db
+class TestKeysetPage:
+    """Test cursor paging over mixed and tied orderings"""
+
+    def test_pages_cover_every_row_once(self):
+        same_time = timezone.now()
+        AppointmentFactory.create_batch(3, appointment_date=same_time)
+        AppointmentFactory.create_batch(4, appointment_date=same_time + timedelta(hours=1))
+        seen, cursor = [], None
+        while True:
+            page, cursor = keyset_page(Appointment.objects.all(), NEWEST_FIRST, cursor, limit=2)
+            seen.extend(page)
+            if cursor is None:
+                break
+        expected = list(Appointment.objects.order_by(*NEWEST_FIRST).values_list('id', flat=True))
+        assert [appointment.id for appointment in seen] == expected
+
+    def test_ascending_ordering(self):
+        ids = [appointment.id for appointment in AppointmentFactory.create_batch(3)]
+        first = keyset_page(Appointment.objects.all(), ('id',), limit=2)
+        second = keyset_page(Appointment.objects.all(), ('id',), first.next_cursor, limit=2)
+        assert [row.id for row in first.object_list + second.object_list] == sorted(ids)
+        assert second.next_cursor is None
+
+    def test_invalid_cursors(self):
+        for cursor in ('not-a-cursor', encode_cursor([1]), encode_cursor(['yesterday', 1])):
+            with pytest.raises(InvalidCursor):
+                keyset_page(Appointment.objects.all(), NEWEST_FIRST, cursor)
+
+
+@pytest.mark.django_db
+class TestCachedCount:
+    """Test that exact counts are cached per filter signature"""
+
+    def setup_method(self):
+        cache.clear()
+
+    def test_count_is_reused_for_the_same_filters(self, django_assert_num_queries):
+        AppointmentFactory.create_batch(2, status='pending')
+        AppointmentFactory(status='confirmed')
+        pending = Appointment.objects.filter(status='pending')
+        assert cached_count(pending) == 2
+        with django_assert_num_queries(0):
+            assert cached_count(Appointment.objects.filter(status='pending').order_by('-id')) == 2
+        assert cached_count(Appointment.objects.filter(status='confirmed')) == 1
+
+    def test_small_filtered_lists_use_the_cached_count(self, django_assert_num_queries):
+        AppointmentFactory.create_batch(2)
+        queryset = Appointment.objects.filter(status='pending')
+        expected = estimated_count(queryset, threshold=1000)
+        with django_assert_num_queries(0):
+            assert estimated_count(queryset, threshold=1000) == expected
@@ -0,0 +1,88 @@
+import pytest
+from django.contrib.auth.models import update_last_login
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from .factories import UserFactory, make_member
+from .models import DoctorSearchDocument, UserProfile
+from .signals import suppress_profile_signals
+
+
+def profile_queries(queries):
+    return [query['sql'] for query in queries.captured_queries if 'appointments_userprofile' in query['sql']]
+
+
+def make_doctor(**user_fields):
+    return make_member('doctor', **user_fields)
+
+
+def reload(user):
+    """The same user without a cached profile"""
+    return type(user).objects.get(pk=user.pk)
+
+
+@pytest.mark.django_db
+class TestProfileSync:
+    """Test that User saves only write the profile when it was loaded and changed"""
+
+    def test_login_does_not_touch_profile(self):
+        user = UserFactory()
+        user.profile
+        with CaptureQueriesContext(connection) as queries:
+            update_last_login(None, user)
+        assert profile_queries(queries) == []
+
+    def test_unloaded_profile_is_not_fetched(self):
+        user = reload(UserFactory())
+        user.email = 'new@example.com'
+        with CaptureQueriesContext(connection) as queries:
+            user.save()
+        assert profile_queries(queries) == []
+
+    def test_only_changed_fields_are_written(self):
+        user = reload(UserFactory())
+        user.profile.phone = '555-0100'
+        with CaptureQueriesContext(connection) as queries:
+            user.save()
+        updates = [sql for sql in profile_queries(queries) if sql.startswith('UPDATE')]
+        assert len(updates) == 1 and '"phone"' in updates[0] and '"bio"' not in updates[0]
+        assert UserProfile.objects.get(user=user).phone == '555-0100'
+        assert user.profile.changed_fields() == set()
+
+    def test_in_place_json_edits_are_changes(self):
+        profile = UserProfile.objects.get(user=UserFactory())
+        profile.languages.append('Hindi')
+        assert profile.changed_fields() == {'languages'}
+        assert profile.save_if_changed()
+        assert not profile.save_if_changed()
+
+    def test_doctor_rename_reindexes_without_profile_save(self):
+        doctor = make_doctor(first_name='Asha', last_name='Verma')
+        doctor.first_name = 'Anya'
+        doctor.save()
+        assert DoctorSearchDocument.objects.get(user=doctor).full_name == 'Anya Verma'
+
+
+@pytest.mark.django_db
+class TestSuppressProfileSignals:
+    """Test that bulk blocks defer search syncing to one pass on exit"""
+
+    def test_documents_are_synced_on_exit(self):
+        with suppress_profile_signals():
+            user = UserFactory(first_name='Asha', last_name='Verma')
+            UserProfile.objects.filter(user=user).update(role='doctor')
+            profile = UserProfile.objects.get(user=user)
+            profile.specialization = 'Cardiology'
+            profile.save()
+            assert not DoctorSearchDocument.objects.filter(user=user).exists()
+        document = DoctorSearchDocument.objects.get(user=user)
+        assert (document.full_name, document.specialization) == ('Asha Verma', 'Cardiology')
+
+    def test_nested_blocks_sync_once(self, monkeypatch):
+        synced = []
+        monkeypatch.setattr('appointments.signals.sync_users', synced.append)
+        with suppress_profile_signals():
+            with suppress_profile_signals():
+                first = UserFactory()
+            second = UserFactory()
+        assert synced == [{first.id, second.id}]
@@ -0,0 +1,91 @@
+import logging
+from datetime import timedelta
+
+import pytest
+from django.core import mail
+from django.db import connection
+from django.test import RequestFactory
+from django.utils import timezone
+
+from . import query_budget as budget_module
+from .factories import AppointmentFactory, make_member
+from .models import Appointment, UserProfile
+from .query_budget import (
+    QueryBudgetExceeded, QueryBudgetMiddleware, enforce_query_budget, query_budget, query_shape,
+)
+from .tasks import send_daily_appointment_summary, update_doctor_availability
+
+
+def make_doctors(count, on_duty=False):
+    return [make_member('doctor', profile_fields={'on_duty': on_duty}) for _ in range(count)]
+
+
+class TestQueryShape:
+    """Test that queries differing only in literals share a shape"""
+
+    def test_ids_and_in_lists_collapse(self):
+        assert query_shape('SELECT * FROM t WHERE id = 12') == query_shape('SELECT * FROM t WHERE id = 7')
+        assert query_shape('WHERE id IN (%s, %s)') == query_shape('WHERE id IN (%s, %s, %s)')
+        assert query_shape("WHERE name = 'a'") == query_shape("WHERE name = 'bb'")
+
+
+@pytest.mark.django_db
+class TestQueryBudget:
+    """Test budget enforcement and N+1 detection"""
+
+    def test_lazy_loads_in_a_loop_are_reported_with_caller(self):
+        AppointmentFactory.create_batch(8)
+        with pytest.raises(QueryBudgetExceeded) as error:
+            with enforce_query_budget():
+                [str(appointment) for appointment in Appointment.objects.all()]
+        assert 'test_query_budget.py' in str(error.value)
+
+    def test_select_related_stays_within_budget(self):
+        AppointmentFactory.create_batch(8)
+        with enforce_query_budget(1) as recorder:
+            [str(appointment) for appointment in Appointment.objects.select_related('patient', 'doctor')]
+        assert recorder.count == 1
+
+    def test_budget_overrun_fails(self):
+        with pytest.raises(QueryBudgetExceeded):
+            with enforce_query_budget(1, repeat_threshold=100):
+                list(Appointment.objects.all())
+                list(UserProfile.objects.all())
+
+    def test_decorator_declares_view_budget(self, monkeypatch, caplog):
+        monkeypatch.setattr(budget_module, 'QUERY_BUDGET_ENABLED', True)
+
+        @query_budget(0)
+        def view(request):
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+
+        request = RequestFactory().get('/slow/')
+        middleware = QueryBudgetMiddleware(view)
+        middleware.process_view(request, view, (), {})
+        with caplog.at_level(logging.WARNING, logger='appointments.query_budget'):
+            middleware(request)
+        assert 'GET /slow/: 1 queries, budget 0' in caplog.text
+
+
+@pytest.mark.django_db
+class TestTaskBudgets:
+    """Test that the doctor tasks no longer query once per doctor"""
+
+    def test_daily_summary(self):
+        tomorrow = timezone.now() + timedelta(days=1)
+        for doctor in make_doctors(10):
+            AppointmentFactory(doctor=doctor, appointment_date=tomorrow, status='confirmed')
+        with enforce_query_budget(send_daily_appointment_summary.run.query_budget):
+            send_daily_appointment_summary()
+        assert len(mail.outbox) == 10
+
+    def test_doctor_availability(self):
+        now = timezone.now()
+        busy, *idle = make_doctors(10, on_duty=True)
+        AppointmentFactory(doctor=busy, appointment_date=now + timedelta(hours=1), status='confirmed')
+        with enforce_query_budget(update_doctor_availability.run.query_budget):
+            update_doctor_availability()
+        next_available = dict(UserProfile.objects.filter(role='doctor').values_list('user_id', 'next_available'))
+        assert next_available[busy.id] > now + timedelta(hours=1)
+        assert all(next_available[doctor.id] <= timezone.now() for doctor in idle)
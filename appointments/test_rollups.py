@@ -0,0 +1,95 @@
+import pytest
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from django.core.management import call_command
+from django.utils import timezone
+
+from .models import Appointment, DailyAppointmentFact, Payment
+from .rollups import daily_series, facts_for, rebuild_rollups, refresh_cells, summarize
+from .factories import AppointmentFactory, OrganizationFactory, UserFactory
+
+
+def at(day, hour=10):
+    return timezone.make_aware(datetime.combine(day, datetime.min.time()) + timedelta(hours=hour))
+
+
+@pytest.mark.django_db
+class TestRollups:
+    """Test incremental and rebuilt daily appointment rollups"""
+
+    @pytest.fixture(autouse=True)
+    def setup(self, django_capture_on_commit_callbacks):
+        self.clinic = OrganizationFactory(is_location_verified=True)
+        self.doctor = UserFactory()
+        self.patient = UserFactory()
+        self.today = timezone.localdate()
+        self.on_commit = django_capture_on_commit_callbacks
+
+    def book(self, day, **fields):
+        defaults = dict(patient=self.patient, doctor=self.doctor, organization=self.clinic,
+                        appointment_date=at(day), status='confirmed', appointment_type='new', fee=Decimal('50'))
+        defaults.update(fields)
+        with self.on_commit(execute=True):
+            return AppointmentFactory(**defaults)
+
+    def cell(self, day, status='confirmed'):
+        return DailyAppointmentFact.objects.get(doctor=self.doctor, date=day, status=status)
+
+    def test_save_updates_cell_incrementally(self):
+        self.book(self.today)
+        self.book(self.today, fee=Decimal('30'))
+        fact = self.cell(self.today)
+        assert fact.appointment_count == 2
+        assert fact.fee_total == Decimal('80')
+
+    def test_status_change_and_reschedule_move_counts(self):
+        appointment = Appointment.objects.get(pk=self.book(self.today).pk)
+        appointment.status = 'completed'
+        appointment.appointment_date = at(self.today + timedelta(days=1))
+        with self.on_commit(execute=True):
+            appointment.save()
+        assert not DailyAppointmentFact.objects.filter(date=self.today).exists()
+        assert self.cell(self.today + timedelta(days=1), 'completed').appointment_count == 1
+
+    def test_delete_and_payments(self):
+        appointment = self.book(self.today)
+        with self.on_commit(execute=True):
+            Payment.objects.create(appointment=appointment, patient=self.patient, doctor=self.doctor,
+                                   organization=self.clinic, payment_type='appointment', amount=Decimal('45'),
+                                   status='completed', payment_method='cash')
+        assert self.cell(self.today).paid_total == Decimal('45')
+        with self.on_commit(execute=True):
+            appointment.delete()
+        assert not DailyAppointmentFact.objects.exists()
+
+    def test_rebuild_matches_incremental(self):
+        for offset in range(5):
+            self.book(self.today - timedelta(days=offset), status='pending' if offset % 2 else 'completed')
+        Appointment.objects.update(fee=Decimal('10'))  # bypasses signals
+        incremental = DailyAppointmentFact.objects.count()
+        assert rebuild_rollups(self.today - timedelta(days=10), self.today, chunk_days=3) == incremental
+        assert all(fact.fee_total == Decimal('10') for fact in DailyAppointmentFact.objects.all())
+
+    def test_summary_and_series(self):
+        yesterday = self.today - timedelta(days=1)
+        self.book(yesterday, status='pending')
+        self.book(yesterday, status='completed', fee=Decimal('20'))
+        self.book(yesterday, status='cancelled')
+        self.book(self.today, status='pending')
+
+        summary = summarize(facts_for(organization=self.clinic))
+        assert summary['total'] == 4
+        assert summary['fee_total'] == Decimal('170')
+        assert summary['no_show_rate'] == 50.0
+
+        labels, counts = daily_series(facts_for(), yesterday - timedelta(days=1), self.today)
+        assert labels[-1] == self.today.isoformat()
+        assert counts == [0, 3, 1]
+
+    def test_backfill_command(self):
+        self.book(self.today)
+        DailyAppointmentFact.objects.all().delete()
+        call_command('backfill_rollups')
+        assert self.cell(self.today).appointment_count == 1
+        assert refresh_cells(set()) == 0
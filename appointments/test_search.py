@@ -0,0 +1,127 @@
+import pytest
+import uuid
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import connection
+
+from . import facets
+from .models import DoctorSearchDocument
+from .search import parse_search_filters, search_doctors, search_terms
+from .factories import OrganizationFactory, make_member
+
+
+def make_doctor(first_name, last_name, organization=None, **profile_fields):
+    return make_member('doctor', organization, profile_fields, first_name=first_name, last_name=last_name)
+
+
+class TestSearchParsing:
+    """Test query tokenizing and facet filter parsing"""
+
+    def test_search_terms_strip_operators(self):
+        assert search_terms("Cardio & (smith) | !x:*") == ['cardio', 'smith', 'x']
+        assert search_terms(None) == []
+
+    def test_parse_search_filters(self):
+        filters = parse_search_filters({
+            'org_type': 'clinic', 'on_duty': 'true', 'max_fee': '50', 'min_rating': 'abc', 'org_name': ' ',
+        })
+        assert filters == {'org_type': 'clinic', 'on_duty': True, 'max_fee': Decimal('50')}
+
+    def test_unknown_bands_are_ignored(self):
+        assert parse_search_filters({'fee_band': '25-50', 'rating_band': 'best'}) == {'fee_band': '25-50'}
+
+
+@pytest.mark.django_db
+class TestDoctorSearchDocument:
+    """Test that search documents follow profile and organization changes"""
+
+    def test_doctor_profile_is_indexed(self):
+        clinic = OrganizationFactory(name='Harbor Clinic', org_type='clinic')
+        doctor = make_doctor('Asha', 'Verma', clinic, specialization='Cardiology', languages=['Hindi', 'English'])
+        document = DoctorSearchDocument.objects.get(user=doctor)
+        assert document.full_name == 'Asha Verma'
+        assert document.org_type == 'clinic'
+        assert document.document == 'asha verma cardiology hindi english harbor clinic'
+
+    def test_role_change_removes_document(self):
+        doctor = make_doctor('Asha', 'Verma')
+        doctor.profile.role = 'patient'
+        doctor.profile.save()
+        assert not DoctorSearchDocument.objects.filter(user=doctor).exists()
+
+    def test_saves_of_unrelated_fields_skip_reindexing(self, django_assert_num_queries):
+        doctor = make_doctor('Asha', 'Verma')
+        profile = doctor.profile
+        profile.calendar_feed_key = uuid.uuid4()
+        with django_assert_num_queries(1):
+            profile.save(update_fields=['calendar_feed_key'])
+        profile.specialization = 'Dermatology'
+        profile.save(update_fields=['specialization'])
+        assert DoctorSearchDocument.objects.get(user=doctor).specialization == 'Dermatology'
+
+    def test_organization_rename_reindexes_members(self):
+        clinic = OrganizationFactory(name='Harbor Clinic')
+        doctor = make_doctor('Asha', 'Verma', clinic)
+        clinic.name = 'Bayside Clinic'
+        clinic.save()
+        assert DoctorSearchDocument.objects.get(user=doctor).organization_name == 'Bayside Clinic'
+
+    @pytest.mark.skipif(connection.vendor != 'postgresql', reason='full-text search needs PostgreSQL')
+    def test_search_ranks_prefix_and_typo_matches(self):
+        clinic = OrganizationFactory(org_type='clinic')
+        cardiologist = make_doctor('Asha', 'Verma', clinic, specialization='Cardiology', on_duty=True,
+                                   consultation_fee=Decimal('40'))
+        make_doctor('Ravi', 'Kumar', clinic, specialization='Dermatology', consultation_fee=Decimal('90'))
+
+        assert [d.user_id for d in search_doctors('cardi')] == [cardiologist.id]
+        assert [d.user_id for d in search_doctors('cardiolgy')] == [cardiologist.id]
+        assert [d.user_id for d in search_doctors('', {'max_fee': Decimal('50')})] == [cardiologist.id]
+
+
+@pytest.mark.django_db
+class TestDoctorFacets:
+    """Test single-pass facet counting"""
+
+    def setup_method(self):
+        cache.clear()
+        clinic = OrganizationFactory(org_type='clinic')
+        self.cardio = make_doctor('Asha', 'Verma', clinic, specialization='Cardiology', on_duty=True,
+                                  consultation_fee=Decimal('40'), rating=Decimal('4.8'), languages=['Hindi'])
+        self.derm = make_doctor('Ravi', 'Kumar', clinic, specialization='Dermatology', on_duty=False,
+                                consultation_fee=Decimal('120'), rating=Decimal('3.5'), languages=['English'])
+
+    def test_each_facet_ignores_its_own_filter(self):
+        rows = {
+            row['user_id']: row
+            for row in facets.facet_documents('', {'specialization': 'Cardiology', 'fee_band': '25-50'})
+        }
+        cardio, derm = rows[self.cardio.id], rows[self.derm.id]
+        assert cardio['fee_band'] == '25-50' and derm['fee_band'] == '100-200'
+        assert derm['rating_band'] == '3-4'
+        assert cardio['ok_all'] and not derm['ok_all']
+        assert cardio['ok_specialization'] and cardio['ok_fee_band']
+        # Dermatology fails the fee filter, so it does not count toward specializations
+        assert not derm['ok_specialization'] and not derm['ok_fee_band']
+
+    def test_counts_are_cached_per_signature(self, monkeypatch):
+        calls = []
+
+        def compute(query, filters):
+            calls.append((query, filters))
+            return {'total': len(calls), 'facets': {}}
+
+        monkeypatch.setattr(facets, 'compute_facet_counts', compute)
+        assert facets.facet_counts('Cardio', {'on_duty': True}) == facets.facet_counts('cardio', {'on_duty': True})
+        facets.facet_counts('cardio')
+        assert len(calls) == 2
+
+    @pytest.mark.skipif(connection.vendor != 'postgresql', reason='GROUPING SETS needs PostgreSQL')
+    def test_compute_facet_counts(self):
+        result = facets.compute_facet_counts('', {'specialization': 'Cardiology'})
+        assert result['total'] == 1
+        assert {b['value']: b['count'] for b in result['facets']['specialization']} == {
+            'Cardiology': 1, 'Dermatology': 1,
+        }
+        assert result['facets']['language'] == [{'value': 'Hindi', 'count': 1}]
+        assert result['facets']['on_duty'] == [{'value': True, 'count': 1}]
@@ -0,0 +1,41 @@
+from pulsecal_system.celery import app
+
+from . import tasks
+
+
+def route(task_name):
+    options = app.amqp.router.route({}, task_name, (), {})
+    return options['queue'].name, options.get('priority')
+
+
+class TestTaskRouting:
+    """Test the Celery queue topology, priorities and delivery options"""
+
+    def test_confirmations_never_share_a_queue_with_bulk_work(self):
+        assert route(tasks.send_appointment_confirmation.name) == ('realtime', 0)
+        assert route(tasks.send_appointment_cancellation.name) == ('realtime', 0)
+        assert route(tasks.send_appointment_reminder.name)[0] == 'reminders'
+        assert route(tasks.sync_google_calendar.name)[0] == 'bulk'
+        assert route(tasks.refresh_user_appointment_search.name)[0] == 'bulk'
+
+    def test_unrouted_tasks_default_to_maintenance(self):
+        assert route(tasks.prune_calendar_tombstones.name) == ('maintenance', 6)
+        assert route('pulsecal_system.celery.debug_task')[0] == 'maintenance'
+
+    def test_priorities_order_work_within_a_queue(self):
+        assert route(tasks.sync_google_calendar.name)[1] < route(tasks.queue_google_calendar_syncs.name)[1]
+        assert route(tasks.refresh_cache_entry.name)[1] < route(tasks.cleanup_old_notifications.name)[1]
+
+    def test_only_idempotent_tasks_ack_late(self):
+        assert tasks.rebuild_recent_rollups.acks_late and tasks.rebuild_recent_rollups.reject_on_worker_lost
+        assert tasks.sync_google_calendar.acks_late
+        assert not tasks.send_appointment_confirmation.acks_late
+        assert not tasks.send_appointment_reminder.acks_late
+
+    def test_time_limits_fit_inside_the_visibility_timeout(self):
+        visibility_timeout = app.conf.broker_transport_options['visibility_timeout']
+        for name in app.conf.task_annotations:
+            task = app.tasks[name]
+            assert task.soft_time_limit < task.time_limit < visibility_timeout
+        assert tasks.send_appointment_confirmation.rate_limit is None
+        assert tasks.sync_google_calendar.rate_limit
@@ -0,0 +1,68 @@
+import pytest
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache
+from django.test import RequestFactory
+
+from .factories import OrganizationFactory, make_member
+from .middleware import RequestContextMiddleware
+from .models import UserProfile
+from .user_context import ANONYMOUS, user_context
+
+
+@pytest.mark.django_db
+class TestUserContext:
+    """Test the cached per-user role/organization context"""
+
+    def setup_method(self):
+        cache.clear()
+
+    def test_context_is_cached_across_requests(self, django_assert_num_queries):
+        clinic = OrganizationFactory()
+        receptionist = make_member('receptionist', clinic)
+        context = user_context(receptionist)
+        assert (context.role, context.organization_id) == ('receptionist', clinic.id)
+        assert context.can('use_reception_desk') and context.can('import_appointments')
+
+        fresh = User.objects.get(pk=receptionist.pk)
+        with django_assert_num_queries(0):
+            assert user_context(fresh) == context
+
+    def test_miss_loads_profile_with_organization(self, django_assert_num_queries):
+        clinic = OrganizationFactory(name='Harbor Clinic')
+        doctor = make_member('doctor', clinic)
+        with django_assert_num_queries(1):
+            user_context(doctor)
+            assert doctor.profile.organization.name == 'Harbor Clinic'
+            str(doctor.profile)
+
+    def test_profile_save_retires_context(self):
+        patient = make_member('patient')
+        assert user_context(patient).is_patient
+        profile = UserProfile.objects.get(user=patient)
+        profile.role = 'doctor'
+        profile.save()
+        assert user_context(User.objects.get(pk=patient.pk)).is_doctor
+
+    def test_organization_delete_retires_members_context(self):
+        clinic = OrganizationFactory()
+        receptionist = make_member('receptionist', clinic)
+        assert user_context(receptionist).organization_id == clinic.id
+        clinic.delete()
+        context = user_context(User.objects.get(pk=receptionist.pk))
+        assert context.organization_id is None
+        assert not context.can('use_reception_desk')
+
+    def test_staff_permissions_follow_the_user(self):
+        patient = make_member('patient')
+        assert not user_context(patient).can('import_appointments')
+        patient = User.objects.get(pk=patient.pk)
+        patient.is_staff = True
+        assert user_context(patient).can('view_admin_analytics')
+
+    def test_middleware_attaches_lazy_context(self):
+        request = RequestFactory().get('/')
+        request.user = AnonymousUser()
+        seen = []
+        RequestContextMiddleware(lambda request: seen.append(request.pc_context.role))(request)
+        assert seen == [None]
+        assert request.pc_context == ANONYMOUS
@@ -12,6 +12,8 @@ urlpatterns = [
     path('dashboard/', views.dashboard, name='dashboard'),
     path('patient-dashboard/', views.patient_dashboard, name='patient_dashboard'),
     path('browse-doctors/', views.browse_doctors, name='browse_doctors'),
+    path('api/doctors/search/', views.api_search_doctors, name='api_search_doctors'),
+    path('api/doctors/facets/', views.api_doctor_facets, name='api_doctor_facets'),
     path('doctor/<int:doctor_id>/', views.doctor_detail, name='doctor_detail'),
     path('schedule/', views.schedule_appointment, name='schedule'),
     path('reschedule/<int:appointment_id>/', views.reschedule_appointment, name='reschedule'),
@@ -22,6 +24,9 @@ urlpatterns = [
     path('reminders/', views.reminders, name='reminders'),
     path('manage/', views.manage_appointments, name='manage'),
     path('calendar/', views.calendar_view, name='calendar'),
+    path('calendar/feed/create/', views.create_calendar_feed, name='create_calendar_feed'),
+    path('calendar/feed/reset/', views.reset_calendar_feed, name='reset_calendar_feed'),
+    path('calendar/feed/<uuid:feed_key>.ics', views.calendar_ics_feed, name='calendar_ics_feed'),
     path('api/appointments/', views.api_appointments, name='api_appointments'),
     path('update-status/<int:appointment_id>/', views.update_appointment_status, name='update_status'),
     path('google-calendar/init/', views.google_calendar_init, name='google_calendar_init'),
@@ -50,6 +55,7 @@ urlpatterns = [
     path('api/mark-notification-read/<int:notification_id>/', views.mark_notification_read, name='mark_notification_read'),
     path('api/unread-notifications-count/', views.get_unread_notifications_count, name='unread_notifications_count'),
     path('manage-analytics/', views.admin_analytics, name='admin_analytics'),
+    path('api/analytics/series/', views.api_analytics_series, name='api_analytics_series'),
     path('export-appointments/', views.export_appointments, name='export_appointments'),
     path('export-users/', views.export_users, name='export_users'),
     path('import-patients/', views.import_patients, name='import_patients'),
@@ -106,7 +112,7 @@ urlpatterns = [
     path('telemedicine-sessions/<int:session_id>/end/', views.end_telemedicine_session, name='end_telemedicine_session'),
     
     # Enhanced Features - Health Analytics
-    path('health-analytics/', views.health_analytics_view, name='health_analytics'),
+    path('health-analytics/', views.health_analytics, name='health_analytics'),
     
     # Reception Dashboard Import/Export
     path('reception/export-data/', views.export_reception_data, name='export_reception_data'),
@@ -0,0 +1,89 @@
+"""
+Per-user role and organization context.
+
+Views, dashboards and API scoping mostly need two facts about the caller:
+their role and their organization. ``user_context(user)`` returns them as a
+small ``UserContext``, cached under the user's profile namespace so a
+profile write retires it, and memoized on the user object so a request
+resolves it at most once. A cache miss loads the profile and organization
+in one query and keeps them on ``user.profile`` for the view to reuse.
+
+``appointments.middleware.RequestContextMiddleware`` exposes it lazily as
+``request.pc_context``.
+"""
+
+from collections import namedtuple
+
+from django.core.cache import cache
+
+from .cache_versions import profile_namespace, versioned_key
+
+CONTEXT_TIMEOUT = 60 * 60
+
+ROLE_PERMISSIONS = {
+    'doctor': {'view_practice_analytics', 'toggle_duty'},
+    'receptionist': {'view_practice_analytics', 'import_appointments'},
+    'patient': set(),
+}
+ORGANIZATION_PERMISSIONS = {
+    'receptionist': {'use_reception_desk'},
+}
+STAFF_PERMISSIONS = {'view_admin_analytics', 'import_appointments'}
+
+
+class UserContext(namedtuple('UserContext', ['user_id', 'role', 'organization_id', 'is_staff'])):
+    __slots__ = ()
+
+    @property
+    def is_patient(self):
+        return self.role == 'patient'
+
+    @property
+    def is_doctor(self):
+        return self.role == 'doctor'
+
+    @property
+    def is_receptionist(self):
+        return self.role == 'receptionist'
+
+    @property
+    def permissions(self):
+        permissions = set(ROLE_PERMISSIONS.get(self.role, ()))
+        if self.organization_id:
+            permissions |= ORGANIZATION_PERMISSIONS.get(self.role, set())
+        if self.is_staff:
+            permissions |= STAFF_PERMISSIONS
+        return frozenset(permissions)
+
+    def can(self, permission):
+        return permission in self.permissions
+
+
+ANONYMOUS = UserContext(None, None, None, False)
+
+
+def _load_profile(user):
+    """The user's profile (its organization joined in), kept on ``user.profile``; None without one"""
+    from .models import UserProfile
+    try:
+        return user.profile
+    except UserProfile.DoesNotExist:
+        return None
+
+
+def user_context(user):
+    """Role, organization and permissions for ``user``, resolved once per user object"""
+    if not user.is_authenticated:
+        return ANONYMOUS
+    context = getattr(user, '_pc_context', None)
+    if context is None:
+        key = versioned_key('user-context', [profile_namespace(user.id)], user.id)
+        cached = cache.get(key)
+        if cached is None:
+            profile = _load_profile(user)
+            cached = (profile.role, profile.organization_id) if profile is not None else (None, None)
+            cache.set(key, cached, CONTEXT_TIMEOUT)
+        context = UserContext(user.id, *cached, user.is_staff)
+        user._pc_context = context
+    return context
+
@@ -6,14 +6,46 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import login, authenticate
 from django.contrib import messages
-from django.http import JsonResponse, HttpResponse
+from django.http import JsonResponse, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.urls import reverse
 from django.views.decorators.csrf import csrf_exempt, ensure_csrf_cookie
 from django.views.decorators.http import require_http_methods
 from django.core.exceptions import ValidationError
 from django.db import transaction
+from django.db.models import Count, Q, Sum
 from django.conf import settings
+from django.contrib.auth.models import User
+from django.utils import timezone
+from collections import defaultdict
+from datetime import date, timedelta
+import json
 import logging
 
+from .analytics import SeriesError, SeriesScope, cached_series, hour_of_day_counts, parse_range
+from .appointment_search import search_appointments as find_appointments
+from .dashboard_cache import cached_fragment, dashboard_scope, doctor_infos, doctor_status
+from .cache_versions import DOCTOR_DIRECTORY, ORGANIZATION_DIRECTORY
+from .calendar_feed import CalendarFeedError, SyncTokenExpired, calendar_events, parse_window
+from .directions import get_travel_estimate, remember_origin, remembered_origins
+from .facets import facet_counts
+from .forms import AppointmentForm, AppointmentImportForm, DoctorDutyForm, MinimalPatientCreationForm
+from .geo import decode_geohash, filter_within_radius, parse_coordinates
+from .google_calendar import connect_link, oauth_flow
+from .ics_feed import (
+    cached_feed, ensure_feed_key, feed_etag, feed_key_for, feed_owner, last_modified_header, not_modified, render_time, reset_feed_key,
+    schedule_stamp, stream_and_cache,
+)
+from .importers import AppointmentImporter, read_appointment_rows
+from .map_clusters import MarkerLayer, filter_signature, parse_viewport
+from .models import (
+    Appointment, DoctorSearchDocument, GoogleCalendarLink, MedicalRecord, Organization, Payment, Prescription, UserProfile,
+)
+from .pagination import InvalidCursor, keyset_page
+from .query_budget import query_budget
+from .rollups import daily_series, facts_for, summarize
+from .search import DEFAULT_SEARCH_LIMIT, cached_search_doctors, parse_search_filters
+from .utils import log_audit_event
+
 logger = logging.getLogger(__name__)
 
 def home(request):
@@ -32,16 +64,833 @@ def home(request):
 def dashboard(request):
     """Dashboard view with proper error handling"""
     try:
+        pc_context = request.pc_context
+        if request.method == 'POST' and pc_context.can('toggle_duty'):
+            duty_form = DoctorDutyForm(request.POST, instance=request.user.profile)
+            if duty_form.is_valid():
+                duty_form.save()
+                messages.success(request, 'Duty status updated')
+            return redirect('appointments:dashboard')
+
+        today = timezone.localdate()
+        filter_day = _date_param(request.GET.get('date'), today)
+        filter_status = request.GET.get('status', '')
         context = {
             'user': request.user,
-            'title': 'Dashboard'
+            'title': 'Dashboard',
+            'filter_date': request.GET.get('date', ''),
+            'filter_status': filter_status,
+            'available_patient_statuses': [
+                {'value': value, 'label': label} for value, label in Appointment.PATIENT_STATUS_CHOICES
+            ],
         }
+        scope = dashboard_scope(request.user)
+        if scope is not None:
+            context.update(cached_fragment(*scope, 'stats', today))
+            appointments = cached_fragment(*scope, 'day', filter_day)
+            context['appointments'] = [
+                appointment for appointment in appointments
+                if not filter_status or appointment.status == filter_status
+            ]
+        if pc_context.is_doctor:
+            schedule = cached_fragment('doctor', request.user.id, 'day', today)
+            context.update(doctor_status(schedule, today))
+            context['duty_form'] = DoctorDutyForm(instance=request.user.profile)
+            context['current_org'] = request.user.profile.organization
+        elif pc_context.is_receptionist and pc_context.organization_id:
+            context['member_doctors'] = UserProfile.objects.filter(
+                organization_id=pc_context.organization_id, role='doctor'
+            ).select_related('user')
         return render(request, 'appointments/dashboard.html', context)
     except Exception as e:
         logger.error(f"Error in dashboard view: {e}")
         messages.error(request, 'Unable to load dashboard')
         return redirect('home')
 
+PATIENT_ORDERING = ('first_name', 'last_name', 'id')
+PATIENT_PAGE_SIZE = 50
+
+@login_required
+def reception_dashboard(request):
+    """Reception desk: doctor cards for the organization, patient lookup and booking"""
+    organization_id = request.pc_context.organization_id
+    if not request.pc_context.can('use_reception_desk'):
+        messages.error(request, 'Only receptionists of an organization can access the reception dashboard')
+        return redirect('appointments:dashboard')
+
+    form = AppointmentForm()
+    patient_form = MinimalPatientCreationForm()
+    if request.method == 'POST' and request.POST.get('create_patient'):
+        patient_form = MinimalPatientCreationForm(request.POST)
+        if patient_form.is_valid():
+            patient = patient_form.save()
+            patient.profile.phone = patient_form.cleaned_data.get('phone')
+            patient.profile.save()
+            messages.success(request, f'Patient {patient.get_full_name() or patient.username} added')
+            return redirect(f"{request.path}?patient={patient.id}")
+    elif request.method == 'POST':
+        form = AppointmentForm(request.POST)
+        if form.is_valid():
+            appointment = form.save(commit=False)
+            appointment.organization_id = organization_id
+            appointment.save()
+            log_audit_event(request.user, 'appointment_booked', f'Booked appointment {appointment.id}',
+                            object_type='Appointment', object_id=appointment.id)
+            messages.success(request, 'Appointment booked')
+            return redirect('appointments:reception_dashboard')
+
+    today = timezone.localdate()
+    doctors = list(
+        User.objects.filter(profile__organization_id=organization_id, profile__role='doctor')
+        .select_related('profile').order_by('first_name', 'last_name')
+    )
+    search_query = request.GET.get('search', '').strip()
+    patients = User.objects.filter(profile__role='patient')
+    if search_query:
+        patients = patients.filter(
+            Q(first_name__icontains=search_query) | Q(last_name__icontains=search_query)
+            | Q(username__icontains=search_query)
+        )
+    try:
+        patient_page = keyset_page(patients, PATIENT_ORDERING, request.GET.get('patients_after'), PATIENT_PAGE_SIZE)
+    except InvalidCursor:
+        patient_page = keyset_page(patients, PATIENT_ORDERING, limit=PATIENT_PAGE_SIZE)
+    context = {
+        'today': today,
+        'doctor_infos': doctor_infos(doctors, today),
+        'patients': patient_page.object_list,
+        'next_patients_cursor': patient_page.next_cursor,
+        'search_query': search_query,
+        'selected_patient_id': request.GET.get('patient', ''),
+        'form': form,
+        'patient_form': patient_form,
+    }
+    context.update(cached_fragment('organization', organization_id, 'stats', today))
+    return render(request, 'appointments/reception_dashboard.html', context)
+
+@login_required
+def patient_dashboard(request):
+    """A patient's appointments today, their place in the queue and what is coming up"""
+    today = timezone.localdate()
+    user_id = request.user.id
+    today_appointments = cached_fragment('patient', user_id, 'day', today)
+    queue_appointments = [
+        appointment for appointment in today_appointments
+        if appointment.status in ('confirmed', 'checkedin') and appointment.patient_status != 'done'
+    ]
+    doctors = {appointment.doctor_id: appointment.doctor for appointment in queue_appointments}
+    context = {
+        'today_appointments': today_appointments,
+        'queue_appointments': queue_appointments,
+        'upcoming_appointments': cached_fragment('patient', user_id, 'upcoming', today),
+        'doctor_infos': doctor_infos(list(doctors.values()), today),
+    }
+    context.update(cached_fragment('patient', user_id, 'stats', today))
+    return render(request, 'appointments/patient_dashboard.html', context)
+
+@login_required
+def import_appointments_enhanced(request):
+    """Import appointments from CSV/Excel with batched conflict detection"""
+    if not request.pc_context.can('import_appointments'):
+        messages.error(request, 'You do not have permission to import appointments')
+        return redirect('appointments:dashboard')
+
+    context = {'title': 'Import Appointments'}
+    if request.method == 'POST':
+        form = AppointmentImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            import_mode = form.cleaned_data['import_mode']
+            try:
+                rows = read_appointment_rows(form.cleaned_data['file'])
+                importer = AppointmentImporter(form.cleaned_data['organization'])
+                results, created = importer.run(rows, commit=import_mode == 'import')
+            except Exception as e:
+                logger.error(f"Error importing appointments: {e}")
+                messages.error(request, 'Unable to read the uploaded file')
+                results, created = [], []
+
+            context.update({
+                'preview_data': [r for r in results if r.is_valid],
+                'errors': [f"Row {r.row_number}: {'; '.join(r.errors)}" for r in results if not r.is_valid],
+                'import_report': [r.as_dict() for r in results],
+                'import_mode': import_mode,
+            })
+            if created:
+                log_audit_event(
+                    request.user, 'data_imported',
+                    details=f"Imported {len(created)} appointments",
+                    object_type='appointment',
+                )
+                messages.success(request, f'Imported {len(created)} appointments')
+    else:
+        form = AppointmentImportForm()
+
+    context['form'] = form
+    return render(request, 'appointments/import_appointments_enhanced.html', context)
+
+DEFAULT_SEARCH_RADIUS_KM = 10
+MAX_SEARCH_RADIUS_KM = 100
+DEFAULT_RESULT_LIMIT = 20
+MAX_RESULT_LIMIT = 200
+
+def _bounded_number(value, default, maximum, cast=float):
+    """Parse a positive numeric query parameter, clamped to ``maximum``"""
+    try:
+        number = cast(value)
+    except (TypeError, ValueError):
+        return default
+    if number <= 0:
+        return default
+    return min(number, maximum)
+
+def _clinic_payload(organization):
+    distance = getattr(organization, 'distance_km', None)
+    return {
+        'id': organization.id,
+        'name': organization.name,
+        'address': organization.address,
+        'phone': organization.phone,
+        'org_type': organization.org_type,
+        'org_type_display': organization.get_org_type_display(),
+        'is_24_hours': organization.is_24_hours,
+        'latitude': float(organization.latitude),
+        'longitude': float(organization.longitude),
+        'distance': round(distance, 2) if distance is not None else None,
+    }
+
+def _doctor_payload(profile):
+    organization = profile.organization
+    distance = getattr(profile, 'distance_km', None)
+    return {
+        'id': profile.user_id,
+        'name': f"Dr. {profile.user.get_full_name() or profile.user.username}",
+        'specialization': profile.specialization or '',
+        'organization': organization.name,
+        'organization_id': organization.id,
+        'org_type': organization.org_type,
+        'rating': float(profile.rating or 0),
+        'consultation_fee': float(profile.consultation_fee or 0),
+        'on_duty': profile.on_duty,
+        'avatar_url': profile.avatar.url if profile.avatar else None,
+        'latitude': float(organization.latitude),
+        'longitude': float(organization.longitude),
+        'distance': round(distance, 2) if distance is not None else None,
+    }
+
+def nearby_clinics(request):
+    """Nearby clinics page; POST returns the k nearest clinics as JSON"""
+    if request.method == 'POST':
+        coordinates = parse_coordinates(request.POST.get('latitude'), request.POST.get('longitude'))
+        if coordinates is None:
+            return JsonResponse({'error': 'Valid latitude and longitude are required'}, status=400)
+        radius = _bounded_number(request.POST.get('radius'), DEFAULT_SEARCH_RADIUS_KM, MAX_SEARCH_RADIUS_KM)
+        limit = _bounded_number(request.POST.get('limit'), DEFAULT_RESULT_LIMIT, MAX_RESULT_LIMIT, int)
+        clinics = Organization.objects.nearest(*coordinates, limit=limit, max_radius_km=radius)
+        return JsonResponse({
+            'clinics': [_clinic_payload(clinic) for clinic in clinics],
+            'radius': radius,
+        })
+
+    clinics = Organization.objects.with_coordinates().order_by('name')[:DEFAULT_RESULT_LIMIT]
+    return render(request, 'appointments/nearby_clinics.html', {
+        'clinics': clinics,
+        'google_maps_api_key': settings.GOOGLE_MAPS_API_KEY,
+    })
+
+def clinic_search_results(query='', coordinates=None, radius=DEFAULT_SEARCH_RADIUS_KM, limit=DEFAULT_RESULT_LIMIT):
+    """Organizations matching ``query`` with their doctors; nearest first when coordinates are given"""
+    organizations = Organization.objects.all()
+    if query:
+        organizations = organizations.filter(name__icontains=query)
+    if coordinates is not None:
+        organizations = organizations.nearest(*coordinates, limit=limit, max_radius_km=radius)
+    else:
+        organizations = list(organizations.order_by('name')[:limit])
+    doctors = defaultdict(list)
+    profiles = UserProfile.objects.filter(role='doctor', organization__in=organizations).select_related('user')
+    for profile in profiles.order_by('user__first_name', 'user__last_name'):
+        doctors[profile.organization_id].append(profile)
+    return [{'org': organization, 'doctors': doctors[organization.id]} for organization in organizations]
+
+def search_clinics(request):
+    """Clinic search by name; with latitude/longitude the results come from the geohash radius search"""
+    query = request.GET.get('q', '').strip()
+    coordinates = parse_coordinates(request.GET.get('latitude'), request.GET.get('longitude'))
+    radius = _bounded_number(request.GET.get('radius'), DEFAULT_SEARCH_RADIUS_KM, MAX_SEARCH_RADIUS_KM)
+    limit = _bounded_number(request.GET.get('limit'), DEFAULT_RESULT_LIMIT, MAX_RESULT_LIMIT, int)
+    return render(request, 'appointments/search_clinics.html', {
+        'query': query,
+        'coordinates': coordinates,
+        'orgs_with_doctors': clinic_search_results(query, coordinates, radius, limit),
+    })
+
+def _location_org_payload(organization):
+    return {
+        **_clinic_payload(organization),
+        'type': organization.get_org_type_display(),
+        'email': organization.email,
+        'specialization': organization.get_org_type_display(),
+    }
+
+def _location_doctor_payload(profile):
+    organization = profile.organization
+    return {
+        **_doctor_payload(profile),
+        'address': organization.address,
+        'phone': profile.phone or organization.phone,
+        'email': profile.user.email,
+    }
+
+def _map_doctors_queryset():
+    return UserProfile.objects.filter(
+        role='doctor',
+        organization__latitude__isnull=False,
+        organization__longitude__isnull=False,
+    ).select_related('user', 'organization')
+
+@require_http_methods(["GET"])
+def api_locations(request):
+    """
+    Organizations and doctors for the maps page, clustered for a viewport.
+
+    Accepts ``bbox=west,south,east,north``, ``zoom`` and a ``filter``
+    (all, organizations, doctors, on_duty, 24_hours). Each list holds
+    clusters (count + centroid) or, when zoomed in, individual markers.
+    """
+    viewport = parse_viewport(request.GET.get('bbox'), request.GET.get('zoom'))
+    if viewport is None:
+        return JsonResponse({'error': 'bbox must be west,south,east,north'}, status=400)
+    bbox, zoom = viewport
+    map_filter = request.GET.get('filter', 'all')
+
+    organizations = Organization.objects.with_coordinates()
+    doctors = _map_doctors_queryset()
+    if map_filter == '24_hours':
+        organizations = organizations.filter(is_24_hours=True)
+        doctors = doctors.filter(organization__is_24_hours=True)
+    elif map_filter == 'on_duty':
+        doctors = doctors.filter(on_duty=True)
+
+    signature = filter_signature(filter=map_filter)
+    response = {'zoom': zoom, 'organizations': [], 'doctors': []}
+    if map_filter not in ('doctors', 'on_duty'):
+        layer = MarkerLayer(
+            'organizations', organizations, _location_org_payload, signature,
+            namespaces=[ORGANIZATION_DIRECTORY],
+        )
+        response['organizations'] = layer.markers(bbox, zoom)
+    if map_filter != 'organizations':
+        layer = MarkerLayer(
+            'doctors', doctors, _location_doctor_payload, signature,
+            prefix='organization__', id_field='user_id', namespaces=[DOCTOR_DIRECTORY],
+        )
+        response['doctors'] = layer.markers(bbox, zoom)
+    return JsonResponse(response)
+
+@require_http_methods(["GET"])
+def api_doctors_map(request):
+    """
+    Doctors for the map, filtered by the sidebar controls.
+
+    With ``lat``/``lng`` the nearest doctors within ``radius`` km are
+    returned with their distance, ranked in SQL. With ``bbox``/``zoom`` the
+    result is clustered for that viewport like ``api_locations``.
+    """
+    params = request.GET
+    doctors = _map_doctors_queryset()
+
+    search = params.get('search', '').strip()
+    if search:
+        doctors = doctors.filter(
+            Q(user__first_name__icontains=search)
+            | Q(user__last_name__icontains=search)
+            | Q(specialization__icontains=search)
+        )
+    if params.get('specialization'):
+        doctors = doctors.filter(specialization__iexact=params['specialization'])
+    if params.get('org_type'):
+        doctors = doctors.filter(organization__org_type=params['org_type'])
+    if params.get('on_duty') == 'true':
+        doctors = doctors.filter(on_duty=True)
+    min_rating = _bounded_number(params.get('min_rating'), None, 5)
+    if min_rating is not None:
+        doctors = doctors.filter(rating__gte=min_rating)
+    max_fee = _bounded_number(params.get('max_fee'), None, float('inf'))
+    if max_fee is not None:
+        doctors = doctors.filter(consultation_fee__lte=max_fee)
+
+    if 'bbox' in params:
+        viewport = parse_viewport(params.get('bbox'), params.get('zoom'))
+        if viewport is None:
+            return JsonResponse({'error': 'bbox must be west,south,east,north'}, status=400)
+        bbox, zoom = viewport
+        signature = filter_signature(
+            search=search.lower(),
+            specialization=params.get('specialization', '').lower(),
+            org_type=params.get('org_type'),
+            on_duty=params.get('on_duty') == 'true',
+            min_rating=min_rating,
+            max_fee=max_fee,
+        )
+        layer = MarkerLayer(
+            'doctor-map', doctors, _doctor_payload, signature,
+            prefix='organization__', id_field='user_id', namespaces=[DOCTOR_DIRECTORY],
+        )
+        return JsonResponse({'zoom': zoom, 'doctors': layer.markers(bbox, zoom)})
+
+    limit = _bounded_number(params.get('limit'), MAX_RESULT_LIMIT, MAX_RESULT_LIMIT, int)
+    coordinates = parse_coordinates(params.get('lat'), params.get('lng'))
+    if coordinates is not None:
+        radius = _bounded_number(params.get('radius'), DEFAULT_SEARCH_RADIUS_KM, MAX_SEARCH_RADIUS_KM)
+        doctors = filter_within_radius(doctors, *coordinates, radius, prefix='organization__')
+    else:
+        doctors = doctors.order_by('id')
+
+    return JsonResponse({'doctors': [_doctor_payload(profile) for profile in doctors[:limit]]})
+
+def _search_result_payload(document):
+    rank = getattr(document, 'rank', None)
+    return {
+        'id': document.user_id,
+        'name': f"Dr. {document.full_name}",
+        'specialization': document.specialization,
+        'qualification': document.qualification,
+        'languages': document.languages,
+        'organization': document.organization_name,
+        'organization_id': document.organization_id,
+        'org_type': document.org_type,
+        'on_duty': document.on_duty,
+        'rating': float(document.rating) if document.rating is not None else None,
+        'consultation_fee': float(document.consultation_fee) if document.consultation_fee is not None else None,
+        'score': round(rank, 4) if rank is not None else None,
+    }
+
+def browse_doctors(request):
+    """Doctor directory with ranked full-text search and facet filters"""
+    search_query = request.GET.get('search', '').strip()
+    filters = parse_search_filters(request.GET)
+    documents = cached_search_doctors(search_query, filters, limit=60)
+    doctor_infos = [
+        {
+            'doctor': document.user,
+            'profile': document,
+            'on_duty': document.on_duty,
+            'organization': document.organization,
+        }
+        for document in documents
+    ]
+    specializations = (
+        DoctorSearchDocument.objects.filter(is_active=True).exclude(specialization='')
+        .order_by('specialization').values_list('specialization', flat=True).distinct()
+    )
+    context = {
+        'doctor_infos': doctor_infos,
+        'specializations': specializations,
+        'search_query': search_query,
+        'org_name': filters.get('org_name', ''),
+        'specialization_filter': filters.get('specialization', ''),
+    }
+    return render(request, 'appointments/browse_doctors.html', context)
+
+@require_http_methods(["GET"])
+def api_search_doctors(request):
+    """
+    Search-as-you-type endpoint for doctors.
+
+    ``q`` is matched by prefix and typo-tolerant trigram similarity; facet
+    filters are ``specialization``, ``org_type``, ``org_name``, ``on_duty``,
+    ``min_fee``, ``max_fee`` and ``min_rating``.
+    """
+    limit = _bounded_number(request.GET.get('limit'), DEFAULT_SEARCH_LIMIT, MAX_RESULT_LIMIT, int)
+    documents = cached_search_doctors(request.GET.get('q', ''), parse_search_filters(request.GET), limit=limit)
+    return JsonResponse({'results': [_search_result_payload(document) for document in documents]})
+
+@require_http_methods(["GET"])
+def api_doctor_facets(request):
+    """
+    Facet counts for the doctor browser, for the same parameters as
+    ``api_search_doctors``. Each facet is counted with every other selected
+    filter applied, so the UI can refresh all counts in one cheap call.
+    """
+    return JsonResponse(facet_counts(request.GET.get('q', ''), parse_search_filters(request.GET)))
+
+def _appointment_search_payload(appointment):
+    return {
+        'id': appointment.id,
+        'patient': appointment.patient.get_full_name() or appointment.patient.username,
+        'doctor': f"Dr. {appointment.doctor.get_full_name() or appointment.doctor.username}",
+        'organization': appointment.organization.name if appointment.organization else None,
+        'appointment_date': appointment.appointment_date.isoformat(),
+        'status': appointment.status,
+        'status_display': appointment.get_status_display(),
+        'appointment_type': appointment.appointment_type,
+        'notes': appointment.notes or '',
+    }
+
+@login_required
+@require_http_methods(["GET"])
+def search_appointments(request):
+    """
+    Search appointments by patient/doctor name, email or notes.
+
+    Scoped to the caller (organization for reception, own appointments for
+    doctors and patients) and paged with an opaque ``cursor``.
+    """
+    limit = _bounded_number(request.GET.get('limit'), DEFAULT_RESULT_LIMIT, MAX_RESULT_LIMIT, int)
+    try:
+        appointments, next_cursor = find_appointments(
+            request.user,
+            request.GET.get('q', ''),
+            cursor=request.GET.get('cursor'),
+            limit=limit,
+            status=request.GET.get('status') or None,
+        )
+    except InvalidCursor:
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+    return JsonResponse({
+        'results': [_appointment_search_payload(appointment) for appointment in appointments],
+        'next_cursor': next_cursor,
+    })
+
+ICS_CONTENT_TYPE = 'text/calendar; charset=utf-8'
+
+@login_required
+def calendar_view(request):
+    """Calendar page; events are fetched from api_appointments as the visible range changes"""
+    feed_key = feed_key_for(request.user)
+    feed_url = reverse('appointments:calendar_ics_feed', args=[feed_key]) if feed_key else None
+    return render(request, 'appointments/calendar.html', {
+        'feed_url': request.build_absolute_uri(feed_url) if feed_url else None,
+        'google_calendar_connected': GoogleCalendarLink.objects.filter(user=request.user).exists(),
+    })
+
+@login_required
+@require_http_methods(["POST"])
+def create_calendar_feed(request):
+    """Create the user's subscription URL; the calendar page only reads it"""
+    ensure_feed_key(request.user)
+    return redirect('appointments:calendar')
+
+@login_required
+@require_http_methods(["POST"])
+def reset_calendar_feed(request):
+    """Issue a new subscription URL; apps subscribed to the old one stop receiving updates"""
+    reset_feed_key(request.user)
+    messages.success(request, 'Your calendar subscription link has been reset')
+    return redirect('appointments:calendar')
+
+@login_required
+def google_calendar_init(request):
+    """Start the Google consent flow for writing appointments to the user's calendar"""
+    if not settings.GOOGLE_CLIENT_ID:
+        messages.error(request, 'Google Calendar sync is not configured')
+        return redirect('appointments:calendar')
+    flow = oauth_flow(request.build_absolute_uri(reverse('appointments:google_calendar_redirect')))
+    authorization_url, state = flow.authorization_url(access_type='offline', prompt='consent')
+    request.session['google_calendar_state'] = state
+    return redirect(authorization_url)
+
+@login_required
+def google_calendar_redirect(request):
+    """OAuth callback: store the credentials and queue the first sync"""
+    from .tasks import sync_google_calendar
+    state = request.session.pop('google_calendar_state', None)
+    if state is None or request.GET.get('state') != state or 'error' in request.GET:
+        messages.error(request, 'Google Calendar was not connected')
+        return redirect('appointments:calendar')
+    try:
+        flow = oauth_flow(request.build_absolute_uri(reverse('appointments:google_calendar_redirect')), state=state)
+        flow.fetch_token(authorization_response=request.build_absolute_uri())
+    except Exception as e:
+        logger.error(f"Google Calendar authorization failed for user {request.user.id}: {e}")
+        messages.error(request, 'Google Calendar authorization failed')
+        return redirect('appointments:calendar')
+    credentials = flow.credentials
+    link = connect_link(request.user, {
+        'token': credentials.token,
+        'refresh_token': credentials.refresh_token,
+        'scopes': list(credentials.scopes or []),
+    })
+    transaction.on_commit(lambda: sync_google_calendar.delay(link.id))
+    messages.success(request, 'Google Calendar connected; your appointments will appear there shortly')
+    return redirect('appointments:calendar')
+
+@login_required
+@require_http_methods(["POST"])
+def google_calendar_sync(request):
+    """Queue a sync of the user's Google Calendar now instead of waiting for the next scheduled one"""
+    from .tasks import sync_google_calendar
+    link = GoogleCalendarLink.objects.filter(user=request.user).only('id').first()
+    if link is None:
+        return redirect('appointments:google_calendar_init')
+    try:
+        sync_google_calendar.delay(link.id)
+        messages.success(request, 'Google Calendar sync started')
+    except Exception as e:
+        logger.error(f"Failed to queue Google Calendar sync for user {request.user.id}: {e}")
+        messages.error(request, 'Unable to start Google Calendar sync')
+    return redirect('appointments:calendar')
+
+@require_http_methods(["GET"])
+def calendar_ics_feed(request, feed_key):
+    """
+    iCalendar subscription feed of the key owner's appointments.
+
+    Unchanged schedules are answered with 304 from the cache alone; changed
+    ones from the rendered feed cached for the new schedule version, or a
+    streamed render that fills it.
+    """
+    user_id = feed_owner(feed_key)
+    if user_id is None:
+        return HttpResponse('Unknown calendar feed', status=404, content_type='text/plain')
+    stamp = schedule_stamp(user_id)
+    etag = feed_etag(user_id, stamp)
+    last_modified = None
+    if not_modified(request, etag):
+        response = HttpResponseNotModified()
+    else:
+        cached = cached_feed(user_id, stamp)
+        if cached is None:
+            last_modified = render_time()
+            response = StreamingHttpResponse(stream_and_cache(user_id, stamp, last_modified), content_type=ICS_CONTENT_TYPE)
+        else:
+            body, last_modified = cached
+            if not_modified(request, etag, last_modified):
+                response = HttpResponseNotModified()
+            else:
+                response = HttpResponse(body, content_type=ICS_CONTENT_TYPE)
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = last_modified_header(last_modified)
+    response['Cache-Control'] = 'private, max-age=300'
+    return response
+
+@login_required
+@require_http_methods(["GET"])
+@query_budget(6)
+def api_appointments(request):
+    """
+    Calendar events between ``start`` and ``end`` (ISO dates or datetimes).
+
+    Send back the previous response's ``sync_token`` to get only what changed:
+    drop the ``deleted`` ids and events outside the range, then upsert
+    ``events``. An expired token answers 410; reload without it.
+    """
+    try:
+        start, end = parse_window(request.GET.get('start'), request.GET.get('end'))
+        feed = calendar_events(request.user, start, end, request.GET.get('sync_token') or None)
+    except SyncTokenExpired as e:
+        return JsonResponse({'error': str(e)}, status=410)
+    except CalendarFeedError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse(feed)
+
+ANALYTICS_DEFAULT_DAYS = 30
+
+def _date_param(value, default):
+    try:
+        return date.fromisoformat(value) if value else default
+    except ValueError:
+        return default
+
+def _int_param(value):
+    return int(value) if value and value.isdigit() else None
+
+@login_required
+def admin_analytics(request):
+    """Organization-wide analytics for staff, read from the daily rollups"""
+    if not request.user.is_staff:
+        messages.error(request, 'You do not have permission to view analytics')
+        return redirect('appointments:dashboard')
+
+    today = timezone.localdate()
+    date_end = _date_param(request.GET.get('date_end'), today)
+    date_start = _date_param(request.GET.get('date_start'), date_end - timedelta(days=ANALYTICS_DEFAULT_DAYS - 1))
+    selected_org = _int_param(request.GET.get('organization'))
+    selected_doctor = _int_param(request.GET.get('doctor'))
+    selected_specialization = request.GET.get('specialization', '')
+
+    facts = facts_for(organization=selected_org, doctor=selected_doctor, start=date_start, end=date_end)
+    appointments = Appointment.objects.all()
+    if selected_org:
+        appointments = appointments.filter(organization_id=selected_org)
+    if selected_doctor:
+        appointments = appointments.filter(doctor_id=selected_doctor)
+    if selected_specialization:
+        facts = facts.filter(doctor__profile__specialization=selected_specialization)
+        appointments = appointments.filter(doctor__profile__specialization=selected_specialization)
+
+    summary = summarize(facts)
+    day_labels, appt_counts = daily_series(facts, date_start, date_end)
+    # Hour of day is finer than the daily rollups, so it only covers the end of a long range
+    hour_counts, hour_start = hour_of_day_counts(appointments, date_start, date_end)
+    roles = dict(UserProfile.objects.order_by().values_list('role').annotate(total=Count('id')))
+    role_labels = [label for _, label in UserProfile.ROLE_CHOICES]
+
+    context = {
+        'org_options': Organization.objects.order_by('name').only('id', 'name'),
+        'doctor_options': User.objects.filter(profile__role='doctor').order_by('first_name', 'last_name'),
+        'specialization_options': (
+            UserProfile.objects.filter(role='doctor').exclude(specialization__isnull=True).exclude(specialization='')
+            .order_by('specialization').values_list('specialization', flat=True).distinct()
+        ),
+        'selected_org': selected_org,
+        'selected_doctor': selected_doctor,
+        'selected_specialization': selected_specialization,
+        'date_start': date_start.isoformat(),
+        'date_end': date_end.isoformat(),
+        'summary': summary,
+        'no_show_rate': summary['no_show_rate'],
+        'day_labels': json.dumps(day_labels),
+        'appt_counts': json.dumps(appt_counts),
+        'hour_labels': json.dumps([f"{hour:02d}:00" for hour in range(24)]),
+        'hour_counts': json.dumps(hour_counts),
+        'hour_start': hour_start.isoformat(),
+        'role_labels': json.dumps(role_labels),
+        'role_counts': json.dumps([roles.get(role, 0) for role, _ in UserProfile.ROLE_CHOICES]),
+        'active_doctors_per_org': [
+            {'org': org, 'active': org.active, 'total': org.total}
+            for org in Organization.objects.annotate(
+                total=Count('members', filter=Q(members__role='doctor')),
+                active=Count('members', filter=Q(members__role='doctor', members__on_duty=True)),
+            ).filter(total__gt=0).order_by('name')
+        ],
+    }
+    return render(request, 'appointments/admin_analytics.html', context)
+
+@login_required
+def health_analytics(request):
+    """Practice/clinic analytics from the rollups for staff; personal history for patients"""
+    pc_context = request.pc_context
+    is_doctor = pc_context.is_doctor
+    is_receptionist = pc_context.is_receptionist
+
+    if is_doctor or is_receptionist:
+        if is_doctor:
+            facts = facts_for(doctor=request.user)
+            appointments = Appointment.objects.filter(doctor=request.user)
+        else:
+            organization_id = pc_context.organization_id
+            facts = facts_for(organization=organization_id) if organization_id else facts_for().none()
+            appointments = Appointment.objects.filter(organization_id=organization_id)
+        summary = summarize(facts)
+        total_appointments = summary['total']
+        completed_appointments = summary['by_status'].get('completed', 0)
+        total_spent = summary['paid_total']
+        total_patients = appointments.values('patient_id').distinct().count()
+        active_prescriptions = 0
+    else:
+        appointments = Appointment.objects.filter(patient=request.user)
+        counts = appointments.aggregate(total=Count('id'), completed=Count('id', filter=Q(status='completed')))
+        total_appointments, completed_appointments = counts['total'], counts['completed']
+        total_spent = Payment.objects.filter(patient=request.user, status='completed').aggregate(
+            total=Sum('amount'))['total'] or 0
+        total_patients = 0
+        active_prescriptions = Prescription.objects.filter(patient=request.user, status='active').count()
+
+    prescriptions = Prescription.objects.filter(doctor=request.user) if is_doctor else Prescription.objects.filter(patient=request.user)
+    records = MedicalRecord.objects.filter(doctor=request.user) if is_doctor else MedicalRecord.objects.filter(patient=request.user)
+    context = {
+        'is_doctor': is_doctor,
+        'is_receptionist': is_receptionist,
+        'total_appointments': total_appointments,
+        'completed_appointments': completed_appointments,
+        'total_patients': total_patients,
+        'total_spent': total_spent,
+        'active_prescriptions': active_prescriptions,
+        'recent_appointments': appointments.select_related('patient', 'doctor').order_by('-appointment_date')[:5],
+        'recent_prescriptions': prescriptions.order_by('-prescribed_date')[:5],
+        'recent_records': records.select_related('doctor').order_by('-date_recorded')[:5],
+    }
+    return render(request, 'appointments/health_analytics.html', context)
+
+@login_required
+@require_http_methods(["GET"])
+def api_analytics_series(request):
+    """
+    Bucketed chart data: ``metric`` (appointments, fees, revenue), ``bucket``
+    (hour, day, week, month), optional ``dimension``, ``start``/``end`` dates
+    and, for staff, ``organization``. Returns columnar JSON with an ETag so
+    unchanged series are answered with 304.
+    """
+    scope = SeriesScope.for_user(request.user, _int_param(request.GET.get('organization')))
+    if scope is None:
+        return JsonResponse({'error': 'You do not have permission to view analytics'}, status=403)
+    try:
+        start, end = parse_range(request.GET.get('start'), request.GET.get('end'))
+        body, etag = cached_series(
+            request.GET.get('metric', 'appointments'),
+            request.GET.get('bucket', 'day'),
+            start, end, scope,
+            dimension=request.GET.get('dimension') or None,
+        )
+    except SeriesError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    if etag in request.headers.get('If-None-Match', ''):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(body, content_type='application/json')
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, max-age=60'
+    return response
+
+def _travel_origin(request):
+    """
+    The patient's origin for travel estimates.
+
+    Coordinates passed as ``lat``/``lng`` are remembered (coarsely) so the
+    beat task can precompute routes; otherwise the last remembered area is
+    used.
+    """
+    coordinates = parse_coordinates(request.GET.get('lat'), request.GET.get('lng'))
+    if coordinates is not None:
+        remember_origin(request.user.id, *coordinates)
+        return coordinates
+    cell = remembered_origins([request.user.id]).get(request.user.id)
+    return decode_geohash(cell) if cell else None
+
+@login_required
+def appointment_directions(request, appointment_id):
+    """Directions to an appointment's clinic, with a cached travel estimate"""
+    appointment = get_object_or_404(
+        Appointment.objects.select_related('doctor', 'organization'),
+        Q(patient=request.user) | Q(doctor=request.user),
+        id=appointment_id,
+    )
+    organization = appointment.organization
+    if organization is None or organization.latitude is None or organization.longitude is None:
+        messages.error(request, 'Location information is not available for this appointment')
+        return redirect('appointments:dashboard')
+
+    origin = _travel_origin(request)
+    context = {
+        'appointment': appointment,
+        'clinic_data': {
+            'name': organization.name,
+            'address': organization.address,
+            'phone': organization.phone,
+            'latitude': float(organization.latitude),
+            'longitude': float(organization.longitude),
+        },
+        'travel_estimate': get_travel_estimate(*origin, organization) if origin else None,
+        'google_maps_api_key': settings.GOOGLE_MAPS_API_KEY,
+    }
+    return render(request, 'appointments/appointment_directions.html', context)
+
+@login_required
+def clinic_details_map(request, clinic_id):
+    """Clinic details with its doctors and a cached travel estimate"""
+    clinic = get_object_or_404(Organization, id=clinic_id)
+    doctors = UserProfile.objects.filter(organization=clinic, role='doctor').select_related('user')
+    origin = _travel_origin(request)
+    context = {
+        'clinic': clinic,
+        'doctors': doctors,
+        'travel_estimate': get_travel_estimate(*origin, clinic) if origin else None,
+    }
+    return render(request, 'appointments/clinic_details_map.html', context)
+
 @ensure_csrf_cookie
 def login_view(request):
     """Login view with CSRF protection"""
@@ -74,6 +923,7 @@ def health_check(request):
     try:
         from django.db import connection
         from django.core.cache import cache
+        from .cache_codecs import cache_metrics
         
         # Test database
         with connection.cursor() as cursor:
@@ -98,6 +948,7 @@ def health_check(request):
         "status": "healthy" if is_healthy else "unhealthy",
         "database": db_status,
         "cache": cache_status,
+        "cache_metrics": cache_metrics(),
         "version": "1.0.0"
     }
     
@@ -204,8 +204,8 @@ main() {
 }
 
 # Handle different startup scenarios
-if [ "$1" = "celery" ]; then
-    log "Starting Celery worker/beat - skipping full initialization"
+if [ "$1" = "celery" ] || [ "$3" = "relay_outbox" ]; then
+    log "Starting Celery worker/beat or outbox relay - skipping full initialization"
     cd /app
     wait_for_db || exit 1
     wait_for_redis || exit 1
@@ -1,5 +1,8 @@
 import os
+from fnmatch import fnmatchcase
+
 from celery import Celery
+from kombu import Exchange, Queue
 
 # Set the default Django settings module for the 'celery' program.
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'pulsecal_system.settings')
@@ -10,9 +13,106 @@ app = Celery('pulsecal_system')
 # the configuration object to child processes.
 app.config_from_object('django.conf:settings', namespace='CELERY')
 
+# Task topology. Realtime and reminders share one worker pool, and bulk and maintenance each get
+# their own (see docker-compose.yml). A long calendar sync can therefore never hold the
+# processes that send booking confirmations or refresh caches:
+#   realtime     confirmations, cancellations and other user-facing notifications
+#   reminders    scheduled reminders and summaries; may lag by minutes, not hours
+#   bulk         calendar syncs and search refreshes that can run for minutes
+#   maintenance  periodic housekeeping, cache refreshes and geocoding
+# Unrouted tasks land in maintenance. With the Redis broker priority 0 is served first; routes
+# set a default priority per task, and callers can still pass priority= to apply_async.
+REALTIME, REMINDERS, BULK, MAINTENANCE = 'realtime', 'reminders', 'bulk', 'maintenance'
+TASK_QUEUES = (REALTIME, REMINDERS, BULK, MAINTENANCE)
+
+TASK_ROUTES = {
+    'appointments.tasks.send_appointment_confirmation': {'queue': REALTIME, 'priority': 0},
+    'appointments.tasks.send_appointment_cancellation': {'queue': REALTIME, 'priority': 0},
+    'appointments.tasks.relay_outbox_events': {'queue': REALTIME, 'priority': 3},
+    'appointments.tasks.send_appointment_reminder': {'queue': REMINDERS, 'priority': 3},
+    'appointments.tasks.send_daily_appointment_summary': {'queue': REMINDERS, 'priority': 6},
+    # A sync the user asked for from the calendar page goes ahead of the periodic fan-out
+    'appointments.tasks.sync_google_calendar': {'queue': BULK, 'priority': 3},
+    'appointments.tasks.queue_google_calendar_syncs': {'queue': BULK, 'priority': 6},
+    'appointments.tasks.refresh_user_appointment_search': {'queue': BULK, 'priority': 6},
+    # Readers are waiting on a stale value, so cache refreshes go ahead of housekeeping
+    'appointments.tasks.refresh_cache_entry': {'queue': MAINTENANCE, 'priority': 0},
+    'appointments.tasks.update_doctor_availability': {'queue': MAINTENANCE, 'priority': 3},
+    'appointments.tasks.geocode_organization': {'queue': MAINTENANCE, 'priority': 3},
+    'appointments.tasks.*': {'queue': MAINTENANCE, 'priority': 6},
+}
+
+# Tasks that can safely run twice: they are acknowledged only after they finish, so a worker
+# that dies mid-task hands them to another worker instead of losing them. Emails stay
+# acknowledged on receipt; a duplicate confirmation is worse than a rare lost one.
+IDEMPOTENT_TASKS = (
+    'appointments.tasks.cleanup_old_notifications',
+    'appointments.tasks.update_doctor_availability',
+    'appointments.tasks.geocode_organization',
+    'appointments.tasks.geocode_unverified_organizations',
+    'appointments.tasks.warm_upcoming_travel_estimates',
+    'appointments.tasks.refresh_user_appointment_search',
+    'appointments.tasks.rebuild_recent_rollups',
+    'appointments.tasks.refresh_cache_entry',
+    'appointments.tasks.prune_calendar_tombstones',
+    'appointments.tasks.sync_google_calendar',
+    'appointments.tasks.queue_google_calendar_syncs',
+    'appointments.tasks.relay_outbox_events',
+    'appointments.tasks.prune_outbox_events',
+)
+
+# Rate limits (Celery syntax, '' for none) apply to each task on the queue, per worker process
+# pool; they keep bulk work from saturating the database and third-party APIs. Time limits bound
+# how long one task can hold a worker and must stay below the broker's visibility timeout
+# (CELERY_VISIBILITY_TIMEOUT), or Redis hands a still-running late-acked task to a second worker.
+QUEUE_RATE_LIMITS = {
+    REALTIME: os.environ.get('CELERY_REALTIME_RATE_LIMIT', ''),
+    REMINDERS: os.environ.get('CELERY_REMINDERS_RATE_LIMIT', '120/m'),
+    BULK: os.environ.get('CELERY_BULK_RATE_LIMIT', '30/m'),
+    MAINTENANCE: os.environ.get('CELERY_MAINTENANCE_RATE_LIMIT', '60/m'),
+}
+QUEUE_TIME_LIMITS = {
+    REALTIME: int(os.environ.get('CELERY_REALTIME_TIME_LIMIT', 60)),
+    REMINDERS: int(os.environ.get('CELERY_REMINDERS_TIME_LIMIT', 60 * 5)),
+    BULK: int(os.environ.get('CELERY_BULK_TIME_LIMIT', 60 * 30)),
+    MAINTENANCE: int(os.environ.get('CELERY_MAINTENANCE_TIME_LIMIT', 60 * 10)),
+}
+
+
+def task_queues():
+    """Declared queues, each with the broker's full priority range"""
+    return [
+        Queue(name, Exchange(name), routing_key=name, queue_arguments={'x-max-priority': 9})
+        for name in TASK_QUEUES
+    ]
+
+
+def task_annotations():
+    """Per-task options: the queue's rate and time limits, and late acks for idempotent tasks"""
+    annotations = {}
+    for name in sorted(set(IDEMPOTENT_TASKS) | {pattern for pattern in TASK_ROUTES if '*' not in pattern}):
+        queue = next(route['queue'] for pattern, route in TASK_ROUTES.items() if fnmatchcase(name, pattern))
+        options = {}
+        if QUEUE_RATE_LIMITS[queue]:
+            options['rate_limit'] = QUEUE_RATE_LIMITS[queue]
+        options.update(time_limit=QUEUE_TIME_LIMITS[queue], soft_time_limit=QUEUE_TIME_LIMITS[queue] - 30)
+        if name in IDEMPOTENT_TASKS:
+            options.update(acks_late=True, reject_on_worker_lost=True)
+        annotations[name] = options
+    return annotations
+
+
+app.conf.task_queues = task_queues()
+app.conf.task_default_queue = MAINTENANCE
+app.conf.task_default_exchange = MAINTENANCE
+app.conf.task_default_routing_key = MAINTENANCE
+app.conf.task_routes = TASK_ROUTES
+app.conf.task_annotations = task_annotations()
+
 # Load task modules from all registered Django apps.
 app.autodiscover_tasks()
 
+
 @app.task(bind=True)
 def debug_task(self):
-    print(f'Request: {self.request!r}') 
\ No newline at end of file
+    print(f'Request: {self.request!r}')
@@ -82,6 +82,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'appointments',
     'django.contrib.sites',
     'allauth',
@@ -97,6 +98,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'appointments.query_budget.QueryBudgetMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
@@ -105,6 +107,7 @@ MIDDLEWARE = [
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'allauth.account.middleware.AccountMiddleware',
+    'appointments.middleware.RequestContextMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'axes.middleware.AxesMiddleware',
@@ -322,6 +325,72 @@ GOOGLE_REDIRECT_URI = os.environ.get('GOOGLE_REDIRECT_URI', 'http://localhost:80
 GOOGLE_MAPS_API_KEY = os.environ.get('GOOGLE_MAPS_API_KEY', '')
 GOOGLE_PLACES_API_KEY = os.environ.get('GOOGLE_PLACES_API_KEY', '')
 
+# Geocoding (see appointments/geocoding.py). Leave the provider empty to use Google when
+# GOOGLE_MAPS_API_KEY is set and skip geocoding otherwise; the offline stub
+# ('appointments.geocoding.StubGeocoder') writes fake coordinates and must be chosen explicitly.
+GEOCODING_PROVIDER = os.environ.get('GEOCODING_PROVIDER', '')
+GEOCODING_CACHE_TTL_DAYS = int(os.environ.get('GEOCODING_CACHE_TTL_DAYS', 90))
+GEOCODING_NEGATIVE_CACHE_TTL_DAYS = int(os.environ.get('GEOCODING_NEGATIVE_CACHE_TTL_DAYS', 7))
+GEOCODING_RATE_LIMIT = float(os.environ.get('GEOCODING_RATE_LIMIT', 10))  # provider calls per second
+GEOCODING_BATCH_SIZE = int(os.environ.get('GEOCODING_BATCH_SIZE', 100))
+
+# Travel estimates for directions pages (see appointments/directions.py)
+DIRECTIONS_PROVIDER = os.environ.get('DIRECTIONS_PROVIDER', '')
+TRAVEL_ESTIMATE_CACHE_TIMEOUT = int(os.environ.get('TRAVEL_ESTIMATE_CACHE_TIMEOUT', 60 * 60 * 24))
+TRAVEL_ESTIMATE_LRU_SIZE = int(os.environ.get('TRAVEL_ESTIMATE_LRU_SIZE', 2048))
+TRAVEL_ESTIMATE_LRU_TIMEOUT = int(os.environ.get('TRAVEL_ESTIMATE_LRU_TIMEOUT', 60 * 5))
+
+# Dashboard fragments are invalidated by version bumps; the timeout only bounds stale memory use
+DASHBOARD_CACHE_TIMEOUT = int(os.environ.get('DASHBOARD_CACHE_TIMEOUT', 60 * 10))
+# How long past expiry cached reads may be served while one refresh runs (appointments/cache_aside.py)
+CACHE_ASIDE_STALE_TIMEOUT = int(os.environ.get('CACHE_ASIDE_STALE_TIMEOUT', 60 * 5))
+# Redis cache codecs (appointments/cache_codecs.py): values under the threshold are stored as is;
+# 'auto' picks lz4, then zstd, then zlib, and orjson, then msgpack, then pickle, by what is installed
+CACHE_COMPRESSION = os.environ.get('CACHE_COMPRESSION', 'auto')
+CACHE_COMPRESSION_MIN_SIZE = int(os.environ.get('CACHE_COMPRESSION_MIN_SIZE', 1024))
+CACHE_JSON_CODEC = os.environ.get('CACHE_JSON_CODEC', 'auto')
+
+# Query counting and N+1 warnings for requests and tasks (appointments/query_budget.py)
+QUERY_BUDGET_ENABLED = os.environ.get('QUERY_BUDGET_ENABLED', str(DEBUG)).lower() == 'true'
+QUERY_BUDGET_DEFAULT = int(os.environ.get('QUERY_BUDGET_DEFAULT', 50))
+QUERY_REPEAT_THRESHOLD = int(os.environ.get('QUERY_REPEAT_THRESHOLD', 8))
+
+# Above this many rows, admin and list paginators use planner estimates instead of COUNT(*)
+PAGINATION_ESTIMATE_THRESHOLD = int(os.environ.get('PAGINATION_ESTIMATE_THRESHOLD', 100000))
+# Exact counts below the threshold are cached this long per filter signature (0 disables)
+PAGINATION_COUNT_CACHE_TIMEOUT = int(os.environ.get('PAGINATION_COUNT_CACHE_TIMEOUT', 60))
+
+# Calendar feed and sync tokens (appointments/calendar_feed.py); tokens live as long as tombstones
+CALENDAR_MAX_RANGE_DAYS = int(os.environ.get('CALENDAR_MAX_RANGE_DAYS', 62))
+CALENDAR_EVENT_MINUTES = int(os.environ.get('CALENDAR_EVENT_MINUTES', 30))
+CALENDAR_SYNC_OVERLAP_SECONDS = int(os.environ.get('CALENDAR_SYNC_OVERLAP_SECONDS', 120))
+CALENDAR_TOMBSTONE_RETENTION_DAYS = int(os.environ.get('CALENDAR_TOMBSTONE_RETENTION_DAYS', 30))
+# iCalendar subscription feeds (appointments/ics_feed.py): renders are keyed by schedule version
+ICS_FEED_CACHE_TIMEOUT = int(os.environ.get('ICS_FEED_CACHE_TIMEOUT', 60 * 60 * 24))
+ICS_FEED_PAST_DAYS = int(os.environ.get('ICS_FEED_PAST_DAYS', 90))
+
+# Google Calendar sync (appointments/google_calendar.py). GOOGLE_CALENDAR_CLIENT is a dotted path to a
+# client class; empty means the Google API, 'appointments.google_calendar.FakeCalendarClient' the local stand-in
+GOOGLE_CALENDAR_CLIENT = os.environ.get('GOOGLE_CALENDAR_CLIENT', '')
+GOOGLE_CALENDAR_BATCH_SIZE = int(os.environ.get('GOOGLE_CALENDAR_BATCH_SIZE', 50))
+GOOGLE_CALENDAR_MAX_RETRIES = int(os.environ.get('GOOGLE_CALENDAR_MAX_RETRIES', 5))
+GOOGLE_CALENDAR_BACKOFF_SECONDS = float(os.environ.get('GOOGLE_CALENDAR_BACKOFF_SECONDS', 1))
+GOOGLE_CALENDAR_SYNC_PAST_DAYS = int(os.environ.get('GOOGLE_CALENDAR_SYNC_PAST_DAYS', 30))
+# The per-link lock must outlive the longest sync, i.e. the bulk queue's time limit (pulsecal_system/celery.py)
+GOOGLE_CALENDAR_LOCK_TIMEOUT = int(os.environ.get(
+    'GOOGLE_CALENDAR_LOCK_TIMEOUT', int(os.environ.get('CELERY_BULK_TIME_LIMIT', 60 * 30)) + 60,
+))
+
+# Appointment outbox (appointments/outbox.py): the relay_outbox command polls this often when idle;
+# failed deliveries back off exponentially from OUTBOX_RETRY_SECONDS and stop after OUTBOX_MAX_ATTEMPTS
+OUTBOX_BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE', 100))
+OUTBOX_POLL_SECONDS = float(os.environ.get('OUTBOX_POLL_SECONDS', 0.5))
+OUTBOX_RETRY_SECONDS = int(os.environ.get('OUTBOX_RETRY_SECONDS', 5))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', 10))
+OUTBOX_RETENTION_DAYS = int(os.environ.get('OUTBOX_RETENTION_DAYS', 7))
+# How long a relay owns the events it claimed; longer than delivering one batch takes
+OUTBOX_LEASE_SECONDS = int(os.environ.get('OUTBOX_LEASE_SECONDS', 60 * 5))
+
 # Celery Configuration
 CELERY_BROKER_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
 CELERY_RESULT_BACKEND = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
@@ -329,6 +398,43 @@ CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
+# Queues, routes, priorities and per-queue limits live in pulsecal_system/celery.py. Workers take
+# one task at a time so a long task never sits on prefetched messages another worker could run.
+# Unacknowledged messages go back to the queue after the visibility timeout; it must exceed the
+# longest task time limit and any countdown/ETA used.
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+CELERY_VISIBILITY_TIMEOUT = int(os.environ.get('CELERY_VISIBILITY_TIMEOUT', 60 * 60))
+CELERY_BROKER_TRANSPORT_OPTIONS = {
+    'visibility_timeout': CELERY_VISIBILITY_TIMEOUT,
+    'queue_order_strategy': 'priority',
+    'priority_steps': [0, 3, 6, 9],
+}
+CELERY_BEAT_SCHEDULE = {
+    'warm-upcoming-travel-estimates': {
+        'task': 'appointments.tasks.warm_upcoming_travel_estimates',
+        'schedule': 30 * 60,
+    },
+    'rebuild-recent-rollups': {
+        'task': 'appointments.tasks.rebuild_recent_rollups',
+        'schedule': 24 * 60 * 60,
+    },
+    'prune-calendar-tombstones': {
+        'task': 'appointments.tasks.prune_calendar_tombstones',
+        'schedule': 24 * 60 * 60,
+    },
+    'sync-google-calendars': {
+        'task': 'appointments.tasks.queue_google_calendar_syncs',
+        'schedule': 15 * 60,
+    },
+    'relay-outbox-events': {
+        'task': 'appointments.tasks.relay_outbox_events',
+        'schedule': 60,
+    },
+    'prune-outbox-events': {
+        'task': 'appointments.tasks.prune_outbox_events',
+        'schedule': 24 * 60 * 60,
+    },
+}
 
 # Django Axes Configuration
 AXES_ENABLED = True
@@ -391,18 +497,32 @@ CACHES = {
         'BACKEND': 'django_redis.cache.RedisCache',
         'LOCATION': os.environ.get('REDIS_URL', 'redis://localhost:6379/1'),
         'OPTIONS': {
-            'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+            'CLIENT_CLASS': 'appointments.cache_codecs.MeteredClient',
             'CONNECTION_POOL_KWARGS': {
                 'max_connections': 50,
                 'retry_on_timeout': True,
             },
-            'COMPRESSOR': 'django_redis.compressors.zlib.ZlibCompressor',
+            'COMPRESSOR': 'appointments.cache_codecs.ThresholdCompressor',
+            'SERIALIZER': 'appointments.cache_codecs.FastSerializer',
             'IGNORE_EXCEPTIONS': True,
         },
         'TIMEOUT': 300,
         'KEY_PREFIX': 'pulsecal',
         'VERSION': 1,
-    }
+    },
+    # Small hot lookups (clinic/doctor cards for analytics labels, appointments/lookups.py): per-process
+    # LRU in front of Redis, capped well below the 512 MB box and invalidated across processes over pub/sub
+    'hot': {
+        'BACKEND': 'appointments.cache_backends.TwoTierCache',
+        'TIMEOUT': 3600,
+        'KEY_PREFIX': 'hot',
+        'OPTIONS': {
+            'REMOTE': 'default',
+            'LOCAL_TIMEOUT': int(os.environ.get('HOT_CACHE_LOCAL_TIMEOUT', 30)),
+            'MAX_ENTRIES': 5000,
+            'MAX_BYTES': int(os.environ.get('HOT_CACHE_MAX_BYTES', 16 * 1024 * 1024)),
+        },
+    },
 }
 
 # Session Configuration
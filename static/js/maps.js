@@ -7,6 +7,8 @@ class PulseCalMaps {
         this.markers = [];
         this.infoWindows = [];
         this.currentFilter = 'all';
+        this.refreshTimer = null;
+        this.requestSeq = 0;
         this.mapData = {
             organizations: [],
             doctors: []
@@ -22,8 +24,8 @@ class PulseCalMaps {
         try {
             await this.loadGoogleMapsAPI();
             this.initMap();
-            await this.loadLocationData();
-            this.addMarkers();
+            // Markers are fetched per viewport once the map settles.
+            this.map.addListener('idle', () => this.scheduleRefresh());
         } catch (error) {
             console.error('Error initializing maps:', error);
             this.showError('Failed to load maps');
@@ -90,23 +92,43 @@ class PulseCalMaps {
         });
     }
 
+    scheduleRefresh() {
+        clearTimeout(this.refreshTimer);
+        this.refreshTimer = setTimeout(async () => {
+            await this.loadLocationData();
+            this.addMarkers();
+        }, 250);
+    }
+
+    viewportParams() {
+        const bounds = this.map.getBounds();
+        const params = new URLSearchParams({
+            zoom: this.map.getZoom(),
+            filter: this.currentFilter
+        });
+        if (bounds) {
+            const sw = bounds.getSouthWest();
+            const ne = bounds.getNorthEast();
+            params.set('bbox', [sw.lng(), sw.lat(), ne.lng(), ne.lat()].map(v => v.toFixed(6)).join(','));
+        }
+        return params;
+    }
+
     async loadLocationData() {
+        const seq = ++this.requestSeq;
         try {
-            const response = await fetch('/api/locations/');
+            const response = await fetch('/api/locations/?' + this.viewportParams().toString());
             if (!response.ok) {
                 throw new Error('Failed to load location data');
             }
-            
-            this.mapData = await response.json();
-            
-            // Update center to first location if available
-            const firstLocation = this.mapData.organizations[0] || this.mapData.doctors[0];
-            if (firstLocation) {
-                this.map.setCenter({ lat: firstLocation.latitude, lng: firstLocation.longitude });
+
+            const data = await response.json();
+            // Ignore responses for viewports the user has already left.
+            if (seq === this.requestSeq) {
+                this.mapData = data;
             }
         } catch (error) {
             console.error('Error loading location data:', error);
-            // Use fallback data if API fails
             this.mapData = {
                 organizations: [],
                 doctors: []
@@ -117,23 +139,44 @@ class PulseCalMaps {
     addMarkers() {
         this.clearMarkers();
 
-        // Add organization markers
+        // Filtering happens server-side, so every returned entry is shown.
         this.mapData.organizations.forEach(org => {
-            if (this.shouldShowMarker(org, 'organization')) {
-                this.addMarker(org, 'organization');
-            }
+            org.cluster ? this.addClusterMarker(org, 'organization') : this.addMarker(org, 'organization');
         });
 
-        // Add doctor markers
         this.mapData.doctors.forEach(doctor => {
-            if (this.shouldShowMarker(doctor, 'doctor')) {
-                this.addMarker(doctor, 'doctor');
-            }
+            doctor.cluster ? this.addClusterMarker(doctor, 'doctor') : this.addMarker(doctor, 'doctor');
         });
 
         this.updateCount();
     }
 
+    addClusterMarker(cluster, type) {
+        const position = { lat: cluster.latitude, lng: cluster.longitude };
+        const marker = new google.maps.Marker({
+            position: position,
+            map: this.map,
+            title: `${cluster.count} ${type === 'organization' ? 'organizations' : 'doctors'}`,
+            label: { text: String(cluster.count), color: '#ffffff', fontSize: '12px', fontWeight: 'bold' },
+            icon: {
+                path: google.maps.SymbolPath.CIRCLE,
+                scale: Math.min(28, 12 + Math.log2(cluster.count) * 3),
+                fillColor: type === 'organization' ? '#dc3545' : '#007bff',
+                fillOpacity: 0.85,
+                strokeColor: '#ffffff',
+                strokeWeight: 2
+            }
+        });
+        marker.itemCount = cluster.count;
+
+        marker.addListener('click', () => {
+            this.map.setCenter(position);
+            this.map.setZoom(Math.min(this.map.getZoom() + 2, 21));
+        });
+
+        this.markers.push(marker);
+    }
+
     addMarker(item, type) {
         const position = { lat: item.latitude, lng: item.longitude };
         
@@ -148,6 +191,7 @@ class PulseCalMaps {
                 scaledSize: new google.maps.Size(32, 32)
             }
         });
+        marker.itemCount = 1;
 
         const infoWindow = new google.maps.InfoWindow({
             content: this.createInfoWindowContent(item, type)
@@ -193,23 +237,6 @@ class PulseCalMaps {
         }
     }
 
-    shouldShowMarker(item, type) {
-        switch (this.currentFilter) {
-            case 'all':
-                return true;
-            case 'organizations':
-                return type === 'organization';
-            case 'doctors':
-                return type === 'doctor';
-            case 'on_duty':
-                return item.on_duty;
-            case '24_hours':
-                return item.is_24_hours;
-            default:
-                return true;
-        }
-    }
-
     clearMarkers() {
         this.markers.forEach(marker => marker.setMap(null));
         this.infoWindows.forEach(iw => iw.close());
@@ -219,13 +246,13 @@ class PulseCalMaps {
 
     setFilter(filter) {
         this.currentFilter = filter;
-        this.addMarkers();
+        this.scheduleRefresh();
     }
 
     updateCount() {
         const countElement = document.getElementById('total-count');
         if (countElement) {
-            countElement.textContent = this.markers.length;
+            countElement.textContent = this.markers.reduce((total, marker) => total + marker.itemCount, 0);
         }
     }
 
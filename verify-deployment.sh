@@ -159,7 +159,7 @@ test_admin() {
 
 # Test 9: Celery Worker
 test_celery() {
-    if docker-compose exec -T celery celery -A pulsecal_system inspect ping -d celery@$(docker-compose exec -T celery hostname) >/dev/null 2>&1; then
+    if docker-compose exec -T celery celery -A pulsecal_system inspect ping -d realtime@$(docker-compose exec -T celery hostname) >/dev/null 2>&1; then
         echo "Celery worker is responding"
         return 0
     else